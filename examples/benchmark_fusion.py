@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import os
+import sys
+
+fl_path = os.path.abspath(".")
+if fl_path not in sys.path:
+    sys.path.append(fl_path)
+
+from examples.constants import (
+    BENCHMARK_COMPARE_DESC,
+    BENCHMARK_DESC,
+    BENCHMARK_DTYPE_DESC,
+    BENCHMARK_HANDLERS_DESC,
+    BENCHMARK_LAYERS_DESC,
+    BENCHMARK_NUM_PARTIES_DESC,
+    BENCHMARK_OUTPUT_DESC,
+    BENCHMARK_REPEATS_DESC,
+    BENCHMARK_SEED_DESC,
+)
+from examples.extensions.benchmark.fusion_benchmark import (
+    FUSION_CASES,
+    compare_results,
+    load_results,
+    parse_layer_shapes,
+    run_benchmarks,
+    write_results,
+)
+
+
+def setup_parser():
+    """
+    Sets up the parser for Python script
+
+    :return: a command line parser
+    :rtype: argparse.ArgumentParser
+    """
+    p = argparse.ArgumentParser(description=BENCHMARK_DESC)
+    p.add_argument("--num_parties", "-n", help=BENCHMARK_NUM_PARTIES_DESC, type=int, default=10)
+    p.add_argument("--layers", "-l", help=BENCHMARK_LAYERS_DESC, default="784x128,128,128x10,10")
+    p.add_argument("--dtype", help=BENCHMARK_DTYPE_DESC, choices=["float16", "float32", "float64"], default="float32")
+    p.add_argument("--handlers", help=BENCHMARK_HANDLERS_DESC, nargs="+", choices=list(FUSION_CASES))
+    p.add_argument("--repeats", "-r", help=BENCHMARK_REPEATS_DESC, type=int, default=5)
+    p.add_argument("--seed", help=BENCHMARK_SEED_DESC, type=int, default=0)
+    p.add_argument("--output", "-o", help=BENCHMARK_OUTPUT_DESC, default="fusion_benchmark.json")
+    p.add_argument("--compare", "-c", help=BENCHMARK_COMPARE_DESC)
+    return p
+
+
+if __name__ == "__main__":
+    parser = setup_parser()
+    args = parser.parse_args()
+    logging.getLogger("ibmfl").setLevel(logging.WARNING)
+
+    results = run_benchmarks(
+        handlers=args.handlers,
+        num_parties=args.num_parties,
+        layer_shapes=parse_layer_shapes(args.layers),
+        dtype=args.dtype,
+        repeats=args.repeats,
+        seed=args.seed,
+    )
+    write_results(results, args.output)
+
+    for result in results["results"]:
+        if "median_s" in result:
+            print(
+                "{:<12} {:<24} median {:10.6f} s  peak {:>12,} B".format(
+                    result["kind"], result["name"], result["median_s"], result.get("peak_bytes", 0)
+                )
+            )
+        else:
+            reason = result.get("skipped") or result.get("error")
+            print("{:<12} {:<24} {}".format(result["kind"], result["name"], reason))
+
+    if args.compare:
+        print("\nCompared to {}:".format(args.compare))
+        for row in compare_results(load_results(args.compare), results):
+            memory = "  memory x{:.2f}".format(row["memory_ratio"]) if "memory_ratio" in row else ""
+            print("{:<12} {:<24} time x{:.2f}{}".format(row["kind"], row["name"], row["time_ratio"], memory))
+
+    print("Finished! :) Results written to {}".format(args.output))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import os
+import sys
+
+fl_path = os.path.abspath(".")
+if fl_path not in sys.path:
+    sys.path.append(fl_path)
+
+from examples.constants import (
+    BENCHMARK_COMPARE_DESC,
+    BENCHMARK_OUTPUT_DESC,
+    IMPORT_BENCHMARK_AGG_CONFIG_DESC,
+    IMPORT_BENCHMARK_DESC,
+    IMPORT_BENCHMARK_MAX_SECONDS_DESC,
+    IMPORT_BENCHMARK_MODULES_DESC,
+    IMPORT_BENCHMARK_PARTY_CONFIG_DESC,
+    IMPORT_BENCHMARK_REPEATS_DESC,
+    IMPORT_BENCHMARK_TOLERANCE_DESC,
+)
+from examples.extensions.benchmark.fusion_benchmark import compare_results, load_results, write_results
+from examples.extensions.benchmark.import_benchmark import check_startup, run_import_benchmarks
+
+
+def setup_parser():
+    """
+    Sets up the parser for Python script
+
+    :return: a command line parser
+    :rtype: argparse.ArgumentParser
+    """
+    p = argparse.ArgumentParser(description=IMPORT_BENCHMARK_DESC)
+    p.add_argument("--modules", "-m", help=IMPORT_BENCHMARK_MODULES_DESC, nargs="+")
+    p.add_argument("--repeats", "-r", help=IMPORT_BENCHMARK_REPEATS_DESC, type=int, default=5)
+    p.add_argument("--agg_config", help=IMPORT_BENCHMARK_AGG_CONFIG_DESC)
+    p.add_argument("--party_config", help=IMPORT_BENCHMARK_PARTY_CONFIG_DESC)
+    p.add_argument("--output", "-o", help=BENCHMARK_OUTPUT_DESC, default="import_benchmark.json")
+    p.add_argument("--compare", "-c", help=BENCHMARK_COMPARE_DESC)
+    p.add_argument("--max_seconds", help=IMPORT_BENCHMARK_MAX_SECONDS_DESC, type=float)
+    p.add_argument("--tolerance", help=IMPORT_BENCHMARK_TOLERANCE_DESC, type=float, default=1.5)
+    return p
+
+
+if __name__ == "__main__":
+    parser = setup_parser()
+    args = parser.parse_args()
+    logging.getLogger("ibmfl").setLevel(logging.WARNING)
+
+    results = run_import_benchmarks(
+        modules=args.modules, repeats=args.repeats, agg_config=args.agg_config, party_config=args.party_config
+    )
+    write_results(results, args.output)
+
+    for result in results["results"]:
+        if "median_s" in result:
+            print(
+                "{:<40} median {:8.3f} s  peak RSS {:>12,} B  {:>5} modules".format(
+                    result["name"], result["median_s"], result["peak_bytes"], result["num_modules"]
+                )
+            )
+            if result["heavy_modules"]:
+                print("    loads {}".format(", ".join(result["heavy_modules"])))
+            for module, seconds in result["top_imports"][:5]:
+                print("    {:<36} {:8.3f} s".format(module, seconds))
+        else:
+            print("{:<40} {}".format(result["name"], result.get("error")))
+
+    baseline = None
+    if args.compare:
+        baseline = load_results(args.compare)
+        print("\nCompared to {}:".format(args.compare))
+        for row in compare_results(baseline, results):
+            memory = "  memory x{:.2f}".format(row["memory_ratio"]) if "memory_ratio" in row else ""
+            print("{:<40} time x{:.2f}{}".format(row["name"], row["time_ratio"], memory))
+
+    failures = check_startup(results, max_seconds=args.max_seconds, baseline=baseline, tolerance=args.tolerance)
+    for failure in failures:
+        print("FAILED: " + failure)
+    if failures:
+        sys.exit(1)
+
+    print("Finished! :) Results written to {}".format(args.output))
@@ -8,11 +8,40 @@ DATASET_DESC = "which data set to use"
 PATH_DESC = "directory to save the data"
 PER_PARTY = "the number of data points per party"
 STRATIFY_DESC = "proportionally stratify the data according to the source distribution"
+DIRICHLET_ALPHA_DESC = "split the labels non-iid with this Dirichlet concentration (smaller is more skewed)"
+NPY_SHARDS_DESC = "write each party's arrays as a directory of memory-mappable .npy files instead of an .npz"
+WRITE_WORKERS_DESC = "number of threads writing the party files"
 CONF_PATH = "directory to save the configs"
+CONVERT_DATA_DESC = "converts party .npz files into memory-mappable .npy directories"
+CONVERT_PATH_DESC = "party .npz files or folders containing them"
+REMOVE_NPZ_DESC = "delete each .npz file once it has been converted"
+SIMULATE_DESC = "runs an aggregator and its parties in-process from generated configs"
+SIMULATE_CONFIG_DESC = "folder containing config_agg.yml and config_party<i>.yml"
+SIMULATE_NUM_PARTIES_DESC = "number of parties to simulate (default is all party configs)"
+SIMULATE_WORKERS_DESC = "number of worker processes hosting the parties (default 0 runs them in this process)"
+SIMULATE_COMMANDS_DESC = "aggregator commands to run in order"
+SIMULATE_NO_COPY_DESC = "deliver messages without copying their data"
+BENCHMARK_DESC = "benchmarks fusion handlers and serializers on synthetic model updates"
+BENCHMARK_NUM_PARTIES_DESC = "number of synthetic party updates to fuse"
+BENCHMARK_LAYERS_DESC = "comma separated layer shapes, e.g. 784x128,128,128x10,10"
+BENCHMARK_DTYPE_DESC = "dtype of the synthetic weights"
+BENCHMARK_HANDLERS_DESC = "fusion handlers to benchmark (default is all)"
+BENCHMARK_REPEATS_DESC = "number of timed runs per benchmark"
+BENCHMARK_SEED_DESC = "random seed of the synthetic updates"
+BENCHMARK_OUTPUT_DESC = "JSON file to write the results to"
+BENCHMARK_COMPARE_DESC = "JSON results of an earlier run to compare against"
+IMPORT_BENCHMARK_DESC = "benchmarks the import time and memory of the aggregator and party entry points"
+IMPORT_BENCHMARK_MODULES_DESC = "modules to import (default is ibmfl.aggregator.aggregator and ibmfl.party.party)"
+IMPORT_BENCHMARK_REPEATS_DESC = "number of fresh interpreters per module"
+IMPORT_BENCHMARK_AGG_CONFIG_DESC = "aggregator config to also benchmark loading and building the aggregator from"
+IMPORT_BENCHMARK_PARTY_CONFIG_DESC = "party config to also benchmark loading and building the party from"
+IMPORT_BENCHMARK_MAX_SECONDS_DESC = "fail if the median import time of a module exceeds this many seconds"
+IMPORT_BENCHMARK_TOLERANCE_DESC = "fail if a module got slower than the compared run by more than this factor"
 
 NEW_DESC = "create a new directory for this run based on current time instead of overriding"
 NAME_DESC = "the name of the run (default is current time)"
 PER_PARTY_ERR = "points per party must either specify one number of a list equal to num_parties"
+NPY_SHARDS_ERR = "--npy is only supported for the datasets {}"
 GENERATE_CONFIG_DESC = "generates aggregator and party configuration files"
 PATH_CONFIG_DESC = "path to load saved config data"
 FUSION_CONFIG_DESC = "which fusion example to run"
@@ -43,6 +72,9 @@ FL_DATASETS = [
     "custom_dataset",
 ]
 
+# datasets whose party shards can be written as .npy directories
+NPY_SHARD_DATASETS = ["mnist", "federated-clustering", "femnist", "cifar10"]
+
 FL_EXAMPLES = [
     "iter_avg",
     "iter_avg_openshift",
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import os
+import sys
+
+fl_path = os.path.abspath(".")
+if fl_path not in sys.path:
+    sys.path.append(fl_path)
+
+from examples.constants import CONVERT_DATA_DESC, CONVERT_PATH_DESC, REMOVE_NPZ_DESC
+from examples.extensions.data.npy_dataset import convert_npz_to_npy
+
+
+def setup_parser():
+    """
+    Sets up the parser for Python script
+
+    :return: a command line parser
+    :rtype: argparse.ArgumentParser
+    """
+    p = argparse.ArgumentParser(description=CONVERT_DATA_DESC)
+    p.add_argument("paths", help=CONVERT_PATH_DESC, nargs="+")
+    p.add_argument("--remove", "-rm", help=REMOVE_NPZ_DESC, action="store_true")
+    return p
+
+
+def collect_npz_files(paths):
+    """
+    Expands folders into the party .npz files they contain
+
+    :param paths: files or folders given on the command line
+    :type paths: `list[str]`
+    :return: sorted list of .npz files
+    :rtype: `list[str]`
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, "*.npz")))
+        elif path.endswith(".npz") and os.path.isfile(path):
+            files.append(path)
+        else:
+            print("Skipping {}: not a .npz file or folder".format(path))
+    return sorted(files)
+
+
+if __name__ == "__main__":
+    parser = setup_parser()
+    args = parser.parse_args()
+
+    npz_files = collect_npz_files(args.paths)
+    if not npz_files:
+        parser.error("No .npz files found in {}".format(args.paths))
+
+    for npz_file in npz_files:
+        out_dir = convert_npz_to_npy(npz_file, remove=args.remove)
+        print("Converted {} -> {}".format(npz_file, out_dir))
+
+    print("Finished! :) Point the data handler `npy_dir` at the converted folders.")
@@ -0,0 +1,479 @@
+"""
+Offline benchmark of the aggregation path.
+
+Parties are replaced by synthetic `ModelUpdate` lists with a configurable
+number of parties, layer shapes and dtype, and the `ProtoHandler` by a stub
+that never touches the network, so `fusion_collected_responses` of each
+fusion handler can be timed and memory-profiled in isolation, together with
+the serializer round trip of a party reply. Results are plain JSON with the
+environment and git commit they were measured on, and `compare_results`
+reports the change between two such files.
+"""
+import importlib
+import json
+import logging
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+from ibmfl.exceptions import FLException
+from ibmfl.message.message import Message
+from ibmfl.message.message_type import MessageType
+from ibmfl.message.serializer_factory import SerializerFactory
+from ibmfl.message.serializer_types import SerializerTypes
+from ibmfl.model.model_update import ModelUpdate
+
+logger = logging.getLogger(__name__)
+
+RESULTS_VERSION = 1
+
+DEFAULT_LAYER_SHAPES = [(784, 128), (128,), (128, 10), (10,)]
+
+
+class StubProtoHandler:
+    """
+    Stand-in for `ProtoHandler` with a fixed list of registered parties.
+    Handlers are only asked to fuse the updates they are given, so any
+    attempt to reach a party is an error.
+    """
+
+    def __init__(self, num_parties):
+        self.parties = ["party{}".format(i) for i in range(num_parties)]
+
+    def get_registered_parties(self):
+        return list(self.parties)
+
+    def get_available_parties(self):
+        return list(self.parties)
+
+    def get_n_parties(self):
+        return len(self.parties)
+
+    def _no_network(self, *args, **kwargs):
+        raise FLException("The benchmark protocol handler cannot reach parties")
+
+    query_parties = query_parties_data = sync_model_parties = _no_network
+    save_model_parties = eval_model_parties = stop_parties = _no_network
+
+
+def parse_layer_shapes(spec):
+    """
+    Parses layer shapes written as `784x128,128,128x10,10`.
+
+    :param spec: Comma separated shapes with `x` between dimensions.
+    :type spec: `str`
+    :return: list of shapes
+    :rtype: `list` of `tuple`
+    """
+    try:
+        return [tuple(int(d) for d in layer.split("x")) for layer in spec.split(",") if layer.strip()]
+    except ValueError:
+        raise FLException("Invalid layer shapes " + str(spec))
+
+
+def synthetic_weights(num_parties, layer_shapes, dtype="float32", noise=0.01, seed=0):
+    """
+    Creates per-party weights that scatter around a common random model, so
+    that robust aggregators see realistic distances between updates.
+
+    :param num_parties: Number of parties.
+    :type num_parties: `int`
+    :param layer_shapes: Shape of every layer.
+    :type layer_shapes: `list` of `tuple`
+    :param dtype: Dtype of the weights.
+    :type dtype: `str`
+    :param noise: Standard deviation of the party deviations.
+    :type noise: `float`
+    :param seed: Random seed.
+    :type seed: `int`
+    :return: list of per-party lists of layers
+    :rtype: `list`
+    """
+    rng = np.random.RandomState(seed)
+    base = [rng.standard_normal(shape) for shape in layer_shapes]
+    return [
+        [(layer + noise * rng.standard_normal(layer.shape)).astype(dtype) for layer in base] for _ in range(num_parties)
+    ]
+
+
+def synthetic_model_updates(num_parties, layer_shapes=None, dtype="float32", noise=0.01, seed=0, num_classes=None):
+    """
+    Creates the model updates parties would send after local training, with
+    `weights` and `train_counts`. With `num_classes` the updates also carry
+    the `class_counts` and `transpose_weight` entries PFNM expects.
+
+    :param num_parties: Number of parties.
+    :type num_parties: `int`
+    :param layer_shapes: Shape of every layer, `DEFAULT_LAYER_SHAPES` by default.
+    :type layer_shapes: `list` of `tuple`
+    :param dtype: Dtype of the weights.
+    :type dtype: `str`
+    :param noise: Standard deviation of the party deviations.
+    :type noise: `float`
+    :param seed: Random seed.
+    :type seed: `int`
+    :param num_classes: Number of classes for `class_counts`.
+    :type num_classes: `int`
+    :return: list of model updates
+    :rtype: `list` of `ModelUpdate`
+    """
+    layer_shapes = layer_shapes or DEFAULT_LAYER_SHAPES
+    rng = np.random.RandomState(seed + 1)
+    train_counts = rng.randint(100, 1000, size=num_parties)
+    lst_weights = synthetic_weights(num_parties, layer_shapes, dtype=dtype, noise=noise, seed=seed)
+
+    updates = []
+    for weights, count in zip(lst_weights, train_counts):
+        extra = {}
+        if num_classes is not None:
+            counts = rng.multinomial(int(count), np.ones(num_classes) / num_classes)
+            extra = {"class_counts": {str(c): int(n) for c, n in enumerate(counts)}, "transpose_weight": False}
+        updates.append(ModelUpdate(weights=weights, train_counts=int(count), **extra))
+    return updates
+
+
+def mlp_layer_shapes(layer_shapes):
+    """
+    Kernel and bias shapes of a dense network with the input and output
+    sizes of the kernels in `layer_shapes`, as PFNM matches neurons of fully
+    connected layers only.
+
+    :return: list of shapes
+    :rtype: `list` of `tuple`
+    """
+    kernels = [shape for shape in layer_shapes if len(shape) == 2]
+    if not kernels:
+        raise FLException("PFNM needs at least one 2-d layer shape")
+    shapes = []
+    for kernel in kernels:
+        shapes.extend([kernel, (kernel[1],)])
+    return shapes
+
+
+def centroid_shape(layer_shapes, num_clusters=10):
+    """
+    Shape of the cluster centers SPAHM matches: `num_clusters` centroids with
+    as many features as the first layer has inputs.
+
+    :return: centroid matrix shape
+    :rtype: `list` of `tuple`
+    """
+    return [(num_clusters, layer_shapes[0][0])]
+
+
+def _handler(module_name, class_name):
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _robust_threshold(num_parties):
+    # the largest f with num_parties > 2 * f + 2
+    return max(0, (num_parties - 3) // 2)
+
+
+def _iter_avg(num_parties, updates):
+    cls = _handler("ibmfl.aggregator.fusion.iter_avg_fusion_handler", "IterAvgFusionHandler")
+    handler = cls({"global": {"rounds": 1}}, StubProtoHandler(num_parties))
+    return lambda: handler.fusion_collected_responses(updates)
+
+
+def _fedavg(num_parties, updates):
+    cls = _handler("ibmfl.aggregator.fusion.fedavg_fusion_handler", "FedAvgFusionHandler")
+    handler = cls({"global": {"rounds": 1}}, StubProtoHandler(num_parties))
+    return lambda: handler.fusion_collected_responses(updates)
+
+
+def _krum(num_parties, updates):
+    cls = _handler("ibmfl.aggregator.fusion.krum_fusion_handler", "KrumFusionHandler")
+    hyperparams = {
+        "global": {"rounds": 1, "num_parties": num_parties, "byzantine_threshold": _robust_threshold(num_parties)}
+    }
+    handler = cls(hyperparams, StubProtoHandler(num_parties))
+    return lambda: handler.fusion_collected_responses(updates)
+
+
+def _coordinate_median(num_parties, updates):
+    cls = _handler("ibmfl.aggregator.fusion.coordinate_median_fusion_handler", "CoordinateMedianFusionHandler")
+    handler = cls({"global": {"rounds": 1}}, StubProtoHandler(num_parties))
+    return lambda: handler.fusion_collected_responses(updates)
+
+
+def _geometric_median(num_parties, updates):
+    cls = _handler(
+        "ibmfl.aggregator.fusion.geometric_median_fedplus_fusion_handler", "GeometricMedianFedplusFusionHandler"
+    )
+    handler = cls({"global": {"rounds": 1, "rho": 0.1}}, StubProtoHandler(num_parties))
+
+    def fuse():
+        # the first round is a plain weighted average; time the median iterations
+        handler.round = 2
+        return handler.fusion_collected_responses(updates)
+
+    return fuse
+
+
+def _afa(num_parties, updates):
+    cls = _handler("ibmfl.aggregator.fusion.afa_fusion_handler", "AFAFusionHandler")
+    ph = StubProtoHandler(num_parties)
+    parties = ph.get_registered_parties()
+
+    def fuse():
+        # party reputations accumulate over rounds, start from scratch every run
+        handler = cls({"global": {"rounds": 1}}, ph)
+        return handler.fusion_collected_responses(updates, parties)
+
+    return fuse
+
+
+def _comparative_elimination(num_parties, updates):
+    cls = _handler(
+        "ibmfl.aggregator.fusion.comparative_elimination_fusion_handler", "ComparativeEliminationFusionHandler"
+    )
+    initial_weights = [np.zeros_like(layer) for layer in updates[0].get("weights")]
+    hyperparams = {
+        "global": {"rounds": 1, "num_parties": num_parties, "byzantine_threshold": (num_parties - 1) // 2},
+        "initial_weights": initial_weights,
+    }
+    handler = cls(hyperparams, StubProtoHandler(num_parties))
+    return lambda: handler.fusion_collected_responses(updates)
+
+
+def _pfnm(num_parties, updates):
+    cls = _handler("ibmfl.aggregator.fusion.pfnm_fusion_handler", "PFNMFusionHandler")
+    handler = cls({"global": {"rounds": 1, "iters": 1}}, StubProtoHandler(num_parties), None)
+    parties = handler.ph.get_registered_parties()
+    return lambda: handler.fusion_collected_responses(updates, parties)
+
+
+def _spahm(num_parties, updates):
+    cls = _handler("ibmfl.aggregator.fusion.spahm_fusion_handler", "SPAHMFusionHandler")
+    hyperparams = {"global": {"rounds": 1, "iters": 3, "optimize_hyperparams": False}}
+    handler = cls(hyperparams, StubProtoHandler(num_parties))
+    return lambda: handler.fusion_collected_responses(updates)
+
+
+# name -> (kind of synthetic updates, factory returning a fusion callable)
+FUSION_CASES = {
+    "IterAvg": ("layers", _iter_avg),
+    "FedAvg": ("layers", _fedavg),
+    "Krum": ("layers", _krum),
+    "CoordinateMedian": ("layers", _coordinate_median),
+    "GeometricMedianFedplus": ("layers", _geometric_median),
+    "AFA": ("layers", _afa),
+    "ComparativeElimination": ("layers", _comparative_elimination),
+    "PFNM": ("mlp", _pfnm),
+    "SPAHM": ("centroids", _spahm),
+}
+
+SERIALIZERS = {"pickle": SerializerTypes.PICKLE, "jsonpickle": SerializerTypes.JSON_PICKLE}
+
+
+def measure(fn, repeats=5, warmup=1, profile_memory=True):
+    """
+    Times `fn` and, in a separate run, records the peak of the memory it
+    allocates with `tracemalloc`, which would otherwise slow down the timed
+    runs.
+
+    :param fn: Callable without arguments.
+    :type fn: `callable`
+    :param repeats: Number of timed runs.
+    :type repeats: `int`
+    :param warmup: Number of untimed runs before the timed ones.
+    :type warmup: `int`
+    :param profile_memory: Whether to measure the allocation peak.
+    :type profile_memory: `bool`
+    :return: timings in seconds and peak memory in bytes
+    :rtype: `dict`
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    result = {
+        "repeats": repeats,
+        "min_s": min(times),
+        "median_s": float(np.median(times)),
+        "mean_s": float(np.mean(times)),
+        "max_s": max(times),
+    }
+    if profile_memory:
+        tracemalloc.start()
+        try:
+            fn()
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def _updates_for(kind, num_parties, layer_shapes, dtype, seed, cache):
+    if kind not in cache:
+        if kind == "mlp":
+            shapes = mlp_layer_shapes(layer_shapes)
+            cache[kind] = synthetic_model_updates(num_parties, shapes, dtype, seed=seed, num_classes=shapes[-1][0])
+        elif kind == "centroids":
+            cache[kind] = synthetic_model_updates(num_parties, centroid_shape(layer_shapes), dtype, seed=seed)
+            # SPAHM fuses one centroid matrix per party, not a list of layers
+            cache[kind] = [ModelUpdate(weights=u.get("weights")[0]) for u in cache[kind]]
+        else:
+            cache[kind] = synthetic_model_updates(num_parties, layer_shapes, dtype, seed=seed)
+    return cache[kind]
+
+
+def benchmark_fusion(name, num_parties, layer_shapes=None, dtype="float32", repeats=5, seed=0, _cache=None):
+    """
+    Benchmarks `fusion_collected_responses` of one fusion handler.
+
+    :param name: Key of `FUSION_CASES`.
+    :type name: `str`
+    :return: measurements, or the reason the handler was skipped
+    :rtype: `dict`
+    """
+    if name not in FUSION_CASES:
+        raise FLException("Unknown fusion handler {}, choose from {}".format(name, ", ".join(FUSION_CASES)))
+    layer_shapes = layer_shapes or DEFAULT_LAYER_SHAPES
+    kind, factory = FUSION_CASES[name]
+    result = {"name": name, "kind": "fusion"}
+    try:
+        updates = _updates_for(kind, num_parties, layer_shapes, dtype, seed, {} if _cache is None else _cache)
+        result.update(measure(factory(num_parties, updates), repeats=repeats))
+    except ImportError as ex:
+        # optional dependencies of a handler are missing
+        result["skipped"] = str(ex)
+    except Exception as ex:
+        logger.exception("Benchmark of %s failed", name)
+        result["error"] = "{}: {}".format(type(ex).__name__, ex)
+    return result
+
+
+def benchmark_serializer(name, updates, repeats=5):
+    """
+    Benchmarks serializing and deserializing a party reply carrying one
+    model update.
+
+    :param name: Key of `SERIALIZERS`.
+    :type name: `str`
+    :param updates: Model updates, the first one is sent.
+    :type updates: `list` of `ModelUpdate`
+    :return: measurements of the round trip and size of the payload
+    :rtype: `dict`
+    """
+    serializer = SerializerFactory(SERIALIZERS[name]).build()
+    message = Message(MessageType.TRAIN.value, data={"status": "success", "model_update": updates[0]})
+
+    def round_trip():
+        return serializer.deserialize(serializer.serialize(message))
+
+    result = {"name": name, "kind": "serializer", "payload_bytes": len(serializer.serialize(message))}
+    result.update(measure(round_trip, repeats=repeats))
+    return result
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(
+    handlers=None, num_parties=10, layer_shapes=None, dtype="float32", repeats=5, seed=0, serializers=None
+):
+    """
+    Runs the fusion and serializer benchmarks on one set of synthetic
+    updates.
+
+    :param handlers: Names of `FUSION_CASES` to run, all by default.
+    :type handlers: `list` of `str`
+    :param num_parties: Number of parties.
+    :type num_parties: `int`
+    :param layer_shapes: Shape of every layer.
+    :type layer_shapes: `list` of `tuple`
+    :param dtype: Dtype of the weights.
+    :type dtype: `str`
+    :param repeats: Number of timed runs per benchmark.
+    :type repeats: `int`
+    :param seed: Random seed of the synthetic updates.
+    :type seed: `int`
+    :param serializers: Names of `SERIALIZERS` to run, all by default.
+    :type serializers: `list` of `str`
+    :return: benchmark configuration, environment and results
+    :rtype: `dict`
+    """
+    layer_shapes = [tuple(shape) for shape in (layer_shapes or DEFAULT_LAYER_SHAPES)]
+    handlers = list(FUSION_CASES) if handlers is None else handlers
+    serializers = list(SERIALIZERS) if serializers is None else serializers
+
+    cache = {}
+    results = []
+    for name in handlers:
+        logger.info("Benchmarking %s with %d parties", name, num_parties)
+        results.append(benchmark_fusion(name, num_parties, layer_shapes, dtype, repeats, seed, _cache=cache))
+    updates = _updates_for("layers", num_parties, layer_shapes, dtype, seed, cache)
+    for name in serializers:
+        results.append(benchmark_serializer(name, updates, repeats=repeats))
+
+    return {
+        "version": RESULTS_VERSION,
+        "config": {
+            "num_parties": num_parties,
+            "layer_shapes": [list(shape) for shape in layer_shapes],
+            "dtype": str(np.dtype(dtype)),
+            "repeats": repeats,
+            "seed": seed,
+        },
+        "environment": {
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+
+
+def write_results(results, path):
+    with open(path, "w") as fp:
+        json.dump(results, fp, indent=2)
+
+
+def load_results(path):
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def compare_results(baseline, current):
+    """
+    Relates the median times and memory peaks of two benchmark runs.
+
+    :param baseline: Results of the reference run.
+    :type baseline: `dict`
+    :param current: Results of the new run.
+    :type current: `dict`
+    :return: per benchmark `{"name", "kind", "time_ratio", "memory_ratio"}`, \
+    ratios above 1 are regressions
+    :rtype: `list` of `dict`
+    """
+    if baseline.get("config") != current.get("config"):
+        logger.warning("Comparing benchmark runs with different configurations")
+
+    reference = {(r["kind"], r["name"]): r for r in baseline.get("results", [])}
+    comparison = []
+    for result in current.get("results", []):
+        old = reference.get((result["kind"], result["name"]))
+        if old is None or "median_s" not in old or "median_s" not in result:
+            continue
+        row = {"name": result["name"], "kind": result["kind"], "time_ratio": result["median_s"] / old["median_s"]}
+        if old.get("peak_bytes") and "peak_bytes" in result:
+            row["memory_ratio"] = result["peak_bytes"] / old["peak_bytes"]
+        comparison.append(row)
+    return comparison
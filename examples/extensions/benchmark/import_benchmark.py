@@ -0,0 +1,352 @@
+"""
+Import-time benchmark of the aggregator and party entry points.
+
+Every module is imported in a fresh interpreter, so each run pays the full
+cold import like a new aggregator or party process does. The child reports
+the import time, the peak RSS, the number of modules the import loaded and
+which heavy frameworks (tensorflow, torch, ray, ...) were among them. The
+`-X importtime` report gives the slowest imports of the module itself.
+Given an aggregator or party config, `benchmark_build` also measures a
+whole startup: loading the config and building the `Aggregator` or `Party`,
+once within `lazy_class_resolution()` and once with the eager config
+loader. Results use the layout of `fusion_benchmark`, so `compare_results`
+relates two runs.
+
+`check_startup` is the regression check: it fails a module whose startup
+imports a framework listed in `STARTUP_FORBIDDEN_MODULES`, whose median
+import time exceeds a budget, or that got slower than a baseline run by
+more than a tolerance.
+"""
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from examples.extensions.benchmark.fusion_benchmark import RESULTS_VERSION, git_commit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODULES = ["ibmfl.aggregator.aggregator", "ibmfl.party.party"]
+
+BUILD_CLASSES = {
+    "aggregator": ("ibmfl.aggregator.aggregator", "Aggregator"),
+    "party": ("ibmfl.party.party", "Party"),
+}
+
+HEAVY_MODULES = (
+    "tensorflow",
+    "keras",
+    "torch",
+    "skorch",
+    "ray",
+    "gensim",
+    "sklearn",
+    "scipy",
+    "pandas",
+    "matplotlib",
+    "diffprivlib",
+)
+
+# frameworks the entry points must not import before a config asks for them
+STARTUP_FORBIDDEN_MODULES = {
+    "ibmfl.aggregator.aggregator": ("tensorflow", "keras", "torch", "skorch", "ray", "gensim"),
+    "ibmfl.party.party": ("tensorflow", "keras", "torch", "skorch", "ray", "gensim"),
+}
+
+_CHILD = """
+import json, resource, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+__import__(sys.argv[1])
+elapsed = time.perf_counter() - start
+loaded = set(sys.modules) - before
+heavy = sys.argv[2].split(",")
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "import_s": elapsed,
+    "max_rss_bytes": rss if sys.platform == "darwin" else rss * 1024,
+    "num_modules": len(loaded),
+    "heavy_modules": sorted(m for m in heavy if m in loaded),
+}))
+"""
+
+_BUILD_CHILD = """
+import json, os, resource, sys, time
+module, name, config_file, lazy = sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4] == "1"
+before = set(sys.modules)
+start = time.perf_counter()
+# __import__, unlike importlib.import_module, is reported by -X importtime
+__import__(module)
+cls = getattr(sys.modules[module], name)
+if lazy:
+    from examples.extensions.util.lazy_imports import lazy_class_resolution
+    with lazy_class_resolution():
+        cls(config_file=config_file)
+else:
+    cls(config_file=config_file)
+elapsed = time.perf_counter() - start
+loaded = set(sys.modules) - before
+heavy = sys.argv[5].split(",")
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "import_s": elapsed,
+    "max_rss_bytes": rss if sys.platform == "darwin" else rss * 1024,
+    "num_modules": len(loaded),
+    "heavy_modules": sorted(m for m in heavy if m in loaded),
+}))
+sys.stdout.flush()
+# the connection of the built object may hold non-daemon threads
+os._exit(0)
+"""
+
+
+def parse_importtime(stderr, module, top=10):
+    """
+    Returns the slowest imports done directly by `module`, from an
+    `-X importtime` report.
+
+    :param stderr: standard error of the interpreter
+    :type stderr: `str`
+    :param module: module whose imports to return
+    :type module: `str`
+    :param top: number of imports to return
+    :type top: `int`
+    :return: `(module, cumulative seconds)` pairs, slowest first
+    :rtype: `list` of `tuple`
+    """
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        # nested imports are indented by two spaces per level and reported
+        # before the module that imports them
+        name = fields[2][1:]
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        if depth == 1:
+            children.append((name.strip(), int(fields[1]) / 1e6))
+        elif depth == 0:
+            if name.strip() == module:
+                break
+            children = []
+    children.sort(key=lambda item: item[1], reverse=True)
+    return children[:top]
+
+
+def _run_child(child, args, module, python=None, cwd=None):
+    """
+    Runs a child script with `-X importtime` in a new interpreter.
+
+    :return: measurements of the child process
+    :rtype: `dict`
+    """
+    cwd = cwd or os.getcwd()
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (cwd, env.get("PYTHONPATH")) if p)
+    start = time.perf_counter()
+    out = subprocess.run(
+        [python or sys.executable, "-X", "importtime", "-c", child] + list(args) + [",".join(HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+        cwd=cwd,
+        env=env,
+    )
+    process_s = time.perf_counter() - start
+    if out.returncode != 0:
+        lines = out.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else "exit code {}".format(out.returncode)}
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["process_s"] = process_s
+    result["top_imports"] = parse_importtime(out.stderr, module)
+    return result
+
+
+def import_once(module, python=None, cwd=None):
+    """
+    Imports `module` in a new interpreter.
+
+    :param module: absolute module name
+    :type module: `str`
+    :param python: interpreter to run, the current one by default
+    :type python: `str`
+    :param cwd: working directory, so that `examples.extensions` modules \
+    resolve from the repository root
+    :type cwd: `str`
+    :return: measurements of the child process
+    :rtype: `dict`
+    """
+    return _run_child(_CHILD, [module], module, python=python, cwd=cwd)
+
+
+def build_once(role, config_file, lazy=True, python=None, cwd=None):
+    """
+    Loads `config_file` and builds the aggregator or party in a new
+    interpreter.
+
+    :param role: `aggregator` or `party`
+    :type role: `str`
+    :param config_file: aggregator or party config
+    :type config_file: `str`
+    :param lazy: build within `lazy_class_resolution()`
+    :type lazy: `bool`
+    :return: measurements of the child process, with the import of the \
+    entry point and the build in `import_s`
+    :rtype: `dict`
+    """
+    module, name = BUILD_CLASSES[role]
+    args = [module, name, os.path.abspath(config_file), "1" if lazy else "0"]
+    return _run_child(_BUILD_CHILD, args, module, python=python, cwd=cwd)
+
+
+def _repeat(result, measure, repeats):
+    """
+    Calls `measure` `repeats` times and adds the median and spread of the
+    time, the peak RSS and the modules of the last run to `result`.
+
+    :return: the result
+    :rtype: `dict`
+    """
+    runs = []
+    for _ in range(repeats):
+        run = measure()
+        if "error" in run:
+            result["error"] = run["error"]
+            return result
+        runs.append(run)
+
+    times = [run["import_s"] for run in runs]
+    last = runs[-1]
+    result.update(
+        {
+            "median_s": statistics.median(times),
+            "min_s": min(times),
+            "max_s": max(times),
+            "median_process_s": statistics.median(run["process_s"] for run in runs),
+            "peak_bytes": max(run["max_rss_bytes"] for run in runs),
+            "num_modules": last["num_modules"],
+            "heavy_modules": last["heavy_modules"],
+            "top_imports": last["top_imports"],
+        }
+    )
+    return result
+
+
+def benchmark_import(module, repeats=5, python=None, cwd=None):
+    """
+    Imports `module` `repeats` times, each time in a new interpreter.
+
+    :return: median and spread of the import time, peak RSS and the \
+    modules of the last run
+    :rtype: `dict`
+    """
+    result = {"name": module, "kind": "import"}
+    return _repeat(result, lambda: import_once(module, python=python, cwd=cwd), repeats)
+
+
+def benchmark_build(role, config_file, repeats=5, lazy=True, python=None, cwd=None):
+    """
+    Loads `config_file` and builds the aggregator or party `repeats` times,
+    each time in a new interpreter.
+
+    :return: median and spread of the startup time, peak RSS and the \
+    modules of the last run
+    :rtype: `dict`
+    """
+    name = "{} {} ({})".format(role, os.path.basename(config_file), "lazy" if lazy else "eager")
+    result = {"name": name, "kind": "build"}
+    return _repeat(result, lambda: build_once(role, config_file, lazy=lazy, python=python, cwd=cwd), repeats)
+
+
+def run_import_benchmarks(modules=None, repeats=5, python=None, cwd=None, agg_config=None, party_config=None):
+    """
+    Runs the import benchmark of every module and, for the given configs,
+    the lazy and eager build benchmarks.
+
+    :param modules: absolute module names, `DEFAULT_MODULES` by default
+    :type modules: `list` of `str`
+    :param repeats: number of fresh interpreters per module
+    :type repeats: `int`
+    :param agg_config: aggregator config to build the `Aggregator` from
+    :type agg_config: `str`
+    :param party_config: party config to build the `Party` from
+    :type party_config: `str`
+    :return: benchmark configuration, environment and results
+    :rtype: `dict`
+    """
+    modules = list(DEFAULT_MODULES) if modules is None else modules
+    results = []
+    for module in modules:
+        logger.info("Benchmarking the import of %s", module)
+        results.append(benchmark_import(module, repeats=repeats, python=python, cwd=cwd))
+    for role, config_file in (("aggregator", agg_config), ("party", party_config)):
+        if config_file is None:
+            continue
+        for lazy in (True, False):
+            logger.info("Benchmarking the %s build from %s", role, config_file)
+            results.append(benchmark_build(role, config_file, repeats=repeats, lazy=lazy, python=python, cwd=cwd))
+
+    return {
+        "version": RESULTS_VERSION,
+        "config": {"modules": modules, "repeats": repeats, "agg_config": agg_config, "party_config": party_config},
+        "environment": {
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+
+
+def check_startup(results, max_seconds=None, baseline=None, tolerance=1.5, forbidden=None):
+    """
+    Checks import benchmark results against the startup budget.
+
+    :param results: results of `run_import_benchmarks`
+    :type results: `dict`
+    :param max_seconds: budget of the median import time of every module; \
+    builds are only compared to the baseline
+    :type max_seconds: `float`
+    :param baseline: results of an earlier run
+    :type baseline: `dict`
+    :param tolerance: largest accepted ratio to the baseline median
+    :type tolerance: `float`
+    :param forbidden: frameworks per module that the import must not load, \
+    `STARTUP_FORBIDDEN_MODULES` by default
+    :type forbidden: `dict`
+    :return: description of every failed check, empty if all passed
+    :rtype: `list` of `str`
+    """
+    forbidden = STARTUP_FORBIDDEN_MODULES if forbidden is None else forbidden
+    reference = {}
+    if baseline is not None:
+        reference = {(r.get("kind"), r["name"]): r for r in baseline.get("results", [])}
+
+    failures = []
+    for result in results.get("results", []):
+        name = result["name"]
+        if "error" in result:
+            failures.append("{}: {} failed: {}".format(name, result["kind"], result["error"]))
+            continue
+        loaded = set(result["heavy_modules"]) & set(forbidden.get(name, ()))
+        if loaded:
+            failures.append("{} imports {}".format(name, ", ".join(sorted(loaded))))
+        if max_seconds is not None and result["kind"] == "import" and result["median_s"] > max_seconds:
+            failures.append(
+                "{} imports in {:.3f} s, the budget is {:.3f} s".format(name, result["median_s"], max_seconds)
+            )
+        old = reference.get((result["kind"], name))
+        if old and old.get("median_s") and result["median_s"] > tolerance * old["median_s"]:
+            failures.append(
+                "{} imports in {:.3f} s, {:.2f}x the baseline of {:.3f} s".format(
+                    name, result["median_s"], result["median_s"] / old["median_s"], old["median_s"]
+                )
+            )
+    return failures
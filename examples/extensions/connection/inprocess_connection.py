@@ -0,0 +1,416 @@
+"""Connection that delivers `Message` objects by direct function calls, for
+simulating many parties on a single host.
+
+All supported config combinations are shown below.
+connection:
+  name: InProcessConnection
+  path: examples.extensions.connection.inprocess_connection
+  info:
+    ip: <ip>
+    port: <port>
+    copy_messages: true
+
+    `ip` and `port` are only used to name the endpoint (`<ip>:<port>`), so
+    configs written for `FlaskConnection` work unchanged; an explicit `id`
+    may be given instead. Messages are routed straight to the router of the
+    target node in the same process, without HTTP or jsonpickle. With
+    `copy_messages` (the default) the receiver gets a copy of the message
+    data, as it would over the network; weights inside `ModelUpdate` objects
+    are immutable pickled bytes and are never copied. Set it to false for
+    zero-copy delivery when no handler mutates its payload.
+
+    Parties living in other local processes are reached through a
+    `SharedMemoryChannel`: messages are pickled with protocol 5, large ones
+    and their out-of-band numpy buffers are placed in a
+    `multiprocessing.shared_memory` block, and only the block name goes
+    through a pipe.
+"""
+import copy
+import logging
+import pickle
+import threading
+import uuid
+from multiprocessing import shared_memory
+
+from ibmfl.connection.connection import ConnectionStatus, FLConnection, FLReceiver, FLSender
+from ibmfl.exceptions import FLException, InvalidConfigurationException, InvalidServerConfigurationException
+from ibmfl.message.message import Message
+
+logger = logging.getLogger(__name__)
+
+# endpoint id -> `InProcessReceiver` or `SharedMemoryChannel`
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+
+
+def endpoint_id(info):
+    """Name of the endpoint described by a connection config or sender info.
+
+    :param info: Connection information with `id` or `ip` and `port`
+    :type info: `dict`
+    :return: endpoint id
+    :rtype: `str`
+    """
+    if not info:
+        raise InvalidConfigurationException("Destination info is not valid or null.")
+    if info.get("id") is not None:
+        return str(info["id"])
+    if "ip" in info and "port" in info:
+        return "{}:{}".format(info["ip"], info["port"])
+    raise InvalidConfigurationException("Destination info does not have an id or host and port information")
+
+
+def register_endpoint(name, target):
+    with _endpoints_lock:
+        _endpoints[name] = target
+
+
+def unregister_endpoint(name, target=None):
+    with _endpoints_lock:
+        if target is None or _endpoints.get(name) is target:
+            _endpoints.pop(name, None)
+
+
+def get_endpoint(name):
+    with _endpoints_lock:
+        return _endpoints.get(name)
+
+
+def copy_message(message):
+    """Copies a message the way a network round trip would, without calling
+    its pickling hooks.
+
+    :param message: Message to copy
+    :type message: `Message`
+    :return: copied message
+    :rtype: `Message`
+    """
+    return Message(
+        message.message_type,
+        id_request=message.id_request,
+        data=copy.deepcopy(message.data),
+        sender_info=copy.deepcopy(message.sender_info),
+    )
+
+
+def handle_message(router, message):
+    """Routes a message to its handler like `FlaskReceiver` does and returns
+    the response message.
+
+    :param router: Router of the receiving node
+    :type router: `Router`
+    :param message: Request message
+    :type message: `Message`
+    :return: response message
+    :rtype: `Message`
+    """
+    handler, _ = router.get_handler(request_path=str(message.message_type))
+    if handler is None:
+        logger.info("Invalid Request ! Routing it to default handler")
+        handler, _ = router.get_handler(request_path="default")
+    try:
+        return handler(message)
+    except Exception as ex:
+        res_message = Message()
+        res_message.set_data({"status": "error", "message": str(ex)})
+        return res_message
+
+
+class InProcessConnection(FLConnection):
+    def __init__(self, config):
+        """Initializes the connection object and validates the config
+        provided to this connection instance
+
+        :param config: Dictionary of configuration provided to connection
+        :type config: `dict`
+        """
+        if not config:
+            raise InvalidServerConfigurationException("No connection configuration found")
+        self.settings = {k: v for k, v in config.items() if k in ("id", "ip", "port")}
+        self.settings["id"] = endpoint_id(config)
+        self.copy_messages = config.get("copy_messages", True)
+        self.config = config
+        self.receiver = None
+        self.sender = None
+        self.status = None
+
+    def initialize(self, **kwargs):
+        """Initialize receiver and sender"""
+        self.initialize_receiver(router=kwargs.get("router"))
+        self.initialize_sender()
+
+    def initialize_receiver(self, router=None):
+        """Initialize the receiver of this endpoint.
+
+        :param router: Router object describing the routes for each request \
+            which are passed down to PH
+        :type router: `Router`
+        """
+        self.receiver = InProcessReceiver(router, self.settings["id"])
+        self.receiver.initialize()
+        self.status = ConnectionStatus.INITIALIZED
+
+    def initialize_sender(self):
+        """Initialize the sender using the settings provided during
+        connection creation
+        """
+        self.sender = InProcessSender(self.settings, copy_messages=self.copy_messages)
+        self.sender.initialize()
+        self.status = ConnectionStatus.INITIALIZED
+
+    def get_connection_config(self):
+        """Provide a connection information such that a node can communicate
+        to other nodes on how to communicate with it.
+
+        :return: settings
+        :rtype: `dict`
+        """
+        return self.settings
+
+    def start(self):
+        """Makes this endpoint reachable"""
+        self.receiver.start()
+        self.status = ConnectionStatus.STARTED
+        self.SENDER_STATUS = ConnectionStatus.STARTED
+        self.RECEIVER_STATUS = ConnectionStatus.STARTED
+
+    def stop(self):
+        """Stop and cleanup the connection"""
+        logger.info("Stopping Receiver and Sender")
+        self.status = ConnectionStatus.STOPPED
+        if self.receiver is not None:
+            self.receiver.stop()
+
+
+class InProcessReceiver(FLReceiver):
+    def __init__(self, router, name):
+        """
+        :param router: Router object describing the routes for each request
+            which are passed down to PH
+        :type router: `Router`
+        :param name: Endpoint id under which the receiver is reachable
+        :type name: `str`
+        """
+        self.router = router
+        self.name = name
+
+    def initialize(self):
+        if self.router is None:
+            raise InvalidServerConfigurationException("No router was provided to the receiver")
+
+    def start(self):
+        register_endpoint(self.name, self)
+        logger.info("Endpoint {} started".format(self.name))
+
+    def stop(self):
+        unregister_endpoint(self.name, self)
+
+    def handle(self, message):
+        """Handles a request delivered by a sender.
+
+        :param message: Request message
+        :type message: `Message`
+        :return: response message
+        :rtype: `Message`
+        """
+        return handle_message(self.router, message)
+
+
+class InProcessSender(FLSender):
+    """
+    Delivers messages to receivers registered in this process, or forwards
+    them through the `SharedMemoryChannel` registered for the destination.
+    """
+
+    def __init__(self, source_info, copy_messages=True):
+        """
+        :param source_info: Connection details of the sending node
+        :type source_info: `dict`
+        :param copy_messages: Whether receivers get a copy of the message data
+        :type copy_messages: `bool`
+        """
+        self.source_info = source_info
+        self.copy_messages = copy_messages
+
+    def initialize(self):
+        logger.info("InProcessSender initialized")
+
+    def send_message(self, destination, message):
+        """
+        Delivers a message and returns the response of the destination.
+
+        :param destination: Information about the destination to which message \
+        should be forwarded
+        :type destination: `dict`
+        :param message: Message object constructed by aggregator/party
+        :type message: `Message`
+        :return: response message
+        :rtype: `Message`
+        """
+        name = endpoint_id(destination)
+        target = get_endpoint(name)
+        if target is None:
+            raise FLException("No endpoint {} is running".format(name))
+
+        message.add_sender_info(self.source_info)
+        if isinstance(target, SharedMemoryChannel):
+            # the message is pickled anyway
+            return target.call(name, message)
+
+        if self.copy_messages:
+            return copy_message(target.handle(copy_message(message)))
+        return target.handle(message)
+
+    def cleanup(self):
+        logger.info("Cleanup in-process sender")
+
+
+class SharedMemoryChannel:
+    """
+    Duplex link between two local processes over a `multiprocessing` pipe.
+
+    Each side registers the channel for the endpoints living on the other
+    side; `InProcessSender` then forwards messages for them through
+    `call`. Requests are handled in their own thread, so a handler may send
+    further messages (e.g., a party reply) while a call is pending.
+    """
+
+    def __init__(self, conn, shm_threshold=1 << 20):
+        """
+        :param conn: One end of a duplex `multiprocessing.Pipe`
+        :type conn: `multiprocessing.connection.Connection`
+        :param shm_threshold: Messages of at least this many bytes are \
+        passed through shared memory instead of the pipe
+        :type shm_threshold: `int`
+        """
+        self.conn = conn
+        self.shm_threshold = shm_threshold
+        self.remote_endpoints = []
+        self.endpoints_ready = threading.Event()
+        self.closed = threading.Event()
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._blocks = {}
+        self._listener = threading.Thread(target=self._listen, name="SharedMemoryChannel", daemon=True)
+
+    def start(self):
+        self._listener.start()
+
+    def announce(self, names):
+        """Tells the other side which endpoints live in this process.
+
+        :param names: Endpoint ids
+        :type names: `list` of `str`
+        """
+        self._send(("endpoints", list(names)))
+
+    def close(self):
+        if not self.closed.is_set():
+            try:
+                self._send(("close",))
+            except (OSError, EOFError):
+                pass
+        self._shutdown()
+
+    def call(self, name, message):
+        """Delivers a message to endpoint `name` on the other side.
+
+        :return: response message
+        :rtype: `Message`
+        """
+        call_id = uuid.uuid4().hex
+        pending = {"event": threading.Event()}
+        self._pending[call_id] = pending
+        self._send(("call", call_id, name, self._encode(message)))
+        while not pending["event"].wait(timeout=1.0):
+            if self.closed.is_set():
+                raise FLException("Channel to {} was closed".format(name))
+        del self._pending[call_id]
+        return self._decode(pending["blob"])
+
+    def _send(self, item):
+        with self._send_lock:
+            self.conn.send(item)
+
+    def _encode(self, message):
+        buffers = []
+        state = (message.message_type, message.id_request, message.data, message.sender_info)
+        head = pickle.dumps(state, protocol=5, buffer_callback=buffers.append)
+        raws = [buf.raw() for buf in buffers]
+        sizes = [len(head)] + [raw.nbytes for raw in raws]
+        if sum(sizes) < self.shm_threshold:
+            return ("inline", head, [bytes(raw) for raw in raws])
+
+        block = shared_memory.SharedMemory(create=True, size=sum(sizes))
+        offset = 0
+        for part, size in zip([head] + raws, sizes):
+            block.buf[offset : offset + size] = part
+            offset += size
+        self._blocks[block.name] = block
+        return ("shm", block.name, sizes)
+
+    def _decode(self, blob):
+        if blob[0] == "inline":
+            _, head, raws = blob
+            state = pickle.loads(head, buffers=[bytearray(raw) for raw in raws])
+        else:
+            _, name, sizes = blob
+            block = shared_memory.SharedMemory(name=name)
+            try:
+                parts, offset = [], 0
+                for size in sizes:
+                    parts.append(bytearray(block.buf[offset : offset + size]))
+                    offset += size
+            finally:
+                block.close()
+            self._send(("release", name))
+            state = pickle.loads(parts[0], buffers=parts[1:])
+        message_type, id_request, data, sender_info = state
+        return Message(message_type, id_request=id_request, data=data, sender_info=sender_info)
+
+    def _handle_call(self, call_id, name, blob):
+        message = self._decode(blob)
+        target = get_endpoint(name)
+        if isinstance(target, InProcessReceiver):
+            response = target.handle(message)
+        else:
+            response = Message()
+            response.set_data({"status": "error", "message": "No endpoint {} is running".format(name)})
+        self._send(("reply", call_id, self._encode(response)))
+
+    def _listen(self):
+        try:
+            while True:
+                item = self.conn.recv()
+                kind = item[0]
+                if kind == "call":
+                    threading.Thread(target=self._handle_call, args=item[1:], daemon=True).start()
+                elif kind == "reply":
+                    pending = self._pending.get(item[1])
+                    if pending is not None:
+                        pending["blob"] = item[2]
+                        pending["event"].set()
+                elif kind == "release":
+                    block = self._blocks.pop(item[1], None)
+                    if block is not None:
+                        block.close()
+                        block.unlink()
+                elif kind == "endpoints":
+                    for name in item[1]:
+                        register_endpoint(name, self)
+                    self.remote_endpoints.extend(item[1])
+                    self.endpoints_ready.set()
+                elif kind == "close":
+                    break
+        except (EOFError, OSError):
+            logger.info("Shared memory channel closed by the other side")
+        self._shutdown()
+
+    def _shutdown(self):
+        self.closed.set()
+        for name in self.remote_endpoints:
+            unregister_endpoint(name, self)
+        while self._blocks:
+            _, block = self._blocks.popitem()
+            block.close()
+            block.unlink()
@@ -0,0 +1,254 @@
+"""
+Single-host simulation of an aggregator and N parties over
+`InProcessConnection`.
+
+The aggregator and party configs written by `examples/generate_configs.py`
+are loaded as they are and only their `connection` sections are swapped for
+in-process ones. Parties either live in the launching process or are spread
+over local worker processes, which talk to the aggregator through
+`SharedMemoryChannel`s.
+"""
+import glob
+import logging
+import multiprocessing
+import os
+import re
+import time
+
+import yaml
+
+from examples.extensions.connection.inprocess_connection import SharedMemoryChannel, endpoint_id
+from ibmfl.aggregator.aggregator import Aggregator
+from ibmfl.aggregator.states import States
+from ibmfl.exceptions import FLException
+from ibmfl.party.party import Party
+
+logger = logging.getLogger(__name__)
+
+INPROCESS_CONNECTION = {
+    "name": "InProcessConnection",
+    "path": "examples.extensions.connection.inprocess_connection",
+}
+
+SIMULATION_COMMANDS = ("TRAIN", "SYNC", "EVAL", "SAVE")
+
+
+def to_inprocess_connection(connection, copy_messages=True):
+    """
+    Turns the `connection` section of a generated config into an in-process
+    one that keeps the endpoint address.
+
+    :param connection: Connection section of an aggregator or party config.
+    :type connection: `dict`
+    :param copy_messages: Whether receivers get a copy of the message data.
+    :type copy_messages: `bool`
+    :return: in-process connection section
+    :rtype: `dict`
+    """
+    info = {k: v for k, v in (connection.get("info") or {}).items() if k in ("id", "ip", "port")}
+    info["copy_messages"] = copy_messages
+    return dict(INPROCESS_CONNECTION, info=info, sync=connection.get("sync", False))
+
+
+def load_simulation_configs(config_folder, num_parties=None, copy_messages=True):
+    """
+    Reads `config_agg.yml` and `config_party<i>.yml` from `config_folder`
+    and switches them to in-process connections.
+
+    :param config_folder: Folder written by `examples/generate_configs.py`.
+    :type config_folder: `str`
+    :param num_parties: Number of parties to use, all configs by default.
+    :type num_parties: `int`
+    :param copy_messages: Whether receivers get a copy of the message data.
+    :type copy_messages: `bool`
+    :return: aggregator config and list of party configs
+    :rtype: `tuple`
+    """
+    with open(os.path.join(config_folder, "config_agg.yml")) as stream:
+        agg_config = yaml.safe_load(stream)
+    agg_config["connection"] = to_inprocess_connection(agg_config["connection"], copy_messages)
+
+    def party_index(file_name):
+        return int(re.search(r"config_party(\d+)\.yml$", file_name).group(1))
+
+    party_files = sorted(glob.glob(os.path.join(config_folder, "config_party*.yml")), key=party_index)
+    if num_parties is not None:
+        party_files = party_files[:num_parties]
+    if not party_files:
+        raise FLException("No party configs found in " + str(config_folder))
+
+    party_configs = []
+    for file_name in party_files:
+        with open(file_name) as stream:
+            config = yaml.safe_load(stream)
+        config["connection"] = to_inprocess_connection(config["connection"], copy_messages)
+        party_configs.append(config)
+
+    agg_config["hyperparams"]["global"]["num_parties"] = len(party_configs)
+    return agg_config, party_configs
+
+
+def start_party(config):
+    """
+    Creates and starts one party; it still has to register.
+
+    :param config: Party config with an in-process connection.
+    :type config: `dict`
+    :return: the running party
+    :rtype: `Party`
+    """
+    party = Party(config_dict=config)
+    if not hasattr(party, "proto_handler"):
+        # Party logs and swallows configuration errors
+        raise FLException("Party {} could not be initialized".format(endpoint_id(config["connection"]["info"])))
+    party.start()
+    return party
+
+
+def _party_worker(conn, party_configs, shm_threshold):
+    """
+    Entry point of a worker process hosting a group of parties.
+    """
+    channel = SharedMemoryChannel(conn, shm_threshold=shm_threshold)
+    channel.start()
+    parties = []
+    try:
+        for config in party_configs:
+            parties.append(start_party(config))
+        channel.announce([endpoint_id(p.connection.get_connection_config()) for p in parties])
+        # the aggregator endpoint is announced by the launcher
+        channel.endpoints_ready.wait()
+        for party in parties:
+            party.register_party()
+        channel.closed.wait()
+    finally:
+        for party in parties:
+            party.stop()
+        channel.close()
+
+
+class Simulation:
+    """
+    Runs an `Aggregator` and its parties on one host.
+    """
+
+    def __init__(self, agg_config, party_configs, num_workers=0, shm_threshold=1 << 20, register_timeout=600):
+        """
+        :param agg_config: Aggregator config with an in-process connection.
+        :type agg_config: `dict`
+        :param party_configs: Party configs with in-process connections.
+        :type party_configs: `list` of `dict`
+        :param num_workers: Number of worker processes for the parties; 0 \
+        runs all parties in this process.
+        :type num_workers: `int`
+        :param shm_threshold: Messages of at least this many bytes are \
+        passed through shared memory between processes.
+        :type shm_threshold: `int`
+        :param register_timeout: Seconds to wait for all parties to register.
+        :type register_timeout: `float`
+        """
+        self.agg_config = agg_config
+        self.party_configs = party_configs
+        self.num_workers = num_workers
+        self.shm_threshold = shm_threshold
+        self.register_timeout = register_timeout
+        self.aggregator = None
+        self.parties = []
+        self.workers = []
+        self.channels = []
+
+    def start(self):
+        """
+        Starts the aggregator and all parties and waits until every party
+        is registered.
+
+        :return: None
+        """
+        self.aggregator = Aggregator(config_dict=self.agg_config)
+        self.aggregator.proto_handler.state = States.CLI_WAIT
+        self.aggregator.start()
+        agg_name = endpoint_id(self.aggregator.connection.get_connection_config())
+
+        if self.num_workers <= 0:
+            for config in self.party_configs:
+                party = start_party(config)
+                party.register_party()
+                self.parties.append(party)
+        else:
+            context = multiprocessing.get_context("spawn")
+            groups = [self.party_configs[i :: self.num_workers] for i in range(self.num_workers)]
+            for group in filter(None, groups):
+                parent_conn, child_conn = context.Pipe()
+                worker = context.Process(target=_party_worker, args=(child_conn, group, self.shm_threshold))
+                worker.start()
+                channel = SharedMemoryChannel(parent_conn, shm_threshold=self.shm_threshold)
+                channel.start()
+                channel.announce([agg_name])
+                self.workers.append(worker)
+                self.channels.append(channel)
+
+        deadline = time.time() + self.register_timeout
+        while self.aggregator.proto_handler.get_n_parties() < len(self.party_configs):
+            if any(not worker.is_alive() for worker in self.workers):
+                raise FLException("A party worker process exited before all parties registered")
+            if time.time() > deadline:
+                raise FLException(
+                    "Only {} of {} parties registered".format(
+                        self.aggregator.proto_handler.get_n_parties(), len(self.party_configs)
+                    )
+                )
+            time.sleep(0.1)
+        logger.info("All {} parties registered".format(len(self.party_configs)))
+
+    def run(self, commands=("TRAIN", "EVAL")):
+        """
+        Executes aggregator commands as the aggregator CLI does.
+
+        :param commands: Sequence of `TRAIN`, `SYNC`, `EVAL` and `SAVE`.
+        :type commands: `tuple` of `str`
+        :return: True if all commands succeeded
+        :rtype: `bool`
+        """
+        for command in commands:
+            command = command.upper()
+            if command == "TRAIN":
+                self.aggregator.proto_handler.state = States.TRAIN
+                if not self.aggregator.start_training():
+                    return False
+            elif command == "SYNC":
+                self.aggregator.proto_handler.state = States.SYNC
+                self.aggregator.model_synch()
+            elif command == "EVAL":
+                self.aggregator.proto_handler.state = States.EVAL
+                self.aggregator.eval_model()
+            elif command == "SAVE":
+                self.aggregator.proto_handler.state = States.SAVE
+                self.aggregator.save_model()
+            else:
+                raise FLException("Unsupported simulation command " + str(command))
+        return True
+
+    def stop(self):
+        """
+        Stops the parties, the worker processes and the aggregator.
+
+        :return: None
+        """
+        if self.aggregator is not None:
+            self.aggregator.proto_handler.state = States.STOP
+            self.aggregator.stop()
+        for party in self.parties:
+            party.stop()
+        for channel in self.channels:
+            channel.close()
+        for worker in self.workers:
+            worker.join(timeout=30)
+            if worker.is_alive():
+                worker.terminate()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
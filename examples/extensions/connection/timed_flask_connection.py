@@ -0,0 +1,171 @@
+"""`FlaskConnection` that measures payload sizes and (de)serialization times
+for `examples.extensions.metrics.phase_timing` and serves the aggregator's
+round metrics in the Prometheus text format.
+
+connection:
+  name: TimedFlaskConnection
+  path: examples.extensions.connection.timed_flask_connection
+  info:
+    ip: <ip>
+    port: <port>
+    recorder: default
+    metrics_endpoint: true
+
+    All `FlaskConnection` settings apply. `recorder` names the
+    `PhaseRecorder` shared with `TimedProtoHandler` and
+    `PhaseTimingMetricsHandler`. With `metrics_endpoint` (the default)
+    `GET /metrics` on the node's Flask app returns the metrics of the last
+    finished round.
+"""
+import logging
+import time
+
+from flask import Flask, Response, request
+from requests.exceptions import SSLError
+
+from examples.extensions.metrics.phase_timing import get_recorder
+from ibmfl.connection.connection import ConnectionStatus
+from ibmfl.connection.flask_connection import FlaskConnection, FlaskReceiver, RestSender
+from ibmfl.exceptions import FLException
+from ibmfl.message.message import Message
+from ibmfl.message.serializer_factory import SerializerFactory
+from ibmfl.message.serializer_types import SerializerTypes
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class TimedFlaskConnection(FlaskConnection):
+    def __init__(self, config):
+        super().__init__(config)
+        self.recorder = get_recorder(config.get("recorder", "default"))
+        self.metrics_endpoint = config.get("metrics_endpoint", True)
+
+    def initialize_receiver(self, router=None):
+        """Initialize the timed flask server using the settings and handler.
+
+        :param router: Router object describing the routes for each request \
+            which are passed down to PH
+        :type router: `Router`
+        """
+        self.receiver = TimedFlaskReceiver(
+            router,
+            self.settings.get("ip"),
+            self.settings.get("port"),
+            self.ssl_config,
+            recorder=self.recorder,
+            metrics_endpoint=self.metrics_endpoint,
+        )
+        logger.info("Receiver Initialized")
+        self.receiver.initialize()
+        self.status = ConnectionStatus.INITIALIZED
+
+    def initialize_sender(self):
+        """Initialize the timed http client"""
+        self.sender = TimedRestSender(self.settings, self.ssl_config, recorder=self.recorder)
+        self.sender.initialize()
+        self.status = ConnectionStatus.INITIALIZED
+
+
+class TimedFlaskReceiver(FlaskReceiver):
+    def __init__(self, router, host, port, ssl_config=None, recorder=None, metrics_endpoint=True):
+        super().__init__(router, host, port, ssl_config)
+        self.recorder = recorder or get_recorder()
+        self.metrics_endpoint = metrics_endpoint
+
+    def initialize(self):
+        """
+        Creates the Flask app like `FlaskReceiver`, timing the
+        deserialization of every request, and adds `GET /metrics`.
+        """
+        logger.info("Initializing Flask application")
+        app = Flask(__name__)
+
+        @app.route("/shutdown", methods=["POST"])
+        def shutdown():
+            self.shutdown_server()
+            return "Server shutting down..."
+
+        if self.metrics_endpoint:
+
+            @app.route("/metrics", methods=["GET"])
+            def metrics():
+                return Response(response=self.recorder.prometheus_text(), status=200, mimetype=PROMETHEUS_CONTENT_TYPE)
+
+        @app.route("/", defaults={"path": ""}, methods=["GET", "POST"])
+        @app.route("/<path:path>", methods=["GET", "POST"])
+        def handle_request(path):
+            logger.info("Request received for path :" + path)
+
+            serializer = SerializerFactory(SerializerTypes.JSON_PICKLE).build()
+
+            start = time.perf_counter()
+            message = serializer.deserialize(request.data)
+            # picked up by the protocol handler in this thread
+            self.recorder.set_transfer(received_bytes=len(request.data), deserialize_s=time.perf_counter() - start)
+            handler, kwargs = self.router.get_handler(request_path=path)
+            if handler is None:
+                logger.info("Invalid Request ! Routing it to default handler")
+                handler, kwargs = self.router.get_handler(request_path="default")
+            try:
+                res_message = handler(message)
+
+            except Exception as ex:
+                res_message = Message()
+                data = {"status": "error", "message": str(ex)}
+                res_message.set_data(data)
+
+            return Response(response=serializer.serialize(res_message), status=200)
+
+        self.app = app
+
+
+class TimedRestSender(RestSender):
+    def __init__(self, source_info, ssl_config=None, recorder=None):
+        super().__init__(source_info, ssl_config)
+        self.recorder = recorder or get_recorder()
+
+    def send_message(self, destination, message):
+        """
+        Sends a message like `RestSender` and reports the request and
+        response sizes and (de)serialization times to the recorder.
+
+        :param destination: Information about the destination to which message \
+        should be forwarded
+        :type destination: `dict`
+        :param message: Message object constructed by aggregator/party
+        :type message: `Message`
+        :return: response object
+        :rtype: `Response`
+        """
+        path = message.message_type
+        endpoint = self.get_url_from_info(destination)
+
+        message.add_sender_info(self.source_info)
+        serializer = SerializerFactory(SerializerTypes.JSON_PICKLE).build()
+
+        start = time.perf_counter()
+        message = serializer.serialize(message)
+        serialize_s = time.perf_counter() - start
+
+        headers = self.get_headers(destination)
+        certs = self.get_certificates_mutual_auth()
+        logger.debug("Sending serialized message")
+        try:
+            response = self.post(endpoint, path, message, headers, certs)
+        except SSLError:
+            logger.exception("Error occurred while performing ssl handshake")
+            raise FLException("SSL Handshake error occured while sending request to url: " + str(endpoint))
+
+        logger.debug("Received serialized message as response")
+        start = time.perf_counter()
+        response_message = serializer.deserialize(response.content)
+        # picked up by the protocol handler in this thread
+        self.recorder.set_transfer(
+            request_bytes=len(message),
+            serialize_s=serialize_s,
+            reply_bytes=len(response.content),
+            deserialize_s=time.perf_counter() - start,
+        )
+        return response_message
@@ -0,0 +1,329 @@
+"""
+Streaming mini-batch data sources for local training.
+
+`PytorchFLModel`, `KerasFLModel` and `TensorFlowFLModel` are normally given
+`(x_train, y_train)` as fully materialized arrays. A `BatchStream` instead
+reads one mini-batch at a time from arrays, memory-mapped arrays or
+`BatchView` objects, applies per-batch preprocessing and prepares the next
+batches in a background thread while the model trains on the current one.
+The streaming model wrappers in `examples.extensions.model` consume it
+natively through a torch `IterableDataset`, `tf.data.Dataset.from_generator`
+and a Keras generator.
+"""
+import logging
+import queue
+import threading
+
+import numpy as np
+
+from ibmfl.exceptions import FLException
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class BatchStream:
+    """
+    Re-iterable source of `(x, y)` mini-batches.
+
+    Each iteration is one epoch. With `shuffle=True` the rows are shuffled
+    every epoch; if `shard_size` is also set, the dataset is split into
+    contiguous shards of `shard_size` rows, the order of the shards is
+    shuffled and rows are shuffled within each shard only. Batches then read
+    from at most a couple of neighbouring regions, which keeps disk access
+    of memory-mapped arrays mostly sequential.
+    """
+
+    def __init__(
+        self,
+        x,
+        y=None,
+        batch_size=128,
+        shuffle=False,
+        shard_size=None,
+        transform=None,
+        prefetch=2,
+        drop_last=False,
+        seed=None,
+    ):
+        """
+        :param x: Features, any sliceable object with `len`, e.g., \
+        `np.ndarray`, `np.memmap` or `BatchView`.
+        :type x: `np.ndarray`
+        :param y: Labels aligned with `x`, or None.
+        :type y: `np.ndarray`
+        :param batch_size: Rows per batch.
+        :type batch_size: `int`
+        :param shuffle: Whether to shuffle the rows every epoch.
+        :type shuffle: `bool`
+        :param shard_size: Rows per shard for sharded shuffling; None \
+        shuffles across the whole dataset.
+        :type shard_size: `int`
+        :param transform: Per-batch preprocessing `transform(x, y) -> (x, y)`.
+        :type transform: `callable`
+        :param prefetch: Number of batches prepared ahead in a background \
+        thread; 0 reads batches synchronously.
+        :type prefetch: `int`
+        :param drop_last: Whether to drop the last incomplete batch.
+        :type drop_last: `bool`
+        :param seed: Seed of the shuffling.
+        :type seed: `int`
+        """
+        if y is not None and len(x) != len(y):
+            raise FLException("Features and labels have different lengths: {} and {}".format(len(x), len(y)))
+        self.x = x
+        self.y = y
+        self.batch_size = int(batch_size)
+        self.shuffle = shuffle
+        self.shard_size = shard_size
+        self.transform = transform
+        self.prefetch = int(prefetch)
+        self.drop_last = drop_last
+        self._rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        """
+        :return: number of batches per epoch
+        :rtype: `int`
+        """
+        if self.drop_last:
+            return len(self.x) // self.batch_size
+        return int(np.ceil(len(self.x) / float(self.batch_size)))
+
+    @property
+    def num_samples(self):
+        return len(self.x)
+
+    def set_batch_size(self, batch_size):
+        """
+        Sets the number of rows per batch, e.g., from the training
+        hyperparameters of the current round.
+
+        :param batch_size: Rows per batch.
+        :type batch_size: `int`
+        :return: None
+        """
+        if batch_size:
+            self.batch_size = int(batch_size)
+
+    def epoch_order(self):
+        """
+        Returns the row order of the next epoch, or None for the natural
+        order.
+
+        :return: row indices
+        :rtype: `np.ndarray`
+        """
+        if not self.shuffle:
+            return None
+        num_samples = len(self.x)
+        if not self.shard_size or self.shard_size >= num_samples:
+            return self._rng.permutation(num_samples)
+
+        starts = np.arange(0, num_samples, self.shard_size)
+        order = []
+        for start in starts[self._rng.permutation(len(starts))]:
+            stop = min(start + self.shard_size, num_samples)
+            order.append(start + self._rng.permutation(stop - start))
+        return np.concatenate(order)
+
+    def batch_slices(self, order=None):
+        """
+        Yields the row selection of every batch of one epoch: a `slice` for
+        the natural order, otherwise sorted row indices.
+
+        :param order: Row order returned by `epoch_order`.
+        :type order: `np.ndarray`
+        :return: generator of `slice` or `np.ndarray`
+        """
+        num_samples = len(self.x)
+        stop = len(self) * self.batch_size if self.drop_last else num_samples
+        for start in range(0, stop, self.batch_size):
+            if order is None:
+                yield slice(start, min(start + self.batch_size, num_samples))
+            else:
+                # sorted reads keep memory-mapped access sequential
+                yield np.sort(order[start : start + self.batch_size])
+
+    def read_batch(self, rows):
+        """
+        Reads and preprocesses one batch.
+
+        :param rows: Row selection returned by `batch_slices`.
+        :type rows: `slice` or `np.ndarray`
+        :return: features and labels of the batch
+        :rtype: `tuple`
+        """
+        x = np.asarray(self.x[rows])
+        y = np.asarray(self.y[rows]) if self.y is not None else None
+        if self.transform is not None:
+            x, y = self.transform(x, y)
+        return x, y
+
+    def __iter__(self):
+        order = self.epoch_order()
+        if self.prefetch <= 0:
+            return (self.read_batch(rows) for rows in self.batch_slices(order))
+        return self._prefetched(order)
+
+    def _prefetched(self, order):
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            # gives up once the consumer has stopped, instead of blocking on a full queue
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for rows in self.batch_slices(order):
+                    if not put(self.read_batch(rows)):
+                        return
+                put(_END)
+            except Exception as ex:
+                put(ex)
+
+        worker = threading.Thread(target=produce, name="BatchStreamPrefetch", daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise FLException("Error while reading a training batch: " + str(item)) from item
+                yield item
+        finally:
+            # also reached when the consumer stops early
+            stop.set()
+
+    def keras_generator(self):
+        """
+        Endless generator over the epochs, as expected by Keras
+        `fit_generator` together with `steps_per_epoch=len(stream)`.
+
+        :return: generator of `(x, y)`
+        """
+        while True:
+            for batch in self:
+                yield batch
+
+    def to_torch_dataset(self):
+        """
+        Wraps the stream in a torch `IterableDataset` that yields whole
+        batches; load it with `DataLoader(dataset, batch_size=None)`.
+
+        :return: iterable dataset
+        :rtype: `torch.utils.data.IterableDataset`
+        """
+        from torch.utils.data import IterableDataset
+
+        stream = self
+
+        class BatchStreamDataset(IterableDataset):
+            def __iter__(self):
+                return iter(stream)
+
+            def __len__(self):
+                return len(stream)
+
+        return BatchStreamDataset()
+
+    def to_tf_dataset(self):
+        """
+        Wraps the stream in a `tf.data.Dataset`. Shapes and dtypes are taken
+        from the first batch, with an unknown batch dimension.
+
+        :return: dataset of `(x, y)` batches
+        :rtype: `tf.data.Dataset`
+        """
+        import tensorflow as tf
+
+        x, y = self.read_batch(next(self.batch_slices()))
+
+        def spec(batch):
+            return tf.TensorSpec(shape=(None,) + batch.shape[1:], dtype=tf.as_dtype(batch.dtype))
+
+        if y is None:
+            return tf.data.Dataset.from_generator(lambda: (b[0] for b in self), output_signature=spec(x))
+        return tf.data.Dataset.from_generator(self.__iter__, output_signature=(spec(x), spec(y)))
+
+
+def training_batch_size(fit_params, local_params=None, default=None):
+    """
+    Reads the batch size of the current round from the fit parameters
+    sent by the aggregator, as the model wrappers do.
+
+    :param fit_params: Fit parameters containing `hyperparams`.
+    :type fit_params: `dict`
+    :param local_params: Party specific training parameters, which take \
+    precedence if they set `batch_size`.
+    :type local_params: `dict`
+    :param default: Batch size if none is configured.
+    :type default: `int`
+    :return: batch size
+    :rtype: `int`
+    """
+    hyperparams = (fit_params or {}).get("hyperparams") or {}
+    training_hp = (hyperparams.get("local") or {}).get("training") or {}
+    batch_size = training_hp.get("batch_size", default)
+    if local_params and "batch_size" in local_params:
+        batch_size = local_params["batch_size"]
+    return batch_size
+
+
+class StreamingDataMixin:
+    """
+    Mixin for `DataHandler` subclasses that serves the training data as a
+    `BatchStream` instead of materialized arrays.
+
+    The stream reads `self.train_view`/`self.y_train_view` if set (see
+    `memmap_data_handlers`), otherwise `self.x_train`/`self.y_train`.
+    Override `transform_batch` for per-batch preprocessing. Options come
+    from `self.stream_params`, typically the `stream` entry of the data
+    config, e.g. `{"shuffle": true, "shard_size": 8192, "prefetch": 4}`.
+    """
+
+    stream_params = None
+
+    def transform_batch(self, x, y):
+        """
+        Preprocesses one training batch; the identity by default.
+
+        :param x: Features of the batch.
+        :type x: `np.ndarray`
+        :param y: Labels of the batch.
+        :type y: `np.ndarray`
+        :return: preprocessed features and labels
+        :rtype: `tuple`
+        """
+        return x, y
+
+    def get_train_stream(self, **kwargs):
+        """
+        Creates a stream over the training data.
+
+        :param kwargs: `BatchStream` arguments, overriding `stream_params`.
+        :type kwargs: `dict`
+        :return: training batch stream
+        :rtype: `BatchStream`
+        """
+        params = dict(self.stream_params or {})
+        params.update(kwargs)
+        params.setdefault("batch_size", getattr(self, "batch_size", 128))
+        params.setdefault("transform", self.transform_batch)
+
+        x = getattr(self, "train_view", None)
+        y = getattr(self, "y_train_view", None)
+        if x is None:
+            x, y = self.x_train, self.y_train
+        if x is None:
+            raise FLException("No data is provided!")
+        return BatchStream(x, y, **params)
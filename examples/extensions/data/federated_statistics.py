@@ -0,0 +1,210 @@
+"""
+Party and aggregator glue for federated dataset statistics.
+
+Parties summarize their training data in one streaming pass with
+`FeatureStatistics` and send only the summary; the aggregator merges the
+summaries into global statistics and can send back a global preprocessor,
+e.g., a `StandardScaler` fitted on the union of all parties' data.
+"""
+import logging
+
+from examples.extensions.data.statistics import FeatureStatistics, iter_chunks, merge_statistics
+from ibmfl.exceptions import FLException, LocalTrainingException
+from ibmfl.party.training.local_training_handler import LocalTrainingHandler
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingStatisticsMixin:
+    """
+    Mixin for `DataHandler` subclasses that computes statistics of the
+    training data in chunks instead of on the fully loaded `x_train`.
+
+    Handlers whose data does not fit in memory should override
+    `iter_training_chunks` to yield blocks read from disk.
+    """
+
+    def iter_training_chunks(self, chunk_size=10000):
+        """
+        Yields the training features in row blocks.
+
+        :param chunk_size: Number of rows per block.
+        :type chunk_size: `int`
+        :return: generator of `np.ndarray`
+        """
+        if self.x_train is None:
+            raise FLException("No data is provided!")
+        return iter_chunks(self.x_train, chunk_size)
+
+    def get_feature_statistics(self, chunk_size=10000, quantiles=True, sketch_k=200, seed=None):
+        """
+        Summarizes the training features in one pass.
+
+        :param chunk_size: Number of rows per block.
+        :type chunk_size: `int`
+        :param quantiles: Whether to maintain a quantile sketch.
+        :type quantiles: `bool`
+        :param sketch_k: Size parameter of the quantile sketch.
+        :type sketch_k: `int`
+        :param seed: Seed of the quantile sketch.
+        :type seed: `int`
+        :return: mergeable statistics of the training data
+        :rtype: `FeatureStatistics`
+        """
+        return FeatureStatistics.from_data(
+            self.iter_training_chunks(chunk_size), quantiles=quantiles, sketch_k=sketch_k, seed=seed
+        )
+
+    def get_statistics_of_training_data(self, sample_data_schema, lst_stats_name, **kwargs):
+        """
+        Return the corresponding statistics, which is specified by the
+        provided list of statistics names, of the local training dataset.
+
+        :param sample_data_schema: Provided data with only feature values, \
+        or None to stream over the training data.
+        :type sample_data_schema: `np.array`
+        :param lst_stats_name: A list of statistics names, \
+        all in lowercase form, for example, ['min'], ['mean', 'variance'], etc.
+        :type lst_stats_name: `list` of `str`
+        :param kwargs: `q` for quantiles, `chunk_size` and `sketch_k`.
+        :type kwargs: `dict`
+        :return: The requested statistics based on the local dataset.
+        :rtype: `dict`
+        """
+        chunk_size = kwargs.get("chunk_size", 10000)
+        quantiles = "quantile" in lst_stats_name
+        sketch_k = kwargs.get("sketch_k", 200)
+        if sample_data_schema is None:
+            stats = self.get_feature_statistics(chunk_size=chunk_size, quantiles=quantiles, sketch_k=sketch_k)
+        else:
+            stats = FeatureStatistics.from_data(
+                sample_data_schema, chunk_size=chunk_size, quantiles=quantiles, sketch_k=sketch_k
+            )
+        return stats.get_statistics(list(lst_stats_name), q=kwargs.get("q"))
+
+
+class FederatedStatisticsMixin:
+    """
+    Mixin for `LocalTrainingHandler` subclasses that answers the statistics
+    queries sent by `GlobalStatisticsFusionMixin`.
+
+    Queries arrive through `FusionHandler.query` as a TRAIN payload of the
+    form `{"func": <name>, "args": {...}}`; any other payload is handed to
+    the regular `train`.
+    """
+
+    STATISTICS_FUNCS = ("get_feature_statistics", "set_global_preprocessor")
+
+    def train(self, fit_params=None):
+        if fit_params and fit_params.get("func") in self.STATISTICS_FUNCS:
+            return getattr(self, fit_params["func"])(**(fit_params.get("args") or {}))
+        return super().train(fit_params)
+
+    def get_feature_statistics(self, chunk_size=10000, quantiles=True, sketch_k=200):
+        """
+        Returns the picklable summary of the local training features.
+
+        :return: state of a `FeatureStatistics`
+        :rtype: `dict`
+        """
+        if hasattr(self.data_handler, "get_feature_statistics"):
+            stats = self.data_handler.get_feature_statistics(
+                chunk_size=chunk_size, quantiles=quantiles, sketch_k=sketch_k
+            )
+        else:
+            (x_train, _), _ = self.data_handler.get_data()
+            stats = FeatureStatistics.from_data(x_train, chunk_size=chunk_size, quantiles=quantiles, sketch_k=sketch_k)
+        logger.info("Computed statistics over %d local samples.", stats.count)
+        return stats.get_state()
+
+    def set_global_preprocessor(self, preprocessor_name, statistics, feature_range=(0, 1)):
+        """
+        Sets `data_handler.preprocessor` from the global statistics.
+
+        :param preprocessor_name: `standardscaler` or `minmaxscaler`.
+        :type preprocessor_name: `str`
+        :param statistics: State of the merged `FeatureStatistics`.
+        :type statistics: `dict`
+        :param feature_range: Target range of the `minmaxscaler`.
+        :type feature_range: `tuple`
+        :return: True if the preprocessor was set
+        :rtype: `bool`
+        """
+        stats = FeatureStatistics.from_state(statistics)
+        if preprocessor_name in ("standardscaler", "standardization"):
+            self.data_handler.preprocessor = stats.to_standard_scaler()
+        elif preprocessor_name == "minmaxscaler":
+            self.data_handler.preprocessor = stats.to_minmax_scaler(feature_range=tuple(feature_range))
+        else:
+            raise LocalTrainingException("Unsupported global preprocessor " + str(preprocessor_name))
+        logger.info("Set global %s computed over %d samples.", preprocessor_name, stats.count)
+        return True
+
+
+class StatisticsLocalTrainingHandler(FederatedStatisticsMixin, LocalTrainingHandler):
+    """
+    `LocalTrainingHandler` that also answers federated statistics queries.
+    """
+
+
+class GlobalStatisticsFusionMixin:
+    """
+    Mixin for `FusionHandler` subclasses that merges party statistics into
+    global ones.
+
+    If `hyperparams.global.global_preprocessing` is set, e.g.
+    `{"preprocessor": "standardscaler", "chunk_size": 10000}`, the global
+    preprocessor is computed and sent to all parties during
+    `initialization`, before the first training round.
+    """
+
+    def collect_global_statistics(self, chunk_size=10000, quantiles=True, sketch_k=200, lst_parties=None):
+        """
+        Queries the parties for their statistics and merges them.
+
+        :param chunk_size: Rows per chunk used by the parties.
+        :type chunk_size: `int`
+        :param quantiles: Whether parties should maintain a quantile sketch.
+        :type quantiles: `bool`
+        :param sketch_k: Size parameter of the quantile sketches.
+        :type sketch_k: `int`
+        :param lst_parties: Parties to query, all registered ones by default.
+        :type lst_parties: `list`
+        :return: global statistics
+        :rtype: `FeatureStatistics`
+        """
+        payload = {"chunk_size": chunk_size, "quantiles": quantiles, "sketch_k": sketch_k}
+        lst_states = self.query("get_feature_statistics", payload, lst_parties=lst_parties)
+        global_stats = merge_statistics(lst_states)
+        logger.info("Merged statistics of %d parties over %d samples.", len(lst_states), global_stats.count)
+        return global_stats
+
+    def distribute_preprocessor(self, global_stats, preprocessor_name="standardscaler", **kwargs):
+        """
+        Sends the global statistics to all parties so that each one sets the
+        requested preprocessor.
+
+        :param global_stats: Merged statistics.
+        :type global_stats: `FeatureStatistics`
+        :param preprocessor_name: `standardscaler` or `minmaxscaler`.
+        :type preprocessor_name: `str`
+        :return: replies of the parties
+        :rtype: `list`
+        """
+        payload = {"preprocessor_name": preprocessor_name, "statistics": global_stats.get_state()}
+        payload.update(kwargs)
+        return self.query("set_global_preprocessor", payload)
+
+    def initialization(self):
+        super().initialization()
+        config = (self.hyperparams.get("global") or {}).get("global_preprocessing")
+        if not config:
+            return
+        preprocessor_name = config.get("preprocessor", "standardscaler")
+        self.global_statistics = self.collect_global_statistics(
+            chunk_size=config.get("chunk_size", 10000),
+            quantiles=config.get("quantiles", False),
+            sketch_k=config.get("sketch_k", 200),
+        )
+        extra = {"feature_range": config["feature_range"]} if "feature_range" in config else {}
+        self.distribute_preprocessor(self.global_statistics, preprocessor_name, **extra)
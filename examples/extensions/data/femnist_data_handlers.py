@@ -0,0 +1,64 @@
+"""
+FEMNIST data handlers that read LEAF data through the binary cache of
+`leaf_cache` instead of parsing the JSON files on every start.
+
+Data config::
+
+    data:
+      name: FemnistCachedKerasDataHandler
+      path: examples.extensions.data.femnist_data_handlers
+      info:
+        data_folder: examples/datasets/femnist
+"""
+import logging
+
+import numpy as np
+
+from examples.extensions.data.leaf_cache import load_leaf_femnist_cached
+from ibmfl.util.data_handlers.femnist_keras_data_handler import FemnistKerasDataHandler
+
+logger = logging.getLogger(__name__)
+
+
+class FemnistCachedKerasDataHandler(FemnistKerasDataHandler):
+    """
+    `FemnistKerasDataHandler` that loads the LEAF dataset from its binary
+    cache when no `npz_file` is configured. The optional `num_workers`
+    entry of the data config sets the number of processes used to build
+    the cache on first start.
+    """
+
+    def __init__(self, data_config=None, channels_first=False):
+        self.num_workers = (data_config or {}).get("num_workers")
+        super().__init__(data_config, channels_first)
+
+    def load_dataset(self, nb_points=500):
+        """
+        Loads the local dataset from a provided local data path. \
+        If no local data path is provided, it loads the cached \
+        femnist dataset from LEAF, and reduces the dataset size to contain \
+        500 data points per training and testing dataset.
+
+        :param nb_points: Number of data points to be included in each set if
+        no local dataset is provided.
+        :type nb_points: `int`
+        :return: training and testing datasets
+        :rtype: `tuple`
+        """
+        if self.file_name is not None:
+            return super().load_dataset(nb_points)
+
+        return load_leaf_femnist_cached(
+            download_dir=self.data_folder, num_workers=self.num_workers, nb_points=nb_points
+        )
+
+
+class FemnistCachedDPKerasDataHandler(FemnistCachedKerasDataHandler):
+    """
+    Cached counterpart of `FemnistDPKerasDataHandler`.
+    """
+
+    def __init__(self, data_config=None):
+        super().__init__(data_config)
+        self.y_train = np.argmax(self.y_train, axis=1)
+        self.y_test = np.argmax(self.y_test, axis=1)
@@ -0,0 +1,285 @@
+"""
+Binary cache of the LEAF FEMNIST dataset.
+
+`ibmfl.util.datasets.load_leaf_femnist` parses every `all_data_<i>.json` file
+serially into Python lists on every call, which takes minutes. The loader
+below parses the JSON files once in a process pool and writes a per-writer
+cache next to them:
+
+* `x.npy` (float32, one flattened 28x28 image per row) and `y.npy` (int64),
+  with the samples of each writer stored contiguously, and
+* `index.json`, mapping every writer to its `[start, stop)` row range and
+  recording the size and modification time of the source files.
+
+Later loads memory-map the cache and only rebuild it if the JSON files
+changed. The per-writer (`orig_dist`) partitioning is read from the index.
+Every build writes into its own temporary directory and moves the finished
+files into place, so parties that build the cache at the same time neither
+truncate the arrays another party has mapped nor delete its parts.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ibmfl.exceptions import FLException
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+INDEX_FILE = "index.json"
+
+
+def _source_files(data_dir):
+    files = sorted(f for f in os.listdir(data_dir) if f.endswith(".json"))
+    if not files:
+        raise FLException("No LEAF .json files found in " + str(data_dir))
+    sources = {}
+    for file_name in files:
+        stat = os.stat(os.path.join(data_dir, file_name))
+        sources[file_name] = [stat.st_size, stat.st_mtime]
+    return sources
+
+
+def _parse_leaf_file(json_file, part_prefix):
+    """
+    Parses one LEAF JSON file into `<part_prefix>.x.npy`/`.y.npy`, writer by
+    writer. Runs in a worker process.
+
+    :return: list of `(writer, num_samples)` in file order
+    :rtype: `list`
+    """
+    with open(json_file, "r") as fp:
+        all_data = json.load(fp)
+
+    writers, xs, ys = [], [], []
+    for writer, data in all_data["user_data"].items():
+        writers.append((writer, len(data["y"])))
+        xs.append(np.asarray(data["x"], dtype=np.float32).reshape(len(data["y"]), -1))
+        ys.append(np.asarray(data["y"], dtype=np.int64))
+    del all_data
+
+    np.save(part_prefix + ".x.npy", np.concatenate(xs), allow_pickle=False)
+    np.save(part_prefix + ".y.npy", np.concatenate(ys), allow_pickle=False)
+    return writers
+
+
+def build_leaf_cache(data_dir, cache_dir, num_workers=None):
+    """
+    Parses all LEAF JSON files of `data_dir` in parallel and writes the
+    binary cache to `cache_dir`.
+
+    :param data_dir: Directory with the `all_data_<i>.json` files.
+    :type data_dir: `str`
+    :param cache_dir: Target directory of the cache.
+    :type cache_dir: `str`
+    :param num_workers: Number of worker processes, one per CPU by default.
+    :type num_workers: `int`
+    :return: the index of the cache
+    :rtype: `dict`
+    """
+    sources = _source_files(data_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    # private to this build, on the file system of the cache for the final os.replace
+    part_dir = tempfile.mkdtemp(prefix=".build-", dir=cache_dir)
+    try:
+        index = _build_leaf_cache(data_dir, sources, cache_dir, part_dir, num_workers)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+    return index
+
+
+def _build_leaf_cache(data_dir, sources, cache_dir, part_dir, num_workers):
+    """
+    Writes the cache into `part_dir` and moves it into `cache_dir`.
+
+    :return: the index of the cache
+    :rtype: `dict`
+    """
+    files = list(sources)
+    prefixes = [os.path.join(part_dir, os.path.splitext(f)[0]) for f in files]
+    logger.info("Parsing %d LEAF files with %s worker processes", len(files), num_workers or "all")
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        file_writers = list(pool.map(_parse_leaf_file, [os.path.join(data_dir, f) for f in files], prefixes))
+
+    # lay out the parts one after another, keeping each writer contiguous
+    writers = []
+    offset = 0
+    for lst_writers in file_writers:
+        for writer, num_samples in lst_writers:
+            writers.append([writer, offset, offset + num_samples])
+            offset += num_samples
+
+    num_features = np.load(prefixes[0] + ".x.npy", mmap_mode="r").shape[1]
+    x_cache = np.lib.format.open_memmap(
+        os.path.join(part_dir, "x.npy"), mode="w+", dtype=np.float32, shape=(offset, num_features)
+    )
+    y_cache = np.lib.format.open_memmap(os.path.join(part_dir, "y.npy"), mode="w+", dtype=np.int64, shape=(offset,))
+    start = 0
+    for prefix in prefixes:
+        y_part = np.load(prefix + ".y.npy")
+        stop = start + len(y_part)
+        x_cache[start:stop] = np.load(prefix + ".x.npy", mmap_mode="r")
+        y_cache[start:stop] = y_part
+        start = stop
+    x_cache.flush()
+    y_cache.flush()
+    del x_cache, y_cache
+
+    index = {"version": CACHE_VERSION, "sources": sources, "writers": writers}
+    with open(os.path.join(part_dir, INDEX_FILE), "w") as fp:
+        json.dump(index, fp)
+    # new files replace the old ones, so mapped arrays of other processes stay
+    # valid; the index is moved last, so an interrupted build is never picked up
+    for file_name in ("x.npy", "y.npy", INDEX_FILE):
+        os.replace(os.path.join(part_dir, file_name), os.path.join(cache_dir, file_name))
+    logger.info("Cached %d samples of %d writers in %s", offset, len(writers), cache_dir)
+    return index
+
+
+class LeafCache:
+    """
+    Memory-mapped view of a LEAF binary cache.
+    """
+
+    def __init__(self, cache_dir, mmap_mode="r"):
+        """
+        :param cache_dir: Directory written by `build_leaf_cache`.
+        :type cache_dir: `str`
+        :param mmap_mode: Memory-map mode passed to `np.load`.
+        :type mmap_mode: `str`
+        """
+        with open(os.path.join(cache_dir, INDEX_FILE), "r") as fp:
+            self.index = json.load(fp)
+        self.x = np.load(os.path.join(cache_dir, "x.npy"), mmap_mode=mmap_mode)
+        self.y = np.load(os.path.join(cache_dir, "y.npy"), mmap_mode=mmap_mode)
+        self.writers = [w for w, _, _ in self.index["writers"]]
+        self.offsets = np.array([[start, stop] for _, start, stop in self.index["writers"]], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.y)
+
+    def writer_data(self, idx):
+        """
+        :param idx: Position of the writer in the index.
+        :type idx: `int`
+        :return: memory-mapped samples of the writer, as `{"x": ..., "y": ...}`
+        :rtype: `dict`
+        """
+        start, stop = self.offsets[idx]
+        return {"x": self.x[start:stop], "y": self.y[start:stop]}
+
+    def partywise_data(self):
+        """
+        Per-writer data in the format of `load_leaf_femnist(orig_dist=True)`,
+        backed by memory-mapped slices instead of lists.
+
+        :return: writer to `{"x": ..., "y": ...}`
+        :rtype: `dict`
+        """
+        return {writer: self.writer_data(idx) for idx, writer in enumerate(self.writers)}
+
+    def split_indices(self, test_fraction=0.1):
+        """
+        Row indices of the per-writer train/test split used by
+        `load_leaf_femnist`: the last `int(n * test_fraction)` samples of
+        each writer are test samples.
+
+        :param test_fraction: Fraction of each writer's samples used for testing.
+        :type test_fraction: `float`
+        :return: training and testing row indices
+        :rtype: `tuple` of `np.ndarray`
+        """
+        sizes = self.offsets[:, 1] - self.offsets[:, 0]
+        num_test = (sizes * test_fraction).astype(np.int64)
+        # as in load_leaf_femnist, `data[:-0]` puts all samples of writers
+        # without test samples into the test set
+        num_test = np.where(num_test == 0, sizes, num_test)
+
+        # writers are stored back to back, each as a train block then a test block
+        flags = np.tile([False, True], len(sizes))
+        is_test = np.repeat(flags, np.column_stack([sizes - num_test, num_test]).ravel())
+        rows = np.arange(len(self))
+        return rows[~is_test], rows[is_test]
+
+    def train_test_data(self, test_fraction=0.1, nb_points=None):
+        """
+        Materializes the pooled train/test split of `load_leaf_femnist`.
+
+        :param test_fraction: Fraction of each writer's samples used for testing.
+        :type test_fraction: `float`
+        :param nb_points: Number of leading samples of each set to read, all if None.
+        :type nb_points: `int`
+        :return: training and testing datasets
+        :rtype: `tuple`
+        """
+        train_idx, test_idx = self.split_indices(test_fraction)
+        # only the rows that are kept are read from the memory map
+        train_idx, test_idx = train_idx[:nb_points], test_idx[:nb_points]
+        return (self.x[train_idx], self.y[train_idx]), (self.x[test_idx], self.y[test_idx])
+
+
+def load_leaf_cache(data_dir, cache_dir=None, num_workers=None, mmap_mode="r"):
+    """
+    Opens the binary cache of `data_dir`, building it first if it is missing
+    or out of date.
+
+    :param data_dir: Directory with the `all_data_<i>.json` files.
+    :type data_dir: `str`
+    :param cache_dir: Cache directory, `<data_dir>/npy_cache` by default.
+    :type cache_dir: `str`
+    :param num_workers: Number of worker processes used to build the cache.
+    :type num_workers: `int`
+    :param mmap_mode: Memory-map mode passed to `np.load`.
+    :type mmap_mode: `str`
+    :return: the opened cache
+    :rtype: `LeafCache`
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(data_dir, "npy_cache")
+    index_file = os.path.join(cache_dir, INDEX_FILE)
+
+    up_to_date = False
+    if os.path.exists(index_file):
+        with open(index_file, "r") as fp:
+            index = json.load(fp)
+        up_to_date = index.get("version") == CACHE_VERSION and index.get("sources") == _source_files(data_dir)
+    if not up_to_date:
+        build_leaf_cache(data_dir, cache_dir, num_workers=num_workers)
+    return LeafCache(cache_dir, mmap_mode=mmap_mode)
+
+
+def load_leaf_femnist_cached(download_dir="", orig_dist=False, num_workers=None, nb_points=None):
+    """
+    Cached counterpart of `ibmfl.util.datasets.load_leaf_femnist`, with the
+    same return values. Images are float32 instead of float64, and the
+    per-writer data is memory-mapped.
+
+    :param download_dir: Directory of the FEMNIST dataset.
+    :type download_dir: `str`
+    :param orig_dist: Whether to return the data per writer.
+    :type orig_dist: `bool`
+    :param num_workers: Number of worker processes used to build the cache.
+    :type num_workers: `int`
+    :param nb_points: Number of leading samples of the training and testing \
+    datasets to load, all if None.
+    :type nb_points: `int`
+    :return: per-writer data, or training and testing datasets
+    :rtype: `dict` or `tuple`
+    """
+    data_dir = os.path.join(download_dir, "all_data")
+    if not os.path.exists(data_dir):
+        # downloading and converting the raw images is left to the library
+        from ibmfl.util.datasets import load_leaf_femnist
+
+        load_leaf_femnist(download_dir=download_dir, orig_dist=True)
+
+    cache = load_leaf_cache(data_dir, num_workers=num_workers)
+    if orig_dist:
+        logger.info("Using FEMNIST's original distribution over %d writers", len(cache.writers))
+        return cache.partywise_data()
+    return cache.train_test_data(nb_points=nb_points)
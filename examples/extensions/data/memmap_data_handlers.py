@@ -0,0 +1,279 @@
+"""
+Memory-mapped, lazily converted counterparts of the built-in MNIST and
+CIFAR10 data handlers.
+
+The built-in handlers `np.load` a party `.npz` file, which reads every array
+into memory, and `preprocess` then makes another full `astype("float32")`
+copy; `LocalTrainingHandler.train` calls `get_data()` every round. The
+handlers below open a `.npy` party directory (see `npy_dataset`) with
+`mmap_mode="r"` and convert dtypes batch by batch, so parties with datasets
+larger than RAM can train and start up instantly.
+
+Data config::
+
+    data:
+      name: MnistMemmapPytorchDataHandler
+      path: examples.extensions.data.memmap_data_handlers
+      info:
+        npy_dir: examples/data/mnist/random/data_party0
+        batch_size: 128
+
+With a `stream` entry in `info`, e.g. `stream: {shard_size: 8192}`, the
+training data is returned as a prefetching `BatchStream` instead, which the
+streaming models in `examples.extensions.model` train on.
+"""
+import logging
+
+import numpy as np
+
+from examples.extensions.data.batch_stream import StreamingDataMixin
+from examples.extensions.data.npy_dataset import BatchView, load_npy_dataset
+from ibmfl.data.data_handler import DataHandler
+from ibmfl.exceptions import FLException
+
+logger = logging.getLogger(__name__)
+
+
+class MemmapDataHandler(StreamingDataMixin, DataHandler):
+    """
+    Base class for data handlers backed by memory-mapped `.npy` arrays.
+
+    `x_train`, `y_train`, `x_test` and `y_test` stay memory-mapped (reshaped
+    views only), and `train_view`/`test_view` convert rows on access.
+    Subclasses set the per-sample shape and dtypes in `preprocess` and wrap
+    the views in framework specific loaders in `get_data`.
+    """
+
+    def __init__(self, data_config=None):
+        super().__init__()
+        data_config = data_config or {}
+        self.file_name = data_config.get("npy_dir") or data_config.get("npz_file")
+        if self.file_name is None:
+            raise FLException("Memory-mapped data handlers require `npy_dir` in the data config.")
+        self.batch_size = data_config.get("batch_size", 128)
+        self.shuffle = data_config.get("shuffle", True)
+        self.stream_params = data_config.get("stream")
+        if self.stream_params is not None:
+            self.stream_params = dict(self.stream_params)
+            self.stream_params.setdefault("shuffle", self.shuffle)
+
+        # load the datasets
+        (self.x_train, self.y_train), (self.x_test, self.y_test) = self.load_dataset()
+        logger.info("Opened training data from %s (%d train samples)", self.file_name, len(self.x_train))
+
+        self.train_view = self.test_view = None
+        self.y_train_view = self.y_test_view = None
+        # pre-process the datasets
+        self.preprocess()
+
+    def load_dataset(self):
+        """
+        Opens the party arrays without reading them into memory.
+
+        :return: training and testing datasets
+        :rtype: `tuple`
+        """
+        try:
+            arrays = load_npy_dataset(self.file_name, mmap_mode="r")
+            return (arrays["x_train"], arrays["y_train"]), (arrays["x_test"], arrays["y_test"])
+        except (KeyError, OSError, FLException):
+            raise IOError("Unable to load training data from path " "provided in config file: " + self.file_name)
+
+    def preprocess(self):
+        raise NotImplementedError
+
+    def get_train_counts(self):
+        return len(self.x_train)
+
+
+class _TorchViewDataset:
+    """
+    Map-style dataset over a pair of `BatchView` objects; created as a
+    `torch.utils.data.Dataset` subclass by `_torch_dataset`.
+    """
+
+    def __init__(self, x_view, y_view):
+        self.x_view = x_view
+        self.y_view = y_view
+
+    def __len__(self):
+        return len(self.x_view)
+
+    def __getitem__(self, idx):
+        return self.x_view[idx], self.y_view[idx]
+
+
+def _torch_dataset(x_view, y_view):
+    from torch.utils.data import Dataset
+
+    cls = type("TorchViewDataset", (_TorchViewDataset, Dataset), {})
+    return cls(x_view, y_view)
+
+
+class MemmapPytorchDataHandler(MemmapDataHandler):
+    """
+    Returns a torch `Dataset` for training, which `PytorchFLModel.fit_model`
+    hands to skorch as is, and a `DataLoader` for testing.
+    """
+
+    def get_data(self):
+        """
+        Gets the lazily converted training and testing data.
+
+        :return: training dataset (or `BatchStream`) and testing data loader
+        :rtype: `tuple`
+        """
+        from torch.utils.data import DataLoader
+
+        if self.stream_params is not None:
+            train_ds = self.get_train_stream()
+        else:
+            train_ds = _torch_dataset(self.train_view, self.y_train_view)
+        test_loader = DataLoader(_torch_dataset(self.test_view, self.y_test_view), batch_size=self.batch_size)
+        return train_ds, test_loader
+
+
+class MemmapKerasDataHandler(MemmapDataHandler):
+    """
+    Returns `keras.utils.Sequence` objects that convert one batch at a time;
+    `KerasFLModel` and `TensorFlowFLModel` train on them through their
+    generator code path.
+    """
+
+    keras_utils = "keras.utils"
+
+    def get_data(self):
+        """
+        Gets the lazily converted training and testing data.
+
+        :return: training batch sequence (or `BatchStream`) and testing \
+        batch sequence
+        :rtype: `tuple`
+        """
+        if self.stream_params is not None:
+            train_seq = self.get_train_stream()
+        else:
+            train_seq = self._sequence(self.train_view, self.y_train_view, shuffle=self.shuffle)
+        test_seq = self._sequence(self.test_view, self.y_test_view, shuffle=False)
+        return train_seq, test_seq
+
+    def _sequence(self, x_view, y_view, shuffle):
+        from importlib import import_module
+
+        sequence_cls = import_module(self.keras_utils).Sequence
+        batch_size = self.batch_size
+
+        class BatchSequence(sequence_cls):
+            def __init__(self):
+                super().__init__()
+                self.indices = np.arange(len(x_view))
+                self.on_epoch_end()
+
+            def __len__(self):
+                return int(np.ceil(len(x_view) / float(batch_size)))
+
+            def __getitem__(self, idx):
+                # sorted reads keep memory-mapped access sequential
+                rows = np.sort(self.indices[idx * batch_size : (idx + 1) * batch_size])
+                return x_view[rows], y_view[rows]
+
+            def on_epoch_end(self):
+                if shuffle:
+                    np.random.shuffle(self.indices)
+
+        return BatchSequence()
+
+
+class MnistMemmapPytorchDataHandler(MemmapPytorchDataHandler):
+    """
+    Memory-mapped counterpart of `MnistPytorchDataHandler`.
+    """
+
+    def preprocess(self):
+        img_rows, img_cols = 28, 28
+        self.train_view = BatchView(self.x_train, dtype="float32", sample_shape=(1, img_rows, img_cols))
+        self.test_view = BatchView(self.x_test, dtype="float32", sample_shape=(1, img_rows, img_cols))
+        self.y_train_view = BatchView(self.y_train, dtype="int64")
+        self.y_test_view = BatchView(self.y_test, dtype="int64")
+
+
+class MnistMemmapKerasDataHandler(MemmapKerasDataHandler):
+    """
+    Memory-mapped counterpart of `MnistKerasDataHandler`.
+    """
+
+    def __init__(self, data_config=None, channels_first=False):
+        self.channels_first = channels_first
+        super().__init__(data_config)
+
+    def preprocess(self):
+        num_classes = 10
+        img_rows, img_cols = 28, 28
+        sample_shape = (1, img_rows, img_cols) if self.channels_first else (img_rows, img_cols, 1)
+        self.train_view = BatchView(self.x_train, dtype="float32", sample_shape=sample_shape)
+        self.test_view = BatchView(self.x_test, dtype="float32", sample_shape=sample_shape)
+        self.y_train_view = BatchView(self.y_train, dtype="float32", num_classes=num_classes)
+        self.y_test_view = BatchView(self.y_test, dtype="float32", num_classes=num_classes)
+
+
+class MnistMemmapTFDataHandler(MnistMemmapKerasDataHandler):
+    """
+    Memory-mapped counterpart of `MnistTFDataHandler`.
+    """
+
+    keras_utils = "tensorflow.keras.utils"
+
+    def preprocess(self):
+        img_rows, img_cols = 28, 28
+        self.train_view = BatchView(self.x_train, dtype="float32", sample_shape=(img_rows, img_cols, 1))
+        self.test_view = BatchView(self.x_test, dtype="float32", sample_shape=(img_rows, img_cols, 1))
+        self.y_train_view = BatchView(self.y_train)
+        self.y_test_view = BatchView(self.y_test)
+
+
+class Cifar10MemmapPytorchDataHandler(MemmapPytorchDataHandler):
+    """
+    Memory-mapped counterpart of `Cifar10PytorchDataHandler`.
+    """
+
+    def preprocess(self):
+        img_rows, img_cols = 32, 32
+        self.train_view = BatchView(self.x_train, dtype="float32", sample_shape=(3, img_rows, img_cols))
+        self.test_view = BatchView(self.x_test, dtype="float32", sample_shape=(3, img_rows, img_cols))
+        self.y_train_view = BatchView(self.y_train.reshape(-1), dtype="int64")
+        self.y_test_view = BatchView(self.y_test.reshape(-1), dtype="int64")
+
+
+class Cifar10MemmapKerasDataHandler(MemmapKerasDataHandler):
+    """
+    Memory-mapped counterpart of `Cifar10KerasDataHandler`.
+    """
+
+    def __init__(self, data_config=None, channels_first=False):
+        self.channels_first = channels_first
+        super().__init__(data_config)
+
+    def preprocess(self):
+        num_classes = 10
+        img_rows, img_cols = 32, 32
+        sample_shape = (3, img_rows, img_cols) if self.channels_first else (img_rows, img_cols, 3)
+        self.train_view = BatchView(self.x_train, dtype="float32", sample_shape=sample_shape)
+        self.test_view = BatchView(self.x_test, dtype="float32", sample_shape=sample_shape)
+        self.y_train_view = BatchView(self.y_train.reshape(-1), dtype="float32", num_classes=num_classes)
+        self.y_test_view = BatchView(self.y_test.reshape(-1), dtype="float32", num_classes=num_classes)
+
+
+class Cifar10MemmapTFDataHandler(Cifar10MemmapKerasDataHandler):
+    """
+    Memory-mapped counterpart of `Cifar10TFDataHandler`.
+    """
+
+    keras_utils = "tensorflow.keras.utils"
+
+    def preprocess(self):
+        img_rows, img_cols = 32, 32
+        sample_shape = (3, img_rows, img_cols) if self.channels_first else (img_rows, img_cols, 3)
+        self.train_view = BatchView(self.x_train, dtype="float32", sample_shape=sample_shape)
+        self.test_view = BatchView(self.x_test, dtype="float32", sample_shape=sample_shape)
+        self.y_train_view = BatchView(self.y_train)
+        self.y_test_view = BatchView(self.y_test)
@@ -0,0 +1,158 @@
+"""
+Uncompressed, memory-mappable party datasets.
+
+`examples/generate_data.py` writes each party's data as an `.npz` archive.
+Members of an `.npz` cannot be memory-mapped, so `np.load` has to read every
+array into memory. A party dataset directory instead holds one `.npy` file
+per array (`x_train.npy`, `y_train.npy`, `x_test.npy`, `y_test.npy`) that can
+be opened with `mmap_mode="r"`: start up is instant and only the pages
+touched by the current batch are read.
+"""
+import logging
+import os
+
+import numpy as np
+
+from ibmfl.exceptions import FLException
+
+logger = logging.getLogger(__name__)
+
+NPY_KEYS = ("x_train", "y_train", "x_test", "y_test")
+
+
+def save_npy_dataset(folder, **arrays):
+    """
+    Saves each array as `<folder>/<name>.npy`.
+
+    :param folder: Target party dataset directory.
+    :type folder: `str`
+    :param arrays: Arrays to save, e.g., `x_train=..., y_train=...`.
+    :type arrays: `dict`
+    :return: None
+    """
+    os.makedirs(folder, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(folder, name + ".npy"), np.asarray(array), allow_pickle=False)
+
+
+def load_npy_dataset(path, mmap_mode="r", keys=NPY_KEYS):
+    """
+    Opens a party dataset directory with memory mapping. For backwards
+    compatibility, an `.npz` file is loaded eagerly instead.
+
+    :param path: Party dataset directory or `.npz` file.
+    :type path: `str`
+    :param mmap_mode: Memory-map mode passed to `np.load`.
+    :type mmap_mode: `str`
+    :param keys: Names of the arrays to load; missing ones are skipped.
+    :type keys: `tuple` of `str`
+    :return: arrays keyed by name
+    :rtype: `dict`
+    """
+    if os.path.isdir(path):
+        arrays = {}
+        for key in keys:
+            file_name = os.path.join(path, key + ".npy")
+            if os.path.exists(file_name):
+                arrays[key] = np.load(file_name, mmap_mode=mmap_mode, allow_pickle=False)
+        if not arrays:
+            raise FLException("No .npy arrays found in " + str(path))
+        return arrays
+
+    if os.path.isfile(path):
+        logger.warning("%s is not a .npy directory; loading it fully into memory.", path)
+        with np.load(path) as data:
+            return {key: data[key] for key in keys if key in data.files}
+
+    raise FLException("Unable to find party dataset " + str(path))
+
+
+def convert_npz_to_npy(npz_file, out_dir=None, remove=False):
+    """
+    Converts a party `.npz` file into a memory-mappable `.npy` directory,
+    one array at a time.
+
+    :param npz_file: Party `.npz` file, e.g., `data_party0.npz`.
+    :type npz_file: `str`
+    :param out_dir: Target directory, the `.npz` path without its \
+    extension by default.
+    :type out_dir: `str`
+    :param remove: Whether to delete the `.npz` file afterwards.
+    :type remove: `bool`
+    :return: the target directory
+    :rtype: `str`
+    """
+    if out_dir is None:
+        out_dir = os.path.splitext(npz_file)[0]
+    os.makedirs(out_dir, exist_ok=True)
+    with np.load(npz_file) as data:
+        for key in data.files:
+            np.save(os.path.join(out_dir, key + ".npy"), data[key], allow_pickle=False)
+    if remove:
+        os.unlink(npz_file)
+    return out_dir
+
+
+class BatchView:
+    """
+    Read-only view of a (memory-mapped) array that reshapes lazily and
+    converts the dtype, scales and one-hot encodes only the rows that are
+    indexed, so the full converted copy never exists in memory.
+    """
+
+    def __init__(self, array, dtype=None, sample_shape=None, scale=None, num_classes=None):
+        """
+        :param array: Underlying array, typically opened with `mmap_mode`.
+        :type array: `np.ndarray`
+        :param dtype: Target dtype of the returned batches.
+        :type dtype: `str` or `np.dtype`
+        :param sample_shape: Shape of a single sample, without batch axis.
+        :type sample_shape: `tuple`
+        :param scale: Factor multiplied into the converted batches.
+        :type scale: `float`
+        :param num_classes: If set, labels are one-hot encoded.
+        :type num_classes: `int`
+        """
+        self.array = array
+        self.dtype = np.dtype(dtype) if dtype is not None else array.dtype
+        self.sample_shape = tuple(sample_shape) if sample_shape is not None else array.shape[1:]
+        self.scale = scale
+        self.num_classes = num_classes
+
+    def __len__(self):
+        return len(self.array)
+
+    @property
+    def shape(self):
+        if self.num_classes is not None:
+            return (len(self), self.num_classes)
+        return (len(self),) + self.sample_shape
+
+    def __getitem__(self, idx):
+        batch = self.array[idx]
+        single = np.isscalar(idx) or isinstance(idx, (int, np.integer))
+        if self.num_classes is not None:
+            return np.eye(self.num_classes, dtype=self.dtype)[batch]
+        batch = np.asarray(batch).reshape((() if single else (-1,)) + self.sample_shape)
+        batch = batch.astype(self.dtype, copy=True)
+        if self.scale is not None:
+            batch *= self.scale
+        return batch
+
+    def batches(self, batch_size, indices=None):
+        """
+        Yields converted batches of `batch_size` rows, in `indices` order
+        if given.
+
+        :param batch_size: Rows per batch.
+        :type batch_size: `int`
+        :param indices: Row order, e.g., a permutation for shuffling.
+        :type indices: `np.ndarray`
+        :return: generator of `np.ndarray`
+        """
+        for start in range(0, len(self), batch_size):
+            if indices is None:
+                yield self[start : start + batch_size]
+            else:
+                # sorted reads keep memory-mapped access sequential
+                yield self[np.sort(indices[start : start + batch_size])]
@@ -0,0 +1,239 @@
+"""
+Vectorized splitting of a dataset into party shards.
+
+The `save_*_party_data` functions of `examples/generate_data.py` built the
+sampling probability of every sample with a list comprehension over the
+dataset (for MNIST, CIFAR-10 and FEMNIST once per party), drew each party's
+indices with its own `np.random.choice(p=...)` call and wrote the party
+files one after the other. Splitting MNIST for 1000 parties rebuilt a
+60000-entry list 2000 times.
+
+`label_probabilities` looks the probabilities up with one indexing
+operation, and `sample_party_indices` draws the indices of all parties at
+once. Given `dirichlet_alpha`, each party's label distribution is drawn
+from a Dirichlet distribution, the usual non-IID split: small values leave
+each party with a few labels, large values approach the IID split.
+`write_party_shards` writes the shards from a thread pool, either as `.npz`
+archives or as the memory-mappable `.npy` directories of `npy_dataset`:
+
+    python examples/generate_data.py -n 1000 -d mnist -pp 60 --dirichlet_alpha 0.5 --npy
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from examples.extensions.data.npy_dataset import save_npy_dataset
+
+logger = logging.getLogger(__name__)
+
+SHARD_FORMATS = ("npz", "npy")
+
+
+def as_labels(y):
+    """
+    Returns the labels as a 1-d array; column vectors are flattened.
+
+    :param y: labels
+    :type y: `np.ndarray` or `list`
+    :rtype: `np.ndarray`
+    """
+    y = np.asarray(y)
+    return y.reshape(len(y)) if y.ndim > 1 else y
+
+
+def label_probabilities(y, should_stratify=False):
+    """
+    Sampling probability of every sample: proportional to the frequency of
+    its label if stratified, uniform otherwise.
+
+    :param y: labels
+    :type y: `np.ndarray` or `list`
+    :param should_stratify: weight the samples by the frequency of their label
+    :type should_stratify: `bool`
+    :return: probabilities summing to 1
+    :rtype: `np.ndarray`
+    """
+    y = as_labels(y)
+    if not should_stratify:
+        return np.full(len(y), 1.0 / len(y))
+    _, inverse, counts = np.unique(y, return_inverse=True, return_counts=True)
+    p = counts[inverse.reshape(-1)].astype(float)
+    return p / p.sum()
+
+
+def dirichlet_proportions(num_parties, alpha, label_prior, rng=None):
+    """
+    Draws the label distribution of every party from a Dirichlet
+    distribution with concentration `alpha * num_labels * label_prior`, so
+    that a uniform prior gives `alpha` for every label.
+
+    :param num_parties: number of parties
+    :type num_parties: `int`
+    :param alpha: concentration per label
+    :type alpha: `float`
+    :param label_prior: relative frequency of each label
+    :type label_prior: `np.ndarray`
+    :param rng: random generator, `np.random` by default
+    :type rng: `np.random.Generator` or `np.random.RandomState`
+    :return: array of shape (num_parties, num_labels) with rows summing to 1
+    :rtype: `np.ndarray`
+    """
+    if alpha <= 0:
+        raise ValueError("The Dirichlet concentration must be positive, got " + str(alpha))
+    rng = np.random if rng is None else rng
+    prior = np.asarray(label_prior, dtype=float)
+    prior = prior / prior.sum()
+    proportions = rng.dirichlet(alpha * len(prior) * prior, size=num_parties)
+    # very small concentrations can underflow to rows of NaN; in the limit
+    # alpha -> 0 each party holds one label, drawn from the prior
+    invalid = np.flatnonzero(~np.isfinite(proportions).all(axis=1))
+    if len(invalid):
+        proportions[invalid] = 0.0
+        proportions[invalid, rng.choice(len(prior), len(invalid), p=prior)] = 1.0
+    return proportions
+
+
+def sample_party_indices(
+    y,
+    nb_dp_per_party,
+    should_stratify=False,
+    dirichlet_alpha=None,
+    proportions=None,
+    labels=None,
+    replace=True,
+    rng=None,
+):
+    """
+    Draws the sample indices of every party at once.
+
+    Without `dirichlet_alpha` or `proportions`, all indices are drawn in one
+    call from `label_probabilities` and split by party, like one
+    `np.random.choice` per party would. Otherwise the number of samples of
+    each label is drawn per party from its label distribution, and the
+    samples of a label uniformly from the samples with that label.
+
+    :param y: labels
+    :type y: `np.ndarray` or `list`
+    :param nb_dp_per_party: the number of data points each party should have
+    :type nb_dp_per_party: `list[int]`
+    :param should_stratify: True if data should be assigned proportional to source class distributions
+    :type should_stratify: `bool`
+    :param dirichlet_alpha: concentration of the Dirichlet label distributions
+    :type dirichlet_alpha: `float`
+    :param proportions: label distribution of every party, e.g. from \
+    `dirichlet_proportions`, to split a test set like its training set
+    :type proportions: `np.ndarray`
+    :param labels: labels of the columns of `proportions`, the sorted labels of `y` by default
+    :type labels: `np.ndarray`
+    :param replace: draw with replacement; otherwise the shards are disjoint
+    :type replace: `bool`
+    :param rng: random generator, `np.random` by default
+    :type rng: `np.random.Generator` or `np.random.RandomState`
+    :return: index array of every party
+    :rtype: `list[np.ndarray]`
+    """
+    rng = np.random if rng is None else rng
+    y = as_labels(y)
+    nb_dp_per_party = np.asarray(nb_dp_per_party, dtype=int)
+    splits = np.cumsum(nb_dp_per_party)[:-1]
+    total = int(nb_dp_per_party.sum())
+    if not replace and total > len(y):
+        raise ValueError("Cannot draw {} disjoint samples from {}".format(total, len(y)))
+
+    if dirichlet_alpha is None and proportions is None:
+        p = label_probabilities(y, should_stratify) if should_stratify else None
+        return np.split(rng.choice(len(y), total, replace=replace, p=p), splits)
+
+    labels = np.unique(y) if labels is None else np.asarray(labels)
+    members = [np.flatnonzero(y == label) for label in labels]
+    if proportions is None:
+        prior = np.array([len(m) for m in members], dtype=float) if should_stratify else np.ones(len(labels))
+        proportions = dirichlet_proportions(len(nb_dp_per_party), dirichlet_alpha, prior, rng=rng)
+
+    # labels without samples get no share; a party left without any label samples uniformly
+    available = np.array([len(m) > 0 for m in members])
+    proportions = np.where(available, proportions, 0.0)
+    sums = proportions.sum(axis=1, keepdims=True)
+    proportions = np.where(sums > 0, proportions / np.where(sums > 0, sums, 1.0), available / available.sum())
+    counts = np.stack([rng.multinomial(dp, row) for dp, row in zip(nb_dp_per_party, proportions)])
+
+    chosen, parties = [], []
+    for label_idx, label_members in enumerate(members):
+        label_total = int(counts[:, label_idx].sum())
+        if label_total == 0:
+            continue
+        if replace:
+            picks = rng.choice(len(label_members), label_total)
+        elif label_total > len(label_members):
+            raise ValueError(
+                "Cannot draw {} disjoint samples of label {} from {}".format(
+                    label_total, labels[label_idx], len(label_members)
+                )
+            )
+        else:
+            picks = rng.permutation(len(label_members))[:label_total]
+        chosen.append(label_members[picks])
+        parties.append(np.repeat(np.arange(len(nb_dp_per_party)), counts[:, label_idx]))
+    if not chosen:
+        return [np.zeros(0, dtype=int) for _ in nb_dp_per_party]
+
+    chosen = np.concatenate(chosen)
+    parties = np.concatenate(parties)
+    # group by party, shuffling the labels within each party
+    order = np.lexsort((rng.random(len(chosen)), parties))
+    return np.split(chosen[order], splits)
+
+
+def map_parties(fn, num_parties, max_workers=None):
+    """
+    Calls `fn(i)` for every party `i` from a thread pool. Indexing the
+    arrays and writing the files release the GIL, so the shards are written
+    concurrently.
+
+    :param fn: function of the party index
+    :type fn: `callable`
+    :param num_parties: number of parties
+    :type num_parties: `int`
+    :param max_workers: number of threads, the executor's default if None
+    :type max_workers: `int`
+    :return: the results, by party
+    :rtype: `list`
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fn, range(num_parties)))
+
+
+def write_party_shards(party_folder, num_parties, get_shard, shard_format="npz", max_workers=None):
+    """
+    Writes the arrays of every party as `data_party<i>.npz`, or as a
+    `data_party<i>` directory of `.npy` files for `shard_format="npy"`,
+    building and writing the shards from a thread pool.
+
+    :param party_folder: folder to save party data
+    :type party_folder: `str`
+    :param num_parties: number of parties
+    :type num_parties: `int`
+    :param get_shard: returns the arrays of a party by name, e.g. `x_train`
+    :type get_shard: `callable`
+    :param shard_format: `npz` or `npy`
+    :type shard_format: `str`
+    :param max_workers: number of threads, the executor's default if None
+    :type max_workers: `int`
+    :return: the path of every shard
+    :rtype: `list[str]`
+    """
+    if shard_format not in SHARD_FORMATS:
+        raise ValueError("Unknown shard format {}, expected one of {}".format(shard_format, SHARD_FORMATS))
+
+    def write(idx):
+        shard = get_shard(idx)
+        name_file = os.path.join(party_folder, "data_party" + str(idx))
+        if shard_format == "npy":
+            save_npy_dataset(name_file, **shard)
+            return name_file
+        np.savez(name_file + ".npz", **shard)
+        return name_file + ".npz"
+
+    return map_parties(write, num_parties, max_workers=max_workers)
@@ -0,0 +1,452 @@
+"""
+Streaming, mergeable summary statistics of party datasets.
+
+`DataHandler.get_statistics_of_training_data` and the helpers of
+`ibmfl.data.data_util` need the whole training set in memory and produce
+results that cannot be combined across parties. The classes below consume
+the data chunk by chunk in a single pass and can be merged with the
+summaries of other parties:
+
+* `RunningMoments` keeps count, mean, sum of squared deviations, minimum
+  and maximum per feature, updated with Chan et al.'s parallel formula, so
+  merged moments are exact.
+* `KLLSketch` keeps a KLL quantile sketch per feature whose size only
+  depends on `k`; merged sketches give approximate quantiles.
+* `FeatureStatistics` bundles both and answers the same statistics names as
+  `DataHandler.get_statistics_of_training_data`.
+"""
+import logging
+
+import numpy as np
+
+from ibmfl.exceptions import FLException
+
+logger = logging.getLogger(__name__)
+
+
+def iter_chunks(data, chunk_size=10000):
+    """
+    Yields consecutive row blocks of `data` without copying them.
+
+    :param data: Dataset of shape (num_samples, num_features), \
+    possibly memory-mapped.
+    :type data: `np.ndarray`
+    :param chunk_size: Number of rows per chunk.
+    :type chunk_size: `int`
+    :return: generator of `np.ndarray`
+    """
+    if chunk_size is None or chunk_size <= 0:
+        raise FLException("chunk_size must be a positive integer, got " + str(chunk_size))
+    for start in range(0, len(data), chunk_size):
+        yield data[start : start + chunk_size]
+
+
+def _as_2d(chunk):
+    chunk = np.asarray(chunk, dtype=np.float64)
+    return chunk.reshape(len(chunk), -1)
+
+
+class RunningMoments:
+    """
+    Count, mean, variance, minimum and maximum per feature, computed in one
+    pass and mergeable across chunks and parties.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+
+    def update(self, chunk):
+        """
+        Adds a block of samples of shape (num_samples, num_features).
+
+        :param chunk: Block of samples.
+        :type chunk: `np.ndarray`
+        :return: None
+        """
+        chunk = _as_2d(chunk)
+        if len(chunk) == 0:
+            return
+        mean = chunk.mean(axis=0)
+        m2 = np.square(chunk - mean).sum(axis=0)
+        self._combine(len(chunk), mean, m2, chunk.min(axis=0), chunk.max(axis=0))
+
+    def merge(self, other):
+        """
+        Merges the moments of another `RunningMoments` into this one.
+
+        :param other: Moments computed on another part of the data.
+        :type other: `RunningMoments`
+        :return: None
+        """
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.min, other.max)
+
+    def _combine(self, count, mean, m2, min_vec, max_vec):
+        if self.count == 0:
+            self.count = count
+            self.mean = np.array(mean, dtype=np.float64)
+            self.m2 = np.array(m2, dtype=np.float64)
+            self.min = np.array(min_vec, dtype=np.float64)
+            self.max = np.array(max_vec, dtype=np.float64)
+            return
+        if np.shape(mean) != self.mean.shape:
+            raise FLException(
+                "Cannot merge statistics of {} features into statistics of {} features".format(
+                    np.shape(mean), self.mean.shape
+                )
+            )
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * (count / total)
+        self.m2 += m2 + np.square(delta) * (self.count * count / total)
+        np.minimum(self.min, min_vec, out=self.min)
+        np.maximum(self.max, max_vec, out=self.max)
+        self.count = total
+
+    @property
+    def var(self):
+        """Population variance per feature, as `np.var(data, axis=0)`."""
+        if self.count == 0:
+            return None
+        return self.m2 / self.count
+
+    @property
+    def std(self):
+        """Population standard deviation per feature."""
+        var = self.var
+        return None if var is None else np.sqrt(var)
+
+    def get_state(self):
+        """
+        Returns a picklable dictionary that `from_state` can rebuild.
+
+        :return: state
+        :rtype: `dict`
+        """
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_state(cls, state):
+        moments = cls()
+        moments.count = state["count"]
+        if moments.count:
+            moments.mean = np.array(state["mean"], dtype=np.float64)
+            moments.m2 = np.array(state["m2"], dtype=np.float64)
+            moments.min = np.array(state["min"], dtype=np.float64)
+            moments.max = np.array(state["max"], dtype=np.float64)
+        return moments
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch (Karnin, Lang and Liberty, 2016) applied to every
+    feature column at once.
+
+    Each level holds a (num_items, num_features) block whose rows carry a
+    weight of 2**level. Compacting a level sorts every column independently
+    and promotes every other item, so all features share the same level
+    layout and each operation is a single vectorized numpy call.
+    """
+
+    def __init__(self, k=200, seed=None):
+        """
+        :param k: Size of the top compactor; the rank error is roughly 1.7 / k.
+        :type k: `int`
+        :param seed: Seed of the random offsets used during compaction.
+        :type seed: `int`
+        """
+        self.k = k
+        self.n = 0
+        self.levels = []
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def update(self, chunk):
+        """
+        Adds a block of samples of shape (num_samples, num_features).
+
+        :param chunk: Block of samples.
+        :type chunk: `np.ndarray`
+        :return: None
+        """
+        chunk = _as_2d(chunk)
+        if len(chunk) == 0:
+            return
+        self._append(0, chunk)
+        self.n += len(chunk)
+        self._compress()
+
+    def merge(self, other):
+        """
+        Merges another sketch built over the same features into this one.
+
+        :param other: Sketch computed on another part of the data.
+        :type other: `KLLSketch`
+        :return: None
+        """
+        for level, items in enumerate(other.levels):
+            if len(items):
+                self._append(level, items)
+        self.n += other.n
+        self._compress()
+
+    def _append(self, level, items):
+        while len(self.levels) <= level:
+            self.levels.append(np.empty((0, items.shape[1])))
+        if self.levels[level].shape[1] != items.shape[1]:
+            raise FLException(
+                "Cannot merge a sketch of {} features into a sketch of {} features".format(
+                    items.shape[1], self.levels[level].shape[1]
+                )
+            )
+        self.levels[level] = np.concatenate([self.levels[level], items])
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                items = np.sort(self.levels[level], axis=0)
+                keep = items[:0]
+                if len(items) % 2:
+                    keep, items = items[-1:], items[:-1]
+                promoted = items[self._rng.integers(2) :: 2]
+                self.levels[level] = keep
+                self._append(level + 1, promoted)
+            level += 1
+
+    def quantile(self, q):
+        """
+        Returns the approximate `q`-quantiles of every feature.
+
+        :param q: Quantile or sequence of quantiles in [0, 1].
+        :type q: `float` or `list` of `float`
+        :return: Array of shape (num_features,) for a scalar `q`, \
+        otherwise (len(q), num_features), as `np.quantile(data, q, axis=0)`.
+        :rtype: `np.ndarray`
+        """
+        if self.n == 0:
+            raise FLException("Cannot compute quantiles of an empty sketch.")
+        q_arr = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if np.any((q_arr < 0) | (q_arr > 1)):
+            raise FLException("Quantiles must be between 0 and 1 inclusive.")
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items_h), 2.0**level) for level, items_h in enumerate(self.levels)])
+        order = np.argsort(items, axis=0)
+        sorted_items = np.take_along_axis(items, order, axis=0)
+        cum_weights = np.cumsum(weights[order], axis=0)
+        total = cum_weights[-1]
+
+        result = np.empty((len(q_arr), items.shape[1]))
+        for i, quant in enumerate(q_arr):
+            idx = np.argmax(cum_weights >= quant * total, axis=0)
+            result[i] = sorted_items[idx, np.arange(items.shape[1])]
+
+        return result[0] if np.ndim(q) == 0 else result
+
+    def get_state(self):
+        """
+        Returns a picklable dictionary that `from_state` can rebuild.
+
+        :return: state
+        :rtype: `dict`
+        """
+        return {"k": self.k, "n": self.n, "levels": list(self.levels)}
+
+    @classmethod
+    def from_state(cls, state, seed=None):
+        sketch = cls(k=state["k"], seed=seed)
+        sketch.n = state["n"]
+        sketch.levels = list(state["levels"])
+        return sketch
+
+
+class FeatureStatistics:
+    """
+    Mergeable per-feature statistics of a dataset: exact moments plus an
+    optional quantile sketch.
+    """
+
+    def __init__(self, quantiles=True, sketch_k=200, seed=None):
+        """
+        :param quantiles: Whether to maintain a quantile sketch.
+        :type quantiles: `bool`
+        :param sketch_k: Size parameter of the quantile sketch.
+        :type sketch_k: `int`
+        :param seed: Seed of the quantile sketch.
+        :type seed: `int`
+        """
+        self.moments = RunningMoments()
+        self.sketch = KLLSketch(k=sketch_k, seed=seed) if quantiles else None
+
+    @classmethod
+    def from_data(cls, data, chunk_size=10000, **kwargs):
+        """
+        Computes the statistics of `data` in one pass over row chunks.
+
+        :param data: Dataset of shape (num_samples, num_features), \
+        or an iterable of such chunks.
+        :type data: `np.ndarray` or iterable
+        :param chunk_size: Rows per chunk when `data` is an array.
+        :type chunk_size: `int`
+        :return: statistics
+        :rtype: `FeatureStatistics`
+        """
+        stats = cls(**kwargs)
+        chunks = iter_chunks(data, chunk_size) if isinstance(data, np.ndarray) else data
+        for chunk in chunks:
+            stats.update(chunk)
+        return stats
+
+    def update(self, chunk):
+        self.moments.update(chunk)
+        if self.sketch is not None:
+            self.sketch.update(chunk)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        if self.sketch is not None:
+            if other.sketch is None:
+                logger.warning("Merged statistics carry no quantile sketch; dropping quantile support.")
+                self.sketch = None
+            else:
+                self.sketch.merge(other.sketch)
+
+    @property
+    def count(self):
+        return self.moments.count
+
+    def get_statistics(self, lst_stats_name, q=None):
+        """
+        Returns the requested statistics under the names accepted by
+        `DataHandler.get_statistics_of_training_data`.
+
+        :param lst_stats_name: A list of statistics names, \
+        e.g., ['min'], ['mean', 'variance'], ['quantile'].
+        :type lst_stats_name: `list` of `str`
+        :param q: Quantile(s) required when `quantile` is requested.
+        :type q: `float` or `list` of `float`
+        :return: requested statistics
+        :rtype: `dict`
+        """
+        if type(lst_stats_name) is not list:
+            raise FLException(
+                "list of requested statistics badly form. "
+                "It should of type list, but it is instead "
+                "of type " + str(type(lst_stats_name))
+            )
+        if self.count == 0:
+            raise FLException("No data is provided!")
+
+        list_stats = {}
+        for stat_name in lst_stats_name:
+            if stat_name in ("min", "minimum"):
+                list_stats[stat_name] = self.moments.min
+            elif stat_name in ("max", "maximum"):
+                list_stats[stat_name] = self.moments.max
+            elif stat_name == "mean":
+                list_stats[stat_name] = self.moments.mean
+            elif stat_name in ("var", "variance"):
+                list_stats[stat_name] = self.moments.var
+            elif stat_name in ("std", "standard deviation"):
+                list_stats[stat_name] = self.moments.std
+            elif stat_name in ("count", "n_samples"):
+                list_stats[stat_name] = self.count
+            elif stat_name == "quantile":
+                if q is None:
+                    raise FLException("Cannot compute quantile, missing quantile requirement.")
+                if self.sketch is None:
+                    raise FLException("Cannot compute quantile, statistics were collected without a sketch.")
+                list_stats[stat_name] = self.sketch.quantile(q)
+            else:
+                logger.warning("Current required statistics %s is not supported. Skipping...", stat_name)
+
+        return list_stats
+
+    def to_standard_scaler(self):
+        """
+        Builds a fitted `sklearn.preprocessing.StandardScaler` from the
+        merged moments, without access to the data.
+
+        :return: standard scaler
+        :rtype: `sklearn.preprocessing.StandardScaler`
+        """
+        from sklearn import preprocessing
+
+        scaler = preprocessing.StandardScaler()
+        scaler.mean_ = self.moments.mean.copy()
+        scaler.var_ = self.moments.var
+        scaler.scale_ = np.where(scaler.var_ > 0, np.sqrt(scaler.var_), 1.0)
+        scaler.n_samples_seen_ = self.count
+        scaler.n_features_in_ = len(scaler.mean_)
+        return scaler
+
+    def to_minmax_scaler(self, feature_range=(0, 1)):
+        """
+        Builds a fitted `sklearn.preprocessing.MinMaxScaler` from the merged
+        minimum and maximum, without access to the data.
+
+        :param feature_range: Desired range of transformed data.
+        :type feature_range: `tuple`
+        :return: min-max scaler
+        :rtype: `sklearn.preprocessing.MinMaxScaler`
+        """
+        from sklearn import preprocessing
+
+        scaler = preprocessing.MinMaxScaler(feature_range=feature_range)
+        scaler.partial_fit(np.vstack([self.moments.min, self.moments.max]))
+        scaler.n_samples_seen_ = self.count
+        return scaler
+
+    def get_state(self):
+        """
+        Returns a picklable dictionary that `from_state` can rebuild; this
+        is what parties send to the aggregator.
+
+        :return: state
+        :rtype: `dict`
+        """
+        return {
+            "moments": self.moments.get_state(),
+            "sketch": self.sketch.get_state() if self.sketch is not None else None,
+        }
+
+    @classmethod
+    def from_state(cls, state, seed=None):
+        stats = cls(quantiles=False)
+        stats.moments = RunningMoments.from_state(state["moments"])
+        if state.get("sketch") is not None:
+            stats.sketch = KLLSketch.from_state(state["sketch"], seed=seed)
+        return stats
+
+
+def merge_statistics(lst_states, seed=None):
+    """
+    Merges the statistics collected by several parties into global ones.
+
+    :param lst_states: List of `FeatureStatistics` or of their `get_state()` \
+    dictionaries, one per party.
+    :type lst_states: `list`
+    :param seed: Seed of the merged quantile sketch.
+    :type seed: `int`
+    :return: global statistics
+    :rtype: `FeatureStatistics`
+    """
+    if not lst_states:
+        raise FLException("No party statistics were provided.")
+
+    merged = None
+    for state in lst_states:
+        stats = state if isinstance(state, FeatureStatistics) else FeatureStatistics.from_state(state)
+        if merged is None:
+            merged = FeatureStatistics.from_state(stats.get_state(), seed=seed)
+        else:
+            merged.merge(stats)
+    return merged
@@ -0,0 +1,416 @@
+"""
+Crash-resume checkpoints of the fusion state.
+
+`FusionHandler.save_current_state` only hands round metrics to the metrics
+manager, so an aggregator that dies late in a run has to start over.
+`CheckpointFusionMixin` snapshots the fusion state every `every` rounds: the
+global weights, `curr_round`, the state specific to the fusion algorithm and
+the party registry. A background thread writes each snapshot while training
+goes on. Numeric arrays are written as `.npy` files and loaded memory-mapped
+on resume, everything else is pickled. Every snapshot is written to a
+temporary directory that is renamed into place once complete, so a crash
+while writing leaves the previous snapshot intact.
+
+    fusion:
+      name: CheckpointIterAvgFusionHandler
+      path: examples.extensions.fusion.checkpoint_fusion_handler
+      info:
+        checkpoint:
+          dir: <path>
+          every: 10
+          keep: 2
+          resume: false
+
+With `resume: true`, or `FL_RESUME_FROM_CHECKPOINT=1` in the environment,
+`start_global_training` continues from the latest snapshot in `dir`. Party
+ids are derived from the party's connection info, so parties that register
+again after the restart get their previous ids.
+"""
+import copy
+import glob
+import logging
+import os
+import pickle
+import re
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from ibmfl.aggregator.fusion.afa_fusion_handler import AFAFusionHandler
+from ibmfl.aggregator.fusion.comparative_elimination_fusion_handler import ComparativeEliminationFusionHandler
+from ibmfl.aggregator.fusion.coordinate_median_fedplus_fusion_handler import CoordinateMedianFedplusFusionHandler
+from ibmfl.aggregator.fusion.coordinate_median_fusion_handler import CoordinateMedianFusionHandler
+from ibmfl.aggregator.fusion.fedavg_fusion_handler import FedAvgFusionHandler
+from ibmfl.aggregator.fusion.fedplus_fusion_handler import FedplusFusionHandler
+from ibmfl.aggregator.fusion.geometric_median_fedplus_fusion_handler import GeometricMedianFedplusFusionHandler
+from ibmfl.aggregator.fusion.gradient_fusion_handler import GradientFusionHandler
+from ibmfl.aggregator.fusion.iter_avg_fusion_handler import IterAvgFusionHandler
+from ibmfl.aggregator.fusion.krum_fusion_handler import KrumFusionHandler
+from ibmfl.aggregator.fusion.pfnm_fusion_handler import PFNMFusionHandler
+from ibmfl.aggregator.fusion.spahm_fusion_handler import SPAHMFusionHandler
+from ibmfl.exceptions import FLException
+from ibmfl.model.model_update import ModelUpdate
+
+logger = logging.getLogger(__name__)
+
+RESUME_ENV = "FL_RESUME_FROM_CHECKPOINT"
+SNAPSHOT_PATTERN = re.compile(r"^round_(\d+)$")
+LATEST_FILE = "LATEST"
+STATE_FILE = "state.pkl"
+
+# attributes restored for every fusion handler
+FUSION_STATE = ("curr_round", "current_model_weights", "termination_metrics_agg", "termination_metrics_party")
+
+# algorithm specific attributes, looked up along the handler's class hierarchy
+HANDLER_STATE = {
+    "AFAFusionHandler": ("_parties", "_blocked_parties"),
+    "PFNMFusionHandler": ("_local_weights", "_assignment", "_party_list", "model_update", "global_accuracy"),
+    "SPAHMFusionHandler": ("_local_weights", "model_update", "score"),
+    "FedplusFusionHandler": ("round",),
+    "ServerOptimizerMixin": ("server_optimizer",),
+    "ServerOptimizerGradientFusionHandler": ("server_optimizer",),
+    # not `broadcast_rows`: parties get a fresh initial model on resume, so the first round is a full sync
+    "SparseDoc2VecFusionHandler": ("rounds_since_full_sync",),
+}
+
+
+class ArrayRef:
+    """Placeholder of an array that is stored in its own `.npy` file."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def file_name(self):
+        return "array_{:05d}.npy".format(self.index)
+
+
+def extract_arrays(value, arrays):
+    """
+    Replaces the numeric arrays in nested dicts, lists and tuples with
+    `ArrayRef`s and collects them in `arrays`.
+
+    :return: `value` with placeholders
+    """
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        arrays.append(value)
+        return ArrayRef(len(arrays) - 1)
+    if type(value) in (dict, OrderedDict):
+        return type(value)((k, extract_arrays(v, arrays)) for k, v in value.items())
+    if type(value) in (list, tuple):
+        return type(value)(extract_arrays(v, arrays) for v in value)
+    return value
+
+
+def restore_arrays(value, directory):
+    """
+    Replaces `ArrayRef`s with copy-on-write memory maps of their files.
+
+    :return: `value` with arrays
+    """
+    if isinstance(value, ArrayRef):
+        return np.asarray(np.load(os.path.join(directory, value.file_name()), mmap_mode="c"))
+    if type(value) in (dict, OrderedDict):
+        return type(value)((k, restore_arrays(v, directory)) for k, v in value.items())
+    if type(value) in (list, tuple):
+        return type(value)(restore_arrays(v, directory) for v in value)
+    return value
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_snapshot(directory, round_no, state, keep=2):
+    """
+    Writes one snapshot and points `LATEST` at it. Snapshots beyond the
+    `keep` most recent are removed.
+
+    :param directory: checkpoint directory
+    :type directory: `str`
+    :param round_no: round of the snapshot
+    :type round_no: `int`
+    :param state: picklable fusion state
+    :type state: `dict`
+    :param keep: number of snapshots to keep
+    :type keep: `int`
+    :return: path of the snapshot
+    :rtype: `str`
+    """
+    name = "round_{:06d}".format(round_no)
+    final_path = os.path.join(directory, name)
+    temp_path = os.path.join(directory, "." + name + ".tmp")
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    arrays = []
+    state = extract_arrays(state, arrays)
+    for index, array in enumerate(arrays):
+        with open(os.path.join(temp_path, ArrayRef(index).file_name()), "wb") as stream:
+            np.save(stream, array, allow_pickle=False)
+            stream.flush()
+            os.fsync(stream.fileno())
+    with open(os.path.join(temp_path, STATE_FILE), "wb") as stream:
+        pickle.dump(state, stream, protocol=pickle.HIGHEST_PROTOCOL)
+        stream.flush()
+        os.fsync(stream.fileno())
+    _fsync(temp_path)
+
+    if os.path.exists(final_path):
+        shutil.rmtree(final_path)
+    os.rename(temp_path, final_path)
+    latest_temp = os.path.join(directory, LATEST_FILE + ".tmp")
+    with open(latest_temp, "w") as stream:
+        stream.write(name)
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.replace(latest_temp, os.path.join(directory, LATEST_FILE))
+    _fsync(directory)
+
+    for old in list_snapshots(directory)[:-keep] if keep > 0 else []:
+        shutil.rmtree(old, ignore_errors=True)
+    return final_path
+
+
+def list_snapshots(directory):
+    """
+    Returns the complete snapshots in `directory`, oldest first.
+
+    :rtype: `list` of `str`
+    """
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, "round_*")):
+        match = SNAPSHOT_PATTERN.match(os.path.basename(path))
+        if match and os.path.exists(os.path.join(path, STATE_FILE)):
+            snapshots.append((int(match.group(1)), path))
+    return [path for _, path in sorted(snapshots)]
+
+
+def load_snapshot(directory):
+    """
+    Loads the snapshot named in `LATEST`, or the most recent complete one.
+
+    :param directory: checkpoint directory
+    :type directory: `str`
+    :return: fusion state, or None if there is no snapshot
+    :rtype: `dict`
+    """
+    path = None
+    latest = os.path.join(directory, LATEST_FILE)
+    if os.path.exists(latest):
+        with open(latest) as stream:
+            path = os.path.join(directory, stream.read().strip())
+    if path is None or not os.path.exists(os.path.join(path, STATE_FILE)):
+        snapshots = list_snapshots(directory)
+        if not snapshots:
+            return None
+        path = snapshots[-1]
+    with open(os.path.join(path, STATE_FILE), "rb") as stream:
+        state = pickle.load(stream)
+    logger.info("Loaded fusion checkpoint " + path)
+    return restore_arrays(state, path)
+
+
+class CheckpointWriter:
+    """
+    Writes snapshots in a background thread. If snapshots arrive faster than
+    they are written, only the latest pending one is kept.
+    """
+
+    def __init__(self, directory, keep=2):
+        self.directory = directory
+        self.keep = keep
+        self.cond = threading.Condition()
+        self.pending = None
+        self.busy = False
+        self.error = None
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name="FusionCheckpointWriter", daemon=True)
+        self.thread.start()
+
+    def submit(self, round_no, state):
+        """
+        Queues a snapshot of round `round_no`.
+
+        :return: None
+        """
+        with self.cond:
+            if self.pending is not None:
+                logger.info("Skipping fusion checkpoint of round {}".format(self.pending[0]))
+            self.pending = (round_no, state)
+            self.cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.pending is None:
+                    self.cond.wait()
+                (round_no, state), self.pending = self.pending, None
+                self.busy = True
+            try:
+                path = write_snapshot(self.directory, round_no, state, keep=self.keep)
+                logger.info("Wrote fusion checkpoint " + path)
+            except Exception as ex:
+                logger.exception(ex)
+                self.error = ex
+            finally:
+                with self.cond:
+                    self.busy = False
+                    self.cond.notify_all()
+
+    def wait(self):
+        """
+        Waits until all queued snapshots are written.
+
+        :return: None
+        """
+        with self.cond:
+            while self.pending is not None or self.busy:
+                self.cond.wait()
+
+
+class CheckpointFusionMixin:
+    """
+    Adds periodic checkpoints and resuming to a fusion handler. List the
+    mixin before the fusion handler class.
+    """
+
+    def __init__(self, hyperparams, protocol_handler, *args, **kwargs):
+        super().__init__(hyperparams, protocol_handler, *args, **kwargs)
+        info = (kwargs.get("info") or {}).get("checkpoint") or {}
+        self.checkpoint_dir = info.get("dir", "checkpoints")
+        self.checkpoint_every = int(info.get("every", 10))
+        self.resume = bool(info.get("resume", False)) or os.getenv(RESUME_ENV, "").lower() in ("1", "true", "yes")
+        self.checkpoint_writer = CheckpointWriter(self.checkpoint_dir, keep=int(info.get("keep", 2)))
+
+    @property
+    def curr_round(self):
+        return self.__dict__.get("_curr_round", 0)
+
+    @curr_round.setter
+    def curr_round(self, value):
+        # start_global_training begins with `self.curr_round = 0`
+        resume_round = self.__dict__.pop("_resume_round", None)
+        self._curr_round = resume_round if value == 0 and resume_round is not None else value
+
+    def checkpoint_state_attributes(self):
+        """
+        Returns the names of the attributes that make up the fusion state.
+
+        :rtype: `list` of `str`
+        """
+        names = list(FUSION_STATE)
+        for cls in type(self).__mro__:
+            names += [name for name in HANDLER_STATE.get(cls.__name__, ()) if name not in names]
+        return names
+
+    def get_checkpoint_state(self):
+        """
+        Returns a copy of the fusion state that does not change with the
+        training loop.
+
+        :rtype: `dict`
+        """
+        attributes = {name: getattr(self, name) for name in self.checkpoint_state_attributes() if hasattr(self, name)}
+        return {
+            "handler": type(self).__name__,
+            "attributes": copy.deepcopy(attributes),
+            "parties": {party_id: copy.deepcopy(party.info) for party_id, party in self.ph.parties_list.items()},
+        }
+
+    def save_current_state(self):
+        """Saves the state like `FusionHandler` and queues a checkpoint every `every` rounds."""
+        super().save_current_state()
+        if self.checkpoint_every > 0 and self.curr_round % self.checkpoint_every == 0:
+            self.checkpoint_writer.submit(self.curr_round, self.get_checkpoint_state())
+
+    def resume_from_checkpoint(self):
+        """
+        Restores the fusion state from the latest checkpoint.
+
+        :return: round to continue from, or None without a checkpoint
+        :rtype: `int`
+        """
+        state = load_snapshot(self.checkpoint_dir)
+        if state is None:
+            logger.info("No fusion checkpoint in {}, starting from round 0".format(self.checkpoint_dir))
+            return None
+        if state["handler"] != type(self).__name__:
+            raise FLException("Checkpoint was written by {}, not by {}".format(state["handler"], type(self).__name__))
+        attributes = dict(state["attributes"])
+        resume_round = attributes.pop("curr_round", 0)
+        for name, value in attributes.items():
+            setattr(self, name, value)
+        self._resume_round = resume_round
+
+        missing = sorted(set(state["parties"]) - set(self.ph.parties_list))
+        if missing:
+            logger.warning("Parties of the checkpoint that have not registered again: {}".format(missing))
+        if self.fl_model is not None and getattr(self, "current_model_weights", None) is not None:
+            self.fl_model.update_model(ModelUpdate(weights=self.current_model_weights))
+        logger.info("Resuming training after round {}".format(resume_round))
+        return resume_round
+
+    def start_global_training(self):
+        """
+        Starts global training, from the latest checkpoint if resuming.
+        """
+        if self.resume:
+            self.resume_from_checkpoint()
+        try:
+            return super().start_global_training()
+        finally:
+            self.checkpoint_writer.wait()
+
+
+class CheckpointIterAvgFusionHandler(CheckpointFusionMixin, IterAvgFusionHandler):
+    """`IterAvgFusionHandler` with crash-resume checkpoints."""
+
+
+class CheckpointFedAvgFusionHandler(CheckpointFusionMixin, FedAvgFusionHandler):
+    """`FedAvgFusionHandler` with crash-resume checkpoints."""
+
+
+class CheckpointGradientFusionHandler(CheckpointFusionMixin, GradientFusionHandler):
+    """`GradientFusionHandler` with crash-resume checkpoints."""
+
+
+class CheckpointKrumFusionHandler(CheckpointFusionMixin, KrumFusionHandler):
+    """`KrumFusionHandler` with crash-resume checkpoints."""
+
+
+class CheckpointCoordinateMedianFusionHandler(CheckpointFusionMixin, CoordinateMedianFusionHandler):
+    """`CoordinateMedianFusionHandler` with crash-resume checkpoints."""
+
+
+class CheckpointComparativeEliminationFusionHandler(CheckpointFusionMixin, ComparativeEliminationFusionHandler):
+    """`ComparativeEliminationFusionHandler` with crash-resume checkpoints."""
+
+
+class CheckpointAFAFusionHandler(CheckpointFusionMixin, AFAFusionHandler):
+    """`AFAFusionHandler` with crash-resume checkpoints, including party reputations."""
+
+
+class CheckpointPFNMFusionHandler(CheckpointFusionMixin, PFNMFusionHandler):
+    """`PFNMFusionHandler` with crash-resume checkpoints, including the neuron assignments."""
+
+
+class CheckpointSPAHMFusionHandler(CheckpointFusionMixin, SPAHMFusionHandler):
+    """`SPAHMFusionHandler` with crash-resume checkpoints."""
+
+
+class CheckpointFedplusFusionHandler(CheckpointFusionMixin, FedplusFusionHandler):
+    """`FedplusFusionHandler` with crash-resume checkpoints."""
+
+
+class CheckpointCoordinateMedianFedplusFusionHandler(CheckpointFusionMixin, CoordinateMedianFedplusFusionHandler):
+    """`CoordinateMedianFedplusFusionHandler` with crash-resume checkpoints."""
+
+
+class CheckpointGeometricMedianFedplusFusionHandler(CheckpointFusionMixin, GeometricMedianFedplusFusionHandler):
+    """`GeometricMedianFedplusFusionHandler` with crash-resume checkpoints."""
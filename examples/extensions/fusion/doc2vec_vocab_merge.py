@@ -0,0 +1,122 @@
+"""
+Vectorized merge of the Doc2Vec vocabularies of the parties.
+
+`Doc2VecFusionHandler.merge_vocab` walks every word of every party's
+frequency dictionary in Python, and a word's frequency ends up being the
+one reported by the last party that has it. `merge_vocab_tables` turns each
+vocabulary into a pair of word and count arrays, joins all of them on a
+vectorized hash of the words with one `np.unique` and sums the counts per
+word with `np.bincount`.
+
+Parties using `CachedDoc2VecLocalTrainingHandler` can send their
+vocabularies as such arrays directly with
+`hyperparams.global.vocab_format: table`.
+"""
+import logging
+
+import numpy as np
+
+from examples.extensions.fusion.sparse_doc2vec_fusion_handler import SparseDoc2VecFusionHandler
+from ibmfl.aggregator.fusion.doc2vec_fusion_handler import Doc2VecFusionHandler
+
+logger = logging.getLogger(__name__)
+
+
+def vocab_to_table(vocab):
+    """
+    Converts a vocabulary to arrays of words and counts.
+
+    :param vocab: word to frequency dictionary, or a `(words, counts)` tuple
+    :type vocab: `dict` or `tuple`
+    :return: words and counts
+    :rtype: `tuple(np.ndarray, np.ndarray)`
+    """
+    if isinstance(vocab, tuple):
+        words, counts = vocab
+        return np.asarray(words, dtype=str), np.asarray(counts, dtype=np.int64)
+    words = np.array(list(vocab.keys()), dtype=str)
+    counts = np.fromiter(vocab.values(), dtype=np.int64, count=len(vocab))
+    return words, counts
+
+
+def word_keys(words):
+    """
+    64-bit FNV-1a hashes of the code points of an array of strings.
+
+    :param words: strings
+    :type words: `np.ndarray` of `str`
+    :return: hashes
+    :rtype: `np.ndarray` of `np.uint64`
+    """
+    codes = np.ascontiguousarray(words).view(np.uint32).reshape(len(words), -1)
+    keys = np.full(len(words), 14695981039346656037, dtype=np.uint64)
+    prime = np.uint64(1099511628211)
+    for column in codes.T:
+        keys ^= column
+        keys *= prime
+    return keys
+
+
+def merge_vocab_tables(vocabs):
+    """
+    Sums the word frequencies of several vocabularies. Words are joined on
+    their 64-bit hashes, which is much faster than sorting the strings; the
+    strings are compared only to rule out hash collisions.
+
+    :param vocabs: vocabularies as accepted by `vocab_to_table`
+    :type vocabs: `list`
+    :return: unique words and their total counts
+    :rtype: `tuple(np.ndarray, np.ndarray)`
+    """
+    tables = [vocab_to_table(vocab) for vocab in vocabs]
+    tables = [(words, counts) for words, counts in tables if len(words)]
+    if not tables:
+        return np.zeros(0, dtype=str), np.zeros(0, dtype=np.int64)
+    words = np.concatenate([words for words, _ in tables])
+    counts = np.concatenate([counts for _, counts in tables])
+
+    _, first, inverse = np.unique(word_keys(words), return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    unique_words = words[first]
+    if not np.array_equal(unique_words[inverse], words):
+        logger.info("Hash collision in the vocabulary, merging by sorting the words")
+        unique_words, inverse = np.unique(words, return_inverse=True)
+        inverse = inverse.ravel()
+    totals = np.bincount(inverse, weights=counts, minlength=len(unique_words))
+    return unique_words, totals.astype(np.int64)
+
+
+class VectorizedVocabMergeMixin:
+    """
+    Replaces `merge_vocab` of a Doc2Vec fusion handler with
+    `merge_vocab_tables`. List the mixin before the fusion handler class.
+    """
+
+    def query(self, function, payload, *args, **kwargs):
+        vocab_format = self.params_global.get("vocab_format")
+        if function == "get_vocabulary" and vocab_format:
+            payload = dict(payload, vocab_format=vocab_format)
+        return super().query(function, payload, *args, **kwargs)
+
+    def merge_vocab(self, vocab_lists):
+        """
+        Combines the vocabularies of the parties, summing the frequencies
+        of words that several parties have.
+
+        :param vocab_lists: word frequency dictionaries or `(words, counts)` \
+        tuples of the parties
+        :type vocab_lists: `list`
+        :return: A dictionary with all words and their total frequency
+        :rtype: `dict`
+        """
+        words, counts = merge_vocab_tables(vocab_lists)
+        logger.info("Merged %d vocabularies into %d words", len(vocab_lists), len(words))
+        return dict(zip(words.tolist(), counts.tolist()))
+
+
+class VectorizedVocabDoc2VecFusionHandler(VectorizedVocabMergeMixin, Doc2VecFusionHandler):
+    """`Doc2VecFusionHandler` with the vectorized vocabulary merge."""
+
+
+class VectorizedVocabSparseDoc2VecFusionHandler(VectorizedVocabMergeMixin, SparseDoc2VecFusionHandler):
+    """`SparseDoc2VecFusionHandler` with the vectorized vocabulary merge."""
@@ -0,0 +1,220 @@
+"""
+Vectorized merge of federated Gaussian Naive Bayes statistics.
+
+`NaiveBayesFusionHandler.fusion_collected_responses` walks the party
+updates twice and unpickles `theta`, `var` and `class_count` again on every
+use. `stack_nb_updates` reads each update once into `(N, C)` counts and
+`(N, C, F)` means and variances, and `merge_gaussian_stats` pools them in
+one vectorized pass:
+
+    n = sum_i n_i
+    theta = sum_i n_i * theta_i / n
+    var = sum_i n_i * (var_i + (theta_i - theta) ** 2) / n
+
+`GaussianNBAccumulator` merges one update at a time with the pairwise
+parallel-variance update (Chan et al.), so the merge can run while replies
+arrive. `StreamingNaiveBayesFusionHandler` does that when the aggregator
+uses `examples.extensions.protohandler.reply_stream.ReplyStreamProtoHandler`
+and merges the stacked replies otherwise.
+
+    fusion:
+      name: StreamingNaiveBayesFusionHandler
+      path: examples.extensions.fusion.naive_bayes_merge
+"""
+import logging
+import threading
+
+import numpy as np
+
+from ibmfl.aggregator.fusion.naive_bayes_fusion_handler import NaiveBayesFusionHandler
+from ibmfl.model.model_update import ModelUpdate
+
+logger = logging.getLogger(__name__)
+
+
+def stack_nb_updates(lst_model_updates):
+    """
+    Stacks the statistics of the updates that have any.
+
+    :param lst_model_updates: model updates with `theta`, `var` and \
+    `class_count`
+    :type lst_model_updates: `list` of `ModelUpdate`
+    :return: counts `(N, C)`, means and variances `(N, C, F)`, or None if \
+    no update has statistics
+    :rtype: `tuple(np.ndarray, np.ndarray, np.ndarray)`
+    """
+    counts, thetas, variances = [], [], []
+    for model_update in lst_model_updates:
+        class_count = model_update.get("class_count")
+        if class_count is None:
+            continue
+        counts.append(class_count)
+        thetas.append(model_update.get("theta"))
+        variances.append(model_update.get("var"))
+    if not counts:
+        return None
+    return (
+        np.asarray(counts, dtype=float),
+        np.asarray(thetas, dtype=float),
+        np.asarray(variances, dtype=float),
+    )
+
+
+def merge_gaussian_stats(counts, theta, var):
+    """
+    Pools per-party class counts, means and variances. Classes that no
+    party saw get a zero mean and variance.
+
+    :param counts: class counts, `(N, C)`
+    :type counts: `np.ndarray`
+    :param theta: class means, `(N, C, F)`
+    :type theta: `np.ndarray`
+    :param var: class variances, `(N, C, F)`
+    :type var: `np.ndarray`
+    :return: pooled means, variances and counts
+    :rtype: `tuple(np.ndarray, np.ndarray, np.ndarray)`
+    """
+    total = counts.sum(axis=0)
+    inv_total = np.divide(1.0, total, out=np.zeros_like(total), where=total > 0)[:, np.newaxis]
+    pooled_theta = np.einsum("nc,ncf->cf", counts, theta)
+    pooled_theta *= inv_total
+    spread = theta - pooled_theta
+    np.square(spread, out=spread)
+    spread += var
+    pooled_var = np.einsum("nc,ncf->cf", counts, spread)
+    pooled_var *= inv_total
+    return pooled_theta, pooled_var, total
+
+
+class GaussianNBAccumulator:
+    """
+    Running pooled class counts, means and variances, merged one update at a
+    time in place.
+    """
+
+    def __init__(self):
+        self.count = None
+        self.theta = None
+        self.m2 = None
+        self.num_updates = 0
+        self.lock = threading.Lock()
+
+    def add(self, theta, var, class_count):
+        """
+        Merges the statistics of one party.
+
+        :param theta: class means, `(C, F)`
+        :param var: class variances, `(C, F)`
+        :param class_count: class counts, `(C,)`
+        :return: None
+        """
+        count_b = np.asarray(class_count, dtype=float)
+        theta_b = np.asarray(theta, dtype=float)
+        m2_b = np.asarray(var, dtype=float) * count_b[:, np.newaxis]
+        with self.lock:
+            self.num_updates += 1
+            if self.count is None:
+                self.count, self.theta, self.m2 = count_b.copy(), theta_b.copy(), m2_b
+                return
+            count_a = self.count
+            total = count_a + count_b
+            weight_b = np.divide(count_b, total, out=np.zeros_like(total), where=total > 0)[:, np.newaxis]
+            delta = theta_b - self.theta
+            # m2 += m2_b + delta ** 2 * n_a * n_b / n
+            self.m2 += m2_b
+            self.m2 += np.square(delta) * (count_a[:, np.newaxis] * weight_b)
+            delta *= weight_b
+            self.theta += delta
+            self.count = total
+
+    def add_update(self, model_update):
+        """
+        Merges a party `ModelUpdate`, ignoring updates without statistics.
+
+        :param model_update: model update of a party
+        :type model_update: `ModelUpdate`
+        :return: whether the update had statistics
+        :rtype: `bool`
+        """
+        class_count = model_update.get("class_count")
+        if class_count is None:
+            return False
+        self.add(model_update.get("theta"), model_update.get("var"), class_count)
+        return True
+
+    def result(self):
+        """
+        Returns the pooled means, variances and counts.
+
+        :rtype: `tuple(np.ndarray, np.ndarray, np.ndarray)`
+        """
+        with self.lock:
+            inv_total = np.divide(1.0, self.count, out=np.zeros_like(self.count), where=self.count > 0)
+            theta = self.theta * (self.count > 0)[:, np.newaxis]
+            return theta, self.m2 * inv_total[:, np.newaxis], self.count.copy()
+
+
+class StreamingNaiveBayesFusionHandler(NaiveBayesFusionHandler):
+    """
+    `NaiveBayesFusionHandler` with the vectorized merge, which merges the
+    replies as they arrive when the protocol handler supports it.
+    """
+
+    def fusion_collected_responses(self, lst_model_updates, **kwargs):
+        """
+        Combines the counts, means and variances of the model updates into
+        a single model update.
+
+        :param lst_model_updates: list of model updates of type `ModelUpdate` \
+        to be combined.
+        :type lst_model_updates: `list`
+        :return: Model update with combined counts, means and variances.
+        :rtype: `ModelUpdate`
+        """
+        stacked = stack_nb_updates(lst_model_updates)
+        if stacked is None:
+            return ModelUpdate(theta=None, var=None, class_count=None)
+        theta, var, class_count = merge_gaussian_stats(*stacked)
+        return ModelUpdate(theta=theta, var=var, class_count=class_count)
+
+    def start_global_training(self):
+        """
+        Starts global federated learning training process.
+        """
+        payload = {"hyperparams": self.hyperparams, "model_update": self.model_update}
+        if not hasattr(self.ph, "add_reply_listener"):
+            lst_replies = self.query_all_parties(payload)
+            self.model_update = self.fusion_collected_responses(lst_replies)
+        else:
+            accumulator = GaussianNBAccumulator()
+            # (party id, id_request) of every merged reply
+            merged = set()
+
+            def merge_reply(party_info, id_request, reply):
+                if isinstance(reply, ModelUpdate) and accumulator.add_update(reply):
+                    merged.add((self.ph.party_id(party_info), id_request))
+
+            self.ph.add_reply_listener(merge_reply)
+            try:
+                lst_replies, lst_parties = self.query_parties(
+                    payload, self.get_registered_parties(), return_party_list=True
+                )
+            finally:
+                self.ph.remove_reply_listener(merge_reply)
+
+            returned = {
+                (party_id, self.ph.query_requests.get(party_id))
+                for party_id, update in zip(lst_parties, lst_replies)
+                if update.get("class_count") is not None
+            }
+            if returned and merged == returned and accumulator.num_updates == len(returned):
+                theta, var, class_count = accumulator.result()
+                self.model_update = ModelUpdate(theta=theta, var=var, class_count=class_count)
+            else:
+                # late replies of an earlier query or replies past the quorum, merge the returned ones
+                logger.info("Merged %d replies while %d were returned", len(merged), len(returned))
+                self.model_update = self.fusion_collected_responses(lst_replies)
+
+        # Update model if we are maintaining one
+        if self.fl_model is not None:
+            self.fl_model.update_model(self.model_update)
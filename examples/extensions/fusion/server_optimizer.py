@@ -0,0 +1,270 @@
+"""
+Server-side optimizers for weight and gradient fusion.
+
+`IterAvgFusionHandler` and `FedAvgFusionHandler` replace the global weights
+with the (weighted) mean of the parties' weights, and
+`GradientFusionHandler` takes a plain gradient step. The handlers below
+treat the difference between the fused and the current weights, or the
+negative fused gradient, as a pseudo-gradient. They apply it with server
+momentum (FedAvgM) or an adaptive method (FedAdam, FedYogi; Reddi et al.,
+"Adaptive Federated Optimization", 2021). The optimizer state is kept per
+layer in float32 arrays allocated in the first round and updated in place.
+
+    fusion:
+      name: ServerOptimizerFedAvgFusionHandler
+      path: examples.extensions.fusion.server_optimizer
+    hyperparams:
+      global:
+        server_optimizer: adam         # sgd, momentum, adam or yogi
+        server_lr: 0.01                # default 1.0, `lr` for gradient fusion
+        server_momentum: 0.9           # beta1
+        server_beta2: 0.99
+        server_tau: 0.001              # adaptivity, v starts at tau ** 2
+
+`sgd` with `server_lr: 1.0` reproduces the wrapped handler.
+"""
+import logging
+
+import numpy as np
+
+from ibmfl.aggregator.fusion.fedavg_fusion_handler import FedAvgFusionHandler
+from ibmfl.aggregator.fusion.gradient_fusion_handler import GradientFusionHandler
+from ibmfl.aggregator.fusion.iter_avg_fusion_handler import IterAvgFusionHandler
+from ibmfl.exceptions import HyperparamsException
+
+logger = logging.getLogger(__name__)
+
+
+class ServerOptimizer:
+    """
+    Applies pseudo-gradients to a list of layer weights. Subclasses turn the
+    float32 pseudo-gradient of a layer into the step to add to its weights.
+    """
+
+    def __init__(self, lr=1.0):
+        """
+        :param lr: Server learning rate.
+        :type lr: `float`
+        """
+        self.lr = np.float32(lr)
+        self.shapes = None
+        self.deltas = None
+        self.scratch = None
+
+    def allocate(self, shapes):
+        """
+        Allocates the state of layers of the given shapes.
+
+        :param shapes: Shape of every layer.
+        :type shapes: `list` of `tuple`
+        :return: None
+        """
+        self.shapes = shapes
+        self.deltas = [np.zeros(shape, dtype=np.float32) for shape in shapes]
+        self.scratch = [np.zeros(shape, dtype=np.float32) for shape in shapes]
+
+    def compute_step(self, index, delta, scratch):
+        """
+        Turns the pseudo-gradient `delta` of layer `index` into the step to
+        apply. `delta` and `scratch` may be overwritten.
+
+        :return: the step, one of `delta` or `scratch`
+        :rtype: `np.ndarray`
+        """
+        delta *= self.lr
+        return delta
+
+    def step(self, weights, deltas):
+        """
+        Applies the pseudo-gradients `deltas` to `weights`.
+
+        :param weights: Current weights, one array-like per layer.
+        :type weights: `list`
+        :param deltas: Pseudo-gradients (the direction that reduces the \
+        loss), one array-like per layer.
+        :type deltas: `list`
+        :return: new weights, one `np.ndarray` per layer
+        :rtype: `list`
+        """
+        shapes = [np.shape(delta) for delta in deltas]
+        if shapes != self.shapes:
+            if self.shapes is not None:
+                logger.warning("Model layers changed, resetting the server optimizer state")
+            self.allocate(shapes)
+
+        new_weights = []
+        for index, (layer, delta) in enumerate(zip(weights, deltas)):
+            buffer = self.deltas[index]
+            np.copyto(buffer, delta, casting="unsafe")
+            step = self.compute_step(index, buffer, self.scratch[index])
+            if isinstance(layer, np.ndarray) and layer.flags.writeable and np.issubdtype(layer.dtype, np.floating):
+                np.add(layer, step, out=layer, casting="unsafe")
+            else:
+                layer = np.asarray(layer, dtype=np.result_type(np.asarray(layer).dtype, np.float32)) + step
+            new_weights.append(layer)
+        return new_weights
+
+
+class MomentumServerOptimizer(ServerOptimizer):
+    """Server momentum, FedAvgM: `m = beta * m + delta`, `x += lr * m`."""
+
+    def __init__(self, lr=1.0, momentum=0.9):
+        super().__init__(lr)
+        self.momentum = np.float32(momentum)
+        self.m = None
+
+    def allocate(self, shapes):
+        super().allocate(shapes)
+        self.m = [np.zeros(shape, dtype=np.float32) for shape in shapes]
+
+    def compute_step(self, index, delta, scratch):
+        m = self.m[index]
+        m *= self.momentum
+        m += delta
+        np.multiply(m, self.lr, out=scratch)
+        return scratch
+
+
+class AdamServerOptimizer(ServerOptimizer):
+    """FedAdam: `x += lr * m / (sqrt(v) + tau)` with exponential moving averages `m` and `v`."""
+
+    def __init__(self, lr=0.01, beta1=0.9, beta2=0.99, tau=1e-3):
+        super().__init__(lr)
+        self.beta1 = np.float32(beta1)
+        self.beta2 = np.float32(beta2)
+        self.tau = np.float32(tau)
+        self.m = None
+        self.v = None
+
+    def allocate(self, shapes):
+        super().allocate(shapes)
+        self.m = [np.zeros(shape, dtype=np.float32) for shape in shapes]
+        self.v = [np.full(shape, self.tau * self.tau, dtype=np.float32) for shape in shapes]
+
+    def update_second_moment(self, v, delta_sq, scratch):
+        v *= self.beta2
+        delta_sq *= 1 - self.beta2
+        v += delta_sq
+
+    def compute_step(self, index, delta, scratch):
+        m, v = self.m[index], self.v[index]
+        m *= self.beta1
+        np.multiply(delta, 1 - self.beta1, out=scratch)
+        m += scratch
+        np.square(delta, out=delta)
+        self.update_second_moment(v, delta, scratch)
+        np.sqrt(v, out=scratch)
+        scratch += self.tau
+        np.divide(m, scratch, out=scratch)
+        scratch *= self.lr
+        return scratch
+
+
+class YogiServerOptimizer(AdamServerOptimizer):
+    """FedYogi: like FedAdam with `v -= (1 - beta2) * delta ** 2 * sign(v - delta ** 2)`."""
+
+    def update_second_moment(self, v, delta_sq, scratch):
+        np.subtract(v, delta_sq, out=scratch)
+        np.sign(scratch, out=scratch)
+        scratch *= delta_sq
+        scratch *= 1 - self.beta2
+        v -= scratch
+
+
+SERVER_OPTIMIZERS = ("sgd", "momentum", "adam", "yogi")
+
+
+def build_server_optimizer(params_global, default_lr=1.0):
+    """
+    Creates the server optimizer configured in `hyperparams.global`.
+
+    :param params_global: Global hyperparameters.
+    :type params_global: `dict`
+    :param default_lr: Server learning rate if `server_lr` is not set.
+    :type default_lr: `float`
+    :return: server optimizer
+    :rtype: `ServerOptimizer`
+    """
+    name = str(params_global.get("server_optimizer", "sgd")).lower()
+    lr = float(params_global.get("server_lr", default_lr))
+    beta1 = float(params_global.get("server_momentum", 0.9))
+    beta2 = float(params_global.get("server_beta2", 0.99))
+    tau = float(params_global.get("server_tau", 1e-3))
+    if name == "sgd":
+        return ServerOptimizer(lr)
+    if name == "momentum":
+        return MomentumServerOptimizer(lr, momentum=beta1)
+    if name == "adam":
+        return AdamServerOptimizer(lr, beta1=beta1, beta2=beta2, tau=tau)
+    if name == "yogi":
+        return YogiServerOptimizer(lr, beta1=beta1, beta2=beta2, tau=tau)
+    raise HyperparamsException(
+        "Unsupported server_optimizer {}, use one of {}".format(name, ", ".join(SERVER_OPTIMIZERS))
+    )
+
+
+class ServerOptimizerMixin:
+    """
+    Applies the fused weights of an iterative fusion handler through a
+    server optimizer. List the mixin before the fusion handler class.
+    """
+
+    def __init__(self, hyperparams, protocol_handler, *args, **kwargs):
+        super().__init__(hyperparams, protocol_handler, *args, **kwargs)
+        self.server_optimizer = build_server_optimizer(self.params_global, default_lr=1.0)
+
+    def update_weights(self, lst_model_updates):
+        """
+        Moves the global weights towards the fused weights of the parties
+        with the server optimizer.
+
+        :param lst_model_updates: List of model updates of type `ModelUpdate`.
+        :type lst_model_updates: `list`
+        :return: None
+        """
+        fused = self.fusion_collected_responses(lst_model_updates)
+        if not self.current_model_weights:
+            # nothing to move from in the first round without an initial model
+            self.current_model_weights = fused
+            return
+        deltas = [
+            np.asarray(new, dtype=np.float32) - np.asarray(old, dtype=np.float32)
+            for new, old in zip(fused, self.current_model_weights)
+        ]
+        self.current_model_weights = self.server_optimizer.step(self.current_model_weights, deltas)
+
+
+class ServerOptimizerIterAvgFusionHandler(ServerOptimizerMixin, IterAvgFusionHandler):
+    """`IterAvgFusionHandler` with a server optimizer."""
+
+
+class ServerOptimizerFedAvgFusionHandler(ServerOptimizerMixin, FedAvgFusionHandler):
+    """`FedAvgFusionHandler` with a server optimizer."""
+
+
+class ServerOptimizerGradientFusionHandler(GradientFusionHandler):
+    """
+    `GradientFusionHandler` that applies the fused gradient through a server
+    optimizer, with `lr` as the default server learning rate.
+    """
+
+    def __init__(self, hyperparams, protocol_handler, data_handler=None, fl_model=None, **kwargs):
+        super().__init__(hyperparams, protocol_handler, data_handler, fl_model, **kwargs)
+        self.server_optimizer = build_server_optimizer(self.params_global, default_lr=self.lr)
+
+    def update_weights(self, lst_model_updates):
+        """
+        Applies the negative fused gradient with the server optimizer.
+
+        :param lst_model_updates: List of model updates of type `ModelUpdate`.
+        :type lst_model_updates: `list`
+        :return: None
+        """
+        agg_gradient = self.fusion_collected_responses(lst_model_updates, key="gradients")
+        if np.ndim(self.current_model_weights[0]) == 0:
+            # a flat weight vector is a single layer
+            delta = -np.asarray(agg_gradient, dtype=np.float32)
+            self.current_model_weights = self.server_optimizer.step([self.current_model_weights], [delta])[0].tolist()
+            return
+        deltas = [-np.asarray(layer, dtype=np.float32) for layer in agg_gradient]
+        self.current_model_weights = self.server_optimizer.step(self.current_model_weights, deltas)
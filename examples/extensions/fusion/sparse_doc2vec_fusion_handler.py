@@ -0,0 +1,169 @@
+"""
+Doc2Vec fusion over sparse row deltas of `syn1neg`.
+
+`Doc2VecFusionHandler` collects and averages the dense `syn1neg` matrix of
+every party each round. `SparseDoc2VecFusionHandler` asks the parties, which
+use `examples.extensions.model.sparse_doc2vec_fl_model.SparseDoc2VecFLModel`,
+for the rows they changed by more than `threshold` instead. It averages each
+row over the parties that sent it and adds the mean delta to the global
+matrix in place. It then sends only the rows that changed to the parties in
+the next round.
+
+    fusion:
+      name: SparseDoc2VecFusionHandler
+      path: examples.extensions.fusion.sparse_doc2vec_fusion_handler
+    hyperparams:
+      global:
+        sparse_update:
+          threshold: 0.0001     # largest ignored absolute change of a row
+          full_sync_every: 10   # optional, send the dense matrix every N rounds
+
+Parties that miss a round miss the rows changed in it. `full_sync_every`
+bounds how long they stay out of sync.
+"""
+import logging
+
+import numpy as np
+
+from ibmfl.aggregator.fusion.doc2vec_fusion_handler import Doc2VecFusionHandler
+from ibmfl.model.model_update import ModelUpdate
+
+logger = logging.getLogger(__name__)
+
+
+class SparseDoc2VecFusionHandler(Doc2VecFusionHandler):
+    """
+    `Doc2VecFusionHandler` that exchanges the changed rows of `syn1neg`
+    instead of the dense matrix.
+    """
+
+    def __init__(self, hyperparams, protocol_handler, data_handler=None, fl_model=None, **kwargs):
+        super().__init__(hyperparams, protocol_handler, data_handler, fl_model, **kwargs)
+        sparse_update = self.params_global.get("sparse_update") or {}
+        self.threshold = float(sparse_update.get("threshold", 0.0))
+        self.full_sync_every = int(sparse_update.get("full_sync_every", 0))
+        # rows of the global matrix changed in the last round, None to send the dense matrix
+        self.broadcast_rows = None
+        self.rounds_since_full_sync = 0
+        self.row_sums = None
+        self.row_counts = None
+
+    def get_round_model_update(self):
+        """
+        Returns the global model update of the next round: nothing before
+        the first merge, the changed rows, or the dense matrix for a full
+        synchronization.
+
+        :return: model update
+        :rtype: `ModelUpdate`
+        """
+        if self.current_model_weights is None:
+            return None
+        full_sync = self.broadcast_rows is None or (
+            self.full_sync_every and self.rounds_since_full_sync >= self.full_sync_every
+        )
+        if full_sync:
+            self.rounds_since_full_sync = 0
+            return ModelUpdate(weights=self.current_model_weights)
+        self.rounds_since_full_sync += 1
+        return ModelUpdate(
+            row_indices=self.broadcast_rows,
+            row_values=self.current_model_weights[self.broadcast_rows],
+            shape=self.current_model_weights.shape,
+        )
+
+    def start_global_training(self):
+        """
+        Starts an iterative global federated learning training process.
+        """
+        self.curr_round = 0
+        # [RPC] Perform Initialization of the Local Worker by first obtaining their training vocabulary
+        logger.info("Perform Local Training Handler Initialization Process")
+        vocabulary = self.query("get_vocabulary", {"round_zero": True})
+
+        merged_vocab = self.merge_vocab([v["vocab"] for v in vocabulary])
+
+        # Set initial model with merged vocabulary and distribute it
+        initial_model = self.set_initial_model(merged_vocab)
+        self.query("set_initial_model", {"initial_model": initial_model})
+
+        while not self.reach_termination_criteria(self.curr_round):
+            model_update = self.get_round_model_update()
+            payload = {
+                "hyperparams": {"local": self.params_local},
+                "model_update": model_update,
+                "rounds": self.rounds,
+                "sparse_update": {"threshold": self.threshold},
+            }
+
+            # query all available parties
+            lst_replies = self.query_all_parties(payload)
+
+            self.update_weights(lst_replies)
+
+            # Update model if we are maintaining one
+            if self.fl_model is not None:
+                self.fl_model.update_model(ModelUpdate(weights=self.current_model_weights))
+
+            self.curr_round += 1
+            self.save_current_state()
+
+    def update_weights(self, lst_model_updates):
+        """
+        Adds the mean row deltas of the parties to the global `syn1neg` in
+        place. Each row is averaged over the parties that changed it; dense
+        updates count as changes of every row.
+
+        :param lst_model_updates: List of model updates of type `ModelUpdate`.
+        :type lst_model_updates: `list`
+        :return: None
+        """
+        row_updates = []
+        for update in lst_model_updates:
+            if update.exist_key("row_indices"):
+                row_updates.append((update.get("row_indices"), update.get("row_deltas"), tuple(update.get("shape"))))
+            else:
+                weights = np.asarray(update.get("weights"), dtype=np.float32)
+                row_updates.append((None, weights, weights.shape))
+        if not row_updates:
+            return
+
+        shape = row_updates[0][2]
+        if self.current_model_weights is None:
+            # parties start from the zero-initialized syn1neg of the initial model
+            self.current_model_weights = np.zeros(shape, dtype=np.float32)
+            self.broadcast_rows = None
+        elif not isinstance(self.current_model_weights, np.ndarray):
+            self.current_model_weights = np.asarray(self.current_model_weights, dtype=np.float32)
+        weights = self.current_model_weights
+        if self.row_sums is None or self.row_sums.shape != weights.shape:
+            self.row_sums = np.zeros(weights.shape, dtype=np.float32)
+            self.row_counts = np.zeros(len(weights), dtype=np.int32)
+
+        touched = []
+        for rows, values, _ in row_updates:
+            if rows is None:
+                # dense weights: the delta of every row
+                self.row_sums += values
+                self.row_sums -= weights
+                self.row_counts += 1
+                touched.append(np.arange(len(weights)))
+            else:
+                # rows are unique within an update
+                self.row_sums[rows] += values
+                self.row_counts[rows] += 1
+                touched.append(rows)
+
+        changed = np.unique(np.concatenate(touched))
+        mean_deltas = self.row_sums[changed]
+        mean_deltas /= self.row_counts[changed, None]
+        weights[changed] += mean_deltas
+        self.row_sums[changed] = 0
+        self.row_counts[changed] = 0
+        logger.info("Merged %d updates changing %d of %d rows", len(row_updates), len(changed), len(weights))
+
+        if any(rows is None for rows, _, _ in row_updates):
+            # parties that send dense weights also expect them
+            self.broadcast_rows = None
+        else:
+            self.broadcast_rows = changed.astype(np.int32 if len(weights) < np.iinfo(np.int32).max else np.int64)
@@ -0,0 +1,188 @@
+"""
+Fusion of named-layer (state-dict) model updates.
+
+Models such as `RLlibFLModel` send their weights as a dictionary mapping
+layer names to numpy arrays. The fusion handlers shipped for them look up
+`update.get("weights").get(key)` inside the per-layer loop, which unpickles
+every party's whole dictionary once per layer. The engine below fetches each
+update exactly once, validates that all parties agree on layer names and
+shapes, and accumulates the weighted sum per layer into buffers that are
+reused across rounds.
+"""
+import logging
+
+import numpy as np
+
+from ibmfl.aggregator.fusion.iter_avg_fusion_handler import IterAvgFusionHandler
+from ibmfl.exceptions import FusionException, ModelUpdateException
+
+logger = logging.getLogger(__name__)
+
+
+class StateDictFusion:
+    """
+    Weighted per-key averaging of dict-of-ndarray model updates.
+
+    Supported weighting schemes:
+
+    * `uniform`: every party contributes equally (as `RLFusionHandler`).
+    * `reward`: parties are weighted by `train_result["episode_reward_mean"]` \
+    (as `RLWeightedAvgFusionHandler`).
+    * `count`: parties are weighted by `train_counts` (as `FedAvgFusionHandler`).
+    """
+
+    WEIGHTING_SCHEMES = ("uniform", "reward", "count")
+
+    def __init__(self, weighting="uniform", eps=1e-6):
+        """
+        :param weighting: One of `uniform`, `reward` or `count`.
+        :type weighting: `str`
+        :param eps: Constant added to the sum of weighting factors to avoid \
+        dividing by zero.
+        :type eps: `float`
+        """
+        if weighting not in self.WEIGHTING_SCHEMES:
+            raise FusionException(
+                "Unsupported weighting scheme {}, expected one of {}".format(weighting, self.WEIGHTING_SCHEMES)
+            )
+        self.weighting = weighting
+        self._eps = eps
+        self._buffers = {}
+
+    def collect(self, lst_model_updates, key="weights"):
+        """
+        Fetches the state dictionary and the weighting factor of every update
+        once and checks that all state dictionaries are aligned.
+
+        :param lst_model_updates: List of model updates of type `ModelUpdate`.
+        :type lst_model_updates: `list`
+        :param key: Key of the state dictionary inside each model update.
+        :type key: `str`
+        :return: list of state dictionaries and the normalized coefficients
+        :rtype: `tuple`
+        """
+        if not lst_model_updates:
+            raise FusionException("No model updates were provided for fusion.")
+
+        state_dicts = []
+        factors = []
+        try:
+            for update in lst_model_updates:
+                state_dicts.append(update.get(key))
+                factors.append(self._weighting_factor(update))
+        except ModelUpdateException as ex:
+            logger.exception(ex)
+            raise FusionException("Model updates are not appropriate for this fusion method.  Check local training.")
+
+        reference = state_dicts[0]
+        if not isinstance(reference, dict):
+            raise FusionException("Expected a dictionary of layer weights, got " + str(type(reference)))
+
+        shapes = {name: np.shape(value) for name, value in reference.items()}
+        for idx, state_dict in enumerate(state_dicts[1:], start=1):
+            if state_dict.keys() != reference.keys():
+                missing = set(reference.keys()) ^ set(state_dict.keys())
+                raise FusionException("Update {} does not match the layer names of update 0: {}".format(idx, missing))
+            for name, shape in shapes.items():
+                if np.shape(state_dict[name]) != shape:
+                    raise FusionException(
+                        "Update {} has shape {} for layer {}, expected {}".format(
+                            idx, np.shape(state_dict[name]), name, shape
+                        )
+                    )
+
+        factors = np.asarray(factors, dtype=np.float64)
+        if self.weighting == "uniform":
+            coefs = factors / len(factors)
+        else:
+            coefs = factors / (np.sum(factors) + self._eps)
+
+        return state_dicts, coefs
+
+    def fuse(self, lst_model_updates, key="weights"):
+        """
+        Computes the weighted average of each layer across all updates.
+
+        :param lst_model_updates: List of model updates of type `ModelUpdate`.
+        :type lst_model_updates: `list`
+        :param key: Key of the state dictionary inside each model update.
+        :type key: `str`
+        :return: fused state dictionary
+        :rtype: `dict`
+        """
+        state_dicts, coefs = self.collect(lst_model_updates, key=key)
+
+        fused = {}
+        for name, first in state_dicts[0].items():
+            first = np.asarray(first)
+            acc = self._buffer(name, first.shape)
+            np.multiply(first, coefs[0], out=acc)
+            for state_dict, coef in zip(state_dicts[1:], coefs[1:]):
+                acc += coef * np.asarray(state_dict[name])
+
+            dtype = first.dtype if np.issubdtype(first.dtype, np.floating) else np.float64
+            fused[name] = acc.astype(dtype)
+
+        return fused
+
+    def _weighting_factor(self, update):
+        if self.weighting == "reward":
+            return update.get("train_result").get("episode_reward_mean")
+        if self.weighting == "count":
+            return update.get("train_counts")
+        return 1.0
+
+    def _buffer(self, name, shape):
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, dtype=np.float64)
+            self._buffers[name] = buf
+        return buf
+
+
+class StateDictFusionHandler(IterAvgFusionHandler):
+    """
+    Class for averaging named-layer (state-dict) model weights, such as the
+    policy weights sent by `RLlibFLModel`.
+
+    The weighting scheme is set through `hyperparams.global.weighting`
+    (`uniform`, `reward` or `count`) and defaults to `uniform`, which matches
+    `RLFusionHandler`; `reward` matches `RLWeightedAvgFusionHandler`.
+    """
+
+    def __init__(self, hyperparams, protocol_handler, data_handler=None, fl_model=None, **kwargs):
+        """
+        Initializes a StateDictFusionHandler object with provided information,
+        such as protocol handler, fl_model, data_handler and hyperparams.
+
+        :param hyperparams: Hyperparameters used for training.
+        :type hyperparams: `dict`
+        :param protocol_handler: Protocol handler used for handling learning \
+        algorithm's request for communication.
+        :type protocol_handler: `ProtoHandler`
+        :param data_handler: data handler that will be used to obtain data
+        :type data_handler: `DataHandler`
+        :param fl_model: model to be trained
+        :type fl_model: `model.FLModel`
+        :param kwargs: Additional arguments to initialize a fusion handler.
+        :type kwargs: `dict`
+        """
+        super().__init__(hyperparams, protocol_handler, data_handler, fl_model, **kwargs)
+        self.name = "StateDictAvg"
+        self.engine = StateDictFusion(weighting=self.params_global.get("weighting", "uniform"))
+
+    def fusion_collected_responses(self, lst_model_updates, key="weights"):
+        """
+        Receives a list of model updates, where a model update is of the type
+        `ModelUpdate`, and returns the weighted average of the layer weights
+        stored under `key`.
+
+        :param lst_model_updates: List of model updates of type `ModelUpdate` \
+        to be averaged.
+        :type lst_model_updates: `list`
+        :param key: A key indicating what values the method will aggregate over.
+        :type key: `str`
+        :return: results after aggregation
+        :rtype: `dict`
+        """
+        return self.engine.fuse(lst_model_updates, key=key)
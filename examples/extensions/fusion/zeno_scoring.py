@@ -0,0 +1,305 @@
+"""
+Zeno scoring without a model reload per party.
+
+`ZenoGradientFusionHandler` scores a party by building the candidate
+weights w - lr * g as nested lists, loading them into the aggregator model
+with `update_model(ModelUpdate(...))` and calling `get_loss`, one party at
+a time. `BatchedZenoGradientFusionHandler` keeps the weights as arrays and
+scores all parties through a `ZenoScorer`:
+
+* `TorchZenoScorer`, for `PytorchFLModel`, evaluates the candidates of up
+  to `zeno_chunk_size` parties in one `torch.func.vmap` call of the module
+  over stacked parameters, and falls back to applying each step to the
+  parameters in place and copying them back;
+* `ZenoScorer`, for other models, writes the candidates into a reused
+  buffer and loads them with `blend_weights` (see
+  `examples.extensions.model.blend_fl_model`) or `update_model`.
+
+The validation batch is sampled once per round.
+
+    fusion:
+      name: BatchedZenoGradientFusionHandler
+      path: examples.extensions.fusion.zeno_scoring
+    hyperparams:
+      global:
+        lr: 0.1
+        zeno_rho: 0.0005
+        zeno_b: 1             # parties with the lowest scores left out
+        zeno_batch: 32
+        zeno_chunk_size: 16   # parties per vmap call
+"""
+import logging
+
+import numpy as np
+
+from ibmfl.aggregator.fusion.zeno_gradient_fusion_handler import ZenoGradientFusionHandler
+from ibmfl.exceptions import GlobalTrainingException, HyperparamsException
+from ibmfl.model.model_update import ModelUpdate
+
+logger = logging.getLogger(__name__)
+
+
+class ZenoScorer:
+    """
+    Computes the loss of the aggregator model at the current weights and
+    after the gradient step of every party.
+    """
+
+    def __init__(self, fl_model):
+        """
+        :param fl_model: aggregator model holding the current weights
+        :type fl_model: `FLModel`
+        """
+        self.fl_model = fl_model
+        self.candidate = None
+
+    def load(self, weights):
+        if hasattr(self.fl_model, "blend_weights"):
+            self.fl_model.blend_weights(weights, 1.0)
+        else:
+            self.fl_model.update_model(ModelUpdate(weights=weights))
+
+    def losses(self, weights, gradients, lr, batch, to_model=list):
+        """
+        Returns the loss at `weights` and at `weights - lr * g` for every
+        `g` in `gradients`. The model holds `weights` when it returns.
+
+        :param weights: current weights, one array per layer
+        :type weights: `list` of `np.ndarray`
+        :param gradients: gradients of the parties, one array per layer
+        :type gradients: `list` of `list` of `np.ndarray`
+        :param lr: step size
+        :type lr: `float`
+        :param batch: validation batch `(x, y)`
+        :type batch: `tuple`
+        :param to_model: converts a list of layers to the weights layout \
+        of the model
+        :type to_model: `callable`
+        :return: loss at the current weights and loss of every candidate
+        :rtype: `tuple(float, np.ndarray)`
+        """
+        base = self.fl_model.get_loss(batch)
+        if self.candidate is None or [c.shape for c in self.candidate] != [w.shape for w in weights]:
+            self.candidate = [np.empty_like(w) for w in weights]
+        losses = np.empty(len(gradients))
+        try:
+            for i, grads in enumerate(gradients):
+                for c, w, g in zip(self.candidate, weights, grads):
+                    np.multiply(g, -lr, out=c)
+                    c += w
+                self.load(to_model(self.candidate))
+                losses[i] = self.fl_model.get_loss(batch)
+        finally:
+            self.fl_model.update_model(ModelUpdate(weights=to_model(weights)))
+        return base, losses
+
+
+class TorchZenoScorer(ZenoScorer):
+    """
+    Scores the candidates of a `PytorchFLModel` with its skorch loss on
+    stacked parameters, `chunk_size` parties per forward pass.
+    """
+
+    def __init__(self, fl_model, chunk_size=16):
+        super().__init__(fl_model)
+        self.chunk_size = max(1, int(chunk_size))
+        self.batched = True
+
+    def losses(self, weights, gradients, lr, batch, to_model=list):
+        import torch
+
+        try:
+            from torch.func import functional_call, vmap
+        except ImportError:
+            # torch < 2.0
+            try:
+                from functorch import vmap
+                from torch.nn.utils.stateless import functional_call
+            except ImportError:
+                functional_call = vmap = None
+        if vmap is None and self.batched:
+            logger.info("Scoring the parties one by one, torch.func and functorch are not available")
+            self.batched = False
+
+        net = self.fl_model.model
+        module = net.module_
+        params = dict(module.named_parameters())
+        first = next(iter(params.values()))
+        device = first.device
+        x = torch.as_tensor(batch[0], device=device)
+        if x.is_floating_point():
+            # numpy batches are float64, the parameters usually float32
+            x = x.to(first.dtype)
+        y = torch.as_tensor(batch[1], device=device)
+
+        def loss_of(p):
+            return net.get_loss(functional_call(module, p, (x,)), y, X=x, training=False)
+
+        losses = np.empty(len(gradients))
+        was_training = module.training
+        module.eval()
+        try:
+            with torch.no_grad():
+                current = {name: p.detach() for name, p in params.items()}
+                base = float(net.get_loss(module(x), y, X=x, training=False))
+                grads = [
+                    [torch.as_tensor(g, dtype=p.dtype, device=device) for p, g in zip(params.values(), party)]
+                    for party in gradients
+                ]
+                if self.batched:
+                    try:
+                        batched_loss = vmap(loss_of)
+                        for start in range(0, len(grads), self.chunk_size):
+                            chunk = grads[start : start + self.chunk_size]
+                            stacked = {
+                                name: torch.stack([party[k] for party in chunk]).mul_(-lr).add_(p)
+                                for k, (name, p) in enumerate(current.items())
+                            }
+                            losses[start : start + len(chunk)] = batched_loss(stacked).cpu().numpy()
+                        return base, losses
+                    except (RuntimeError, NotImplementedError) as ex:
+                        logger.info("Scoring the parties one by one, the model does not support vmap: %s", ex)
+                        self.batched = False
+                saved = [p.detach().clone() for p in params.values()]
+                for i, party in enumerate(grads):
+                    try:
+                        for p, g in zip(params.values(), party):
+                            p.sub_(g, alpha=lr)
+                        losses[i] = float(net.get_loss(module(x), y, X=x, training=False))
+                    finally:
+                        for p, s in zip(params.values(), saved):
+                            p.copy_(s)
+        finally:
+            module.train(was_training)
+        return base, losses
+
+
+def build_zeno_scorer(fl_model, chunk_size=16):
+    """
+    Returns the scorer for a model: `TorchZenoScorer` for skorch-based
+    `PytorchFLModel`s, `ZenoScorer` otherwise.
+
+    :rtype: `ZenoScorer`
+    """
+    if hasattr(getattr(fl_model, "model", None), "module_"):
+        return TorchZenoScorer(fl_model, chunk_size)
+    return ZenoScorer(fl_model)
+
+
+class BatchedZenoGradientFusionHandler(ZenoGradientFusionHandler):
+    """
+    `ZenoGradientFusionHandler` that keeps the global weights as arrays and
+    scores the parties with a `ZenoScorer`.
+    """
+
+    def __init__(self, hyperparams, protocol_handler, data_handler=None, fl_model=None, **kwargs):
+        super().__init__(hyperparams, protocol_handler, data_handler, fl_model, **kwargs)
+        self.name = "Zeno-SGD-Batched"
+        self.scorer = build_zeno_scorer(self.fl_model, self.params_global.get("zeno_chunk_size") or 16)
+        self.zeno_batch_round = None
+        self.zeno_train_batch = None
+        # current_model_weights as arrays that are updated in place
+        self.weight_arrays = None
+
+    def get_zeno_train_batch(self):
+        """
+        Returns the validation batch of the current round, sampled on the
+        first call of the round.
+
+        :return: `(x, y)`
+        :rtype: `tuple`
+        """
+        if self.zeno_train_batch is None or self.zeno_batch_round != self.curr_round:
+            indices = np.sort(np.random.choice(self.x_train.shape[0], self.zeno_batch, replace=False))
+            self.zeno_train_batch = self.x_train[indices], self.y_train[indices]
+            self.zeno_batch_round = self.curr_round
+        return self.zeno_train_batch
+
+    def is_flat(self):
+        # a flat weight vector is a single layer
+        return np.ndim(self.current_model_weights[0]) == 0
+
+    def weight_layers(self):
+        """
+        Returns the global weights as a list of float arrays owned by the
+        handler, copying them when `current_model_weights` was replaced.
+
+        :rtype: `list` of `np.ndarray`
+        """
+        if self.is_flat():
+            return [np.asarray(self.current_model_weights, dtype=np.float64)]
+        if self.current_model_weights is not self.weight_arrays:
+            layers = [np.array(layer) for layer in self.current_model_weights]
+            self.weight_arrays = [layer if layer.dtype.kind == "f" else layer.astype(np.float64) for layer in layers]
+            self.current_model_weights = self.weight_arrays
+        return self.weight_arrays
+
+    def to_model(self, layers):
+        return layers[0] if self.is_flat() else layers
+
+    def fusion_collected_responses(self, lst_model_updates, key="gradients"):
+        """
+        Receives a list of model updates and computes the score for each party
+        as defined in Zeno.
+
+        :param lst_model_updates: List of model updates of type `ModelUpdate` \
+        to be averaged.
+        :type lst_model_updates: `list`
+        :param key: A key indicating what values the method will aggregate over.
+        :type key: `str`
+        :return: mean gradient of the parties with the highest scores, one \
+        array per layer
+        :rtype: `list` of `np.ndarray`
+        """
+        if not self.b < len(lst_model_updates):
+            raise HyperparamsException("zeno's parameter of b should be " "less than the number of parties")
+
+        try:
+            weights = self.weight_layers()
+            gradients = []
+            for update in lst_model_updates:
+                grads = update.get(key)
+                if self.is_flat():
+                    grads = [grads]
+                gradients.append([np.asarray(g, dtype=w.dtype) for g, w in zip(grads, weights)])
+
+            base, losses = self.scorer.losses(weights, gradients, self.lr, self.get_zeno_train_batch(), self.to_model)
+            norms_squared = np.array([sum(float(np.vdot(g, g)) for g in grads) for grads in gradients])
+            scores = base - losses - self.rho * norms_squared
+            logger.info("Zeno scores: %s", np.round(scores, 6).tolist())
+
+            # the mean update ignoring the 'b' parties with the lowest scores
+            kept = np.argsort(scores, kind="stable")[self.b :]
+            results = [np.array(layer) for layer in gradients[kept[0]]]
+            for i in kept[1:]:
+                for acc, g in zip(results, gradients[i]):
+                    acc += g
+            for acc in results:
+                acc /= len(kept)
+        except NotImplementedError:
+            logger.info("Error occurred while training! " "Model is not compatible with Zeno fusion Handler")
+            raise GlobalTrainingException("Incompatible model and fusion types.")
+
+        except Exception as ex:
+            logger.exception(ex)
+            raise GlobalTrainingException("Error occurred during training.")
+
+        return results
+
+    def update_weights(self, lst_model_updates):
+        """
+        Takes a gradient step with the mean gradient of the parties that
+        Zeno keeps, in place on the global weights.
+
+        :param lst_model_updates: List of model updates of type `ModelUpdate` \
+        to be averaged.
+        :type lst_model_updates: `lst`
+        :return: None
+        """
+        agg_gradient = self.fusion_collected_responses(lst_model_updates, key="gradients")
+        weights = self.weight_layers()
+        for w, g in zip(weights, agg_gradient):
+            g *= -self.lr
+            w += g
+        if self.is_flat():
+            self.current_model_weights = weights[0].tolist()
@@ -0,0 +1,384 @@
+"""
+Group fairness metrics from one contingency tensor.
+
+`ibmfl.util.fairness_metrics.metrics.fairness_report` splits the test set
+into privileged and unprivileged rows with DataFrame filters. It then scans
+the label and prediction arrays once per count (`num_pos`, `num_true_pos`,
+`num_false_pos`, `fav_rate`, `f1_score`). `FairnessContingency` counts every
+(group, label, prediction) combination in one `np.bincount` pass instead,
+
+    counts[s_1, ..., s_k, y, y_pred]
+
+over the levels of k sensitive attributes. Every rate and report is a
+slice or sum of that tensor. Batches can be added one at a time, and tensors
+of several batches or parties can be summed, so the metrics of a large test
+set never need the whole set at once. The reports use the keys of
+`fairness_report`. The underestimation index (`uei`) of binary labels
+follows from the tensor as well, without gensim.
+
+    engine = FairnessContingency(["sex", "race"], columns)
+    for x, y in batches:
+        engine.add(x, y, model.predict(x))
+    engine.report("sex"), engine.group_rates()
+"""
+import logging
+
+import numpy as np
+
+from ibmfl.exceptions import FLException
+
+logger = logging.getLogger(__name__)
+
+
+def _ratio(numerator, denominator):
+    # the library reports 0 for rates of empty groups
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    out = np.zeros(np.broadcast(numerator, denominator).shape)
+    return np.divide(numerator, denominator, out=out, where=denominator != 0)
+
+
+def as_labels(values):
+    """
+    Returns labels or group values as a flat int64 array, rejecting values
+    that are not integral.
+
+    :param values: labels, e.g. `0.0`/`1.0` floats
+    :type values: `np.ndarray`
+    :rtype: `np.ndarray`
+    """
+    values = np.asarray(values).ravel()
+    if values.dtype.kind in "iub":
+        return values.astype(np.int64, copy=False)
+    labels = values.astype(np.int64)
+    if not np.array_equal(labels, values):
+        raise FLException("Expecting integral labels and sensitive attribute values")
+    return labels
+
+
+def sensitive_columns(x, columns, attributes):
+    """
+    Returns the values of the sensitive attributes, one column per attribute.
+
+    :param x: features, an array or a DataFrame
+    :type x: `np.ndarray` or `pandas.DataFrame`
+    :param columns: feature names, used to look attribute names up
+    :type columns: `list`
+    :param attributes: attribute names or column indices
+    :type attributes: `list`
+    :return: `(rows, len(attributes))` array
+    :rtype: `np.ndarray`
+    """
+    indices = []
+    for attribute in attributes:
+        if isinstance(attribute, str):
+            if columns is None or attribute not in columns:
+                raise FLException("Unknown sensitive attribute " + attribute)
+            indices.append(list(columns).index(attribute))
+        else:
+            indices.append(int(attribute))
+    if hasattr(x, "iloc"):
+        return x.iloc[:, indices].to_numpy()
+    return np.asarray(x)[:, indices]
+
+
+def hellinger(p, q):
+    """
+    Hellinger distance of two dense non-negative vectors, as
+    `gensim.matutils.hellinger` computes it.
+
+    :rtype: `float`
+    """
+    return float(np.sqrt(0.5 * np.sum(np.square(np.sqrt(p) - np.sqrt(q)))))
+
+
+def uei(y_train, y_train_pred):
+    """
+    Underestimation index of `ibmfl.util.fairness_metrics.metrics.uei`,
+    without gensim.
+
+    :param y_train: training labels
+    :type y_train: `np.ndarray`
+    :param y_train_pred: predictions of the training samples
+    :type y_train_pred: `np.ndarray`
+    :rtype: `float`
+    """
+    y_train = np.asarray(y_train, dtype=float)
+    y_train_pred = np.asarray(y_train_pred, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        y_train_norm = y_train / np.sum(y_train)
+        pred_sum = np.sum(y_train_pred)
+        y_train_pred_norm = y_train_pred / pred_sum if pred_sum > 0 else y_train_pred
+    return hellinger(y_train_norm, y_train_pred_norm)
+
+
+class FairnessContingency:
+    """
+    Counts of (sensitive attribute levels, label, prediction), accumulated
+    over batches.
+    """
+
+    def __init__(self, attributes, columns=None, levels=2, num_classes=2, favorable_label=1):
+        """
+        :param attributes: sensitive attribute names or column indices
+        :type attributes: `list`
+        :param columns: feature names, needed for attribute names
+        :type columns: `list`
+        :param levels: number of values of every attribute, values are \
+        `0 .. levels - 1`; an int for all attributes or one per attribute
+        :type levels: `int` or `list`
+        :param num_classes: number of labels, labels are `0 .. num_classes - 1`
+        :type num_classes: `int`
+        :param favorable_label: label of the favorable outcome
+        :type favorable_label: `int`
+        """
+        if isinstance(attributes, (str, int)):
+            attributes = [attributes]
+        self.attributes = list(attributes)
+        if not self.attributes:
+            raise FLException("At least one sensitive attribute is required")
+        self.columns = list(columns) if columns is not None else None
+        if np.ndim(levels) == 0:
+            levels = [levels] * len(self.attributes)
+        if len(levels) != len(self.attributes):
+            raise FLException("Expecting one number of levels per sensitive attribute")
+        self.levels = tuple(int(level) for level in levels)
+        self.num_classes = int(num_classes)
+        self.favorable_label = int(favorable_label)
+        self.counts = np.zeros(self.levels + (self.num_classes, self.num_classes), dtype=np.int64)
+
+    def reset(self):
+        self.counts[...] = 0
+
+    @property
+    def num_samples(self):
+        return int(self.counts.sum())
+
+    def add_groups(self, groups, y_true, y_pred):
+        """
+        Counts a batch whose sensitive attribute values are given directly.
+
+        :param groups: `(rows, num_attributes)` attribute values
+        :type groups: `np.ndarray`
+        :param y_true: labels
+        :type y_true: `np.ndarray`
+        :param y_pred: predictions
+        :type y_pred: `np.ndarray`
+        :return: None
+        """
+        groups = np.asarray(groups)
+        if groups.ndim == 1:
+            groups = groups[:, np.newaxis]
+        if groups.ndim != 2 or groups.shape[1] != len(self.attributes):
+            raise FLException("Expecting one column per sensitive attribute, got shape " + str(groups.shape))
+        y_true = as_labels(y_true)
+        y_pred = as_labels(y_pred)
+        if not len(groups) == len(y_true) == len(y_pred):
+            raise FLException(
+                "Expecting as many labels and predictions as samples, got {}, {} and {}".format(
+                    len(groups), len(y_true), len(y_pred)
+                )
+            )
+        coordinates = [as_labels(groups[:, i]) for i in range(groups.shape[1])] + [y_true, y_pred]
+        try:
+            cells = np.ravel_multi_index(coordinates, self.counts.shape)
+        except ValueError:
+            raise FLException(
+                "Sensitive attribute values must lie in 0 .. levels - 1 and labels in 0 .. {}".format(
+                    self.num_classes - 1
+                )
+            )
+        self.counts += np.bincount(cells, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def add(self, x, y_true, y_pred):
+        """
+        Counts a batch of samples.
+
+        :param x: features holding the sensitive attributes
+        :type x: `np.ndarray` or `pandas.DataFrame`
+        :param y_true: labels
+        :type y_true: `np.ndarray`
+        :param y_pred: predictions
+        :type y_pred: `np.ndarray`
+        :return: None
+        """
+        self.add_groups(sensitive_columns(x, self.columns, self.attributes), y_true, y_pred)
+
+    def merge(self, other):
+        """
+        Adds the counts of another engine over the same attributes, e.g.
+        of another party.
+
+        :param other: engine or counts tensor
+        :type other: `FairnessContingency` or `np.ndarray`
+        :return: self
+        """
+        counts = other.counts if isinstance(other, FairnessContingency) else np.asarray(other)
+        if counts.shape != self.counts.shape:
+            raise FLException("Cannot merge counts of shape {} into {}".format(counts.shape, self.counts.shape))
+        self.counts += counts
+        return self
+
+    def axis(self, attribute):
+        if attribute in self.attributes:
+            return self.attributes.index(attribute)
+        if isinstance(attribute, int) and 0 <= attribute < len(self.attributes):
+            return attribute
+        raise FLException("Unknown sensitive attribute " + str(attribute))
+
+    def marginal(self, attributes=None):
+        """
+        Returns the counts of the given attributes, summed over the others.
+
+        :param attributes: attributes to keep, all by default
+        :type attributes: `list`
+        :return: `(levels..., num_classes, num_classes)` counts
+        :rtype: `np.ndarray`
+        """
+        if attributes is None:
+            return self.counts
+        if not isinstance(attributes, (list, tuple)):
+            attributes = [attributes]
+        keep = [self.axis(attribute) for attribute in attributes]
+        dropped = tuple(i for i in range(len(self.attributes)) if i not in keep)
+        table = self.counts.sum(axis=dropped) if dropped else self.counts
+        # order the remaining axes as requested
+        order = sorted(keep)
+        return np.moveaxis(table, [order.index(i) for i in keep], list(range(len(keep))))
+
+    def confusion_matrix(self):
+        """
+        Returns the `(label, prediction)` counts over all groups.
+
+        :rtype: `np.ndarray`
+        """
+        return self.counts.reshape(-1, self.num_classes, self.num_classes).sum(axis=0)
+
+    def group_rates(self, attributes=None):
+        """
+        Returns the sample count, favorable rate, true positive rate and
+        false positive rate of every group of the given attributes, all of
+        them by default, i.e. of every intersectional group.
+
+        :param attributes: attributes that define the groups
+        :type attributes: `list`
+        :return: arrays of shape `levels` of the attributes
+        :rtype: `dict`
+        """
+        table = self.marginal(attributes)
+        fav = self.favorable_label
+        count = table.sum(axis=(-2, -1))
+        positives = table[..., fav, :].sum(axis=-1)
+        predicted = table[..., :, fav].sum(axis=-1)
+        true_pos = table[..., fav, fav]
+        false_pos = predicted - true_pos
+        return {
+            "count": count,
+            "favorable_rate": _ratio(predicted, count),
+            "tpr": _ratio(true_pos, positives),
+            "fpr": _ratio(false_pos, count - positives),
+        }
+
+    def f1(self):
+        matrix = self.confusion_matrix()
+        fav = self.favorable_label
+        true_pos = matrix[fav, fav]
+        denominator = matrix[fav, :].sum() + matrix[:, fav].sum()
+        return float(2.0 * true_pos / denominator) if denominator else 0.0
+
+    def accuracy(self):
+        total = self.num_samples
+        return float(np.trace(self.confusion_matrix()) / total) if total else 0.0
+
+    def report(self, attribute=None, privileged=1, unprivileged=0):
+        """
+        Fairness report of one attribute, with the keys and conventions of
+        `ibmfl.util.fairness_metrics.metrics.fairness_report`.
+
+        :param attribute: sensitive attribute, the first one by default
+        :param privileged: level of the privileged group
+        :type privileged: `int`
+        :param unprivileged: level of the unprivileged group
+        :type unprivileged: `int`
+        :return: F1, statistical parity difference, equal opportunity \
+        difference, average odds difference and disparate impact
+        :rtype: `dict`
+        """
+        rates = self.group_rates(self.attributes[0] if attribute is None else attribute)
+        fav_priv, fav_unpriv = rates["favorable_rate"][privileged], rates["favorable_rate"][unprivileged]
+        tpr_priv, tpr_unpriv = rates["tpr"][privileged], rates["tpr"][unprivileged]
+        fpr_priv, fpr_unpriv = rates["fpr"][privileged], rates["fpr"][unprivileged]
+        return {
+            "F1": self.f1(),
+            "Statistical Parity Difference:": float(fav_unpriv - fav_priv),
+            "Equal Opportunity Difference": float(tpr_unpriv - tpr_priv),
+            "Average Odds Difference:": float(((fpr_unpriv - fpr_priv) + (tpr_unpriv - tpr_priv)) / 2),
+            "Disparate Impact:": float(fav_unpriv / fav_priv) if fav_priv else 0.0,
+        }
+
+    def reports(self, privileged=1, unprivileged=0):
+        """
+        Returns `report` of every attribute.
+
+        :rtype: `dict`
+        """
+        return {str(attribute): self.report(attribute, privileged, unprivileged) for attribute in self.attributes}
+
+    def uei(self):
+        """
+        Underestimation index of the counted labels and predictions, which
+        equals `uei(y_true, y_pred)` for binary labels: with 0/1 vectors the
+        Hellinger terms reduce to positive, predicted positive and true
+        positive counts.
+
+        :rtype: `float`
+        """
+        if self.num_classes != 2 or self.favorable_label != 1:
+            raise FLException("The underestimation index needs binary labels with favorable label 1")
+        matrix = self.confusion_matrix()
+        positives = matrix[1, :].sum()
+        predicted = matrix[:, 1].sum()
+        if positives == 0:
+            return float("nan")
+        if predicted == 0:
+            return float(np.sqrt(0.5))
+        overlap = matrix[1, 1] / np.sqrt(positives * predicted)
+        return float(np.sqrt(max(0.0, 1.0 - overlap)))
+
+
+def reweighing_table(global_counts):
+    """
+    Returns the reweighing weight of every (sensitive attribute, label)
+    pair, from the global counts sent by `ReweighFusionHandler`.
+
+    :param global_counts: `priv`, `unpriv`, `pos`, `neg` and the four \
+    joint frequencies
+    :type global_counts: `dict`
+    :return: `(2, 2)` weights, indexed by attribute value and label
+    :rtype: `np.ndarray`
+    """
+    g = global_counts
+    expected = np.outer([g["unpriv"], g["priv"]], [g["neg"], g["pos"]])
+    observed = np.array([[g["unpriv_neg"], g["unpriv_pos"]], [g["priv_neg"], g["priv_pos"]]], dtype=float)
+    # pairs that no party observed get no samples, so their weight is unused
+    return _ratio(expected, observed)
+
+
+def reweighing_weights(groups, labels, global_counts):
+    """
+    Vectorized sample weights of `ReweighLocalTrainingHandler`.
+
+    :param groups: sensitive attribute value of every sample, 0 or 1
+    :type groups: `np.ndarray`
+    :param labels: label of every sample, 0 or 1
+    :type labels: `np.ndarray`
+    :param global_counts: global counts sent by the aggregator
+    :type global_counts: `dict`
+    :return: weight of every sample
+    :rtype: `np.ndarray`
+    """
+    groups = as_labels(groups)
+    labels = as_labels(labels)
+    if groups.size and (groups.min() < 0 or groups.max() > 1 or labels.min() < 0 or labels.max() > 1):
+        raise FLException("Reweighing expects a binary sensitive attribute and binary labels")
+    return reweighing_table(global_counts)[groups, labels]
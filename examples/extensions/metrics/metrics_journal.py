@@ -0,0 +1,507 @@
+"""
+Append-only journal for per-round metrics.
+
+`MetricsRecorder.write_metrics` rewrites the whole metrics history every
+round and `FileCheckpointHandler` writes one file per round.
+`MetricsJournal` appends one record per round instead, either as a JSON line
+(`.jsonl`) or as a compact binary record (`.journal`, a length and CRC32
+header followed by zlib-compressed JSON). Writes are buffered, flushed and
+fsynced at configurable intervals, and the journal can be rotated by size
+and compacted to the last record per key. `JournalReader` reads the records
+appended since its last call, following rotations and compactions.
+
+Party config::
+
+    metrics_recorder:
+      name: JournalMetricsRecorder
+      path: examples.extensions.metrics.metrics_journal
+      output_file: <path without extension>
+      output_type: jsonl                 # or journal, json rewrites the file
+      compute_pre_train_eval: false
+      compute_post_train_eval: true
+
+The recorder only gets these settings from the config, the journal settings
+are read from `FL_METRICS_JOURNAL_FLUSH_INTERVAL`,
+`FL_METRICS_JOURNAL_FSYNC_INTERVAL`, `FL_METRICS_JOURNAL_MAX_BYTES`,
+`FL_METRICS_JOURNAL_BACKUP_COUNT` and `FL_METRICS_JOURNAL_COMPACT_EVERY`.
+
+Aggregator config::
+
+    metrics:
+      name: JournalCheckpointHandler
+      path: examples.extensions.metrics.metrics_journal
+      info:
+        file: <path>/checkpoint.jsonl    # default $FL_METRICS_MNG_FILE_DIR/checkpoint.jsonl
+        fsync_interval: 10
+        max_bytes: 0
+"""
+import atexit
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from ibmfl.aggregator.metric_service import FileCheckpointHandler
+from ibmfl.exceptions import FLException
+from ibmfl.party.metrics.metrics_recorder import MetricsRecorder
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FORMATS = ("jsonl", "journal")
+RECORD_HEADER = struct.Struct("<II")
+ENTRY_KEY = "_entry"
+
+JOURNAL_ENV_SETTINGS = {
+    "flush_interval": ("FL_METRICS_JOURNAL_FLUSH_INTERVAL", float),
+    "fsync_interval": ("FL_METRICS_JOURNAL_FSYNC_INTERVAL", float),
+    "max_bytes": ("FL_METRICS_JOURNAL_MAX_BYTES", int),
+    "backup_count": ("FL_METRICS_JOURNAL_BACKUP_COUNT", int),
+    "compact_every": ("FL_METRICS_JOURNAL_COMPACT_EVERY", int),
+}
+
+
+def journal_format(path):
+    """
+    Returns the record format of a journal file from its extension.
+
+    :param path: journal file
+    :type path: `str`
+    :return: `journal` for binary records, `jsonl` otherwise
+    :rtype: `str`
+    """
+    return "journal" if path.endswith(".journal") else "jsonl"
+
+
+def journal_settings_from_env():
+    """
+    Reads the `MetricsJournal` settings that are set in the environment.
+
+    :return: keyword arguments of `MetricsJournal`
+    :rtype: `dict`
+    """
+    settings = {}
+    for name, (variable, cast) in JOURNAL_ENV_SETTINGS.items():
+        value = os.getenv(variable)
+        if value not in (None, ""):
+            settings[name] = cast(value)
+    return settings
+
+
+def encode_record(record, fmt):
+    """
+    Serializes one record.
+
+    :param record: JSON-serializable record
+    :type record: `dict`
+    :param fmt: `jsonl` or `journal`
+    :type fmt: `str`
+    :return: the encoded record
+    :rtype: `bytes`
+    """
+    data = json.dumps(record, separators=(",", ":")).encode("utf-8")
+    if fmt == "jsonl":
+        return data + b"\n"
+    data = zlib.compress(data)
+    return RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data
+
+
+def decode_records(buffer, fmt):
+    """
+    Decodes the complete records at the start of `buffer`. An incomplete
+    trailing record, e.g. one that is still being written, is left over.
+
+    :param buffer: journal content
+    :type buffer: `bytes`
+    :param fmt: `jsonl` or `journal`
+    :type fmt: `str`
+    :return: the records and the number of bytes they take
+    :rtype: `tuple` of `list` and `int`
+    """
+    records = []
+    position = 0
+    if fmt == "jsonl":
+        while True:
+            end = buffer.find(b"\n", position)
+            if end < 0:
+                break
+            line = buffer[position:end].strip()
+            if line:
+                records.append(json.loads(line))
+            position = end + 1
+        return records, position
+
+    while position + RECORD_HEADER.size <= len(buffer):
+        length, crc = RECORD_HEADER.unpack_from(buffer, position)
+        start = position + RECORD_HEADER.size
+        if start + length > len(buffer):
+            break
+        data = buffer[start : start + length]
+        if zlib.crc32(data) != crc:
+            raise FLException("Corrupt journal record at byte {}".format(position))
+        records.append(json.loads(zlib.decompress(data)))
+        position = start + length
+    return records, position
+
+
+def backup_paths(path):
+    """
+    Returns the rotated files of a journal, oldest first.
+
+    :return: existing backup files
+    :rtype: `list` of `str`
+    """
+    paths = []
+    index = 1
+    while os.path.exists("{}.{}".format(path, index)):
+        paths.append("{}.{}".format(path, index))
+        index += 1
+    return paths[::-1]
+
+
+def read_journal(path, fmt=None):
+    """
+    Reads all records of a journal including its rotated files.
+
+    :param path: journal file
+    :type path: `str`
+    :param fmt: `jsonl` or `journal`, by default from the extension
+    :type fmt: `str`
+    :return: records, oldest first
+    :rtype: `list` of `dict`
+    """
+    return JournalReader(path, fmt).read()
+
+
+def compact_records(records, key=None, keep_last=None):
+    """
+    Keeps the last record per `key` in the order of their last occurrence
+    and at most `keep_last` of them.
+
+    :param key: record key, or None to keep all records
+    :type key: `str`
+    :param keep_last: number of records to keep, None for all
+    :type keep_last: `int`
+    :return: compacted records
+    :rtype: `list` of `dict`
+    """
+    if key is not None:
+        last = {}
+        for index, record in enumerate(records):
+            last[record.get(key, ("position", index))] = index
+        records = [records[index] for index in sorted(last.values())]
+    if keep_last is not None:
+        records = records[-keep_last:] if keep_last > 0 else []
+    return records
+
+
+class MetricsJournal:
+    """
+    Appends records to a journal file through a buffered writer.
+    """
+
+    def __init__(
+        self,
+        path,
+        fmt=None,
+        buffer_size=64 * 1024,
+        flush_interval=0.0,
+        fsync_interval=10.0,
+        max_bytes=0,
+        backup_count=5,
+        compact_every=0,
+        compact_key=None,
+    ):
+        """
+        :param path: journal file
+        :type path: `str`
+        :param fmt: `jsonl` or `journal`, by default from the extension
+        :type fmt: `str`
+        :param buffer_size: size of the write buffer in bytes
+        :type buffer_size: `int`
+        :param flush_interval: seconds between flushes of the buffer to \
+        the file, 0 flushes after every append
+        :type flush_interval: `float`
+        :param fsync_interval: seconds between fsyncs, 0 syncs every \
+        flush and a negative value only when the journal is closed
+        :type fsync_interval: `float`
+        :param max_bytes: rotate the file when it would grow beyond this \
+        size, 0 never rotates
+        :type max_bytes: `int`
+        :param backup_count: number of rotated files to keep
+        :type backup_count: `int`
+        :param compact_every: compact the journal after this many appends, \
+        0 never compacts automatically
+        :type compact_every: `int`
+        :param compact_key: record key to keep the last record of when \
+        compacting
+        :type compact_key: `str`
+        """
+        self.path = path
+        self.fmt = fmt or journal_format(path)
+        if self.fmt not in JOURNAL_FORMATS:
+            raise FLException("Unsupported journal format {}".format(self.fmt))
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compact_every = compact_every
+        self.compact_key = compact_key
+        self.lock = threading.RLock()
+        self.file = None
+        self.size = 0
+        self.appends_since_compaction = 0
+        self.last_flush = self.last_fsync = time.monotonic()
+        self.dirty = False
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+        atexit.register(self.close)
+
+    def _open(self):
+        self.file = open(self.path, "ab", buffering=self.buffer_size)
+        self.size = self.file.tell()
+
+    def append(self, record):
+        """
+        Appends one record.
+
+        :param record: JSON-serializable record
+        :type record: `dict`
+        :return: None
+        """
+        self.extend([record])
+
+    def extend(self, records):
+        """
+        Appends records with a single flush.
+
+        :param records: JSON-serializable records
+        :type records: `list` of `dict`
+        :return: None
+        """
+        data = b"".join(encode_record(record, self.fmt) for record in records)
+        with self.lock:
+            if self.file is None:
+                self._open()
+            if self.max_bytes and self.size and self.size + len(data) > self.max_bytes:
+                self.rotate()
+            self.file.write(data)
+            self.size += len(data)
+            self.dirty = True
+            self.appends_since_compaction += len(records)
+            now = time.monotonic()
+            if now - self.last_flush >= self.flush_interval:
+                self.flush(fsync=0 <= self.fsync_interval <= now - self.last_fsync)
+            if self.compact_every and self.appends_since_compaction >= self.compact_every:
+                self.compact(key=self.compact_key)
+
+    def flush(self, fsync=False):
+        """
+        Writes the buffer to the file and optionally syncs it to disk.
+
+        :param fsync: whether to fsync the file
+        :type fsync: `bool`
+        :return: None
+        """
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.flush()
+            now = time.monotonic()
+            self.last_flush = now
+            if fsync and self.dirty:
+                os.fsync(self.file.fileno())
+                self.last_fsync = now
+                self.dirty = False
+
+    def rotate(self):
+        """
+        Renames the journal to `<path>.1`, shifting older backups, and
+        starts a new file.
+
+        :return: None
+        """
+        with self.lock:
+            self.flush(fsync=True)
+            self.file.close()
+            for index in range(self.backup_count - 1, 0, -1):
+                source = "{}.{}".format(self.path, index)
+                if os.path.exists(source):
+                    os.replace(source, "{}.{}".format(self.path, index + 1))
+            if self.backup_count > 0:
+                os.replace(self.path, self.path + ".1")
+            else:
+                os.remove(self.path)
+            self._open()
+
+    def compact(self, key=None, keep_last=None):
+        """
+        Rewrites the journal and its backups as one file that holds the last
+        record per `key`, replacing it atomically.
+
+        :param key: record key, or None to keep all records
+        :type key: `str`
+        :param keep_last: number of records to keep, None for all
+        :type keep_last: `int`
+        :return: number of records kept
+        :rtype: `int`
+        """
+        with self.lock:
+            self.flush()
+            backups = backup_paths(self.path)
+            records = compact_records(read_journal(self.path, self.fmt), key=key, keep_last=keep_last)
+            temp_path = self.path + ".compact"
+            with open(temp_path, "wb") as temp_file:
+                temp_file.write(b"".join(encode_record(record, self.fmt) for record in records))
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            self.file.close()
+            os.replace(temp_path, self.path)
+            for backup in backups:
+                os.remove(backup)
+            self._open()
+            self.appends_since_compaction = 0
+            self.dirty = False
+            return len(records)
+
+    def close(self):
+        """
+        Flushes and fsyncs the journal and closes the file.
+
+        :return: None
+        """
+        with self.lock:
+            if self.file is None:
+                return
+            self.flush(fsync=True)
+            self.file.close()
+            self.file = None
+
+
+class JournalReader:
+    """
+    Reads a journal incrementally. Every `read` returns the complete records
+    appended since the previous one, including those in files rotated in the
+    meantime. A compacted journal is read again from the start, so consumers
+    should keep the last record per key.
+    """
+
+    def __init__(self, path, fmt=None):
+        self.path = path
+        self.fmt = fmt or journal_format(path)
+        self.inode = None
+        self.offset = 0
+
+    def _read_from(self, path, offset):
+        try:
+            with open(path, "rb") as stream:
+                stream.seek(offset)
+                buffer = stream.read()
+        except FileNotFoundError:
+            return [], offset
+        records, consumed = decode_records(buffer, self.fmt)
+        return records, offset + consumed
+
+    def read(self):
+        """
+        Returns the records appended since the previous call.
+
+        :return: new records, oldest first
+        :rtype: `list` of `dict`
+        """
+        records = []
+        if self.inode is None:
+            for backup in backup_paths(self.path):
+                records += self._read_from(backup, 0)[0]
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return records
+
+        if self.inode is not None and stat.st_ino != self.inode:
+            # the rest of the file read last, then the files rotated after it
+            backups = backup_paths(self.path)
+            inodes = [os.stat(backup).st_ino for backup in backups]
+            if self.inode in inodes:
+                start = inodes.index(self.inode)
+                records += self._read_from(backups[start], self.offset)[0]
+                backups = backups[start + 1 :]
+            for backup in backups:
+                records += self._read_from(backup, 0)[0]
+            self.offset = 0
+        elif stat.st_size < self.offset:
+            self.offset = 0
+        self.inode = stat.st_ino
+
+        new_records, self.offset = self._read_from(self.path, self.offset)
+        return records + new_records
+
+
+class JournalMetricsRecorder(MetricsRecorder):
+    """
+    `MetricsRecorder` that appends the entries that changed since the last
+    `write_metrics` to a journal instead of rewriting the metrics file. An
+    entry may be written more than once, e.g. after its update hooks ran,
+    and readers keep the last record per `_entry` index.
+    """
+
+    def __init__(self, output_file, output_type, compute_pre_train_eval, compute_post_train_eval):
+        super().__init__(output_file, output_type, compute_pre_train_eval, compute_post_train_eval)
+        self.journal = None
+        if output_type in JOURNAL_FORMATS:
+            settings = dict(journal_settings_from_env(), compact_key=ENTRY_KEY)
+            self.journal = MetricsJournal(self.get_output_file(), fmt=output_type, **settings)
+        self._pending_from = 0
+        self._written = {}
+
+    def write_metrics(self):
+        """
+        Append the entries that changed to the journal, or write the metrics
+        file if the output type is not a journal format.
+
+        :param: None
+        :return: None
+        """
+        if self.journal is None:
+            return super().write_metrics()
+
+        records = []
+        for index in range(self._pending_from, len(self._data)):
+            record = dict(self._data[index].to_dict(), **{ENTRY_KEY: index})
+            encoded = json.dumps(record, sort_keys=True)
+            if self._written.get(index) != encoded:
+                records.append(record)
+                self._written[index] = encoded
+        if records:
+            self.journal.extend(records)
+        # only the latest entry is still filled in by the update hooks
+        self._pending_from = max(len(self._data) - 1, 0)
+        self._written = {k: v for k, v in self._written.items() if k >= self._pending_from}
+
+
+class JournalCheckpointHandler(FileCheckpointHandler):
+    """
+    Metrics handler that appends the aggregator's metrics of every round to
+    one journal instead of writing a `checkpoint_<time>.json` file per round.
+    """
+
+    def __init__(self, info=None, **kwargs):
+        super().__init__(**kwargs)
+        info = dict(info or {})
+        path = info.pop("file", None) or os.path.join(self.file_dir or ".", "checkpoint.jsonl")
+        settings = dict(journal_settings_from_env(), **info)
+        self.journal = MetricsJournal(path, **settings)
+        logger.info("JournalCheckpointHandler writes to " + path)
+
+    def handle(self, metrics):
+        """
+        Appends the metrics as one record.
+
+        :param metrics: Metrics dictionary
+        :type metrics: `dict`
+        """
+        self.journal.append(metrics)
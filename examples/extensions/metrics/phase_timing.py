@@ -0,0 +1,421 @@
+"""
+Per-round phase timing of the aggregator.
+
+A training round goes through the fusion states `SND_MODEL`, `RCV_MODEL`
+and `AGGREGATING` (`FLFusionStateManager`) and the protocol handler states
+`SND_REQ`, `QUORUM_WAIT` and `PROC_RSP` (`ProtoHandler.state`). A
+`PhaseRecorder` timestamps every transition and collects, per party, when
+the request was sent, when the reply arrived, how many bytes went each way
+and how long (de)serialization took, and measures the wall and CPU time of
+fusion. It answers whether a slow round was spent on the network, waiting
+for stragglers or fusing.
+
+Aggregator config::
+
+    protocol_handler:
+      name: TimedProtoHandler
+      path: examples.extensions.metrics.phase_timing
+    metrics:
+      name: PhaseTimingMetricsHandler
+      path: examples.extensions.metrics.phase_timing
+      info:
+        file: timing.jsonl            # optional, one JSON record per round
+        prometheus_file: fl.prom      # optional, Prometheus text format
+        delegate:                     # optional, receives the enriched metrics
+          name: FileCheckpointHandler
+          path: ibmfl.aggregator.metric_service
+
+Payload sizes and (de)serialization times are reported when the aggregator
+uses `TimedFlaskConnection` (see `examples.extensions.connection`), which
+also serves the metrics at `GET /metrics`.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from ibmfl.aggregator.fusion.fusion_state_service import States as FusionStates
+from ibmfl.aggregator.protohandler.proto_handler import ProtoHandler
+from ibmfl.util.config import get_class_by_name
+
+logger = logging.getLogger(__name__)
+
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+def get_recorder(name="default"):
+    """
+    Returns the process-wide recorder `name`, creating it on first use, so
+    the protocol handler, connection and metrics handler of an aggregator
+    share one.
+
+    :param name: Recorder name, `info.recorder` in the configs.
+    :type name: `str`
+    :return: the recorder
+    :rtype: `PhaseRecorder`
+    """
+    with _recorders_lock:
+        if name not in _recorders:
+            _recorders[name] = PhaseRecorder()
+        return _recorders[name]
+
+
+class RoundRecord:
+    """
+    Timestamps of one training round, in seconds since its `SND_MODEL`.
+    """
+
+    def __init__(self, number):
+        self.number = number
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.transitions = []
+        self.parties = {}
+        self.fusion_start = None
+        self.fusion_thread = None
+        self.fusion_cpu_start = None
+        self.fusion_s = None
+        self.fusion_cpu_s = None
+        self.duration_s = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def party(self, party_id):
+        return self.parties.setdefault(str(party_id), {})
+
+    def first(self, state):
+        for name, t in self.transitions:
+            if name == state:
+                return t
+        return None
+
+    def summary(self):
+        """
+        Round record as a JSON-serializable dict, with the phase breakdown:
+
+        * `send_s`: from `SND_MODEL` until the last request was delivered,
+        * `wait_s`: from `QUORUM_WAIT` until the quorum was reached,
+        * `straggler_s`: last reply minus the median reply time,
+        * `fusion_s`/`fusion_cpu_s`: wall and CPU time from `AGGREGATING` on.
+
+        :rtype: `dict`
+        """
+        parties = {p: dict(v) for p, v in self.parties.items()}
+        send_ends = [v["send_end"] for v in parties.values() if "send_end" in v]
+        replies = [v["reply"] for v in parties.values() if "reply" in v]
+        for values in parties.values():
+            if "reply" in values and "send_start" in values:
+                values["latency_s"] = values["reply"] - values["send_start"]
+
+        phases = {"send_s": max(send_ends) if send_ends else None}
+        wait_start, wait_end = self.first("QUORUM_WAIT"), self.first("PROC_RSP")
+        phases["wait_s"] = wait_end - wait_start if wait_start is not None and wait_end is not None else None
+        if replies:
+            phases["first_reply_s"] = min(replies)
+            phases["last_reply_s"] = max(replies)
+            phases["straggler_s"] = max(replies) - float(np.median(replies))
+        phases["fusion_s"] = self.fusion_s
+        phases["fusion_cpu_s"] = self.fusion_cpu_s
+
+        def total(key):
+            values = [v[key] for v in parties.values() if key in v]
+            return sum(values) if values else None
+
+        return {
+            "round": self.number,
+            "start_time": self.start_time,
+            "duration_s": self.duration_s,
+            "phases": phases,
+            "transfer": {
+                "request_bytes": total("request_bytes"),
+                "reply_bytes": total("reply_bytes"),
+                "serialize_s": total("serialize_s"),
+                "deserialize_s": total("deserialize_s"),
+            },
+            "transitions": [[name, t] for name, t in self.transitions],
+            "parties": parties,
+        }
+
+
+class PhaseRecorder:
+    """
+    Thread-safe collector of the `RoundRecord`s of an aggregator.
+    """
+
+    def __init__(self, history=1000):
+        """
+        :param history: Number of finished rounds to keep.
+        :type history: `int`
+        """
+        self.rounds = deque(maxlen=history)
+        self.current = None
+        self.num_rounds = 0
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def on_fusion_state(self, state):
+        """
+        `FLFusionStateManager` handler: `SND_MODEL` opens a round (closing
+        the previous one) and `AGGREGATING` starts the fusion clocks.
+
+        :param state: Fusion state
+        :type state: `States`
+        """
+        with self._lock:
+            if state is FusionStates.SND_MODEL:
+                self.close_round()
+                self.num_rounds += 1
+                self.current = RoundRecord(self.num_rounds)
+            if self.current is None:
+                return
+            self.current.transitions.append((state.name, self.current.elapsed()))
+            if state is FusionStates.AGGREGATING:
+                self.current.fusion_start = self.current.elapsed()
+                self.current.fusion_thread = threading.get_ident()
+                self.current.fusion_cpu_start = time.thread_time()
+
+    def on_protocol_state(self, state):
+        with self._lock:
+            if self.current is not None and self.current.fusion_start is None:
+                self.current.transitions.append((state.name, self.current.elapsed()))
+
+    def record_party(self, party_id, **values):
+        """
+        Adds timestamps (relative to the round start) and sizes of one party.
+
+        :param party_id: Party id
+        :type party_id: `str`
+        :param values: `send_start`, `send_end`, `reply`, `request_bytes`, ...
+        :type values: `dict`
+        """
+        with self._lock:
+            if self.current is not None:
+                self.current.party(party_id).update(values)
+
+    def elapsed(self):
+        with self._lock:
+            return self.current.elapsed() if self.current is not None else None
+
+    def set_transfer(self, **stats):
+        """
+        Called by an instrumented connection with the sizes and
+        (de)serialization times of the message it just handled; the protocol
+        handler picks them up in the same thread with `pop_transfer`.
+        """
+        self._local.transfer = stats
+
+    def pop_transfer(self):
+        stats = getattr(self._local, "transfer", None) or {}
+        self._local.transfer = None
+        return stats
+
+    def close_round(self):
+        """
+        Finishes the open round, if any, and stops the fusion clocks.
+
+        :return: summary of the finished round, or None
+        :rtype: `dict`
+        """
+        with self._lock:
+            record, self.current = self.current, None
+            if record is None:
+                return None
+            now = record.elapsed()
+            if record.fusion_start is not None:
+                record.fusion_s = now - record.fusion_start
+                if record.fusion_thread == threading.get_ident():
+                    record.fusion_cpu_s = time.thread_time() - record.fusion_cpu_start
+            record.duration_s = now
+            summary = record.summary()
+            self.rounds.append(summary)
+            return summary
+
+    def last_round(self):
+        with self._lock:
+            return self.rounds[-1] if self.rounds else None
+
+    def prometheus_text(self):
+        """
+        Renders the totals and the last finished round in the Prometheus
+        text exposition format.
+
+        :rtype: `str`
+        """
+        with self._lock:
+            last = self.rounds[-1] if self.rounds else None
+            lines = [
+                "# HELP fl_rounds_total Training rounds started by the aggregator.",
+                "# TYPE fl_rounds_total counter",
+                "fl_rounds_total {}".format(self.num_rounds),
+            ]
+        if last is None:
+            return "\n".join(lines) + "\n"
+
+        def family(name, kind, help_text, samples):
+            samples = [(labels, value) for labels, value in samples if value is not None]
+            if not samples:
+                return
+            lines.extend(["# HELP {} {}".format(name, help_text), "# TYPE {} {}".format(name, kind)])
+            for labels, value in samples:
+                label_str = ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels.items())
+                lines.append("{}{} {}".format(name, "{" + label_str + "}" if label_str else "", value))
+
+        phases = last["phases"]
+        family("fl_last_round", "gauge", "Number of the last finished round.", [({}, last["round"])])
+        family("fl_last_round_duration_seconds", "gauge", "Duration of the last round.", [({}, last["duration_s"])])
+        family(
+            "fl_last_round_phase_seconds",
+            "gauge",
+            "Phase durations of the last round.",
+            [({"phase": k[: -len("_s")]}, v) for k, v in sorted(phases.items())],
+        )
+        family(
+            "fl_last_round_transfer_bytes",
+            "gauge",
+            "Bytes exchanged with all parties in the last round.",
+            [
+                ({"direction": "request"}, last["transfer"]["request_bytes"]),
+                ({"direction": "reply"}, last["transfer"]["reply_bytes"]),
+            ],
+        )
+        family(
+            "fl_last_round_serialization_seconds",
+            "gauge",
+            "Time spent (de)serializing messages in the last round.",
+            [
+                ({"operation": "serialize"}, last["transfer"]["serialize_s"]),
+                ({"operation": "deserialize"}, last["transfer"]["deserialize_s"]),
+            ],
+        )
+        family(
+            "fl_last_round_party_latency_seconds",
+            "gauge",
+            "Time from sending the request to receiving the reply of each party.",
+            [({"party": p}, v.get("latency_s")) for p, v in sorted(last["parties"].items())],
+        )
+        return "\n".join(lines) + "\n"
+
+
+class TimedProtoHandler(ProtoHandler):
+    """
+    `ProtoHandler` that reports state transitions, request send times and
+    reply arrivals to a `PhaseRecorder`.
+    """
+
+    def __init__(self, connection, synch=False, max_timeout=None, **kwargs):
+        info = kwargs.get("info") or {}
+        self.recorder = get_recorder(info.get("recorder", "default"))
+        super().__init__(connection, synch=synch, max_timeout=max_timeout, **kwargs)
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        self._state = state
+        self.recorder.on_protocol_state(state)
+
+    def query_parties(self, payload, lst_parties, *args, **kwargs):
+        fusion_state = kwargs.get("fusion_state")
+        if fusion_state is not None:
+            # registered handlers are a set, so this happens once
+            fusion_state.register(self.recorder.on_fusion_state)
+        return super().query_parties(payload, lst_parties, *args, **kwargs)
+
+    def send_message(self, party_id, message):
+        send_start = self.recorder.elapsed()
+        self.recorder.pop_transfer()
+        res_status = super().send_message(party_id, message)
+        send_end = self.recorder.elapsed()
+        if send_start is None or send_end is None:
+            return res_status
+
+        values = {"send_start": send_start, "send_end": send_end}
+        transfer = self.recorder.pop_transfer()
+        values.update({k: v for k, v in transfer.items() if k in ("request_bytes", "serialize_s")})
+        if self.synch:
+            # the model update is the response
+            values["reply"] = send_end
+            values.update({k: v for k, v in transfer.items() if k in ("reply_bytes", "deserialize_s")})
+        self.recorder.record_party(party_id, **values)
+        return res_status
+
+    def process_model_update_requests(self, message):
+        reply = self.recorder.elapsed()
+        if reply is not None:
+            info = message.get_header()["sender_info"]
+            party_id = next((pid for pid, party in self.parties_list.items() if party.info == info), None)
+            if party_id is not None:
+                transfer = self.recorder.pop_transfer()
+                values = {"reply": reply}
+                if "received_bytes" in transfer:
+                    values["reply_bytes"] = transfer["received_bytes"]
+                if "deserialize_s" in transfer:
+                    values["deserialize_s"] = transfer["deserialize_s"]
+                self.recorder.record_party(party_id, **values)
+        return super().process_model_update_requests(message)
+
+
+def write_prometheus_file(recorder, path):
+    """
+    Writes `recorder.prometheus_text()` atomically, e.g. for the node
+    exporter's textfile collector.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fp:
+        fp.write(recorder.prometheus_text())
+    os.replace(tmp_path, path)
+
+
+class PhaseTimingMetricsHandler(object):
+    """
+    Metrics handler that closes the round when the fusion handler saves its
+    state and adds the round's timing as `metrics["timing"]`.
+    """
+
+    def __init__(self, info=None, **kwargs):
+        info = info or {}
+        self.recorder = get_recorder(info.get("recorder", "default"))
+        self.file = info.get("file")
+        self.prometheus_file = info.get("prometheus_file")
+        self.delegate = None
+        delegate = info.get("delegate")
+        if delegate:
+            cls = get_class_by_name(delegate["path"], delegate["name"])
+            self.delegate = cls(info=delegate.get("info"))
+        logger.info("PhaseTimingMetricsHandler initialized")
+
+    def handle(self, metrics):
+        """
+        :param metrics: Metrics dictionary
+        :type metrics: `dict`
+        """
+        timing = self.recorder.close_round()
+        if timing is None:
+            timing = self.recorder.last_round()
+        metrics = dict(metrics, timing=timing)
+        if timing is not None:
+            phases = {k: "n/a" if v is None else "{:.3f} s".format(v) for k, v in timing["phases"].items()}
+            logger.info(
+                "Round {round}: {total:.3f} s, send {send_s}, wait {wait_s}, straggler {straggler}, "
+                "fusion {fusion_s} (cpu {fusion_cpu_s})".format(
+                    round=timing["round"],
+                    total=timing["duration_s"],
+                    straggler=phases.get("straggler_s", "n/a"),
+                    **phases
+                )
+            )
+            if self.file:
+                with open(self.file, "a") as fp:
+                    fp.write(json.dumps(timing) + "\n")
+        if self.prometheus_file:
+            write_prometheus_file(self.recorder, self.prometheus_file)
+        if self.delegate is not None:
+            self.delegate.handle(metrics)
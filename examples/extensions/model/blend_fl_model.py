@@ -0,0 +1,248 @@
+"""
+In-place blending of `FLModel` weights toward given weights.
+
+Fed+ style soft updates move the local weights part of the way toward the
+global ones, w <- (1 - alpha) * w + alpha * g, every round and, for the
+mixed-model variants, after every local epoch. Done through
+`get_model_update()` and `update_model(ModelUpdate(...))`, each blend
+copies and pickles the whole model twice. `blend_weights(weights, alpha)`
+changes the parameters in place instead:
+
+* `PytorchBlendMixin` with `torch.lerp_` on the module parameters,
+* `KerasBlendMixin` with `assign_add` on the model variables,
+* `SklearnSGDBlendMixin` on `coef_` and `intercept_`.
+
+`alpha` is a scalar or one array per layer that broadcasts against it.
+`blend_model_weights` and `model_weight_arrays` fall back to the
+`ModelUpdate` round trip for models without the mixins.
+"""
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+
+from ibmfl.exceptions import LocalTrainingException
+from ibmfl.model.model_update import ModelUpdate
+
+logger = logging.getLogger(__name__)
+
+
+def layer_alphas(alpha, num_layers):
+    """
+    Returns one blending factor per layer.
+
+    :param alpha: scalar, or list with a scalar or an array per layer
+    :type alpha: `float` or `list`
+    :param num_layers: number of layers
+    :type num_layers: `int`
+    :rtype: `list`
+    """
+    if isinstance(alpha, (list, tuple)):
+        if len(alpha) != num_layers:
+            raise LocalTrainingException("Expected {} blending factors, got {}".format(num_layers, len(alpha)))
+        return list(alpha)
+    return [alpha] * num_layers
+
+
+def lerp_(current, target, alpha):
+    """
+    Moves the float array `current` in place toward `target`:
+    current += alpha * (target - current).
+
+    :return: `current`
+    :rtype: `np.ndarray`
+    """
+    delta = np.subtract(target, current, dtype=current.dtype)
+    delta *= alpha
+    current += delta
+    return current
+
+
+def model_weight_arrays(fl_model):
+    """
+    Returns the weights of a model as arrays, without a `ModelUpdate` if
+    the model supports `get_weight_arrays`.
+
+    :param fl_model: model
+    :type fl_model: `FLModel`
+    :rtype: `list` of `np.ndarray`
+    """
+    if hasattr(fl_model, "get_weight_arrays"):
+        return fl_model.get_weight_arrays()
+    return [np.asarray(w) for w in fl_model.get_model_update().get("weights")]
+
+
+def blend_model_weights(fl_model, weights, alpha):
+    """
+    Blends the weights of a model toward `weights`, in place if the model
+    supports `blend_weights`.
+
+    :param fl_model: model
+    :type fl_model: `FLModel`
+    :param weights: weights to move toward, in the layout of \
+    `get_model_update().get("weights")`
+    :type weights: `list`
+    :param alpha: blending factor, 0 keeps the model and 1 replaces it
+    :type alpha: `float` or `list`
+    :return: None
+    """
+    if hasattr(fl_model, "blend_weights"):
+        fl_model.blend_weights(weights, alpha)
+        return
+    current = [np.array(w) for w in model_weight_arrays(fl_model)]
+    for layer, target, a in zip(current, weights, layer_alphas(alpha, len(current))):
+        lerp_(layer, target, a)
+    fl_model.update_model(ModelUpdate(weights=current))
+
+
+class PytorchBlendMixin:
+    """
+    `blend_weights` and `get_weight_arrays` for `PytorchFLModel`. List the
+    mixin before the model class.
+    """
+
+    def get_weight_arrays(self):
+        """
+        Returns the parameters as arrays. On the CPU they share memory with
+        the module, so they change when the model does.
+
+        :rtype: `list` of `np.ndarray`
+        """
+        return [param.detach().cpu().numpy() for param in self.model.module_.parameters()]
+
+    def blend_weights(self, weights, alpha):
+        """
+        Moves the module parameters toward `weights` with `torch.lerp_`.
+
+        :param weights: weights in the layout of `get_model_update()`
+        :type weights: `list` of `np.ndarray`
+        :param alpha: blending factor, a scalar or one per layer
+        :type alpha: `float` or `list`
+        :return: None
+        """
+        import torch
+
+        params = list(self.model.module_.parameters())
+        with torch.no_grad():
+            for param, target, a in zip(params, weights, layer_alphas(alpha, len(params))):
+                target = torch.as_tensor(target, dtype=param.dtype, device=param.device)
+                if np.ndim(a):
+                    a = torch.as_tensor(a, dtype=param.dtype, device=param.device)
+                param.lerp_(target, a)
+
+
+class KerasBlendMixin:
+    """
+    `blend_weights` and `get_weight_arrays` for `KerasFLModel` and
+    `TensorFlowFLModel`. Variables are changed with `assign_add` in eager
+    mode; a graph-mode model is blended through `get_weights` and
+    `set_weights`, which does not add ops to the graph.
+    """
+
+    def get_weight_arrays(self):
+        """
+        Returns a copy of the model weights.
+
+        :rtype: `list` of `np.ndarray`
+        """
+        with self.weights_context():
+            return self.model.get_weights()
+
+    @contextmanager
+    def weights_context(self):
+        """
+        Context to read and write the weights in, the graph and session of
+        a `KerasFLModel`.
+        """
+        graph = getattr(self, "graph", None)
+        if graph is None:
+            yield
+            return
+        from tensorflow.python.keras.backend import set_session
+
+        with graph.as_default():
+            set_session(self.sess)
+            yield
+
+    def blend_weights(self, weights, alpha):
+        """
+        Moves the model variables toward `weights`.
+
+        :param weights: weights in the layout of `get_model_update()`
+        :type weights: `list` of `np.ndarray`
+        :param alpha: blending factor, a scalar or one per layer
+        :type alpha: `float` or `list`
+        :return: None
+        """
+        import tensorflow as tf
+
+        with self.weights_context():
+            variables = self.model.weights
+            alphas = layer_alphas(alpha, len(variables))
+            if not tf.executing_eagerly():
+                current = self.model.get_weights()
+                for layer, target, a in zip(current, weights, alphas):
+                    lerp_(layer, target, a)
+                self.model.set_weights(current)
+                return
+            for var, target, a in zip(variables, weights, alphas):
+                delta = tf.convert_to_tensor(target, dtype=var.dtype) - var
+                var.assign_add(delta * tf.cast(a, var.dtype))
+
+
+class SklearnSGDBlendMixin:
+    """
+    `blend_weights` and `get_weight_arrays` for `SklearnSGDFLModel`, on the
+    `coef_` and `intercept_` arrays of the estimator.
+    """
+
+    def get_weight_arrays(self):
+        """
+        Returns the weights in the layout of `get_model_update()`: the
+        coefficients with the intercept as last column for a classifier,
+        or as last element for a regressor.
+
+        :rtype: `np.ndarray`
+        """
+        from sklearn.linear_model import SGDClassifier, SGDRegressor
+
+        if isinstance(self.model, SGDClassifier):
+            return np.hstack([self.model.coef_, self.model.intercept_.reshape(-1, 1)])
+        if isinstance(self.model, SGDRegressor):
+            return np.append(self.model.coef_, self.model.intercept_)
+        raise LocalTrainingException(
+            "Expecting scitkit-learn model of type either sklearn.linear_model.SGDClassifier "
+            "or sklearn.linear_model.SGDRegressor. Instead provided model is of type " + str(type(self.model))
+        )
+
+    def blend_weights(self, weights, alpha):
+        """
+        Moves `coef_` and `intercept_` toward `weights`.
+
+        :param weights: weights in the layout of `get_model_update()`
+        :type weights: `list`
+        :param alpha: blending factor, a scalar or an array of the shape \
+        of the weights
+        :type alpha: `float`, `list` or `np.ndarray`
+        :return: None
+        """
+        if not hasattr(self.model, "coef_"):
+            # not fitted yet, there is nothing to blend
+            self.update_model(ModelUpdate(weights=weights))
+            return
+        from sklearn.linear_model import SGDClassifier, SGDRegressor
+
+        target = np.asarray(weights, dtype=self.model.coef_.dtype)
+        alpha = np.asarray(alpha, dtype=target.dtype)
+        if isinstance(self.model, SGDClassifier):
+            columns = np.s_[..., :-1], np.s_[..., -1]
+        elif isinstance(self.model, SGDRegressor):
+            columns = np.s_[:-1], np.s_[-1:]
+        else:
+            raise LocalTrainingException(
+                "Expecting scitkit-learn model of type either sklearn.linear_model.SGDClassifier "
+                "or sklearn.linear_model.SGDRegressor. Instead provided model is of type " + str(type(self.model))
+            )
+        for attr, column in zip(("coef_", "intercept_"), columns):
+            current = getattr(self.model, attr)
+            lerp_(current, target[column].reshape(current.shape), alpha[column] if alpha.ndim else alpha)
@@ -0,0 +1,128 @@
+"""
+`NaiveBayesFLModel` that predicts and evaluates in chunks.
+
+`NaiveBayesFLModel.evaluate_model` calls `GaussianNB.score` on the whole
+test set. `ChunkedNaiveBayesFLModel` computes the Gaussian joint
+log-likelihood of `eval_batch_size` rows at a time with two matrix
+products against precomputed class tables,
+
+    -0.5 * (x ** 2 @ (1 / var).T - 2 * x @ (theta / var).T + sum(theta ** 2 / var))
+
+instead of materializing the (rows, classes, features) differences. The
+class priors come from the merged `class_count_` unless the model was
+created with fixed `priors`, so an aggregator model that was only updated
+with `update_model` can be evaluated as well.
+
+    model:
+      name: ChunkedNaiveBayesFLModel
+      path: examples.extensions.model.chunked_naive_bayes_fl_model
+      spec:
+        eval_batch_size: 8192
+"""
+import logging
+
+import numpy as np
+
+from ibmfl.exceptions import ModelException
+from ibmfl.model.naive_bayes_fl_model import NaiveBayesFLModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EVAL_BATCH_SIZE = 8192
+
+
+class ChunkedNaiveBayesFLModel(NaiveBayesFLModel):
+    """
+    `NaiveBayesFLModel` with chunked, matrix-product based prediction and
+    evaluation.
+    """
+
+    def __init__(self, model_name, model_spec, model=None, **kwargs):
+        super().__init__(model_name, model_spec, model=model, **kwargs)
+        self.eval_batch_size = int((model_spec or {}).get("eval_batch_size", DEFAULT_EVAL_BATCH_SIZE))
+
+    def class_tables(self):
+        """
+        Returns the per-class tables of the joint log-likelihood: `1 / var`,
+        `theta / var` and the constant term including the log prior.
+
+        :return: inverse variances `(C, F)`, scaled means `(C, F)` and \
+        constants `(C,)`
+        :rtype: `tuple(np.ndarray, np.ndarray, np.ndarray)`
+        """
+        if not hasattr(self.model, "theta_"):
+            raise ModelException("The model has no class statistics yet")
+        theta = np.asarray(self.model.theta_, dtype=float)
+        try:
+            var = np.asarray(self.model.var_, dtype=float)
+        except AttributeError:
+            var = np.asarray(self.model.sigma_, dtype=float)
+        priors = getattr(self.model, "priors", None)
+        if priors is None:
+            class_count = np.asarray(self.model.class_count_, dtype=float)
+            priors = class_count / class_count.sum()
+        with np.errstate(divide="ignore"):
+            log_prior = np.log(np.asarray(priors, dtype=float))
+
+        inv_var = 1.0 / var
+        scaled_theta = theta * inv_var
+        const = log_prior - 0.5 * (np.log(2.0 * np.pi * var).sum(axis=1) + (theta * scaled_theta).sum(axis=1))
+        return inv_var, scaled_theta, const
+
+    def joint_log_likelihood(self, x, batch_size=None):
+        """
+        Yields the joint log-likelihood of consecutive chunks of `x`.
+
+        :param x: samples
+        :type x: `np.ndarray`
+        :param batch_size: rows per chunk
+        :type batch_size: `int`
+        :return: generator of `(rows, C)` arrays
+        """
+        inv_var, scaled_theta, const = self.class_tables()
+        batch_size = batch_size or self.eval_batch_size
+        for start in range(0, len(x), batch_size):
+            chunk = np.asarray(x[start : start + batch_size], dtype=float)
+            jll = np.square(chunk) @ inv_var.T
+            jll *= -0.5
+            jll += chunk @ scaled_theta.T
+            jll += const
+            yield jll
+
+    def predict(self, x, batch_size=None, **kwargs):
+        """
+        Perform prediction for the given input, in chunks.
+
+        :param x: Samples with shape as expected by the model.
+        :type x: `np.ndarray`
+        :return: predicted labels
+        :rtype: `np.ndarray`
+        """
+        classes = self.model.classes_
+        predictions = [classes[np.argmax(jll, axis=1)] for jll in self.joint_log_likelihood(x, batch_size)]
+        return np.concatenate(predictions) if predictions else classes[:0]
+
+    def evaluate_model(self, x, y, batch_size=None, sample_weight=None, **kwargs):
+        """
+        Evaluates the model given test data x and the corresponding labels y,
+        in chunks of `eval_batch_size` rows.
+
+        :param x: Samples with shape as expected by the model.
+        :type x: `np.ndarray`
+        :param y: Corresponding true labels to x
+        :type y: `np.ndarray`
+        :param sample_weight: optional weights of the samples
+        :type sample_weight: `np.ndarray`
+        :return: Dictionary with the accuracy as `score`.
+        :rtype: `dict`
+        """
+        batch_size = batch_size or self.eval_batch_size
+        classes = self.model.classes_
+        y = np.asarray(y)
+        correct = 0.0
+        for i, jll in enumerate(self.joint_log_likelihood(x, batch_size)):
+            rows = slice(i * batch_size, i * batch_size + len(jll))
+            hits = classes[np.argmax(jll, axis=1)] == y[rows]
+            correct += hits.sum() if sample_weight is None else np.dot(hits, sample_weight[rows])
+        total = len(y) if sample_weight is None else np.sum(sample_weight)
+        return {"score": float(correct / total) if total else 0.0}
@@ -0,0 +1,224 @@
+"""
+Direct, layer-by-layer weight transfer for the model wrappers.
+
+`PytorchFLModel.update_model` lists the parameters with `get_weights`,
+which deep-copies the whole module to the CPU once GPU training is enabled,
+and then rebinds every parameter to a new tensor created from the numpy
+array. `get_model_update` deep-copies the module the same way before
+converting it. The mixins below write into and read from the existing
+parameter storage one layer at a time instead:
+
+* `TorchDirectStateMixin` copies every layer into its parameter with
+  `param.copy_`. For CUDA parameters the layer is staged in pinned memory
+  and copied asynchronously, so staging layer k + 1 overlaps the device
+  copy of layer k. Reads go through reused pinned buffers per tensor.
+* `KerasDirectStateMixin` assigns every variable in turn in eager mode,
+  and validates shapes before the usual `set_weights` of a graph-mode
+  `KerasFLModel`.
+
+`load_layers` accepts any iterable of layers, so layers that are decoded
+one at a time are transferred as they become available. Shapes are checked
+per layer and the parameters keep their dtype and device.
+"""
+import logging
+
+import numpy as np
+
+from ibmfl.exceptions import LocalTrainingException
+from ibmfl.model.model_update import ModelUpdate
+
+logger = logging.getLogger(__name__)
+
+
+def check_layer_count(expected, received):
+    if expected != received:
+        raise LocalTrainingException("The model has {} layers, the update has {}".format(expected, received))
+
+
+def check_layer_shape(index, expected, received):
+    if tuple(expected) != tuple(received):
+        raise LocalTrainingException(
+            "Layer {} has shape {}, the update has {}".format(index, tuple(expected), tuple(received))
+        )
+
+
+class TorchDirectStateMixin:
+    """
+    `update_model`, `get_model_update` and `get_weights(to_numpy=True)` of
+    `PytorchFLModel` on the existing parameter storage. List the mixin
+    before the model class.
+    """
+
+    _pinned_buffers = None
+
+    def update_model(self, model_update):
+        """
+        Update model with provided model_update, where model_update
+        should be generated according to `PytorchFLModel.get_model_update()`.
+
+        :param model_update: `ModelUpdate` object that contains the weights \
+        that will be used to update the model.
+        :type model_update: `ModelUpdate`
+        :return: None
+        """
+        if not isinstance(model_update, ModelUpdate):
+            raise ValueError(
+                "Provided model_update should be of type Model." "Instead they are:{0}".format(str(type(model_update)))
+            )
+        self.load_layers(model_update.get("weights"))
+
+    def load_layers(self, layers):
+        """
+        Copies layer values into the module parameters, in order.
+
+        :param layers: one array per parameter
+        :type layers: iterable of `np.ndarray`
+        :return: None
+        """
+        import torch
+
+        params = list(self.model.module_.parameters())
+        devices = set()
+        count = 0
+        with torch.no_grad():
+            for index, value in enumerate(layers):
+                if index >= len(params):
+                    count = index + 1
+                    break
+                param = params[index]
+                source = torch.as_tensor(value)
+                check_layer_shape(index, param.shape, source.shape)
+                if param.is_cuda:
+                    # pinned memory makes the copy asynchronous
+                    param.copy_(source.pin_memory(), non_blocking=True)
+                    devices.add(param.device)
+                else:
+                    param.copy_(source)
+                count = index + 1
+            for device in devices:
+                torch.cuda.current_stream(device).synchronize()
+        check_layer_count(len(params), count)
+
+    def parameter_arrays(self):
+        """
+        Returns the parameters as numpy arrays, copying CUDA tensors through
+        reused pinned buffers. Arrays of CPU parameters share their memory.
+
+        :rtype: `list` of `np.ndarray`
+        """
+        import torch
+
+        params = [param.detach() for param in self.model.module_.parameters()]
+        if not any(param.is_cuda for param in params):
+            return [param.numpy() for param in params]
+
+        # keyed by the instance, so that snapshot clones do not share the buffers
+        signature = (id(self), [(tuple(param.shape), param.dtype) for param in params])
+        if self._pinned_buffers is None or self._pinned_buffers[0] != signature:
+            buffers = [
+                torch.empty(param.shape, dtype=param.dtype, pin_memory=True) if param.is_cuda else None
+                for param in params
+            ]
+            self._pinned_buffers = (signature, buffers)
+        buffers = self._pinned_buffers[1]
+        devices = set()
+        for buffer, param in zip(buffers, params):
+            if buffer is not None:
+                buffer.copy_(param, non_blocking=True)
+                devices.add(param.device)
+        for device in devices:
+            torch.cuda.current_stream(device).synchronize()
+        return [param.numpy() if buffer is None else buffer.numpy() for buffer, param in zip(buffers, params)]
+
+    def get_weights(self, to_numpy=False):
+        """
+        Returns the weights of the model
+
+        :param to_numpy; Determines whether the weights should be returned as numpy array, or tensor
+        :type to_numpy: `boolean`
+        :return: list of model weights
+        """
+        if to_numpy:
+            return [np.array(layer) for layer in self.parameter_arrays()]
+        return super().get_weights(to_numpy=False)
+
+    def get_model_update(self):
+        """
+        Generates a `ModelUpdate` object that will be sent to other entities.
+
+        :return: ModelUpdate
+        :rtype: `ModelUpdate`
+        """
+        # the arrays are pickled by ModelUpdate, so shared buffers are safe
+        return ModelUpdate(weights=self.parameter_arrays())
+
+
+class KerasDirectStateMixin:
+    """
+    `update_model` and `get_model_update` of `KerasFLModel` and
+    `TensorFlowFLModel` that transfer one variable at a time in eager mode.
+    List the mixin before the model class.
+    """
+
+    def update_model(self, model_update):
+        """
+        Update the model with provided model_update, where model_update
+        should be generated according to `get_model_update()`.
+
+        :param model_update: `ModelUpdate` object that contains the weight \
+        that will be used to update the model.
+        :type model_update: `ModelUpdate`
+        :return: None
+        """
+        if not isinstance(model_update, ModelUpdate):
+            raise LocalTrainingException(
+                "Provided model_update should be of " "type ModelUpdate. " "Instead they are:" + str(type(model_update))
+            )
+        self.load_layers(model_update.get("weights"))
+
+    def load_layers(self, layers):
+        """
+        Assigns layer values to the model variables, in order.
+
+        :param layers: one array per variable of `model.weights`
+        :type layers: iterable of `np.ndarray`
+        :return: None
+        """
+        import tensorflow as tf
+
+        graph = getattr(self, "graph", None)
+        if graph is not None:
+            from tensorflow.python.keras.backend import set_session
+
+            with graph.as_default():
+                set_session(self.sess)
+                variables = self.model.weights
+                layers = list(layers)
+                check_layer_count(len(variables), len(layers))
+                for index, (var, value) in enumerate(zip(variables, layers)):
+                    check_layer_shape(index, var.shape.as_list(), np.shape(value))
+                self.model.set_weights(layers)
+            return
+
+        variables = self.model.weights
+        count = 0
+        for index, value in enumerate(layers):
+            if index >= len(variables):
+                count = index + 1
+                break
+            var = variables[index]
+            check_layer_shape(index, var.shape.as_list(), np.shape(value))
+            var.assign(tf.convert_to_tensor(value, dtype=var.dtype))
+            count = index + 1
+        check_layer_count(len(variables), count)
+
+    def get_model_update(self):
+        """
+        Generates a `ModelUpdate` object that will be sent to other entities.
+
+        :return: ModelUpdate
+        :rtype: `ModelUpdate`
+        """
+        if getattr(self, "graph", None) is not None:
+            return super().get_model_update()
+        return ModelUpdate(weights=[var.numpy() for var in self.model.weights])
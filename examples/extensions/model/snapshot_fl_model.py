@@ -0,0 +1,233 @@
+"""
+Copy-on-write snapshots of `FLModel` weights.
+
+`SnapshotFLModelMixin.snapshot()` returns a `ModelSnapshot`, a read-only
+view of the weights at the time of the call. A snapshot reads the live model
+for as long as the weights do not change. The first write after it was taken
+(one of `SNAPSHOT_WRITE_METHODS` or any code in `snapshot_write()`) clones the
+model once for all open snapshots before changing the weights. Evaluating or
+saving a snapshot therefore never sees a half-trained model, and it costs a
+copy only if it overlaps a write.
+
+Snapshots taken while a write is running share the clone of the weights
+before the write, if there is one, and otherwise wait until the write ends.
+"""
+import copy
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+
+from examples.extensions.model.blend_fl_model import SklearnSGDBlendMixin
+from ibmfl.exceptions import FLException
+from ibmfl.model.sklearn_SGD_linear_fl_model import SklearnSGDFLModel
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_WRITE_METHODS = ("fit_model", "update_model", "update_model_gradient", "blend_weights", "load_model")
+
+
+class ModelSnapshot:
+    """
+    Read-only view of an `FLModel` at one version of its weights. Methods of
+    the model are called on the live model while the weights are unchanged
+    and on a frozen clone afterwards.
+    """
+
+    def __init__(self, source, version, frozen=None):
+        self._source = source
+        self._frozen = frozen
+        self._expired = False
+        self.version = version
+
+    @property
+    def is_frozen(self):
+        """Whether the snapshot reads a frozen clone instead of the live model."""
+        return self._frozen is not None
+
+    @contextmanager
+    def reading(self):
+        """
+        Yields the model holding the snapshot's weights. The live model is not
+        changed before the block ends.
+
+        :return: model to read
+        :rtype: `FLModel`
+        """
+        source = self._source
+        with source._snapshot_cond:
+            if self._expired:
+                raise FLException("The model changed and the snapshot could not be preserved")
+            model = self._frozen
+            if model is None:
+                source._snapshot_readers += 1
+        try:
+            yield source if model is None else model
+        finally:
+            if model is None:
+                with source._snapshot_cond:
+                    source._snapshot_readers -= 1
+                    source._snapshot_cond.notify_all()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in SNAPSHOT_WRITE_METHODS:
+            raise FLException("Model snapshots are read-only, {} is not supported".format(name))
+        value = getattr(self._frozen or self._source, name)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            with self.reading() as model:
+                return getattr(model, name)(*args, **kwargs)
+
+        return call
+
+
+class SnapshotFLModelMixin:
+    """
+    Adds copy-on-write snapshots to an `FLModel`. List the mixin before the
+    model class, e.g. `class M(SnapshotFLModelMixin, KerasFLModel)`. Methods
+    of the model class that change weights other than the
+    `SNAPSHOT_WRITE_METHODS` have to run in `snapshot_write()`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.init_snapshots()
+        super().__init__(*args, **kwargs)
+
+    def init_snapshots(self):
+        """Resets the snapshot bookkeeping, e.g. of a clone."""
+        self._snapshot_cond = threading.Condition()
+        self._snapshot_version = 0
+        self._snapshot_writer = None
+        self._snapshot_write_depth = 0
+        self._snapshot_readers = 0
+        self._shared_snapshots = weakref.WeakSet()
+        self._frozen_ref = None
+
+    def snapshot(self):
+        """
+        Returns a read-only view of the current weights.
+
+        :return: snapshot of the model
+        :rtype: `ModelSnapshot`
+        """
+        with self._snapshot_cond:
+            while True:
+                if self._snapshot_writer is None:
+                    snapshot = ModelSnapshot(self, self._snapshot_version)
+                    self._shared_snapshots.add(snapshot)
+                    return snapshot
+                frozen = self._frozen_ref() if self._frozen_ref is not None else None
+                if frozen is not None:
+                    return ModelSnapshot(self, self._snapshot_version, frozen=frozen)
+                if self._snapshot_writer == threading.get_ident():
+                    raise FLException("Cannot take a snapshot of a model while changing it")
+                self._snapshot_cond.wait()
+
+    def clone_for_snapshot(self):
+        """
+        Returns a copy of the wrapper with its own copy of the underlying
+        model. Wrappers whose model cannot be deep-copied override this.
+
+        :return: frozen copy of the model
+        :rtype: `FLModel`
+        """
+        clone = copy.copy(self)
+        clone.init_snapshots()
+        clone.model = copy.deepcopy(self.model)
+        return clone
+
+    @contextmanager
+    def snapshot_write(self):
+        """
+        Runs a block that changes the weights. Snapshots taken before are
+        frozen first and reads in progress on the live model are awaited.
+        """
+        me = threading.get_ident()
+        with self._snapshot_cond:
+            if self._snapshot_writer == me:
+                self._snapshot_write_depth += 1
+                shared = None
+            else:
+                while self._snapshot_writer is not None:
+                    self._snapshot_cond.wait()
+                self._snapshot_writer = me
+                self._snapshot_write_depth = 1
+                shared = list(self._shared_snapshots)
+                self._shared_snapshots = weakref.WeakSet()
+        try:
+            if shared is not None:
+                self._freeze(shared)
+            yield
+        finally:
+            with self._snapshot_cond:
+                self._snapshot_write_depth -= 1
+                if self._snapshot_write_depth == 0:
+                    self._snapshot_writer = None
+                    self._frozen_ref = None
+                    self._snapshot_version += 1
+                    self._snapshot_cond.notify_all()
+
+    def _freeze(self, shared):
+        frozen = None
+        if shared:
+            try:
+                frozen = self.clone_for_snapshot()
+            except Exception as ex:
+                logger.warning("Could not preserve {} model snapshot(s): {}".format(len(shared), ex))
+        with self._snapshot_cond:
+            for snapshot in shared:
+                if frozen is None:
+                    snapshot._expired = True
+                else:
+                    snapshot._frozen = frozen
+            if frozen is not None:
+                self._frozen_ref = weakref.ref(frozen)
+            while self._snapshot_readers:
+                self._snapshot_cond.wait()
+
+    def fit_model(self, *args, **kwargs):
+        with self.snapshot_write():
+            return super().fit_model(*args, **kwargs)
+
+    def update_model(self, *args, **kwargs):
+        with self.snapshot_write():
+            return super().update_model(*args, **kwargs)
+
+    def update_model_gradient(self, *args, **kwargs):
+        with self.snapshot_write():
+            return super().update_model_gradient(*args, **kwargs)
+
+    def blend_weights(self, *args, **kwargs):
+        with self.snapshot_write():
+            return super().blend_weights(*args, **kwargs)
+
+    def load_model(self, *args, **kwargs):
+        with self.snapshot_write():
+            return super().load_model(*args, **kwargs)
+
+
+class SnapshotSklearnSGDFLModel(SnapshotFLModelMixin, SklearnSGDBlendMixin, SklearnSGDFLModel):
+    """`SklearnSGDFLModel` with copy-on-write snapshots and in-place blending."""
+
+
+def clone_compiled_keras_model(model, models):
+    """
+    Clones a compiled Keras model with its weights, for models that cannot
+    be deep-copied.
+
+    :param model: compiled model
+    :type model: `keras.Model`
+    :param models: `keras.models` or `tf.keras.models`
+    :type models: `module`
+    :return: compiled copy of the model
+    :rtype: `keras.Model`
+    """
+    clone = models.clone_model(model)
+    clone.set_weights(model.get_weights())
+    metrics = [name for name in model.metrics_names if name != "loss"]
+    clone.compile(optimizer=model.optimizer, loss=model.loss, metrics=metrics)
+    return clone
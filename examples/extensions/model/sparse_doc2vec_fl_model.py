@@ -0,0 +1,145 @@
+"""
+`Doc2VecFLModel` that exchanges sparse row deltas of `syn1neg`.
+
+`Doc2VecFLModel.get_model_update` returns the whole `syn1neg` matrix
+(vocabulary size x vector size) every round, although a round of local
+training only changes the rows of the words in the party's corpus. When the
+aggregator asks for sparse updates (see
+`examples.extensions.fusion.sparse_doc2vec_fusion_handler`),
+`SparseDoc2VecFLModel` instead returns the indices of the rows that changed
+by more than a threshold since the last global model, together with their
+deltas. It accepts the changed global rows in return and applies them in
+place.
+"""
+import logging
+
+import numpy as np
+
+from ibmfl.exceptions import FLException
+from ibmfl.model.doc2vec_fl_model import Doc2VecFLModel
+from ibmfl.model.model_update import ModelUpdate
+
+logger = logging.getLogger(__name__)
+
+# rows compared at once, which bounds the temporary memory of `changed_rows`
+BLOCK_ROWS = 65536
+
+
+def changed_rows(current, base, threshold=0.0, block_rows=BLOCK_ROWS):
+    """
+    Finds the rows of `current` that differ from `base`.
+
+    :param current: current matrix
+    :type current: `np.ndarray`
+    :param base: matrix of the same shape to compare with
+    :type base: `np.ndarray`
+    :param threshold: largest absolute change of a row that is ignored
+    :type threshold: `float`
+    :param block_rows: rows compared at once
+    :type block_rows: `int`
+    :return: rows that changed by more than `threshold`, and rows that \
+    changed at all
+    :rtype: `tuple(np.ndarray, np.ndarray)`
+    """
+    selected, dirty = [], []
+    for start in range(0, len(current), block_rows):
+        delta = np.subtract(current[start : start + block_rows], base[start : start + block_rows])
+        change = np.abs(delta, out=delta).max(axis=1) if delta.shape[1] else np.zeros(len(delta))
+        selected.append(start + np.flatnonzero(change > threshold))
+        dirty.append(start + np.flatnonzero(change > 0))
+    if not selected:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(selected), np.concatenate(dirty)
+
+
+def row_index_dtype(num_rows):
+    return np.int32 if num_rows < np.iinfo(np.int32).max else np.int64
+
+
+class SparseDoc2VecFLModel(Doc2VecFLModel):
+    """
+    `Doc2VecFLModel` that sends the rows of `syn1neg` changed by local
+    training as `row_indices` and `row_deltas` when the fit parameters
+    contain `sparse_update: {"threshold": t}`, and that applies global
+    updates given as `row_indices` and `row_values`.
+    """
+
+    def __init__(self, model_name, model_spec=None, doc2vec_model=None, **kwargs):
+        super().__init__(model_name, model_spec, doc2vec_model, **kwargs)
+        # syn1neg of the last global model, the reference of the deltas
+        self.base_syn1neg = None
+        self.dirty_rows = None
+        self.sparse_threshold = None
+
+    def fit_model(self, train_data, fit_params=None, rounds=1, **kwargs):
+        """
+        Fits current model with provided training data, keeping a copy of
+        the global `syn1neg` if sparse updates are requested.
+
+        :param train_data: corpus to train on given in the form of (documents, document_ids).
+        otherwise, a list of 'gensim.models.doc2vec.TaggedDocument'
+        :type train_data: (list<str>, list<str>)
+        :param fit_params: (optional) Dictionary with hyperparameters, and \
+        `sparse_update` to send sparse updates.
+        :type fit_params: `dict`
+        :return: None
+        """
+        sparse_update = (fit_params or {}).get("sparse_update")
+        self.sparse_threshold = None if sparse_update is None else float(sparse_update.get("threshold", 0.0))
+        if self.sparse_threshold is not None and self.base_syn1neg is None and self.vocabulary_set():
+            self.base_syn1neg = self.model.trainables.syn1neg.copy()
+
+        super().fit_model(train_data, fit_params, rounds=rounds, **kwargs)
+
+        if self.sparse_threshold is not None and self.base_syn1neg is None:
+            # the vocabulary was built by the fit, from zero-initialized weights
+            self.base_syn1neg = np.zeros_like(self.model.trainables.syn1neg)
+
+    def get_model_update(self):
+        """
+        Generates a `ModelUpdate` object that will be sent to other
+        entities: the dense weights, or the changed rows if sparse updates
+        were requested.
+
+        :return: ModelUpdate
+        :rtype: `ModelUpdate`
+        """
+        if self.sparse_threshold is None or self.base_syn1neg is None:
+            return super().get_model_update()
+
+        syn1neg = self.model.trainables.syn1neg
+        rows, self.dirty_rows = changed_rows(syn1neg, self.base_syn1neg, self.sparse_threshold)
+        deltas = np.subtract(syn1neg[rows], self.base_syn1neg[rows], dtype=np.float32)
+        logger.info("Sending %d of %d rows of syn1neg", len(rows), len(syn1neg))
+        return ModelUpdate(
+            row_indices=rows.astype(row_index_dtype(len(syn1neg))), row_deltas=deltas, shape=syn1neg.shape
+        )
+
+    def update_model(self, model_update):
+        """
+        Update model with provided model_update, either dense weights or
+        the changed global rows.
+
+        :param model_update: `ModelUpdate` object that contains the weights \
+        or `row_indices` and `row_values`.
+        :type model_update: `ModelUpdate`
+        :return: None
+        """
+        if not (isinstance(model_update, ModelUpdate) and model_update.exist_key("row_indices")):
+            super().update_model(model_update)
+            self.base_syn1neg = None
+            self.dirty_rows = None
+            return
+
+        rows = model_update.get("row_indices")
+        values = model_update.get("row_values")
+        syn1neg = self.model.trainables.syn1neg
+        if self.base_syn1neg is None or tuple(model_update.get("shape")) != syn1neg.shape:
+            raise FLException("A sparse model update needs the previous global model of the same shape")
+
+        # local changes that did not make it into the global model are dropped
+        if self.dirty_rows is not None and len(self.dirty_rows):
+            syn1neg[self.dirty_rows] = self.base_syn1neg[self.dirty_rows]
+        self.base_syn1neg[rows] = values
+        syn1neg[rows] = values
+        self.dirty_rows = None
@@ -0,0 +1,112 @@
+"""
+`KerasFLModel` that trains on a `BatchStream` without materializing the
+party dataset, supports copy-on-write snapshots and in-place blending and
+assigns weights one variable at a time.
+"""
+import copy
+import logging
+
+import keras
+import tensorflow as tf
+from tensorflow.python.keras.backend import set_session
+
+from examples.extensions.data.batch_stream import BatchStream, training_batch_size
+from examples.extensions.model.blend_fl_model import KerasBlendMixin
+from examples.extensions.model.direct_state_fl_model import KerasDirectStateMixin
+from examples.extensions.model.snapshot_fl_model import SnapshotFLModelMixin, clone_compiled_keras_model
+from ibmfl.exceptions import FLException
+from ibmfl.model.keras_fl_model import KerasFLModel
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingKerasFLModel(SnapshotFLModelMixin, KerasBlendMixin, KerasDirectStateMixin, KerasFLModel):
+    """
+    Accepts a `BatchStream` as `train_data` in addition to the inputs of
+    `KerasFLModel.fit_model`. The stream is consumed through an endless
+    generator with `steps_per_epoch` defaulting to the number of batches of
+    the stream. The symbolic gradient function of `get_gradient` is built
+    once per model instead of on every call, so computing the gradient in
+    micro-batches does not grow the graph.
+    """
+
+    _gradient_function = None
+
+    def clone_for_snapshot(self):
+        clone = copy.copy(self)
+        clone.init_snapshots()
+        clone.model = clone_compiled_keras_model(self.model, keras.models if self.is_keras else tf.keras.models)
+        clone._gradient_function = None
+        return clone
+
+    def gradient_function(self):
+        """
+        Returns the backend function mapping inputs, targets and sample
+        weights to the gradients of the trainable weights.
+
+        :return: gradient function and the model it was built for
+        :rtype: `tuple`
+        """
+        if self._gradient_function is None or self._gradient_function[1] is not self.model:
+            try:
+                grads = self.model.optimizer.get_gradients(self.model.total_loss, self.model.trainable_weights)
+            except Exception as ex:
+                logger.exception(str(ex))
+                raise FLException("Error occurred when defining " "gradient expression. ")
+            symb_inputs = self.model._feed_inputs + self.model._feed_targets + self.model._feed_sample_weights
+            if self.is_keras:
+                from keras import backend as k
+            else:
+                from tensorflow.python.keras import backend as k
+            self._gradient_function = (k.function(symb_inputs, grads), self.model)
+        return self._gradient_function[0]
+
+    def get_gradient(self, train_data):
+        """
+        Compute the gradient with the provided dataset at the current local
+        model's weights.
+
+        :param train_data: Training data, a tuple \
+        given in the form (x_train, y_train).
+        :type train_data: `np.ndarray`
+        :return: gradients
+        :rtype: `list` of `np.ndarray`
+        """
+        with self.graph.as_default():
+            set_session(self.sess)
+            f = self.gradient_function()
+            try:
+                x, y, sample_weight = self.model._standardize_user_data(train_data[0], train_data[1])
+            except Exception as ex:
+                logger.exception(str(ex))
+                raise FLException("Error occurred when feeding data samples " "to compute current gradient.")
+
+            if sample_weight:
+                return f(x + y + sample_weight)
+            return f(x + y)
+
+    def fit_model(self, train_data, fit_params=None, **kwargs):
+        if isinstance(train_data, BatchStream):
+            train_data.set_batch_size(training_batch_size(fit_params, default=self.batch_size))
+        return super().fit_model(train_data, fit_params, **kwargs)
+
+    def fit_generator(self, training_generator, epochs, steps_per_epoch=None):
+        """
+        Fits current model using model.fit_generator with provided
+        training data generator or `BatchStream`.
+
+        :param training_generator: Training datagenerator of type \
+        `keras.utils.Sequence`, `ImageDataGenerator` or `BatchStream`.
+        :type training_generator: `BatchStream`
+        :param epochs: Number of epochs to train the model.
+        :type epochs: `int`
+        :param steps_per_epoch: Number of batches per epoch, by default all \
+        batches of a `BatchStream`.
+        :type steps_per_epoch: `int`
+        :return: None
+        """
+        if isinstance(training_generator, BatchStream):
+            steps_per_epoch = steps_per_epoch or len(training_generator)
+            logger.info("Training on a stream of %d batches per epoch", steps_per_epoch)
+            training_generator = training_generator.keras_generator()
+        super().fit_generator(training_generator, epochs, steps_per_epoch=steps_per_epoch)
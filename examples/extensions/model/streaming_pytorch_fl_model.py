@@ -0,0 +1,55 @@
+"""
+`PytorchFLModel` that trains on a `BatchStream` without materializing the
+party dataset, supports copy-on-write snapshots and in-place blending and
+transfers weights directly to and from the parameter storage.
+"""
+import logging
+
+from examples.extensions.data.batch_stream import BatchStream, training_batch_size
+from examples.extensions.model.blend_fl_model import PytorchBlendMixin
+from examples.extensions.model.direct_state_fl_model import TorchDirectStateMixin
+from examples.extensions.model.snapshot_fl_model import SnapshotFLModelMixin
+from ibmfl.model.pytorch_fl_model import PytorchFLModel
+
+logger = logging.getLogger(__name__)
+
+_UNSET = object()
+
+
+class StreamingPytorchFLModel(SnapshotFLModelMixin, PytorchBlendMixin, TorchDirectStateMixin, PytorchFLModel):
+    """
+    Accepts a `BatchStream` as `train_data` in addition to the inputs of
+    `PytorchFLModel.fit_model`. The stream is handed to skorch as a torch
+    `IterableDataset` of whole batches, so batching, shuffling and
+    prefetching are done by the stream instead of the skorch `DataLoader`.
+    A `validation_split` is not supported for streams.
+    """
+
+    def fit_model(self, train_data, fit_params=None, validation_data=None, **kwargs):
+        """
+        Fits current model with provided training data.
+
+        :param train_data: Training data, a `BatchStream`, a tuple given in \
+        the form (x_train, y_train) or a skorch compatible dataset.
+        :type train_data: `BatchStream`
+        :param fit_params: (optional) Dictionary with hyperparameters \
+        that will be used to call fit function.
+        :type fit_params: `dict`
+        :return: None
+        """
+        if not isinstance(train_data, BatchStream):
+            return super().fit_model(train_data, fit_params, validation_data, **kwargs)
+
+        train_data.set_batch_size(training_batch_size(fit_params, default=128))
+        logger.info("Training on a stream of %d batches per epoch", len(train_data))
+
+        # the stream yields whole batches, which the DataLoader must not re-batch
+        previous = getattr(self.model, "iterator_train__batch_size", _UNSET)
+        self.model.set_params(iterator_train__batch_size=None)
+        try:
+            super().fit_model(train_data.to_torch_dataset(), fit_params, validation_data, **kwargs)
+        finally:
+            if previous is _UNSET:
+                del self.model.iterator_train__batch_size
+            else:
+                self.model.set_params(iterator_train__batch_size=previous)
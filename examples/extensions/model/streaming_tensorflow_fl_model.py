@@ -0,0 +1,56 @@
+"""
+`TensorFlowFLModel` that trains on a `BatchStream` without materializing
+the party dataset, supports copy-on-write snapshots and in-place blending
+and assigns weights one variable at a time.
+"""
+import copy
+import logging
+
+import tensorflow as tf
+
+from examples.extensions.data.batch_stream import BatchStream, training_batch_size
+from examples.extensions.model.blend_fl_model import KerasBlendMixin
+from examples.extensions.model.direct_state_fl_model import KerasDirectStateMixin
+from examples.extensions.model.snapshot_fl_model import SnapshotFLModelMixin, clone_compiled_keras_model
+from ibmfl.model.tensorflow_fl_model import TensorFlowFLModel
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingTensorFlowFLModel(SnapshotFLModelMixin, KerasBlendMixin, KerasDirectStateMixin, TensorFlowFLModel):
+    """
+    Accepts a `BatchStream` as `train_data` in addition to the inputs of
+    `TensorFlowFLModel.fit_model`. The stream is wrapped with
+    `tf.data.Dataset.from_generator`, which calls it once per epoch.
+    A `validation_split` is ignored for streams; pass `validation_data`
+    instead.
+    """
+
+    def clone_for_snapshot(self):
+        clone = copy.copy(self)
+        clone.init_snapshots()
+        clone.model = clone_compiled_keras_model(self.model, tf.keras.models)
+        return clone
+
+    def update_model_gradient(self, *args, **kwargs):
+        with self.snapshot_write():
+            return super().update_model_gradient(*args, **kwargs)
+
+    def fit_model(self, train_data, fit_params=None, validation_data=None, **kwargs):
+        """
+        Fits current model with provided training data.
+
+        :param train_data: Training data, a `BatchStream` or a tuple given \
+        in the form (x_train, y_train).
+        :type train_data: `BatchStream`
+        :param fit_params: (optional) Dictionary with hyperparameters \
+        that will be used to call fit function.
+        :type fit_params: `dict`
+        :return: None
+        """
+        if isinstance(train_data, BatchStream):
+            local_params = kwargs.get("local_params")
+            train_data.set_batch_size(training_batch_size(fit_params, local_params, default=self.batch_size))
+            logger.info("Training on a stream of %d batches per epoch", len(train_data))
+            train_data = train_data.to_tf_dataset()
+        return super().fit_model(train_data, fit_params, validation_data, **kwargs)
@@ -0,0 +1,160 @@
+"""
+Party protocol handler that answers read-only requests while it trains.
+
+`PartyProtocolHandler` trains in one worker thread under one lock. Read
+requests either queue behind a running round or, with the default routes
+that handle `EVAL_MODEL` and `SAVE_MODEL` in the receiver thread, read the
+model halfway through an update. With a model that supports snapshots (see
+`examples.extensions.model.snapshot_fl_model`),
+`ConcurrentPartyProtocolHandler` serves them from a snapshot of the weights,
+in a separate pool when they arrive asynchronously. Requests that change the
+model keep their order, and `SYNC_MODEL` waits for a running `fit_model`.
+After every request that changed the model a snapshot is kept, so reads
+that arrive during the next one see the last committed weights instead of
+waiting. That costs one copy of the model per change, which
+`keep_snapshot: false` turns off.
+
+    protocol_handler:
+      name: ConcurrentPartyProtocolHandler
+      path: examples.extensions.protohandler.concurrent_requests
+      info:
+        read_workers: 2
+        keep_snapshot: true
+"""
+import copy
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from ibmfl.message.message import ResponseMessage
+from ibmfl.message.message_type import MessageType
+from ibmfl.party.party_protocol_handler import PartyProtocolHandler
+
+logger = logging.getLogger(__name__)
+
+READ_ONLY_REQUESTS = (MessageType.EVAL_MODEL.value, MessageType.SAVE_MODEL.value)
+
+
+class ConcurrentPartyProtocolHandler(PartyProtocolHandler):
+    """
+    `PartyProtocolHandler` that serves read-only requests on model
+    snapshots, concurrently with training.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.model_initialized = threading.Event()
+        super().__init__(*args, **kwargs)
+        info = kwargs.get("info") or {}
+        self.read_pool = ThreadPool(processes=info.get("read_workers", 2))
+        self.keep_snapshot = info.get("keep_snapshot", True)
+        self.committed_snapshot = None
+        self.signal_model_initialization()
+
+    @property
+    def fl_model(self):
+        return self.__dict__.get("_fl_model")
+
+    @fl_model.setter
+    def fl_model(self, model):
+        # every assignment, with or without `set_model`, can complete the initialization
+        self._fl_model = model
+        self._check_initialized()
+
+    @property
+    def local_training_handler(self):
+        return self.__dict__.get("_local_training_handler")
+
+    @local_training_handler.setter
+    def local_training_handler(self, training_handler):
+        self._local_training_handler = training_handler
+        self._check_initialized()
+
+    def _check_initialized(self):
+        if self.fl_model and self.local_training_handler:
+            self.model_initialized.set()
+
+    def supports_snapshots(self):
+        return hasattr(self.fl_model, "snapshot")
+
+    def signal_model_initialization(self):
+        if self.fl_model and self.local_training_handler:
+            self.model_initialized.set()
+            if self.keep_snapshot and self.supports_snapshots():
+                self.committed_snapshot = self.fl_model.snapshot()
+
+    def set_model(self, model):
+        super().set_model(model)
+        self.signal_model_initialization()
+
+    def set_training_handler(self, training_handler):
+        super().set_training_handler(training_handler)
+        self.signal_model_initialization()
+
+    def wait_for_model_initialization(self):
+        """Wait until model and localtraininghandler are initialized"""
+        logger.debug("Waiting for model initialization to finish")
+        self.model_initialized.wait()
+
+    def get_handle(self, message_type):
+        """
+        Get handler for given message type. Read-only requests are handled
+        on a snapshot of the model.
+
+        :param message_type: request message type
+        :type message_type: `int`
+        :return: a handler which was assigned for given message type
+        """
+        handler = super().get_handle(message_type)
+        if message_type not in READ_ONLY_REQUESTS or not self.supports_snapshots():
+            return handler
+
+        def on_snapshot(payload=None):
+            training_handler = copy.copy(self.local_training_handler)
+            training_handler.fl_model = self.fl_model.snapshot()
+            return getattr(training_handler, handler.__name__)(payload)
+
+        return on_snapshot
+
+    def handle_request(self, msg):
+        response_msg = super().handle_request(msg)
+        if (
+            self.keep_snapshot
+            and msg.message_type not in READ_ONLY_REQUESTS
+            and msg.message_type != MessageType.STOP.value
+            and self.supports_snapshots()
+        ):
+            self.committed_snapshot = self.fl_model.snapshot()
+        return response_msg
+
+    def execute_read_async(self, msg):
+        """
+        Handles a read-only request in the read pool, without taking the
+        lock of the requests that change the model.
+
+        :param msg: Message object form connection
+        :type msg: `Message`
+        """
+        try:
+            response_msg = self.handle_request(msg)
+        except Exception as ex:
+            logger.exception(ex)
+            response_msg = ResponseMessage(req_msg=msg)
+            response_msg.set_data({"status": "error", "payload": None})
+        self.connection.send_message(self.agg_info, response_msg)
+
+    def handle_async_request(self, msg):
+        """
+        Handle all incoming requests asynchronously, read-only requests in
+        the read pool and all others in order in the training thread.
+
+        :param msg: Message object form connection
+        :type msg: `Message`
+        :return: Response message sent back to requester
+        :rtype: ResponseMessage
+        """
+        if msg.message_type not in READ_ONLY_REQUESTS or not self.supports_snapshots():
+            return super().handle_async_request(msg)
+
+        logger.info("received a read-only async request")
+        self.read_pool.apply_async(self.execute_read_async, args=(msg,))
+        return ResponseMessage(message_type=MessageType.ACK.value, id_request=-1, data={"ACK": True})
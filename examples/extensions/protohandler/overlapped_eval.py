@@ -0,0 +1,320 @@
+"""
+Post-training evaluation that overlaps with the model-update upload.
+
+With `is_private` false, `PartyProtocolHandler.handle_request` evaluates the
+model on the whole test set after every training round, before the update
+is returned, so each round's critical path includes a full evaluation on
+every party. `OverlappedEvalPartyProtocolHandler` returns the update as soon
+as `train` finishes and evaluates a snapshot of the trained weights in a
+background thread. The metrics then travel either
+
+* `follow_up` (default): in a small `TRAIN` message that carries only
+  `metrics_update` and the `id_request` of the reply it belongs to, or
+* `next_reply`: in the `metrics` of the next training reply, as
+  `{"eval_round": <n>, ...}`.
+
+`EvalFollowUpProtoHandler` on the aggregator merges follow-up metrics into
+the `metrics_party` of the round they belong to. Aggregators without it
+ignore follow-up messages, since they carry no `payload`.
+
+Party config::
+
+    protocol_handler:
+      name: OverlappedEvalPartyProtocolHandler
+      path: examples.extensions.protohandler.overlapped_eval
+      info:
+        eval_delivery: follow_up
+        reply_timeout: 600          # seconds a follow-up waits for its reply
+
+Aggregator config::
+
+    protocol_handler:
+      name: EvalFollowUpProtoHandler
+      path: examples.extensions.protohandler.overlapped_eval
+"""
+import copy
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ibmfl.aggregator.protohandler.proto_handler import ProtoHandler
+from ibmfl.exceptions import FLException, LocalTrainingException
+from ibmfl.message.message import ResponseMessage
+from ibmfl.message.message_type import MessageType
+from ibmfl.party.party_protocol_handler import PartyProtocolHandler
+from ibmfl.party.status_type import StatusType
+
+logger = logging.getLogger(__name__)
+
+EVAL_DELIVERIES = ("follow_up", "next_reply")
+# seconds a follow-up waits for the reply it belongs to
+DEFAULT_REPLY_TIMEOUT = 600
+
+
+class OverlappedEvalPartyProtocolHandler(PartyProtocolHandler):
+    """
+    `PartyProtocolHandler` that evaluates the trained model concurrently
+    with sending the model update.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        info = kwargs.get("info") or {}
+        self.eval_delivery = info.get("eval_delivery", "follow_up")
+        if self.eval_delivery not in EVAL_DELIVERIES:
+            raise FLException(
+                "Unsupported eval_delivery {}, use one of {}".format(self.eval_delivery, ", ".join(EVAL_DELIVERIES))
+            )
+        self.reply_timeout = float(info.get("reply_timeout", DEFAULT_REPLY_TIMEOUT))
+        self.eval_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="OverlappedEval")
+        self.pending_eval = None
+        self.eval_on_live_model = False
+        self._eval_model = None
+        self._reply_sent = {}
+
+    def snapshot_model(self):
+        """
+        Returns a model holding a frozen copy of the current weights, or None
+        if the model cannot be copied, along with the weights still to be
+        loaded into it. Models with copy-on-write snapshots (see
+        `examples.extensions.model.snapshot_fl_model`) return one, other
+        models get a shadow copy that is created once and reused every round.
+        The shadow copy may still be evaluated for the previous round, so the
+        current weights are returned to be loaded by the evaluation job.
+
+        :return: model to evaluate and the weights to load into it, or None
+        :rtype: `tuple(FLModel, ModelUpdate)`
+        """
+        if hasattr(self.fl_model, "snapshot"):
+            return self.fl_model.snapshot(), None
+        if self.eval_on_live_model:
+            return None, None
+        if self._eval_model is None:
+            try:
+                self._eval_model = copy.deepcopy(self.fl_model)
+                return self._eval_model, None
+            except Exception as ex:
+                logger.warning("Model cannot be copied, evaluating the live model instead: " + str(ex))
+                self.eval_on_live_model = True
+                return None, None
+        return self._eval_model, self.fl_model.get_model_update()
+
+    def evaluate_snapshot(self, model, payload):
+        """
+        Evaluates `model` with the local training handler's `eval_model`.
+
+        :return: evaluation results
+        :rtype: `dict`
+        """
+        if model is None:
+            return self.local_training_handler.eval_model(payload)
+        evaluator = copy.copy(self.local_training_handler)
+        evaluator.fl_model = model
+        return evaluator.eval_model(payload)
+
+    def wait_for_pending_eval(self):
+        """
+        Waits for the running evaluation, if any.
+
+        :return: evaluation results or None
+        :rtype: `dict`
+        """
+        pending, self.pending_eval = self.pending_eval, None
+        if pending is None:
+            return None
+        try:
+            return pending.result()
+        except Exception as ex:
+            logger.exception(ex)
+            return None
+
+    def start_eval(self, msg, payload, eval_round):
+        model, model_update = self.snapshot_model()
+        previous = self.pending_eval
+        id_request = msg.get_header()["id_request"]
+        reply_sent = threading.Event()
+        if self.synch or self.eval_delivery != "follow_up":
+            # the reply is the response of the request
+            reply_sent.set()
+        else:
+            self._reply_sent[id_request] = reply_sent
+
+        def run():
+            if previous is not None:
+                # the previous round may still use the shadow model
+                try:
+                    previous.result()
+                except Exception as ex:
+                    logger.exception(ex)
+            if model_update is not None:
+                model.update_model(model_update)
+            metrics = self.evaluate_snapshot(model, payload) or {}
+            metrics = dict(metrics, eval_round=eval_round)
+            if self.eval_delivery == "follow_up":
+                # the aggregator has to know the reply before its metrics
+                if not reply_sent.wait(timeout=self.reply_timeout):
+                    logger.warning(
+                        "Reply to request {} not sent after {} s, sending its evaluation results anyway".format(
+                            id_request, self.reply_timeout
+                        )
+                    )
+                self._reply_sent.pop(id_request, None)
+                self.send_eval_follow_up(msg, metrics)
+            return metrics
+
+        self.pending_eval = self.eval_executor.submit(run)
+
+    def send_eval_follow_up(self, msg, metrics):
+        follow_up = ResponseMessage(req_msg=msg)
+        follow_up.set_data({"status": "success", "metrics_update": metrics})
+        try:
+            self.connection.send_message(self.agg_info, follow_up)
+        except Exception as ex:
+            logger.warning("Could not send evaluation results to the aggregator: " + str(ex))
+
+    def handle_request(self, msg):
+        """
+        Handles requests like `PartyProtocolHandler.handle_request`, except
+        that the post-training evaluation runs in the background.
+
+        :param msg: Message object form connection
+        :type msg: `Message`
+        :return: Response message sent back to requester
+        :rtype: ResponseMessage
+        """
+        logger.info("Received request from aggregator")
+        message_type = msg.message_type
+        logger.info("Received request in with message_type:  " + str(message_type))
+
+        data = msg.get_data()
+
+        response_msg = ResponseMessage(req_msg=msg)
+        response_data = {"status": "success"}
+
+        try:
+            if message_type is MessageType.STOP.value:
+                self.status = StatusType.STOPPING
+                response_msg = ResponseMessage(message_type=MessageType.ACK.value, id_request=-1, data={"ACK": True})
+                logger.info("received a STOP request")
+                return response_msg
+
+            self.wait_for_model_initialization()
+
+            (first_train_msg, last_train_msg) = self.local_training_handler.determine_train_msg_seq(
+                message_type, data.get("payload")
+            )
+            previous_metrics = None
+            if self.eval_on_live_model or (last_train_msg and self.eval_delivery == "next_reply"):
+                # the live model must not change while it is evaluated
+                previous_metrics = self.wait_for_pending_eval()
+
+            if first_train_msg and self.metrics_recorder:
+                self.metrics_recorder.add_entry()
+                self.metrics_recorder.set_round_no(self.local_training_handler.get_n_completed_trains())
+
+            handler = self.get_handle(message_type)
+            response = handler(data.get("payload"))
+
+            if last_train_msg:
+                self.local_training_handler.n_completed_trains += 1
+                if not self.is_private:
+                    if previous_metrics is not None:
+                        response_data["metrics"] = previous_metrics
+                    self.start_eval(msg, data.get("payload"), self.local_training_handler.n_completed_trains)
+                if self.metrics_recorder:
+                    self.metrics_recorder.write_metrics()
+            elif message_type is MessageType.EVAL_MODEL.value:
+                self.local_training_handler.n_completed_evals += 1
+
+        except Exception as ex:
+            logger.exception(ex)
+            raise LocalTrainingException("Error occurred while handling request")
+
+        response_data["payload"] = response
+        response_msg.set_data(response_data)
+        return response_msg
+
+    def execute_async(self, id_request, msg):
+        try:
+            super().execute_async(id_request, msg)
+        finally:
+            # also when sending the reply failed, so the follow-up does not wait for it
+            reply_sent = self._reply_sent.pop(msg.get_header()["id_request"], None)
+            if reply_sent is not None:
+                reply_sent.set()
+
+
+class EvalFollowUpProtoHandler(ProtoHandler):
+    """
+    `ProtoHandler` that merges the evaluation results parties send after
+    their model update into `metrics_party`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self._last_requests = {}
+        self._early_follow_ups = {}
+        self._metrics_party = None
+        self._querying = False
+
+    def send_message(self, party_id, message):
+        with self._metrics_lock:
+            self._last_requests[party_id] = message.get_header()["id_request"]
+        return super().send_message(party_id, message)
+
+    def query_parties(self, payload, lst_parties, *args, **kwargs):
+        with self._metrics_lock:
+            self._metrics_party = kwargs.get("metrics_party") if kwargs.get("collect_metrics") else None
+            self._early_follow_ups = {}
+            self._querying = True
+        try:
+            return super().query_parties(payload, lst_parties, *args, **kwargs)
+        finally:
+            with self._metrics_lock:
+                self._querying = False
+                # results that arrived while the replies were collected
+                for party_id, metrics in self._early_follow_ups.items():
+                    self._merge(party_id, metrics)
+                self._early_follow_ups = {}
+
+    def _merge(self, party_id, metrics):
+        if self._metrics_party is not None:
+            self._metrics_party.setdefault(str(party_id), {}).update(metrics)
+
+    def process_model_update_requests(self, message):
+        """
+        Saves model updates like `ProtoHandler.process_model_update_requests`
+        and merges the evaluation results of follow-up messages into the
+        metrics of the reply they belong to.
+
+        :param message: request send by party
+        :type message: `Message`
+        :return: Message with appropriate response
+        :rtype: `Message`
+        """
+        data = message.get_data()
+        if "metrics_update" not in data:
+            return super().process_model_update_requests(message)
+
+        header = message.get_header()
+        id_request = header["id_request"]
+        party_id = next((pid for pid, party in self.parties_list.items() if party.info == header["sender_info"]), None)
+        if party_id is None:
+            logger.warning("Evaluation results from unknown party {}".format(header["sender_info"]))
+        else:
+            with self._metrics_lock:
+                party = self.parties_list[party_id]
+                if self._last_requests.get(party_id) != id_request:
+                    logger.info("Dropping evaluation results of an earlier round from party {}".format(party_id))
+                elif self._querying:
+                    if id_request in party.metrics:
+                        # the reply has not been collected yet
+                        party.metrics[id_request].update(data["metrics_update"])
+                    # merged again once the replies are collected
+                    self._early_follow_ups[party_id] = data["metrics_update"]
+                else:
+                    self._merge(party_id, data["metrics_update"])
+
+        message.set_data({"status": "success"})
+        return message
@@ -0,0 +1,96 @@
+"""
+Hooks for processing party replies as they arrive.
+
+`ProtoHandler.query_parties` returns the model updates of a round only after
+the quorum replied, so fusion handlers can start merging only when the
+slowest party is done. `ReplyStreamProtoHandler` calls the listeners
+registered with `add_reply_listener` with every reply payload as soon as it
+is stored, from the thread that received it. Fusion handlers that can merge
+incrementally, e.g. `StreamingNaiveBayesFusionHandler`, use it when it is
+the protocol handler of the aggregator and fall back to merging the
+returned list otherwise. `query_requests` maps every party of the latest
+query to the `id_request` it was sent, so that listeners can tell the
+replies of the current query from late replies of an earlier one.
+
+    protocol_handler:
+      name: ReplyStreamProtoHandler
+      path: examples.extensions.protohandler.reply_stream
+"""
+import logging
+import threading
+
+from ibmfl.aggregator.protohandler.proto_handler import ProtoHandler
+from ibmfl.message.message_type import MessageType
+
+logger = logging.getLogger(__name__)
+
+
+class ReplyStreamProtoHandler(ProtoHandler):
+    """
+    `ProtoHandler` that passes every model update reply to its listeners.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._listeners_lock = threading.Lock()
+        self._reply_listeners = []
+        self.query_requests = {}
+
+    def add_reply_listener(self, listener):
+        """
+        Registers a function called as `listener(party_info, id_request,
+        payload)` for every reply that carries a payload.
+
+        :param listener: function to call
+        :type listener: `callable`
+        :return: None
+        """
+        with self._listeners_lock:
+            self._reply_listeners.append(listener)
+
+    def remove_reply_listener(self, listener):
+        with self._listeners_lock:
+            if listener in self._reply_listeners:
+                self._reply_listeners.remove(listener)
+
+    def query_parties_with_same_payload(self, party_ids, data, msg_type=MessageType.TRAIN):
+        id_request = super().query_parties_with_same_payload(party_ids, data, msg_type=msg_type)
+        self.query_requests = {party_id: id_request for party_id in party_ids}
+        return id_request
+
+    def query_parties_with_different_payloads(self, party_ids, data_queries, msg_type=MessageType.TRAIN):
+        id_request_lst = super().query_parties_with_different_payloads(party_ids, data_queries, msg_type=msg_type)
+        self.query_requests = dict(zip(party_ids, id_request_lst))
+        return id_request_lst
+
+    def party_id(self, party_info):
+        """
+        :param party_info: `sender_info` of a message
+        :type party_info: `dict`
+        :return: id of the party, None if unknown
+        """
+        return next((pid for pid, party in self.parties_list.items() if party.info == party_info), None)
+
+    def process_model_update_requests(self, message):
+        """
+        Saves the model update like `ProtoHandler` and passes its payload to
+        the listeners.
+
+        :param message: request send by party
+        :type message: `Message`
+        :return: Message with appropriate response
+        :rtype: `Message`
+        """
+        data = message.get_data()
+        header = message.get_header()
+        response = super().process_model_update_requests(message)
+
+        if isinstance(data, dict) and "ACK" not in data and "payload" in data:
+            with self._listeners_lock:
+                listeners = list(self._reply_listeners)
+            for listener in listeners:
+                try:
+                    listener(header["sender_info"], header["id_request"], data["payload"])
+                except Exception as ex:
+                    logger.exception("Reply listener failed: {}".format(ex))
+        return response
@@ -0,0 +1,133 @@
+"""
+Tokenize the Doc2Vec training corpus once per party.
+
+`Doc2VecFLModel.fit_model` turns the raw `(documents, document_ids)` of the
+party into `TaggedDocument`s every round. `Doc2VecLocalTrainingHandler`
+tokenizes them again for `get_vocabulary` and `set_initial_model`.
+`CachedDoc2VecLocalTrainingHandler` builds the tagged corpus once and hands
+the same list to all of them. With `corpus_cache_file` set, the corpus is
+also pickled to disk and reused by later runs over the same data.
+
+    local_training:
+      name: CachedDoc2VecLocalTrainingHandler
+      path: examples.extensions.training.doc2vec_corpus_cache
+      info:
+        corpus_cache_file: /tmp/party0_corpus.pkl   # optional
+"""
+import hashlib
+import logging
+import os
+import pickle
+from collections import Counter
+from itertools import chain
+
+import numpy as np
+
+from ibmfl.exceptions import LocalTrainingException
+from ibmfl.party.training.doc2vec_local_training_handler import Doc2VecLocalTrainingHandler
+
+logger = logging.getLogger(__name__)
+
+
+def corpus_fingerprint(documents, document_ids):
+    """
+    Hash of the raw documents and their ids.
+
+    :rtype: `str`
+    """
+    sha = hashlib.sha1()
+    for doc, doc_id in zip(documents, document_ids):
+        sha.update(str(doc_id).encode("utf8"))
+        sha.update(b"\0")
+        sha.update(str(doc).encode("utf8"))
+        sha.update(b"\1")
+    return sha.hexdigest()
+
+
+class TaggedCorpusCache:
+    """
+    Tagged corpus built once from raw documents, optionally persisted as a
+    pickle that is reused while the documents do not change.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: file to persist the corpus to, or None to keep it in \
+        memory only
+        :type path: `str`
+        """
+        self.path = path
+
+    def load(self, train_data, build_tagged_documents):
+        """
+        Returns the tagged corpus of `train_data`.
+
+        :param train_data: `(documents, document_ids)` or a list of \
+        `TaggedDocument`, which is returned as is
+        :type train_data: `tuple` or `list`
+        :param build_tagged_documents: function creating the corpus from \
+        documents and ids
+        :type build_tagged_documents: `callable`
+        :return: tagged corpus
+        :rtype: `list<TaggedDocument>`
+        """
+        if type(train_data) is not tuple:
+            return train_data
+        documents, document_ids = train_data
+        if self.path is None:
+            return build_tagged_documents(documents, document_ids)
+
+        fingerprint = corpus_fingerprint(documents, document_ids)
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "rb") as f:
+                    cached = pickle.load(f)
+                if cached.get("fingerprint") == fingerprint:
+                    logger.info("Loaded %d tagged documents from %s", len(cached["corpus"]), self.path)
+                    return cached["corpus"]
+                logger.info("The documents changed, rebuilding the corpus cache %s", self.path)
+            except Exception as ex:
+                logger.warning("Could not read the corpus cache %s: %s", self.path, ex)
+
+        corpus = build_tagged_documents(documents, document_ids)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"fingerprint": fingerprint, "corpus": corpus}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        return corpus
+
+
+class CachedDoc2VecLocalTrainingHandler(Doc2VecLocalTrainingHandler):
+    """
+    `Doc2VecLocalTrainingHandler` that tokenizes the training corpus once
+    and answers vocabulary queries from it.
+    """
+
+    def __init__(self, fl_model, data_handler, hyperparams=None, **kwargs):
+        super().__init__(fl_model, data_handler, hyperparams, **kwargs)
+        info = kwargs.get("info") or {}
+        self.corpus_cache = TaggedCorpusCache(info.get("corpus_cache_file"))
+        # the tagged corpus replaces the raw documents for training and initialization
+        self.train_data = self.corpus_cache.load(self.train_data, self.fl_model.build_tagged_documents)
+
+    def get_vocabulary(self, round_zero, vocab_format="dict"):
+        """
+        A remote function call that counts the words of the training corpus.
+
+        :param round_zero: unused, as in `Doc2VecLocalTrainingHandler`
+        :type round_zero: `bool`
+        :param vocab_format: `dict` for a word to frequency dictionary, \
+        `table` for a tuple of word and frequency arrays
+        :type vocab_format: `str`
+        :return: Dictionary containing training dataset's vocabulary and frequencies
+        :rtype: `dict`
+        """
+        logger.info("Obtaining list of vocabulary words and frequency.")
+        vocab = Counter(chain.from_iterable(doc[0] for doc in self.train_data))
+        if vocab_format == "table":
+            words = np.array(list(vocab.keys()), dtype=str)
+            counts = np.fromiter(vocab.values(), dtype=np.int64, count=len(vocab))
+            return {"vocab": (words, counts)}
+        if vocab_format != "dict":
+            raise LocalTrainingException("Unsupported vocabulary format " + str(vocab_format))
+        return {"vocab": dict(vocab)}
@@ -0,0 +1,224 @@
+"""
+Reweighing and prejudice remover training with contingency-based fairness
+metrics.
+
+`ReweighLocalTrainingHandler` and `PRLocalTrainingHandler` evaluate with
+`fairness_report`, which filters DataFrames per group and rescans the
+predictions once per count. They compute the underestimation index with
+gensim. The reweighing handler also builds its sample weights with
+`DataFrame.iterrows`, and `PrejudiceRemoverFLModel.predict_pr` grows its
+label array with `np.append` once per sample.
+
+The handlers below count the test predictions into a
+`FairnessContingency` (see `examples.extensions.metrics.fairness_contingency`)
+`fairness_batch_size` rows at a time and derive the same report, and the
+underestimation index, from it. Any number of sensitive attributes can be
+reported. With `fairness_every_round` the metrics are computed after every
+local training round as well, logged and kept in `fairness_history`. The
+reweighing weights are looked up from a 2 x 2 table.
+
+    local_training:
+      name: ContingencyReweighLocalTrainingHandler   # or ContingencyPRLocalTrainingHandler
+      path: examples.extensions.training.fairness_training
+      info:
+        sensitive_attributes: [sex, race]   # default: the data handler's get_sa()
+        fairness_every_round: true
+        fairness_batch_size: 8192
+"""
+import logging
+
+import numpy as np
+
+from examples.extensions.metrics.fairness_contingency import (
+    FairnessContingency,
+    reweighing_weights,
+    sensitive_columns,
+)
+from ibmfl.exceptions import LocalTrainingException
+from ibmfl.party.training.pr_local_training_handler import PRLocalTrainingHandler
+from ibmfl.party.training.reweigh_local_training_handler import ReweighLocalTrainingHandler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAIRNESS_BATCH_SIZE = 8192
+
+
+def is_training_request(fit_params):
+    # the reweighing handshake and weight requests do not train
+    return not fit_params or not ({"is_handshake", "global_weights"} & set(fit_params))
+
+
+class ContingencyFairnessMixin:
+    """
+    Fairness metrics of `eval_model`, and optionally of every training
+    round, from contingency tensors. List the mixin before the handler
+    class.
+    """
+
+    def __init__(self, fl_model, data_handler, hyperparams=None, **kwargs):
+        super().__init__(fl_model, data_handler, hyperparams=hyperparams, **kwargs)
+        info = kwargs.get("info") or {}
+        self.sensitive_attributes = info.get("sensitive_attributes")
+        self.fairness_every_round = bool(info.get("fairness_every_round", False))
+        self.fairness_batch_size = int(info.get("fairness_batch_size") or DEFAULT_FAIRNESS_BATCH_SIZE)
+        self.fairness_history = []
+
+    def get_sensitive_attributes(self):
+        attributes = self.sensitive_attributes or self.data_handler.get_sa()
+        return [attributes] if isinstance(attributes, str) else list(attributes)
+
+    def predict_test_labels(self, x):
+        """
+        Returns the predicted labels of test samples.
+
+        :param x: test samples
+        :type x: `np.ndarray`
+        :rtype: `np.ndarray`
+        """
+        return self.fl_model.predict(x)
+
+    def count_predictions(self, x, y, predict):
+        """
+        Counts the labels and predictions of `x` per group, predicting
+        `fairness_batch_size` rows at a time.
+
+        :param x: samples holding the sensitive attributes
+        :type x: `np.ndarray` or `pandas.DataFrame`
+        :param y: labels
+        :type y: `np.ndarray`
+        :param predict: returns the predicted labels of a batch
+        :type predict: `callable`
+        :rtype: `FairnessContingency`
+        """
+        engine = FairnessContingency(self.get_sensitive_attributes(), self.data_handler.get_col_names())
+        y = np.asarray(y)
+        for start in range(0, len(y), self.fairness_batch_size):
+            rows = slice(start, start + self.fairness_batch_size)
+            x_batch = x.iloc[rows] if hasattr(x, "iloc") else x[rows]
+            engine.add(x_batch, y[rows], predict(x_batch))
+        return engine
+
+    def fairness_metrics(self, train_dataset, test_dataset):
+        """
+        Computes the fairness report of the test set and the
+        underestimation index of the training set.
+
+        :param train_dataset: `(x_train, y_train)`
+        :type train_dataset: `tuple`
+        :param test_dataset: `(x_test, y_test)`
+        :type test_dataset: `tuple`
+        :return: `Fairness Report`, `Underestimation Index` and, for more \
+        than one sensitive attribute, `Fairness Reports` per attribute and \
+        the `Group Counts` of the intersectional groups
+        :rtype: `dict`
+        """
+        test = self.count_predictions(test_dataset[0], test_dataset[1], self.predict_test_labels)
+        train = self.count_predictions(train_dataset[0], train_dataset[1], self.fl_model.predict)
+        metrics = {"Fairness Report": test.report()}
+        if len(test.attributes) > 1:
+            metrics["Fairness Reports"] = test.reports()
+            metrics["Group Counts"] = test.group_rates()["count"].tolist()
+        metrics["Underestimation Index"] = train.uei()
+        return metrics
+
+    def get_datasets(self):
+        train_dataset, test_dataset = self.data_handler.get_data()
+        try:
+            (x_train, y_train), (x_test, y_test) = train_dataset, test_dataset
+        except Exception as ex:
+            logger.error(
+                "Expecting the test dataset to be of type tuple. "
+                "However, test dataset is of type " + str(type(test_dataset))
+            )
+            logger.exception(ex)
+            raise LocalTrainingException("Expecting (x, y) tuples for the training and test data")
+        return (x_train, y_train), (x_test, y_test)
+
+    def record_round_fairness(self):
+        """
+        Computes the fairness metrics of the model just trained, if
+        `fairness_every_round` is set, and appends them to
+        `fairness_history`.
+
+        :return: the metrics, or None
+        :rtype: `dict`
+        """
+        if not self.fairness_every_round:
+            return None
+        metrics = self.fairness_metrics(*self.get_datasets())
+        metrics["round"] = len(self.fairness_history)
+        self.fairness_history.append(metrics)
+        logger.info("Fairness after local training: %s", metrics)
+        return metrics
+
+    def train(self, fit_params=None):
+        update = super().train(fit_params)
+        if is_training_request(fit_params):
+            self.record_round_fairness()
+        return update
+
+    def eval_model(self, payload=None):
+        """
+        Evaluate the local model based on the local test data.
+
+        :param payload: data payload received from Aggregator
+        :type payload: `dict`
+        :return: Dictionary of evaluation results
+        :rtype: `dict`
+        """
+        train_dataset, test_dataset = self.get_datasets()
+        evaluations = self.fl_model.evaluate_model(*test_dataset)
+        evaluations.update(self.fairness_metrics(train_dataset, test_dataset))
+        logger.info(evaluations)
+        return evaluations
+
+
+class ContingencyReweighLocalTrainingHandler(ContingencyFairnessMixin, ReweighLocalTrainingHandler):
+    """
+    `ReweighLocalTrainingHandler` with vectorized sample weights and
+    contingency-based fairness metrics.
+    """
+
+    def train(self, fit_params=None):
+        """
+        Answers the reweighing handshake, computes the sample weights from
+        the global counts, or trains locally with them.
+
+        :param fit_params: (optional) Query instruction from aggregator
+        :type fit_params: `dict`
+        :return: ModelUpdate, or the counts of the handshake
+        :rtype: `ModelUpdate` or `dict`
+        """
+        fit_params = {} if fit_params is None else fit_params
+        if "is_handshake" in fit_params:
+            return self.data_handler.get_hist()
+        if "global_weights" in fit_params:
+            (x_train, y_train), _ = self.data_handler.get_data()
+            groups = sensitive_columns(x_train, self.data_handler.get_col_names(), [self.data_handler.get_sa()])
+            self.sample_weight = reweighing_weights(groups, y_train, fit_params["global_counts"])
+            return {}
+
+        train_data, (_) = self.data_handler.get_data()
+        # the library compares the weights with [], which fails for arrays
+        if len(self.sample_weight) == 0:
+            self.sample_weight = self.data_handler.get_weight()
+        fit_params["sample_weight"] = self.sample_weight
+
+        self.update_model(fit_params.get("model_update"))
+        logger.info("Local training started...")
+        self.fl_model.fit_model(train_data, fit_params, local_params=self.hyperparams)
+        update = self.fl_model.get_model_update()
+        logger.info("Local training done, generating model update...")
+
+        self.record_round_fairness()
+        return update
+
+
+class ContingencyPRLocalTrainingHandler(ContingencyFairnessMixin, PRLocalTrainingHandler):
+    """
+    `PRLocalTrainingHandler` with contingency-based fairness metrics. The
+    test labels are the argmax of `predict_proba`, as in `predict_pr`.
+    """
+
+    def predict_test_labels(self, x):
+        return np.argmax(self.fl_model.model.predict_proba(x), axis=1)
@@ -0,0 +1,197 @@
+"""
+Fed+ local training handlers that blend the model weights in place.
+
+The Fed+ handlers of the library read the local weights with
+`fl_model.get_model_update()`, mix them with the global weights layer by
+layer and write the result back with `update_model(ModelUpdate(...))`, once
+per round and, for the mixed-model variants, once per local epoch. The
+handlers here do the same with `blend_model_weights` and
+`model_weight_arrays` of `examples.extensions.model.blend_fl_model`, which
+change the parameters in place for models with a blending mixin, e.g.
+`StreamingPytorchFLModel`, and fall back to the `ModelUpdate` round trip
+for other models.
+
+    local_training:
+      name: InPlaceFedAvgFedPlusLocalTrainingHandler
+      path: examples.extensions.training.fedplus_blend
+      info:
+        alpha: 0.1
+        rho: 0.5
+"""
+import logging
+import math
+
+import numpy as np
+
+from examples.extensions.model.blend_fl_model import blend_model_weights, model_weight_arrays
+from ibmfl.party.training.coordinate_median_fedplus_local_training_handler import (
+    CoordinateMedianFedPlusLocalTrainingHandler,
+)
+from ibmfl.party.training.fedavg_fedplus_local_training_handler import FedAvgFedPlusLocalTrainingHandler
+from ibmfl.party.training.fedplus_local_training_handler import FedPlusLocalTrainingHandler
+from ibmfl.party.training.geometric_median_fedplus_local_training_handler import (
+    GeometricMedianFedPlusLocalTrainingHandler,
+)
+
+logger = logging.getLogger(__name__)
+
+EPS = 1e-6
+
+
+class InPlaceFedPlusMixin:
+    """
+    `train` and `soft_update_model` of `FedPlusLocalTrainingHandler` on
+    top of in-place blending. List the mixin before the handler class.
+    """
+
+    def train(self, fit_params=None):
+        """
+        Train locally using fl_model. At the end of training, a
+        model_update with the new model information is generated and
+        send through the connection.
+
+        :param fit_params: (optional) Query instruction from aggregator
+        :type fit_params: `dict`
+        :return: ModelUpdate
+        :rtype: `ModelUpdate`
+        """
+        train_data, (_) = self.data_handler.get_data()
+        _train_count = self.data_handler.get_train_counts()
+        val_data = self.data_handler.get_val_data()
+
+        try:
+            lr = fit_params["hyperparams"]["local"]["optimizer"]["lr"]
+        except KeyError:
+            raise ValueError("lr value is not set in hyperparams.local.optimizer.lr config")
+        except TypeError:
+            logger.info("This is a PyTorch model. Trying to read configs again")
+            try:
+                lr = fit_params["hyperparams"]["local"]["training"]["lr"]
+            except KeyError:
+                raise ValueError("lr value is not set in hyperparams.local.training.lr config")
+
+        try:
+            num_epochs = fit_params["hyperparams"]["local"]["training"]["epochs"]
+        except KeyError:
+            raise ValueError("epochs value is not set in hyperparams.local.training.epochs config")
+
+        self.update_model(fit_params["model_update"])
+
+        self.get_train_metrics_pre()
+
+        logger.info("Local training started...")
+        if self.mixed_model is not None:
+            logger.info("Solving minimization locally epoch by epoch for " + str(num_epochs) + " epochs")
+            fit_params["hyperparams"]["local"]["training"]["epochs"] = 1
+            theta = 1 / (1 + self.alpha * lr)
+            for _ in range(num_epochs):
+                self.fl_model.fit_model(train_data, fit_params, val_data, local_params=self.hyperparams)
+                # w <- theta * w + (1 - theta) * mixed_model
+                blend_model_weights(self.fl_model, self.mixed_model, 1 - theta)
+        else:
+            self.fl_model.fit_model(train_data, fit_params, val_data, local_params=self.hyperparams)
+
+        update = self.fl_model.get_model_update()
+        update.add("train_counts", _train_count)
+
+        logger.info("Local training done, generating model update...")
+
+        self.get_train_metrics_post()
+
+        return update
+
+    def soft_update_model(self, model_update, key="weights"):
+        """
+        Soft update to local model using fedplus algo, in place
+
+        :param model_update:ModelUpdate
+        :type model_update: `ModelUpdate`
+        :param key: model weights
+        :type key:str
+        :return:None
+        """
+        blend_model_weights(self.fl_model, model_update.get(key), self.alpha)
+
+
+class MixedModelFedPlusMixin(InPlaceFedPlusMixin):
+    """
+    Soft update of the Fed+ variants that do not change the model but keep
+    a mix of the local and global weights, lambda * g + (1 - lambda) * w,
+    to blend toward after every epoch. Subclasses define `mixing_weights`.
+    """
+
+    def mixing_weights(self, local_weights, global_weights):
+        """
+        Returns lambda, a scalar or one array per layer.
+
+        :param local_weights: local weights
+        :type local_weights: `list` of `np.ndarray`
+        :param global_weights: global weights
+        :type global_weights: `list` of `np.ndarray`
+        :rtype: `float` or `list`
+        """
+        raise NotImplementedError
+
+    def soft_update_model(self, model_update, key="weights"):
+        """
+        Computes the mixed model, reusing the arrays of the global weights.
+
+        :param model_update:ModelUpdate
+        :type model_update: `ModelUpdate`
+        :param key: model weights
+        :type key:str
+        :return:None
+        """
+        local_weights = model_weight_arrays(self.fl_model)
+        global_weights = [
+            np.asarray(g, dtype=np.result_type(w.dtype, np.float32))
+            for g, w in zip(model_update.get(key), local_weights)
+        ]
+        lambdas = self.mixing_weights(local_weights, global_weights)
+        if not isinstance(lambdas, list):
+            lambdas = [lambdas] * len(global_weights)
+        self.mixed_model = []
+        for g, w, lambda_ in zip(global_weights, local_weights, lambdas):
+            # lambda * g + (1 - lambda) * w, computed in the array of g
+            mixed = g if g.flags.writeable else g.copy()
+            mixed -= w
+            mixed *= lambda_
+            mixed += w
+            self.mixed_model.append(mixed)
+
+
+class InPlaceFedPlusLocalTrainingHandler(InPlaceFedPlusMixin, FedPlusLocalTrainingHandler):
+    """`FedPlusLocalTrainingHandler` with in-place soft updates."""
+
+
+class InPlaceFedAvgFedPlusLocalTrainingHandler(MixedModelFedPlusMixin, FedAvgFedPlusLocalTrainingHandler):
+    """`FedAvgFedPlusLocalTrainingHandler` with in-place blending."""
+
+    def mixing_weights(self, local_weights, global_weights):
+        return self.rho / (1 + self.rho)
+
+
+class InPlaceGeometricMedianFedPlusLocalTrainingHandler(
+    MixedModelFedPlusMixin, GeometricMedianFedPlusLocalTrainingHandler
+):
+    """`GeometricMedianFedPlusLocalTrainingHandler` with in-place blending."""
+
+    def mixing_weights(self, local_weights, global_weights):
+        # norm of the whole difference, layer by layer instead of concatenated
+        squared = sum(float(np.sum(np.square(g - w))) for g, w in zip(global_weights, local_weights))
+        return min(1, self.rho / (math.sqrt(squared) + EPS))
+
+
+class InPlaceCoordinateMedianFedPlusLocalTrainingHandler(
+    MixedModelFedPlusMixin, CoordinateMedianFedPlusLocalTrainingHandler
+):
+    """`CoordinateMedianFedPlusLocalTrainingHandler` with in-place blending."""
+
+    def mixing_weights(self, local_weights, global_weights):
+        lambdas = []
+        for g, w in zip(global_weights, local_weights):
+            diff = np.abs(g - w)
+            diff += EPS
+            np.divide(self.rho, diff, out=diff)
+            lambdas.append(np.minimum(diff, 1, out=diff))
+        return lambdas
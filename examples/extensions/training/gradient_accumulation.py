@@ -0,0 +1,196 @@
+"""
+Gradient local training in micro-batches.
+
+`GradientLocalTrainingHandler` computes the gradient of the whole party
+dataset with one `fl_model.get_gradient` call, i.e., one forward and
+backward pass over all samples held in memory at once.
+`ChunkedGradientLocalTrainingHandler` calls `get_gradient` on micro-batches
+of `gradient_batch_size` rows and accumulates the gradients, weighted by
+the size of each micro-batch, in place into buffers allocated once per
+round. For losses averaged over the batch, which is the default of Keras
+and TensorFlow, the result is the gradient of the whole dataset. With
+`gradient_sample_size` set, every round uses the gradient of a random
+sample of that many rows instead, as in mini-batch SGD.
+
+    local_training:
+      name: ChunkedGradientLocalTrainingHandler
+      path: examples.extensions.training.gradient_accumulation
+      info:
+        gradient_batch_size: 512
+        gradient_sample_size: 4096    # optional
+        seed: 0                       # optional
+
+Both values can also be set per round in `hyperparams.local.training`.
+Data handlers with `get_train_stream` (see
+`examples.extensions.data.batch_stream`) are read batch by batch, others
+through `get_data`.
+"""
+import logging
+
+import numpy as np
+
+from examples.extensions.data.batch_stream import BatchStream
+from ibmfl.exceptions import LocalTrainingException
+from ibmfl.model.model_update import ModelUpdate
+from ibmfl.party.training.gradient_local_training_handler import GradientLocalTrainingHandler
+
+logger = logging.getLogger(__name__)
+
+
+def gradient_to_numpy(gradient):
+    """
+    Converts a layer gradient returned by `get_gradient`, e.g., a
+    `tf.Tensor` or `tf.IndexedSlices`, to a dense numpy array.
+
+    :param gradient: gradient of one layer
+    :return: dense gradient
+    :rtype: `np.ndarray`
+    """
+    if hasattr(gradient, "indices") and hasattr(gradient, "dense_shape"):
+        import tensorflow as tf
+
+        gradient = tf.convert_to_tensor(gradient)
+    if hasattr(gradient, "numpy"):
+        gradient = gradient.numpy()
+    return np.asarray(gradient)
+
+
+class GradientAccumulator:
+    """
+    Sample-weighted mean of per-batch gradients, accumulated in place.
+    """
+
+    def __init__(self):
+        self.sums = None
+        self.scratch = None
+        self.num_samples = 0
+
+    def reset(self):
+        """Starts a new accumulation; the scratch buffers are kept."""
+        self.sums = None
+        self.num_samples = 0
+
+    def add(self, gradients, num_samples):
+        """
+        Adds the mean gradient of a batch of `num_samples` rows.
+
+        :param gradients: gradient of every layer
+        :type gradients: `list`
+        :param num_samples: rows of the batch
+        :type num_samples: `int`
+        :return: None
+        """
+        gradients = [gradient_to_numpy(gradient) for gradient in gradients]
+        if self.sums is None:
+            shapes = [(gradient.shape, gradient.dtype) for gradient in gradients]
+            if self.scratch is None or [(s.shape, s.dtype) for s in self.scratch] != shapes:
+                self.scratch = [np.empty_like(gradient) for gradient in gradients]
+            self.sums = [np.zeros_like(gradient) for gradient in gradients]
+        elif len(gradients) != len(self.sums):
+            raise LocalTrainingException(
+                "Got gradients of {} layers, expected {}".format(len(gradients), len(self.sums))
+            )
+        for total, scratch, gradient in zip(self.sums, self.scratch, gradients):
+            np.multiply(gradient, num_samples, out=scratch, casting="unsafe")
+            total += scratch
+        self.num_samples += num_samples
+
+    def result(self):
+        """
+        Returns the mean gradient over all added rows. The buffers are handed
+        over and not reused.
+
+        :return: gradient of every layer
+        :rtype: `list` of `np.ndarray`
+        """
+        if not self.num_samples:
+            raise LocalTrainingException("No training samples to compute the gradient on.")
+        sums = self.sums
+        for total in sums:
+            total /= self.num_samples
+        self.reset()
+        return sums
+
+
+class ChunkedGradientLocalTrainingHandler(GradientLocalTrainingHandler):
+    """
+    `GradientLocalTrainingHandler` that accumulates the gradient over
+    micro-batches, optionally of a random sample of the local data.
+    """
+
+    def __init__(self, fl_model, data_handler, hyperparams=None, evidencia=None, **kwargs):
+        super().__init__(fl_model, data_handler, hyperparams=hyperparams, evidencia=evidencia, **kwargs)
+        info = kwargs.get("info") or {}
+        self.gradient_batch_size = info.get("gradient_batch_size", 512)
+        self.gradient_sample_size = info.get("gradient_sample_size")
+        self.rng = np.random.RandomState(info.get("seed"))
+        self.accumulator = GradientAccumulator()
+
+    def get_train_stream(self, batch_size):
+        """
+        Returns the local training data as an unshuffled `BatchStream`.
+
+        :param batch_size: rows per micro-batch
+        :type batch_size: `int`
+        :rtype: `BatchStream`
+        """
+        if hasattr(self.data_handler, "get_train_stream"):
+            return self.data_handler.get_train_stream(batch_size=batch_size, shuffle=False)
+        (x_train, y_train), _ = self.data_handler.get_data()
+        return BatchStream(x_train, y_train, batch_size=batch_size, prefetch=0)
+
+    def iter_micro_batches(self, batch_size, sample_size=None):
+        """
+        Yields the micro-batches of one gradient computation.
+
+        :param batch_size: rows per micro-batch
+        :type batch_size: `int`
+        :param sample_size: rows sampled without replacement, or None for \
+        all rows
+        :type sample_size: `int`
+        :return: generator of `(x, y)`
+        """
+        stream = self.get_train_stream(batch_size)
+        if not sample_size or sample_size >= stream.num_samples:
+            yield from stream
+            return
+        rows = np.sort(self.rng.choice(stream.num_samples, int(sample_size), replace=False))
+        for start in range(0, len(rows), batch_size):
+            yield stream.read_batch(rows[start : start + batch_size])
+
+    def train(self, fit_params):
+        """
+        Computes the gradient at the weights in `fit_params` over
+        micro-batches of the local data.
+
+        :param fit_params: Query instruction containing a set of model weights \
+         from aggregator
+        :type fit_params: `dict`
+        :return: ModelUpdate
+        :rtype: `ModelUpdate`
+        """
+        current_weight = fit_params.get("model_update") or None
+        if current_weight is None:
+            raise LocalTrainingException(
+                "New set of model weights must be " "provided to retrieve " "gradient information."
+            )
+        self.update_model(current_weight)
+
+        training_hp = ((fit_params.get("hyperparams") or {}).get("local") or {}).get("training") or {}
+        batch_size = int(training_hp.get("gradient_batch_size", self.gradient_batch_size))
+        sample_size = training_hp.get("gradient_sample_size", self.gradient_sample_size)
+
+        logger.info("Local training started...")
+
+        self.accumulator.reset()
+        for x, y in self.iter_micro_batches(batch_size, sample_size):
+            self.accumulator.add(self.fl_model.get_gradient((x, y)), len(x))
+        num_samples = self.accumulator.num_samples
+        gradient = self.accumulator.result()
+        logger.info("Accumulated the gradient over %d samples in micro-batches of %d", num_samples, batch_size)
+
+        update = ModelUpdate(gradients=gradient)
+
+        logger.info("Local training done, generating model update...")
+
+        return update
@@ -0,0 +1,197 @@
+"""
+Deferred imports for a faster aggregator and party startup.
+
+`ibmfl.util.config.get_cls_by_config` imports the module of every class
+named in a config while it reads the config. Naming `KerasFLModel` imports
+keras and tensorflow, naming `RLlibFLModel` imports ray, whether or not the
+process goes on to create the object. Within `lazy_class_resolution()` the
+config loader returns a `LazyClassRef` for every `name`/`path` entry
+instead, which imports the module when the class is first called or one of
+its attributes is read:
+
+    with lazy_class_resolution():
+        aggregator = Aggregator(config_file="config_agg.yml")
+
+Sections the process never instantiates, such as the `local_training` or
+`metrics_recorder` section of a shared aggregator config, then never
+import their frameworks. A class path that cannot be imported raises the
+usual `InvalidConfigurationException`, but at first use instead of while
+the config is read. `resolve_classes` restores the early check for a
+parsed config.
+
+`lazy_import` does the same for modules that only some code paths need:
+
+    tf = lazy_import("tensorflow")
+"""
+import importlib
+import logging
+import sys
+import threading
+import types
+from contextlib import contextmanager
+
+from ibmfl.util import config as ibmfl_config
+
+logger = logging.getLogger(__name__)
+
+# the eager resolver, kept while the config module refers to the lazy one
+_get_class_by_name = ibmfl_config.get_class_by_name
+_resolution_lock = threading.Lock()
+_resolution_depth = 0
+
+
+class LazyModule(types.ModuleType):
+    """
+    Module proxy that imports the module on the first attribute access.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_lazy_lock"] = threading.Lock()
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            with self._lazy_lock:
+                module = self.__dict__["_lazy_module"]
+                if module is None:
+                    logger.debug("Importing %s on first use", self.__name__)
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__["_lazy_module"] = module
+        return module
+
+    @property
+    def is_loaded(self):
+        return self.__dict__["_lazy_module"] is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.is_loaded else "not loaded"
+        return "<lazy module '{}' ({})>".format(self.__name__, state)
+
+
+def lazy_import(name):
+    """
+    Returns the module if it was imported already, and a `LazyModule` that
+    imports it on first use otherwise.
+
+    :param name: absolute module name, e.g. `tensorflow`
+    :type name: `str`
+    :return: module or module proxy
+    :rtype: `types.ModuleType`
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+class LazyClassRef:
+    """
+    Stand-in for a class named in a config. The class is resolved with
+    `ibmfl.util.config.get_class_by_name` on the first call or attribute
+    access, and calling the reference instantiates the class.
+    """
+
+    def __init__(self, path, name):
+        """
+        :param path: module path or file path of the class
+        :type path: `str`
+        :param name: class name
+        :type name: `str`
+        """
+        self.path = path
+        self.name = name
+        self._cls = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        """
+        Imports the module and returns the class.
+
+        :return: the class
+        :rtype: `type`
+        :raises `InvalidConfigurationException`: if the class cannot be \
+        loaded
+        """
+        if self._cls is None:
+            with self._lock:
+                if self._cls is None:
+                    logger.debug("Resolving %s from %s", self.name, self.path)
+                    self._cls = _get_class_by_name(self.path, self.name)
+        return self._cls
+
+    @property
+    def is_resolved(self):
+        return self._cls is not None
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        if attr in ("_cls", "_lock", "path", "name") or (
+            attr.startswith("__") and attr not in ("__name__", "__qualname__")
+        ):
+            raise AttributeError(attr)
+        return getattr(self.resolve(), attr)
+
+    def __reduce__(self):
+        # copies and pickles resolve again on first use
+        return LazyClassRef, (self.path, self.name)
+
+    def __repr__(self):
+        return "LazyClassRef({!r}, {!r})".format(self.path, self.name)
+
+
+def lazy_class_by_name(path, name_class):
+    """
+    Drop-in replacement of `ibmfl.util.config.get_class_by_name` that
+    returns a `LazyClassRef`.
+
+    :rtype: `LazyClassRef`
+    """
+    return LazyClassRef(path, name_class)
+
+
+@contextmanager
+def lazy_class_resolution():
+    """
+    Makes the config loader of `ibmfl.util.config` return `LazyClassRef`s
+    for the duration of the block. The context can be nested and entered
+    from several threads; the loader is restored when the last one exits.
+    Code that imported `get_class_by_name` by name is not affected.
+    """
+    global _resolution_depth
+    with _resolution_lock:
+        if _resolution_depth == 0:
+            ibmfl_config.get_class_by_name = lazy_class_by_name
+        _resolution_depth += 1
+    try:
+        yield
+    finally:
+        with _resolution_lock:
+            _resolution_depth -= 1
+            if _resolution_depth == 0:
+                ibmfl_config.get_class_by_name = _get_class_by_name
+
+
+def resolve_classes(cls_config):
+    """
+    Resolves the `LazyClassRef`s of a config returned by the config loader,
+    so that wrong class paths are reported up front.
+
+    :param cls_config: config with `cls_ref` entries
+    :type cls_config: `dict`
+    :return: the config, with classes in place of the references
+    :rtype: `dict`
+    """
+    for section in cls_config.values():
+        if isinstance(section, dict) and isinstance(section.get("cls_ref"), LazyClassRef):
+            section["cls_ref"] = section["cls_ref"].resolve()
+    return cls_config
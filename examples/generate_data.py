@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 import argparse
-import csv
 import os
 import pickle
+import shutil
 import sys
 import time
 from random import shuffle
@@ -23,7 +23,6 @@ from ibmfl.util.datasets import (
     load_diabetes,
     load_german,
     load_higgs,
-    load_leaf_femnist,
     load_linovf,
     load_mnist,
     load_multovf,
@@ -34,15 +33,28 @@ from ibmfl.util.datasets import (
 
 from examples.constants import (
     DATASET_DESC,
+    DIRICHLET_ALPHA_DESC,
     FL_DATASETS,
     GENERATE_DATA_DESC,
     NAME_DESC,
     NEW_DESC,
+    NPY_SHARD_DATASETS,
+    NPY_SHARDS_DESC,
+    NPY_SHARDS_ERR,
     NUM_PARTIES_DESC,
     PATH_DESC,
     PER_PARTY,
     PER_PARTY_ERR,
     STRATIFY_DESC,
+    WRITE_WORKERS_DESC,
+)
+from examples.extensions.data.leaf_cache import load_leaf_femnist_cached
+from examples.extensions.data.partitioning import (
+    as_labels,
+    dirichlet_proportions,
+    map_parties,
+    sample_party_indices,
+    write_party_shards,
 )
 
 
@@ -61,6 +73,9 @@ def setup_parser():
     p.add_argument("--stratify", "-s", help=STRATIFY_DESC, action="store_true")
     p.add_argument("--create_new", "-new", action="store_true", help=NEW_DESC)
     p.add_argument("--name", help=NAME_DESC)
+    p.add_argument("--dirichlet_alpha", "-a", help=DIRICHLET_ALPHA_DESC, type=float)
+    p.add_argument("--npy", help=NPY_SHARDS_DESC, action="store_true")
+    p.add_argument("--workers", "-w", help=WRITE_WORKERS_DESC, type=int)
     return p
 
 
@@ -71,7 +86,144 @@ def print_statistics(i, x_test_pi, x_train_pi, nb_labels, y_train_pi):
         print("* Label ", l, " samples: ", (y_train_pi == l).sum())
 
 
-def save_nursery_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder):
+def print_split_statistics(x_train, y_train, x_test, train_indices, test_indices, nb_labels, first=0):
+    # the statistics of print_statistics, from the indices instead of the party arrays
+    y_train = as_labels(y_train)
+    for i, (train_idx, test_idx) in enumerate(zip(train_indices, test_indices), first):
+        print("Party_", i)
+        print(
+            "nb_x_train: ",
+            (len(train_idx),) + np.shape(x_train)[1:],
+            "nb_x_test: ",
+            (len(test_idx),) + np.shape(x_test)[1:],
+        )
+        y_train_pi = y_train[train_idx]
+        for l in range(nb_labels):
+            print("* Label ", l, " samples: ", (y_train_pi == l).sum())
+
+
+def write_frame_shards(party_folder, frame, party_indices, max_workers=None):
+    """
+    Writes the rows of every party as `data_party<i>.csv` with a header, from a thread pool
+
+    :param party_folder: folder to save party data
+    :type party_folder: `str`
+    :param frame: the dataset
+    :type frame: `pandas.DataFrame`
+    :param party_indices: row indices of every party
+    :type party_indices: `list[np.ndarray]`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
+    """
+
+    def write_party(i):
+        # Use indices for data/classification subset
+        name_file = os.path.join(party_folder, "data_party" + str(i) + ".csv")
+        frame.iloc[party_indices[i]].to_csv(path_or_buf=name_file, index=None)
+
+    map_parties(write_party, len(party_indices), max_workers)
+
+
+def write_csv_shards(party_folder, x, y, party_indices, max_workers=None):
+    """
+    Writes the features and the integer label of every party's rows as `data_party<i>.csv` \
+    without a header, from a thread pool
+
+    :param party_folder: folder to save party data
+    :type party_folder: `str`
+    :param x: features
+    :type x: `np.ndarray`
+    :param y: labels
+    :type y: `np.ndarray`
+    :param party_indices: row indices of every party
+    :type party_indices: `list[np.ndarray]`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
+    """
+
+    def write_party(i):
+        # Use indices for data/classification subset
+        indices = party_indices[i]
+        x_part = [",".join(item) for item in x[indices, :].astype(str)]
+        y_part = y[indices]
+
+        # Write to File
+        name_file = os.path.join(party_folder, "data_party" + str(i) + ".csv")
+        with open(name_file, "w") as out:
+            for x_row, y_row in zip(x_part, y_part):
+                out.write(x_row + "," + str(int(y_row)) + "\n")
+
+    map_parties(write_party, len(party_indices), max_workers)
+
+
+def save_split_party_data(
+    x_train,
+    y_train,
+    x_test,
+    y_test,
+    nb_dp_per_party,
+    nb_test_per_party,
+    should_stratify,
+    party_folder,
+    dirichlet_alpha=None,
+    shard_format="npz",
+    max_workers=None,
+):
+    """
+    Samples the training and test data of all parties at once and writes their shards in parallel. \
+    With `dirichlet_alpha`, the test data of a party follows the label distribution of its training data.
+
+    :param nb_dp_per_party: the number of training data points each party should have
+    :type nb_dp_per_party: `list[int]`
+    :param nb_test_per_party: the number of test data points each party should have
+    :type nb_test_per_party: `list[int]`
+    :param should_stratify: True if data should be assigned proportional to source class distributions
+    :type should_stratify: `bool`
+    :param party_folder: folder to save party data
+    :type party_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param shard_format: `npz`, or `npy` for memory-mappable .npy directories
+    :type shard_format: `str`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
+    """
+    labels, train_counts = np.unique(y_train, return_counts=True)
+    te_labels = np.unique(y_test)
+    if not np.all(np.isin(labels, te_labels)):
+        print("Warning: test set and train set contain different labels")
+    num_labels = len(te_labels)
+    nb_parties = len(nb_dp_per_party)
+
+    proportions = None
+    if dirichlet_alpha is not None:
+        # Sample each party's label distribution, around the source label distribution if stratified
+        prior = train_counts if should_stratify else np.ones(len(labels))
+        proportions = dirichlet_proportions(nb_parties, dirichlet_alpha, prior)
+    train_indices = sample_party_indices(
+        y_train, nb_dp_per_party, should_stratify, proportions=proportions, labels=labels
+    )
+    test_indices = sample_party_indices(
+        y_test, nb_test_per_party, should_stratify, proportions=proportions, labels=labels
+    )
+
+    def get_shard(idx):
+        return {
+            "x_train": x_train[train_indices[idx]],
+            "y_train": y_train[train_indices[idx]],
+            "x_test": x_test[test_indices[idx]],
+            "y_test": y_test[test_indices[idx]],
+        }
+
+    write_party_shards(party_folder, nb_parties, get_shard, shard_format, max_workers)
+    print_split_statistics(x_train, y_train, x_test, train_indices, test_indices, num_labels)
+
+    print("Finished! :) Data saved in ", party_folder)
+
+
+def save_nursery_party_data(
+    nb_dp_per_party, should_stratify, party_folder, dataset_folder, dirichlet_alpha=None, max_workers=None
+):
     """
     Saves Nursery party data
 
@@ -83,40 +235,25 @@ def save_nursery_party_data(nb_dp_per_party, should_stratify, party_folder, data
     :type party_folder: `str`
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     if not os.path.exists(dataset_folder):
         os.makedirs(dataset_folder)
     x_train = load_nursery(download_dir=dataset_folder)
-    num_train = len(x_train.index)
-    y_train = x_train["class"].values.tolist()
-    labels, counts = np.unique(y_train, return_counts=True)
-
-    if should_stratify:
-        probs = {label: counts[np.where(labels == label)[0][0]] / float(num_train) for label in labels}
-    else:
-        probs = {label: 1.0 / num_train for label in labels}
-
-    p_list = np.array([probs[y_train[idx]] for idx in range(num_train)])
-    p_list /= np.sum(p_list)
-    for i, dp in enumerate(nb_dp_per_party):
-        # Create variable for indices
-        indices = np.random.choice(num_train, dp, p=p_list)
-        indices = indices.tolist()
-        # Use indices for data/classification subset
-        x_train_pi = x_train.iloc[indices]
-
-        name_file = "data_party" + str(i) + ".csv"
-        name_file = os.path.join(party_folder, name_file)
-        with open(name_file, "w") as writeFile:
-            writer = csv.writer(writeFile)
-            writer.writerows(x_train_pi)
-
-        x_train_pi.to_csv(path_or_buf=name_file, index=None)
+    party_indices = sample_party_indices(
+        x_train["class"].values, nb_dp_per_party, should_stratify, dirichlet_alpha=dirichlet_alpha
+    )
+    write_frame_shards(party_folder, x_train, party_indices, max_workers)
 
     print("Finished! :) Data saved in", party_folder)
 
 
-def save_adult_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder):
+def save_adult_party_data(
+    nb_dp_per_party, should_stratify, party_folder, dataset_folder, dirichlet_alpha=None, max_workers=None
+):
     """
     Saves Adult party data
 
@@ -128,46 +265,25 @@ def save_adult_party_data(nb_dp_per_party, should_stratify, party_folder, datase
     :type party_folder: `str`
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     if not os.path.exists(dataset_folder):
         os.makedirs(dataset_folder)
     x_train = load_adult(download_dir=dataset_folder)
-    num_train = len(x_train.index)
-    y_train = x_train["class"].values.tolist()
-    labels, counts = np.unique(y_train, return_counts=True)
-
-    if should_stratify:
-        strat_col = y_train
-        groups, counts = np.unique(strat_col, return_counts=True)
-        # to use custom proportions, replace probs with a dictionary where key:value pairs are label:proportion
-        probs = {group: counts[np.where(groups == group)[0][0]] / float(num_train) for group in groups}
-        p_list = np.array([probs[strat_col[idx]] for idx in range(num_train)])
-        p_list /= np.sum(p_list)
-
-    else:
-        probs = {label: 1.0 / num_train for label in labels}
-        p_list = np.array([probs[y_train[idx]] for idx in range(num_train)])
-        p_list /= np.sum(p_list)
-
-    for i, dp in enumerate(nb_dp_per_party):
-        # Create variable for indices
-        indices = np.random.choice(num_train, dp, p=p_list)
-        indices = indices.tolist()
-        # Use indices for data/classification subset
-        x_train_pi = x_train.iloc[indices]
-
-        name_file = "data_party" + str(i) + ".csv"
-        name_file = os.path.join(party_folder, name_file)
-        with open(name_file, "w") as writeFile:
-            writer = csv.writer(writeFile)
-            writer.writerows(x_train_pi)
-
-        x_train_pi.to_csv(path_or_buf=name_file, index=None)
+    party_indices = sample_party_indices(
+        x_train["class"].values, nb_dp_per_party, should_stratify, dirichlet_alpha=dirichlet_alpha
+    )
+    write_frame_shards(party_folder, x_train, party_indices, max_workers)
 
     print("Finished! :) Data saved in", party_folder)
 
 
-def save_german_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder):
+def save_german_party_data(
+    nb_dp_per_party, should_stratify, party_folder, dataset_folder, dirichlet_alpha=None, max_workers=None
+):
     """
     Saves German Credit Scorning party data
     :param nb_dp_per_party: the number of data points each party should have
@@ -178,40 +294,25 @@ def save_german_party_data(nb_dp_per_party, should_stratify, party_folder, datas
     :type party_folder: `str`
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     if not os.path.exists(dataset_folder):
         os.makedirs(dataset_folder)
     x_train = load_german(download_dir=dataset_folder)
-    num_train = len(x_train.index)
-    y_train = x_train["class"].values.tolist()
-    labels, counts = np.unique(y_train, return_counts=True)
-
-    if should_stratify:
-        probs = {label: counts[np.where(labels == label)[0][0]] / float(num_train) for label in labels}
-    else:
-        probs = {label: 1.0 / num_train for label in labels}
-
-    p_list = np.array([probs[y_train[idx]] for idx in range(num_train)])
-    p_list /= np.sum(p_list)
-    for i, dp in enumerate(nb_dp_per_party):
-        # Create variable for indices
-        indices = np.random.choice(num_train, dp, p=p_list)
-        indices = indices.tolist()
-        # Use indices for data/classification subset
-        x_train_pi = x_train.iloc[indices]
-
-        name_file = "data_party" + str(i) + ".csv"
-        name_file = os.path.join(party_folder, name_file)
-        with open(name_file, "w") as writeFile:
-            writer = csv.writer(writeFile)
-            writer.writerows(x_train_pi)
-
-        x_train_pi.to_csv(path_or_buf=name_file, index=None)
+    party_indices = sample_party_indices(
+        x_train["class"].values, nb_dp_per_party, should_stratify, dirichlet_alpha=dirichlet_alpha
+    )
+    write_frame_shards(party_folder, x_train, party_indices, max_workers)
 
     print("Finished! :) Data saved in", party_folder)
 
 
-def save_compas_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder):
+def save_compas_party_data(
+    nb_dp_per_party, should_stratify, party_folder, dataset_folder, dirichlet_alpha=None, max_workers=None
+):
     """
     Saves Compas party data
 
@@ -223,40 +324,31 @@ def save_compas_party_data(nb_dp_per_party, should_stratify, party_folder, datas
     :type party_folder: `str`
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     if not os.path.exists(dataset_folder):
         os.makedirs(dataset_folder)
     x_train = load_compas(download_dir=dataset_folder)
-    num_train = len(x_train.index)
-    y_train = x_train["class"].values.tolist()
-    labels, counts = np.unique(y_train, return_counts=True)
-
-    if should_stratify:
-        probs = {label: counts[np.where(labels == label)[0][0]] / float(num_train) for label in labels}
-    else:
-        probs = {label: 1.0 / num_train for label in labels}
-
-    p_list = np.array([probs[y_train[idx]] for idx in range(num_train)])
-    p_list /= np.sum(p_list)
-    for i, dp in enumerate(nb_dp_per_party):
-        # Create variable for indices
-        indices = np.random.choice(num_train, dp, p=p_list)
-        indices = indices.tolist()
-        # Use indices for data/classification subset
-        x_train_pi = x_train.iloc[indices]
-
-        name_file = "data_party" + str(i) + ".csv"
-        name_file = os.path.join(party_folder, name_file)
-        with open(name_file, "w") as writeFile:
-            writer = csv.writer(writeFile)
-            writer.writerows(x_train_pi)
-
-        x_train_pi.to_csv(path_or_buf=name_file, index=None)
+    party_indices = sample_party_indices(
+        x_train["class"].values, nb_dp_per_party, should_stratify, dirichlet_alpha=dirichlet_alpha
+    )
+    write_frame_shards(party_folder, x_train, party_indices, max_workers)
 
     print("Finished! :) Data saved in", party_folder)
 
 
-def save_cifar10_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder):
+def save_cifar10_party_data(
+    nb_dp_per_party,
+    should_stratify,
+    party_folder,
+    dataset_folder,
+    dirichlet_alpha=None,
+    shard_format="npz",
+    max_workers=None,
+):
     """
     Saves Cifar10 party data
 
@@ -268,55 +360,44 @@ def save_cifar10_party_data(nb_dp_per_party, should_stratify, party_folder, data
     :type party_folder: `str`
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param shard_format: `npz`, or `npy` for memory-mappable .npy directories
+    :type shard_format: `str`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     if not os.path.exists(dataset_folder):
         os.makedirs(dataset_folder)
     (x_train, y_train), (x_test, y_test) = load_cifar10(download_dir=dataset_folder)
-    labels, train_counts = np.unique(y_train, return_counts=True)
-    te_labels, test_counts = np.unique(y_test, return_counts=True)
-    if np.all(np.isin(labels, te_labels)):
-        print("Warning: test set and train set contain different labels")
-
-    num_train = np.shape(y_train)[0]
-    num_test = np.shape(y_test)[0]
-    num_labels = np.shape(np.unique(y_test))[0]
     nb_parties = len(nb_dp_per_party)
 
-    if should_stratify:
-        # Sample according to source label distribution
-        train_probs = {label: train_counts[label] / float(num_train) for label in labels}
-        test_probs = {label: test_counts[label] / float(num_test) for label in te_labels}
-    else:
-        # Sample uniformly
-        train_probs = {label: 1.0 / len(labels) for label in labels}
-        test_probs = {label: 1.0 / len(te_labels) for label in te_labels}
-    for idx, dp in enumerate(nb_dp_per_party):
-        train_p = np.array([train_probs[y_train[idx]] for idx in range(num_train)])
-        train_p = np.array(train_p)
-        train_p /= np.sum(train_p)
-        train_indices = np.random.choice(num_train, dp, p=train_p)
-        test_p = np.array([test_probs[y_test[idx]] for idx in range(num_test)])
-        test_p /= np.sum(test_p)
-
-        # Split test evenly
-        test_indices = np.random.choice(num_test, int(num_test / nb_parties), p=test_p)
-
-        x_train_pi = x_train[train_indices]
-        y_train_pi = y_train[train_indices]
-        x_test_pi = x_test[test_indices]
-        y_test_pi = y_test[test_indices]
-
-        # Now put it all in an npz
-        name_file = "data_party" + str(idx) + ".npz"
-        name_file = os.path.join(party_folder, name_file)
-        np.savez(name_file, x_train=x_train_pi, y_train=y_train_pi, x_test=x_test_pi, y_test=y_test_pi)
-
-        print_statistics(idx, x_test_pi, x_train_pi, num_labels, y_train_pi)
-
-        print("Finished! :) Data saved in ", party_folder)
-
-
-def save_mnist_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder):
+    # Split test evenly
+    nb_test_per_party = [int(np.shape(y_test)[0] / nb_parties)] * nb_parties
+    save_split_party_data(
+        x_train,
+        y_train,
+        x_test,
+        y_test,
+        nb_dp_per_party,
+        nb_test_per_party,
+        should_stratify,
+        party_folder,
+        dirichlet_alpha=dirichlet_alpha,
+        shard_format=shard_format,
+        max_workers=max_workers,
+    )
+
+
+def save_mnist_party_data(
+    nb_dp_per_party,
+    should_stratify,
+    party_folder,
+    dataset_folder,
+    dirichlet_alpha=None,
+    shard_format="npz",
+    max_workers=None,
+):
     """
     Saves MNIST party data
 
@@ -330,55 +411,38 @@ def save_mnist_party_data(nb_dp_per_party, should_stratify, party_folder, datase
     :type data_path: `str`
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param shard_format: `npz`, or `npy` for memory-mappable .npy directories
+    :type shard_format: `str`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     if not os.path.exists(dataset_folder):
         os.makedirs(dataset_folder)
     (x_train, y_train), (x_test, y_test) = load_mnist(download_dir=dataset_folder)
-    labels, train_counts = np.unique(y_train, return_counts=True)
-    te_labels, test_counts = np.unique(y_test, return_counts=True)
-    if np.all(np.isin(labels, te_labels)):
-        print("Warning: test set and train set contain different labels")
-
-    num_train = np.shape(y_train)[0]
-    num_test = np.shape(y_test)[0]
-    num_labels = np.shape(np.unique(y_test))[0]
     nb_parties = len(nb_dp_per_party)
 
-    if should_stratify:
-        # Sample according to source label distribution
-        train_probs = {label: train_counts[label] / float(num_train) for label in labels}
-        test_probs = {label: test_counts[label] / float(num_test) for label in te_labels}
-    else:
-        # Sample uniformly
-        train_probs = {label: 1.0 / len(labels) for label in labels}
-        test_probs = {label: 1.0 / len(te_labels) for label in te_labels}
-
-    for idx, dp in enumerate(nb_dp_per_party):
-        train_p = np.array([train_probs[y_train[idx]] for idx in range(num_train)])
-        train_p /= np.sum(train_p)
-        train_indices = np.random.choice(num_train, dp, p=train_p)
-        test_p = np.array([test_probs[y_test[idx]] for idx in range(num_test)])
-        test_p /= np.sum(test_p)
-
-        # Split test evenly
-        test_indices = np.random.choice(num_test, int(num_test / nb_parties), p=test_p)
-
-        x_train_pi = x_train[train_indices]
-        y_train_pi = y_train[train_indices]
-        x_test_pi = x_test[test_indices]
-        y_test_pi = y_test[test_indices]
-
-        # Now put it all in an npz
-        name_file = "data_party" + str(idx) + ".npz"
-        name_file = os.path.join(party_folder, name_file)
-        np.savez(name_file, x_train=x_train_pi, y_train=y_train_pi, x_test=x_test_pi, y_test=y_test_pi)
-
-        print_statistics(idx, x_test_pi, x_train_pi, num_labels, y_train_pi)
-
-        print("Finished! :) Data saved in ", party_folder)
-
-
-def save_higgs_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder):
+    # Split test evenly
+    nb_test_per_party = [int(np.shape(y_test)[0] / nb_parties)] * nb_parties
+    save_split_party_data(
+        x_train,
+        y_train,
+        x_test,
+        y_test,
+        nb_dp_per_party,
+        nb_test_per_party,
+        should_stratify,
+        party_folder,
+        dirichlet_alpha=dirichlet_alpha,
+        shard_format=shard_format,
+        max_workers=max_workers,
+    )
+
+
+def save_higgs_party_data(
+    nb_dp_per_party, should_stratify, party_folder, dataset_folder, dirichlet_alpha=None, max_workers=None
+):
     """
     Saves Higgs Boson party data
 
@@ -390,42 +454,24 @@ def save_higgs_party_data(nb_dp_per_party, should_stratify, party_folder, datase
     :type party_folder: `str`
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     if not os.path.exists(dataset_folder):
         os.makedirs(dataset_folder)
 
     x, y = load_higgs(dataset_folder)
-    num_train = len(x)
-    labels, counts = np.unique(y, return_counts=True)
-
-    if should_stratify:
-        probs = {label: counts[np.where(labels == label)[0][0]] / float(num_train) for label in labels}
-    else:
-        probs = {label: 1.0 / num_train for label in labels}
-
-    p_list = np.array([probs[y[idx]] for idx in range(num_train)])
-    p_list /= np.sum(p_list)
-    for i, dp in enumerate(nb_dp_per_party):
-        # Create variable for indices
-        indices = np.random.choice(num_train, dp, p=p_list)
-        indices = indices.tolist()
-
-        # Use indices for data/classification subset
-        x_part = [",".join(item) for item in x[indices, :].astype(str)]
-        y_part = y[indices]
-
-        # Write to File
-        name_file = "data_party" + str(i) + ".csv"
-        name_file = os.path.join(party_folder, name_file)
-        out = open(name_file, "w")
-        for i in range(len(x_part)):
-            out.write(x_part[i] + "," + str(int(y_part[i])) + "\n")
-        out.close()
+    party_indices = sample_party_indices(y, nb_dp_per_party, should_stratify, dirichlet_alpha=dirichlet_alpha)
+    write_csv_shards(party_folder, x, y, party_indices, max_workers)
 
     print("Finished! :) Data saved in", party_folder)
 
 
-def save_airline_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder):
+def save_airline_party_data(
+    nb_dp_per_party, should_stratify, party_folder, dataset_folder, dirichlet_alpha=None, max_workers=None
+):
     """
     Saves Airline Delay party data
 
@@ -437,57 +483,24 @@ def save_airline_party_data(nb_dp_per_party, should_stratify, party_folder, data
     :type party_folder: `str`
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     if not os.path.exists(dataset_folder):
         os.makedirs(dataset_folder)
 
     X, y = load_airline(dataset_folder)
-    num_train = len(X)
-    labels, counts = np.unique(y, return_counts=True)
-
-    if should_stratify:
-        probs = {label: counts[np.where(labels == label)[0][0]] / float(num_train) for label in labels}
-    else:
-        probs = {label: 1.0 / num_train for label in labels}
-
-    for i, dp in enumerate(nb_dp_per_party):
-        """
-        # Even Parties Have Biased Dataset, Odd Are Randomly Sampled
-        if not should_stratify and i % 2 == 0:
-            # Unbalanced Dataset
-            niid_prob = {label: 1.0 / num_train * 2 for label in labels}
-
-            p_list = np.array([niid_prob[y[idx]] for idx in range(num_train)])
-            p_list /= np.sum(p_list)
-        else:
-            # Regular Dataset
-            p_list = np.array([probs[y[idx]] for idx in range(num_train)])
-            p_list /= np.sum(p_list)
-        """
-
-        # Regular Dataset
-        p_list = np.array([probs[y[idx]] for idx in range(num_train)])
-        p_list /= np.sum(p_list)
-
-        indices = np.random.choice(num_train, dp, p=p_list)
-        indices = indices.tolist()
-
-        # Use indices for data/classification subset
-        x_part = [",".join(item) for item in X[indices, :].astype(str)]
-        y_part = y[indices]
-
-        # Write to File
-        name_file = "data_party" + str(i) + ".csv"
-        name_file = os.path.join(party_folder, name_file)
-        out = open(name_file, "w")
-        for i in range(len(x_part)):
-            out.write(x_part[i] + "," + str(int(y_part[i])) + "\n")
-        out.close()
+    party_indices = sample_party_indices(y, nb_dp_per_party, should_stratify, dirichlet_alpha=dirichlet_alpha)
+    write_csv_shards(party_folder, X, y, party_indices, max_workers)
 
     print("Finished! :) Data saved in", party_folder)
 
 
-def save_diabetes_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder):
+def save_diabetes_party_data(
+    nb_dp_per_party, should_stratify, party_folder, dataset_folder, dirichlet_alpha=None, max_workers=None
+):
     """
     Saves Diabetes party data
 
@@ -499,47 +512,25 @@ def save_diabetes_party_data(nb_dp_per_party, should_stratify, party_folder, dat
     :type party_folder: `str`
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     if not os.path.exists(dataset_folder):
         os.makedirs(dataset_folder)
-
     x_train = load_diabetes(dataset_folder)
-    num_train = len(x_train)
-    y_train = x_train["readmitted"].values.tolist()
-    labels, counts = np.unique(y_train, return_counts=True)
-
-    if should_stratify:
-        strat_col = y_train
-        groups, counts = np.unique(strat_col, return_counts=True)
-        # to use custom proportions, replace probs with a dictionary where key:value pairs are label:proportion
-        probs = {group: counts[np.where(groups == group)[0][0]] / float(num_train) for group in groups}
-        p_list = np.array([probs[strat_col[idx]] for idx in range(num_train)])
-        p_list /= np.sum(p_list)
-
-    else:
-        probs = {label: 1.0 / num_train for label in labels}
-        p_list = np.array([probs[y_train[idx]] for idx in range(num_train)])
-        p_list /= np.sum(p_list)
-
-    for i, dp in enumerate(nb_dp_per_party):
-        # Create variable for indices
-        indices = np.random.choice(num_train, dp, p=p_list)
-        indices = indices.tolist()
-        # Use indices for data/classification subset
-        x_train_pi = x_train.iloc[indices]
-
-        name_file = "data_party" + str(i) + ".csv"
-        name_file = os.path.join(party_folder, name_file)
-        with open(name_file, "w") as writeFile:
-            writer = csv.writer(writeFile)
-            writer.writerows(x_train_pi)
-
-        x_train_pi.to_csv(path_or_buf=name_file, index=None)
+    party_indices = sample_party_indices(
+        x_train["readmitted"].values, nb_dp_per_party, should_stratify, dirichlet_alpha=dirichlet_alpha
+    )
+    write_frame_shards(party_folder, x_train, party_indices, max_workers)
 
     print("Finished! :) Data saved in", party_folder)
 
 
-def save_binovf_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder):
+def save_binovf_party_data(
+    nb_dp_per_party, should_stratify, party_folder, dataset_folder, dirichlet_alpha=None, max_workers=None
+):
     """
     Saves Binary Overfit party data
 
@@ -551,42 +542,24 @@ def save_binovf_party_data(nb_dp_per_party, should_stratify, party_folder, datas
     :type party_folder: `str`
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     if not os.path.exists(dataset_folder):
         os.makedirs(dataset_folder)
 
     X, y = load_binovf()
-    num_train = len(X)
-    labels, counts = np.unique(y, return_counts=True)
-
-    if should_stratify:
-        probs = {label: counts[np.where(labels == label)[0][0]] / float(num_train) for label in labels}
-    else:
-        probs = {label: 1.0 / num_train for label in labels}
-
-    p_list = np.array([probs[y[idx]] for idx in range(num_train)])
-    p_list /= np.sum(p_list)
-    for i, dp in enumerate(nb_dp_per_party):
-        # Create variable for indices
-        indices = np.random.choice(num_train, dp, p=p_list)
-        indices = indices.tolist()
-
-        # Use indices for data/classification subset
-        x_part = [",".join(item) for item in X[indices, :].astype(str)]
-        y_part = y[indices]
-
-        # Write to File
-        name_file = "data_party" + str(i) + ".csv"
-        name_file = os.path.join(party_folder, name_file)
-        out = open(name_file, "w")
-        for i in range(len(x_part)):
-            out.write(x_part[i] + "," + str(int(y_part[i])) + "\n")
-        out.close()
+    party_indices = sample_party_indices(y, nb_dp_per_party, should_stratify, dirichlet_alpha=dirichlet_alpha)
+    write_csv_shards(party_folder, X, y, party_indices, max_workers)
 
     print("Finished! :) Data saved in", party_folder)
 
 
-def save_multovf_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder):
+def save_multovf_party_data(
+    nb_dp_per_party, should_stratify, party_folder, dataset_folder, dirichlet_alpha=None, max_workers=None
+):
     """
     Saves Multiclass Overfit party data
 
@@ -598,47 +571,22 @@ def save_multovf_party_data(nb_dp_per_party, should_stratify, party_folder, data
     :type party_folder: `str`
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     if not os.path.exists(dataset_folder):
         os.makedirs(dataset_folder)
 
     x_train, y_train = load_multovf()
-    num_train = len(x_train)
-    labels, counts = np.unique(y_train, return_counts=True)
-
-    if should_stratify:
-        strat_col = y_train
-        groups, counts = np.unique(strat_col, return_counts=True)
-        # to use custom proportions, replace probs with a dictionary where key:value pairs are label:proportion
-        probs = {group: counts[np.where(groups == group)[0][0]] / float(num_train) for group in groups}
-        p_list = np.array([probs[strat_col[idx]] for idx in range(num_train)])
-        p_list /= np.sum(p_list)
-
-    else:
-        probs = {label: 1.0 / num_train for label in labels}
-        p_list = np.array([probs[y_train[idx]] for idx in range(num_train)])
-        p_list /= np.sum(p_list)
-
-    for i, dp in enumerate(nb_dp_per_party):
-        # Create variable for indices
-        indices = np.random.choice(num_train, dp, p=p_list)
-        indices = indices.tolist()
-
-        # Use indices for data/classification subset
-        x_part = [",".join(item) for item in x_train[indices, :].astype(str)]
-        y_part = y_train[indices]
-
-        name_file = "data_party" + str(i) + ".csv"
-        name_file = os.path.join(party_folder, name_file)
-        out = open(name_file, "w")
-        for i in range(len(x_part)):
-            out.write(x_part[i] + "," + str(int(y_part[i])) + "\n")
-        out.close()
+    party_indices = sample_party_indices(y_train, nb_dp_per_party, should_stratify, dirichlet_alpha=dirichlet_alpha)
+    write_csv_shards(party_folder, x_train, y_train, party_indices, max_workers)
 
     print("Finished! :) Data saved in", party_folder)
 
 
-def save_linovf_party_data(nb_dp_per_party, party_folder, dataset_folder):
+def save_linovf_party_data(nb_dp_per_party, party_folder, dataset_folder, max_workers=None):
     """
     Saves Linear Overfit party data (For Regression)
     Data stratification is not supported in this function.
@@ -649,6 +597,8 @@ def save_linovf_party_data(nb_dp_per_party, party_folder, dataset_folder):
     :type party_folder: `str`
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     if not os.path.exists(dataset_folder):
         os.makedirs(dataset_folder)
@@ -656,26 +606,34 @@ def save_linovf_party_data(nb_dp_per_party, party_folder, dataset_folder):
     x_train, y_train = load_linovf()
     num_train = len(x_train)
 
-    for i, dp in enumerate(nb_dp_per_party):
-        # Create variable for indices
-        indices = np.random.choice(num_train, dp)
-        indices = indices.tolist()
+    party_indices = sample_party_indices(y_train, nb_dp_per_party)
 
+    def write_party(i):
         # Use indices for data/classification subset
+        indices = party_indices[i]
         x_part = [item for item in x_train[indices].astype(str)]
         y_part = y_train[indices]
 
         name_file = "data_party" + str(i) + ".csv"
         name_file = os.path.join(party_folder, name_file)
-        out = open(name_file, "w")
-        for i in range(len(x_part)):
-            out.write(x_part[i] + "," + str(y_part[i]) + "\n")
-        out.close()
+        with open(name_file, "w") as out:
+            for x_row, y_row in zip(x_part, y_part):
+                out.write(x_row + "," + str(y_row) + "\n")
+
+    map_parties(write_party, len(nb_dp_per_party), max_workers)
 
     print("Finished! :) Data saved in", party_folder)
 
 
-def save_femnist_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder):
+def save_femnist_party_data(
+    nb_dp_per_party,
+    should_stratify,
+    party_folder,
+    dataset_folder,
+    dirichlet_alpha=None,
+    shard_format="npz",
+    max_workers=None,
+):
     """
     Saves LEAF-FEMNIST party data
 
@@ -689,6 +647,12 @@ def save_femnist_party_data(nb_dp_per_party, should_stratify, party_folder, data
     :rtype: None
     :param dataset_folder: folder to save dataset
     :type dataset_folder: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param shard_format: `npz`, or `npy` for memory-mappable .npy directories
+    :type shard_format: `str`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     dataset_folder = os.path.join(dataset_folder, "femnist")
 
@@ -698,72 +662,54 @@ def save_femnist_party_data(nb_dp_per_party, should_stratify, party_folder, data
     # FEMNIST's default data distribution based on LEAF
     if -1 in nb_dp_per_party:
         print("Generating dataset based on FEMNIST's default data distribution...")
-        partywise_data = load_leaf_femnist(download_dir=dataset_folder, orig_dist=True)
-        for idx, (_, data) in enumerate(partywise_data.items()):
-            if idx >= num_parties:
-                break
+        partywise_data = list(load_leaf_femnist_cached(download_dir=dataset_folder, orig_dist=True).values())
+        partywise_data = partywise_data[:num_parties]
+        splits = []
+        for data in partywise_data:
             train_indices = np.random.choice(len(data["x"]), int(len(data["x"]) * 0.9), replace=False)
-            test_indices = [i for i in range(len(data["x"])) if i not in train_indices]
-            x_train_pi = np.array([data["x"][i] for i in train_indices])
-            y_train_pi = np.array([data["y"][i] for i in train_indices])
-            x_test_pi = np.array([data["x"][i] for i in test_indices])
-            y_test_pi = np.array([data["y"][i] for i in test_indices])
-
-            # Now put it all in an npz
-            name_file = "data_party" + str(idx) + ".npz"
-            name_file = os.path.join(party_folder, name_file)
-            np.savez(name_file, x_train=x_train_pi, y_train=y_train_pi, x_test=x_test_pi, y_test=y_test_pi)
-            print_statistics(idx, x_test_pi, x_train_pi, 62, y_train_pi)
-            print("Finished! :) Data saved in ", party_folder)
+            splits += [(train_indices, np.setdiff1d(np.arange(len(data["x"])), train_indices))]
+
+        def get_writer_shard(idx):
+            data, (train_indices, test_indices) = partywise_data[idx], splits[idx]
+            return {
+                "x_train": data["x"][train_indices],
+                "y_train": data["y"][train_indices],
+                "x_test": data["x"][test_indices],
+                "y_test": data["y"][test_indices],
+            }
+
+        write_party_shards(party_folder, len(partywise_data), get_writer_shard, shard_format, max_workers)
+        for idx, (data, (train_indices, test_indices)) in enumerate(zip(partywise_data, splits)):
+            print_split_statistics(data["x"], data["y"], data["x"], [train_indices], [test_indices], 62, first=idx)
+        print("Finished! :) Data saved in ", party_folder)
         return
 
-    (x_train, y_train), (x_test, y_test) = load_leaf_femnist(download_dir=dataset_folder)
-    labels, train_counts = np.unique(y_train, return_counts=True)
-    te_labels, test_counts = np.unique(y_test, return_counts=True)
-    if np.all(np.isin(labels, te_labels)):
-        print("Warning: test set and train set contain different labels")
-
-    num_train = np.shape(y_train)[0]
-    num_test = np.shape(y_test)[0]
-    num_labels = np.shape(np.unique(y_test))[0]
+    (x_train, y_train), (x_test, y_test) = load_leaf_femnist_cached(download_dir=dataset_folder)
 
     # Synthetically distributed FEMNIST
-    if should_stratify:
+    if dirichlet_alpha is not None:
+        print("Generating Dirichlet non-iid FEMNIST distribution...")
+    elif should_stratify:
         print("Generating non-iid FEMNIST distribution...")
-        # Sample according to source label distribution
-        train_probs = {label: train_counts[label] / float(num_train) for label in labels}
-        test_probs = {label: test_counts[label] / float(num_test) for label in te_labels}
     else:
         print("Generating iid FEMNIST distribution...")
-        # Sample uniformly
-        train_probs = {label: 1.0 / len(labels) for label in labels}
-        test_probs = {label: 1.0 / len(te_labels) for label in te_labels}
-
-    for idx, dp in enumerate(nb_dp_per_party):
-        train_p = np.array([train_probs[y_train[idx]] for idx in range(num_train)])
-        train_p /= np.sum(train_p)
-        train_indices = np.random.choice(num_train, dp, p=train_p)
-        test_p = np.array([test_probs[y_test[idx]] for idx in range(num_test)])
-        test_p /= np.sum(test_p)
-
-        # Split test evenly
-        test_indices = np.random.choice(num_test, int(dp * 0.1), p=test_p)
-
-        x_train_pi = x_train[train_indices]
-        y_train_pi = y_train[train_indices]
-        x_test_pi = x_test[test_indices]
-        y_test_pi = y_test[test_indices]
-        # Now put it all in an npz
-        name_file = "data_party" + str(idx) + ".npz"
-        name_file = os.path.join(party_folder, name_file)
-        np.savez(name_file, x_train=x_train_pi, y_train=y_train_pi, x_test=x_test_pi, y_test=y_test_pi)
 
-        print_statistics(idx, x_test_pi, x_train_pi, num_labels, y_train_pi)
-
-        print("Finished! :) Data saved in ", party_folder)
+    save_split_party_data(
+        x_train,
+        y_train,
+        x_test,
+        y_test,
+        nb_dp_per_party,
+        [int(dp * 0.1) for dp in nb_dp_per_party],
+        should_stratify,
+        party_folder,
+        dirichlet_alpha=dirichlet_alpha,
+        shard_format=shard_format,
+        max_workers=max_workers,
+    )
 
 
-def save_federated_clustering_data(nb_dp_per_party, party_folder):
+def save_federated_clustering_data(nb_dp_per_party, party_folder, shard_format="npz", max_workers=None):
     """
     Saves simulated federated clustering dataset for unsupervised federated
     learning setting
@@ -772,6 +718,10 @@ def save_federated_clustering_data(nb_dp_per_party, party_folder):
     :type nb_dp_per_party: `list[int]`
     :param party_folder: folder to save party data
     :type party_folder: `str`
+    :param shard_format: `npz`, or `npy` for memory-mappable .npy directories
+    :type shard_format: `str`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
 
     num_clients = len(nb_dp_per_party)
@@ -787,18 +737,18 @@ def save_federated_clustering_data(nb_dp_per_party, party_folder):
     # data returned is (J, M, D=100) dimensions
     data = load_simulated_federated_clustering(**kwargs)
 
-    for idx in range(num_clients):
+    def get_shard(idx):
         x_train_np = np.array(data[idx])
-        x_test_np = x_train_np  # Duplicating x_train to x_test
-
-        name_file = "data_party" + str(idx) + ".npz"
-        name_file = os.path.join(party_folder, name_file)
-        np.savez(name_file, x_train=x_train_np, x_test=x_test_np)
+        # Duplicating x_train to x_test
+        return {"x_train": x_train_np, "x_test": x_train_np}
 
-        print("Finished! :) Data saved in ", party_folder)
+    write_party_shards(party_folder, num_clients, get_shard, shard_format, max_workers)
+    print("Finished! :) Data saved in ", party_folder)
 
 
-def save_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_folder, dataset):
+def save_party_data(
+    nb_dp_per_party, should_stratify, party_folder, dataset_folder, dataset, dirichlet_alpha=None, max_workers=None
+):
     """
     Loads a generate dataset saved as in csv format and creates parties local datasets
     as specified.
@@ -813,6 +763,10 @@ def save_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_fold
     :type dataset_folder: `str`
     :param dataset: the name of the csv file
     :type dataset: `str`
+    :param dirichlet_alpha: concentration of the Dirichlet label distribution of every party, None for IID
+    :type dirichlet_alpha: `float`
+    :param max_workers: number of threads writing the party files
+    :type max_workers: `int`
     """
     dataset_folder = os.path.join(dataset_folder, dataset) + ".csv"
     print("Loading the original dataset from: " + dataset_folder)
@@ -830,33 +784,8 @@ def save_party_data(nb_dp_per_party, should_stratify, party_folder, dataset_fold
         data = pd.read_csv(dataset_folder, header=1).to_numpy()
         X, y = data[:, :-1], data[:, -1].astype("int")
 
-    num_train = len(X)
-    labels, counts = np.unique(y, return_counts=True)
-
-    if should_stratify:
-        probs = {label: counts[np.where(labels == label)[0][0]] / float(num_train) for label in labels}
-    else:
-        probs = {label: 1.0 / num_train for label in labels}
-
-    for i, dp in enumerate(nb_dp_per_party):
-        # Regular Dataset
-        p_list = np.array([probs[y[idx]] for idx in range(num_train)])
-        p_list /= np.sum(p_list)
-
-        indices = np.random.choice(num_train, dp, p=p_list)
-        indices = indices.tolist()
-
-        # Use indices for data/classification subset
-        x_part = [",".join(item) for item in X[indices, :].astype(str)]
-        y_part = y[indices]
-
-        # Write to File
-        name_file = "data_party" + str(i) + ".csv"
-        name_file = os.path.join(party_folder, name_file)
-        out = open(name_file, "w")
-        for i in range(len(x_part)):
-            out.write(x_part[i] + "," + str(int(y_part[i])) + "\n")
-        out.close()
+    party_indices = sample_party_indices(y, nb_dp_per_party, should_stratify, dirichlet_alpha=dirichlet_alpha)
+    write_csv_shards(party_folder, X, y, party_indices, max_workers)
 
     print("Finished! :) Data saved in", party_folder)
 
@@ -911,12 +840,17 @@ if __name__ == "__main__":
     stratify = args.stratify
     create_new = args.create_new
     exp_name = args.name
+    dirichlet_alpha = args.dirichlet_alpha
+    shard_format = "npy" if args.npy else "npz"
+    workers = args.workers
 
     # Check for errors
     if len(points_per_party) == 1:
         points_per_party = [points_per_party[0] for _ in range(num_parties)]
     elif len(points_per_party) != num_parties:
         parser.error(PER_PARTY_ERR)
+    if args.npy and dataset not in NPY_SHARD_DATASETS:
+        parser.error(NPY_SHARDS_ERR.format(", ".join(NPY_SHARD_DATASETS)))
 
     if data_path is not None:
         if not os.path.exists(data_path):
@@ -934,6 +868,8 @@ if __name__ == "__main__":
         folder_dataset = os.path.join("examples", "datasets")
 
     strat = "balanced" if stratify else "random"
+    if dirichlet_alpha is not None:
+        strat = "dirichlet_{}".format(dirichlet_alpha)
     if args.dataset == "femnist" and -1 in points_per_party:
         strat = "orig_dist"
 
@@ -952,38 +888,51 @@ if __name__ == "__main__":
             f_path = os.path.join(folder_party_data, f_name)
             if os.path.isfile(f_path):
                 os.unlink(f_path)
+            elif os.path.isdir(f_path) and f_name.startswith("data_party"):
+                # .npy shards of an earlier --npy run
+                shutil.rmtree(f_path)
 
     # Save new files
     if dataset == "nursery":
-        save_nursery_party_data(points_per_party, stratify, folder_party_data, folder_dataset)
+        save_nursery_party_data(points_per_party, stratify, folder_party_data, folder_dataset, dirichlet_alpha, workers)
     elif dataset == "adult":
-        save_adult_party_data(points_per_party, stratify, folder_party_data, folder_dataset)
+        save_adult_party_data(points_per_party, stratify, folder_party_data, folder_dataset, dirichlet_alpha, workers)
     elif dataset == "german":
-        save_german_party_data(points_per_party, stratify, folder_party_data, folder_dataset)
+        save_german_party_data(points_per_party, stratify, folder_party_data, folder_dataset, dirichlet_alpha, workers)
     elif args.dataset == "mnist":
-        save_mnist_party_data(points_per_party, stratify, folder_party_data, folder_dataset)
+        save_mnist_party_data(
+            points_per_party, stratify, folder_party_data, folder_dataset, dirichlet_alpha, shard_format, workers
+        )
     elif args.dataset == "compas":
-        save_compas_party_data(points_per_party, stratify, folder_party_data, folder_dataset)
+        save_compas_party_data(points_per_party, stratify, folder_party_data, folder_dataset, dirichlet_alpha, workers)
     elif dataset == "higgs":
-        save_higgs_party_data(points_per_party, stratify, folder_party_data, folder_dataset)
+        save_higgs_party_data(points_per_party, stratify, folder_party_data, folder_dataset, dirichlet_alpha, workers)
     elif dataset == "airline":
-        save_airline_party_data(points_per_party, stratify, folder_party_data, folder_dataset)
+        save_airline_party_data(points_per_party, stratify, folder_party_data, folder_dataset, dirichlet_alpha, workers)
     elif dataset == "diabetes":
-        save_diabetes_party_data(points_per_party, stratify, folder_party_data, folder_dataset)
+        save_diabetes_party_data(
+            points_per_party, stratify, folder_party_data, folder_dataset, dirichlet_alpha, workers
+        )
     elif dataset == "binovf":
-        save_binovf_party_data(points_per_party, stratify, folder_party_data, folder_dataset)
+        save_binovf_party_data(points_per_party, stratify, folder_party_data, folder_dataset, dirichlet_alpha, workers)
     elif dataset == "multovf":
-        save_multovf_party_data(points_per_party, stratify, folder_party_data, folder_dataset)
+        save_multovf_party_data(points_per_party, stratify, folder_party_data, folder_dataset, dirichlet_alpha, workers)
     elif dataset == "linovf":
-        save_linovf_party_data(points_per_party, folder_party_data, folder_dataset)
+        save_linovf_party_data(points_per_party, folder_party_data, folder_dataset, workers)
     elif dataset == "federated-clustering":
-        save_federated_clustering_data(points_per_party, folder_party_data)
+        save_federated_clustering_data(points_per_party, folder_party_data, shard_format, workers)
     elif dataset == "femnist":
-        save_femnist_party_data(points_per_party, stratify, folder_party_data, folder_dataset)
+        save_femnist_party_data(
+            points_per_party, stratify, folder_party_data, folder_dataset, dirichlet_alpha, shard_format, workers
+        )
     elif dataset == "cifar10":
-        save_cifar10_party_data(points_per_party, stratify, folder_party_data, folder_dataset)
+        save_cifar10_party_data(
+            points_per_party, stratify, folder_party_data, folder_dataset, dirichlet_alpha, shard_format, workers
+        )
     elif dataset == "wikipedia":
         save_wikipedia_party_data(points_per_party, folder_party_data, folder_dataset)
     else:
         print("Loading a non-default dataset, redircting to general data split method...")
-        save_party_data(points_per_party, stratify, folder_party_data, folder_dataset, dataset)
+        save_party_data(
+            points_per_party, stratify, folder_party_data, folder_dataset, dataset, dirichlet_alpha, workers
+        )
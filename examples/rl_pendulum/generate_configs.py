@@ -5,7 +5,7 @@ import examples.datahandlers as datahandlers
 
 
 def get_fusion_config():
-    fusion = {"name": "RLFusionHandler", "path": "ibmfl.aggregator.fusion.rl_avg_fusion_handler"}
+    fusion = {"name": "StateDictFusionHandler", "path": "examples.extensions.fusion.state_dict_fusion_handler"}
     return fusion
 
 
@@ -18,7 +18,7 @@ def get_local_training_config(configs_folder=None):
 
 
 def get_hyperparams(model):
-    hyperparams = {"global": {"rounds": 1}}
+    hyperparams = {"global": {"rounds": 1, "weighting": "uniform"}}
 
     return hyperparams
 
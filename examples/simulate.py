@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+
+fl_path = os.path.abspath(".")
+if fl_path not in sys.path:
+    sys.path.append(fl_path)
+
+from examples.constants import (
+    SIMULATE_COMMANDS_DESC,
+    SIMULATE_CONFIG_DESC,
+    SIMULATE_DESC,
+    SIMULATE_NO_COPY_DESC,
+    SIMULATE_NUM_PARTIES_DESC,
+    SIMULATE_WORKERS_DESC,
+)
+from examples.extensions.connection.simulation import SIMULATION_COMMANDS, Simulation, load_simulation_configs
+
+
+def setup_parser():
+    """
+    Sets up the parser for Python script
+
+    :return: a command line parser
+    :rtype: argparse.ArgumentParser
+    """
+    p = argparse.ArgumentParser(description=SIMULATE_DESC)
+    p.add_argument("config_path", help=SIMULATE_CONFIG_DESC)
+    p.add_argument("--num_parties", "-n", help=SIMULATE_NUM_PARTIES_DESC, type=int)
+    p.add_argument("--workers", "-w", help=SIMULATE_WORKERS_DESC, type=int, default=0)
+    p.add_argument(
+        "--commands",
+        "-c",
+        help=SIMULATE_COMMANDS_DESC,
+        nargs="+",
+        choices=SIMULATION_COMMANDS,
+        default=["TRAIN", "EVAL"],
+    )
+    p.add_argument("--no_copy", help=SIMULATE_NO_COPY_DESC, action="store_true")
+    return p
+
+
+if __name__ == "__main__":
+    parser = setup_parser()
+    args = parser.parse_args()
+
+    config_path = args.config_path
+    if not os.path.isfile(os.path.join(config_path, "config_agg.yml")):
+        config_path = os.path.join(config_path, "configs")
+    if not os.path.isfile(os.path.join(config_path, "config_agg.yml")):
+        parser.error("No config_agg.yml found in {}".format(args.config_path))
+
+    agg_config, party_configs = load_simulation_configs(
+        config_path, num_parties=args.num_parties, copy_messages=not args.no_copy
+    )
+    with Simulation(agg_config, party_configs, num_workers=args.workers) as simulation:
+        success = simulation.run(args.commands)
+
+    print("Finished! :) Simulated {} parties.".format(len(party_configs)) if success else "Simulation failed.")
+    sys.exit(0 if success else 1)
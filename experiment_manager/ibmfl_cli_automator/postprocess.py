@@ -9,7 +9,9 @@ Restricted Materials of IBM
 import json
 import math
 import pprint
+import warnings
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import dateutil as du
 import yaml
@@ -65,9 +67,127 @@ def json_to_table(json_data):
     return pd.DataFrame(table_data)
 
 
-def parse_party_data(file_path, n_trials, n_parties):
+# incremental readers of metrics journals and the rows read so far, by file path
+_journal_cache = {}
+
+
+def load_metrics_rows(file_path):
+    """
+    Read the per-round entries of a metrics file. Journals written by
+    `JournalMetricsRecorder` (`.jsonl` and `.journal`) are read incrementally:
+    repeated calls only parse the records appended since the previous call.
+
+    :param file_path: path to the metrics file
+    :type file_path: `str`
+    :return: one dictionary per round
+    :rtype: `list[dict]`
+    """
+    if not file_path.endswith((".jsonl", ".journal")):
+        with open(file_path) as json_file:
+            return json.load(json_file)
+
+    from examples.extensions.metrics.metrics_journal import ENTRY_KEY, JournalReader
+
+    if file_path not in _journal_cache:
+        _journal_cache[file_path] = (JournalReader(file_path), {})
+    reader, rows = _journal_cache[file_path]
+    for record in reader.read():
+        # later records of an entry replace earlier ones
+        rows[record.pop(ENTRY_KEY, len(rows))] = record
+    return [rows[k] for k in sorted(rows)]
+
+
+def flatten_rows(rows):
+    """
+    Flatten the per-round entries of a metrics file into columns in one pass. \
+    Nested dictionaries become `outer:inner` keys, as in json_to_table, and rounds \
+    missing a key hold None.
+
+    :param rows: one dictionary per round
+    :type rows: `list[dict]`
+    :return: one list per key, with one value per round
+    :rtype: `dict[str,list]`
+    """
+    columns = OrderedDict()
+    for i, row in enumerate(rows):
+        for k1, v1 in row.items():
+            items = v1.items() if isinstance(v1, dict) else ((None, v1),)
+            for k2, v2 in items:
+                key = k1 if k2 is None else "{}:{}".format(k1, k2)
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = [None] * len(rows)
+                column[i] = v2
+    return columns
+
+
+def column_array(values):
+    """
+    Convert a column to a float array with NaN for missing values, or to a 1-d object array \
+    if it holds values that are not numbers
+
+    :param values: one value per round
+    :type values: `list`
+    :rtype: `numpy.array`
+    """
+    try:
+        column = np.array([np.nan if v is None else v for v in values], dtype=float)
+        if column.ndim == 1:
+            return column
+    except (TypeError, ValueError):
+        pass
+    column = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        column[i] = v
+    return column
+
+
+def read_metrics_columns(file_path):
+    """
+    Read a metrics file into one array per metric
+
+    :param file_path: path to the metrics file
+    :type file_path: `str`
+    :return: one array per key, with one value per round
+    :rtype: `dict[str,numpy.array]`
+    """
+    return OrderedDict((k, column_array(v)) for k, v in flatten_rows(load_metrics_rows(file_path)).items())
+
+
+def read_experiment_columns(file_path, n_trials, n_parties, max_workers=None, processes=False):
     """
-    Read in all data for an experiment into a single dictionary
+    Read the metrics files of every party and trial of an experiment in parallel. \
+    Threads overlap the file reads; with `processes` the JSON parsing runs in parallel too, \
+    but journals are then read in full on every call, as the incremental readers stay in the workers.
+
+    :param file_path: path to the metrics files, containing a ${trial} and ${id} template parameter
+    :type file_path: `str`
+    :param n_trials: the number of trials in the experiment
+    :type n_trials: `int`
+    :param n_parties: the number of parties for the experiment
+    :type n_parties: `int`
+    :param max_workers: number of threads or processes, the executor's default if None
+    :type max_workers: `int`
+    :param processes: parse the files in worker processes instead of threads
+    :type processes: `bool`
+    :return: columns of every file by (party, trial index), party-major
+    :rtype: `dict[tuple,dict[str,numpy.array]]`
+    """
+    paths = OrderedDict(
+        ((party, trial), Template(file_path).substitute({"trial": trial + 1, "id": party, "ts": "latest"}))
+        for party in range(n_parties)
+        for trial in range(n_trials)
+    )
+    if not paths:
+        return OrderedDict()
+    executor_cls = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor_cls(max_workers=max_workers) as executor:
+        return OrderedDict(zip(paths, executor.map(read_metrics_columns, paths.values())))
+
+
+def parse_party_data(file_path, n_trials, n_parties, max_workers=None):
+    """
+    Read in all data for an experiment into a single dictionary; the files are read in parallel
 
     :param file_path: path to the metrics file
     :type file_path: `str`
@@ -75,6 +195,8 @@ def parse_party_data(file_path, n_trials, n_parties):
     :type n_trials: `int`
     :param n_parties: the number of parties for the experiment
     :type n_parties: `int`
+    :param max_workers: number of threads reading the files
+    :type max_workers: `int`
     :return: Dictionary with one key per metric, whose values are lists with one element per party, \
     which is a list of trials, each trial a numpy.array with a value for each round of the trial
     :rtype: `dict[str,list[list[numpy.array]]]`
@@ -83,58 +205,48 @@ def parse_party_data(file_path, n_trials, n_parties):
     # metadata is just the round number (used to be IPs per party)
     # TODO: un-hard-code this; still treating metadata weirdly
     dat = {}
-    dat["metadata"] = []
+    dat["metadata"] = [{} for _ in range(n_parties)]
     metadata_keys = ["round_no"]
-    for party in range(n_parties):
-        for k, v in dat.items():
-            if "metadata" in k:
-                dat[k] += [{}]
+    for (party, trial), table in read_experiment_columns(file_path, n_trials, n_parties, max_workers).items():
+        for k, v in table.items():
+            if k in metadata_keys:
+                dat["metadata"][party][k] = v
             else:
-                dat[k] += [[]]
-        for trial in range(1, n_trials + 1):
-            with open(Template(file_path).substitute({"trial": trial, "id": party, "ts": "latest"})) as json_file:
-                table = json_to_table(json.load(json_file))
-            for k, v in table.items():
-                if k in metadata_keys:
-                    dat["metadata"][party][k] = table[k].to_numpy()
-                elif k not in dat:
-                    dat[k] = [[]]
-                    dat[k][party] += [table[k].to_numpy()]
-                else:
-                    dat[k][party] += [table[k].to_numpy()]
+                dat.setdefault(k, [[] for _ in range(n_parties)])[party] += [v]
     return dat
 
 
 def offset_method_first(l):
     """
     Example of an offset method that can be passed to the various offset_vals function below; \
-    it offsets all values based on the first value in the list
+    it offsets all values based on the first value in the list. Arrays are offset along their \
+    last axis, so a whole MetricsCube stack is offset at once.
 
     :param l: the values to offset
     :type l: list
     :return: a new list (NOT a reference to the input list) with the new elements
     :rtype: list
     """
-    ret = np.copy(l)
-    for i, v in enumerate(l):
-        ret[i] -= l[0]
-    return ret
+    l = np.asarray(l)
+    return l - l[..., :1]
 
 
 def offset_method_delta(l):
     """
     Example of an offset method that can be passed to the various offset_* functions below; \
-    it offsets all values based on the previous value in the list
+    it offsets all values based on the previous value in the list. Arrays are offset along their \
+    last axis, so a whole MetricsCube stack is offset at once.
 
     :param l: the values to offset
     :type l: list
     :return: a new list (NOT a reference to the input list) with the new elements
     :rtype: list
     """
-    ret = np.copy(l)
-    for i, v in enumerate(l):
-        ret[i] -= l[i - 1 if i > 0 else 0]
-    return ret
+    l = np.asarray(l)
+    return l - np.concatenate((l[..., :1], l[..., :-1]), axis=-1)
+
+
+OFFSET_METHODS = {"off": offset_method_first, "del": offset_method_delta}
 
 
 def offset_vals(metrics_dict, offset_keys, offset_methods_dict):
@@ -208,7 +320,7 @@ def group_by_iter(metrics_dict):
     :return: A new, reorganized dict
     :rtype: `dict[list[list[np.array]]]`
     """
-    # TODO: more pythonic, pandas-thonic, or numpy-thonic way of doing this?
+    # MetricsCube.aggregate reduces the trial axis of a MetricsCube instead, without regrouping
     metrics_gbi = {}
     # look into the metrics...
     for metric_key, metric_llist in metrics_dict.items():
@@ -259,6 +371,273 @@ def aggregate_over_trials(metrics_gbi, agg_methods):
     return metrics_abt
 
 
+def _quietly(reduce):
+    # all-NaN slices (padding past the end of shorter trials) reduce to NaN without a warning
+    def wrapper(values, axis):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            return reduce(values, axis)
+
+    return wrapper
+
+
+def trial_count(values, axis):
+    """
+    Number of values that are not NaN along an axis
+
+    :rtype: `numpy.array`
+    """
+    return np.sum(~np.isnan(values), axis=axis)
+
+
+@_quietly
+def trial_mean(values, axis):
+    return np.nanmean(values, axis=axis)
+
+
+@_quietly
+def trial_median(values, axis):
+    return np.nanmedian(values, axis=axis)
+
+
+@_quietly
+def trial_max(values, axis):
+    return np.nanmax(values, axis=axis)
+
+
+@_quietly
+def trial_var(values, axis):
+    # the sample variance, and 0 for a single trial, as in gen_timing_plots
+    return np.where(trial_count(values, axis) > 1, np.nanvar(values, axis=axis, ddof=1), 0.0)
+
+
+@_quietly
+def trial_stderr(values, axis):
+    # 2.086 * stdev / sqrt(n) as in gen_reward_vs_time_plots2, and 0 for a single trial
+    n = trial_count(values, axis)
+    return np.where(n > 1, 2.086 * np.sqrt(trial_var(values, axis)) / np.sqrt(np.maximum(n, 1)), 0.0)
+
+
+# vectorized counterparts of the agg_methods of aggregate_over_trials; each takes the values and the trial axis
+TRIAL_AGGREGATES = {
+    "mean": trial_mean,
+    "median": trial_median,
+    "max": trial_max,
+    "var": trial_var,
+    "stderr": trial_stderr,
+    "len": trial_count,
+}
+
+
+class MetricsCube:
+    """
+    The numeric metrics of an experiment in one array of shape (metric, party, trial, round). \
+    Trials shorter than the longest one are padded with NaN, as are missing values and values \
+    that are not numbers, so offsets and aggregations run along an axis of the whole cube \
+    instead of looping over parties, trials and rounds in Python.
+    """
+
+    def __init__(self, metrics, values, lengths):
+        """
+        :param metrics: metric keys, in the order of the first axis of `values`
+        :type metrics: `list[str]`
+        :param values: array of shape (metric, party, trial, round)
+        :type values: `numpy.array`
+        :param lengths: number of rounds of every trial, of shape (party, trial)
+        :type lengths: `numpy.array`
+        """
+        self.metrics = list(metrics)
+        self.values = values
+        self.lengths = lengths
+        self._index = {k: i for i, k in enumerate(self.metrics)}
+
+    @property
+    def n_parties(self):
+        return self.values.shape[1]
+
+    @property
+    def n_trials(self):
+        return self.values.shape[2]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __getitem__(self, key):
+        """
+        :return: the values of a metric, of shape (party, trial, round)
+        :rtype: `numpy.array`
+        """
+        return self.values[self._index[key]]
+
+    def stack(self, keys):
+        """
+        :return: the values of several metrics, of shape (len(keys), party, trial, round)
+        :rtype: `numpy.array`
+        """
+        return self.values[[self._index[k] for k in keys]]
+
+    def add(self, keys, values):
+        """
+        Store metrics computed from the cube, replacing metrics of the same key; \
+        new metrics are appended in a single copy of the cube
+
+        :param keys: metric keys
+        :type keys: `list[str]`
+        :param values: array of shape (len(keys), party, trial, round)
+        :type values: `numpy.array`
+        :return: A reference to the cube
+        :rtype: `MetricsCube`
+        """
+        new = []
+        for key, value in zip(keys, values):
+            if key in self._index:
+                self.values[self._index[key]] = value
+            else:
+                new += [key]
+        if new:
+            self.values = np.concatenate((self.values, values[[list(keys).index(k) for k in new]]))
+            for key in new:
+                self._index[key] = len(self.metrics)
+                self.metrics += [key]
+        return self
+
+    def offset(self, offset_keys, offset_methods_dict=None):
+        """
+        Vectorized offset_vals: every method is applied to all the keys at once, \
+        along the round axis, and stored under `<key>_<suffix>`
+
+        :param offset_keys: the keys to apply the offsets to
+        :type offset_keys: `list[str]`
+        :param offset_methods_dict: a label-indexed dictionary of methods taking and returning \
+        arrays offset along their last axis, OFFSET_METHODS by default
+        :type offset_methods_dict: `dict[str,callable]`
+        :return: A reference to the cube
+        :rtype: `MetricsCube`
+        """
+        offset_keys = list(offset_keys)
+        if not offset_keys:
+            return self
+        stacked = self.stack(offset_keys)
+        for suffix, offset_method in (offset_methods_dict or OFFSET_METHODS).items():
+            self.add(["{}_{}".format(k, suffix) for k in offset_keys], offset_method(stacked))
+        return self
+
+    def offset_cycle(self, offset_keys):
+        """
+        Vectorized offset_vals_cycle: the delta of every key to the next key of the same round, \
+        and of the last key to the first key of the next round, stored under `<key>_delta`
+
+        :param offset_keys: timestamp keys, in the order they are taken within a round
+        :type offset_keys: `list[str]`
+        :return: the keys of the deltas
+        :rtype: `list[str]`
+        """
+        stacked = self.stack(offset_keys)
+        following = np.roll(stacked, -1, axis=0)
+        # the round after the last of a trial is NaN padding, except past the end of the cube
+        following[-1] = np.roll(stacked[0], -1, axis=-1)
+        following[-1, ..., -1] = np.nan
+        delta_keys = ["{}_delta".format(k) for k in offset_keys]
+        self.add(delta_keys, following - stacked)
+        return delta_keys
+
+    def aggregate(self, agg_methods, keys=None):
+        """
+        Vectorized aggregate_over_trials: every method reduces the trial axis of all keys at once
+
+        :param agg_methods: a label-indexed dictionary of methods taking the values and the axis \
+        to reduce, such as the entries of TRIAL_AGGREGATES
+        :type agg_methods: `dict[str,callable]`
+        :param keys: the keys to aggregate, all of them by default
+        :type keys: `list[str]`
+        :return: the output format of aggregate_over_trials, with one array per party and method, \
+        cut to the rounds of the party's longest trial
+        :rtype: `dict[str,list[dict[str,numpy.array]]]`
+        """
+        keys = self.metrics if keys is None else list(keys)
+        stacked = self.stack(keys)
+        aggregated = {label: agg(stacked, 2) for label, agg in agg_methods.items()}
+        n_rounds = self.lengths.max(axis=1, initial=0)
+        return {
+            key: [
+                {label: values[i, party, : n_rounds[party]] for label, values in aggregated.items()}
+                for party in range(self.n_parties)
+            ]
+            for i, key in enumerate(keys)
+        }
+
+    def metadata(self):
+        """
+        :return: the 'metadata' of parse_party_data, the round numbers of each party's longest trial
+        :rtype: `list[dict[str,numpy.array]]`
+        """
+        metadata = [{} for _ in range(self.n_parties)]
+        if "round_no" in self:
+            for party, trial in enumerate(np.argmax(self.lengths, axis=1)):
+                metadata[party]["round_no"] = self["round_no"][party, trial, : self.lengths[party, trial]]
+        return metadata
+
+    def to_party_data(self):
+        """
+        :return: the cube in the output format of parse_party_data
+        :rtype: `dict[str,list[list[numpy.array]]]`
+        """
+        dat = {"metadata": self.metadata()}
+        for key in self.metrics:
+            if key != "round_no":
+                dat[key] = [
+                    [self[key][party, trial, : self.lengths[party, trial]] for trial in range(self.n_trials)]
+                    for party in range(self.n_parties)
+                ]
+        return dat
+
+    def to_table(self):
+        """
+        :return: a columnar table with one row per party, trial and round actually run
+        :rtype: `pandas.DataFrame`
+        """
+        party, trial, round_idx = np.nonzero(np.arange(self.values.shape[3]) < self.lengths[..., np.newaxis])
+        table = {"party": party, "trial": trial, "round": round_idx}
+        table.update((key, self.values[i, party, trial, round_idx]) for i, key in enumerate(self.metrics))
+        return pd.DataFrame(table)
+
+
+def load_metrics_cube(file_path, n_trials, n_parties, max_workers=None, processes=False, dtype=np.float64):
+    """
+    Read in the numeric metrics of an experiment into a MetricsCube; the files are read \
+    in parallel (see read_experiment_columns) and every column is copied into the cube once
+
+    :param file_path: path to the metrics files, containing a ${trial} and ${id} template parameter
+    :type file_path: `str`
+    :param n_trials: the number of trials in the experiment
+    :type n_trials: `int`
+    :param n_parties: the number of parties for the experiment
+    :type n_parties: `int`
+    :param max_workers: number of threads or processes reading the files
+    :type max_workers: `int`
+    :param processes: parse the files in worker processes instead of threads
+    :type processes: `bool`
+    :param dtype: float type of the cube; timestamps need float64
+    :type dtype: `numpy.dtype`
+    :rtype: `MetricsCube`
+    """
+    tables = read_experiment_columns(file_path, n_trials, n_parties, max_workers, processes)
+    index = OrderedDict()
+    lengths = np.zeros((n_parties, n_trials), dtype=int)
+    for (party, trial), table in tables.items():
+        lengths[party, trial] = max((len(v) for v in table.values()), default=0)
+        for k, v in table.items():
+            if v.dtype != object:
+                index.setdefault(k, len(index))
+
+    values = np.full((len(index), n_parties, n_trials, lengths.max(initial=0)), np.nan, dtype=dtype)
+    for (party, trial), table in tables.items():
+        for k, v in table.items():
+            if v.dtype != object:
+                values[index[k], party, trial, : len(v)] = v
+    return MetricsCube(index.keys(), values, lengths)
+
+
 ################################################################################################
 
 
@@ -367,7 +746,24 @@ def gen_reward_vs_time_plots2(dat, reward_keys, x_axis_val="round", x_axis_key=N
         "len": len,
     }
     metrics_dict = aggregate_over_trials(metrics_dict, trial_agg_methods)
+    plot_reward_keys(metrics_dict, metadata_dict, reward_keys, x_axis_val)
+
 
+def plot_reward_keys(metrics_dict, metadata_dict, reward_keys, x_axis_val="round"):
+    """
+    Plot each of the given metrics vs round no or time
+
+    :param metrics_dict: data for an experiment \
+    (output of aggregate_over_trials with 'mean' and 'stderr' functions applied during aggregation)
+    :type metrics_dict: `dict[str,list[dict[str,list]]]`
+    :param metadata_dict: 'metadata' key from the output of parse_party_data
+    :type metadata_dict: `dict`
+    :param reward_keys: keys to plot on y axis
+    :type reward_keys: `list[str]`
+    :param x_axis_val: 'round' or 'time'
+    :type x_axis_val: `str`
+    :return: None
+    """
     # make plots for the desired values
     if x_axis_val == "round":
         plot_metric = plot_metric_vs_round
@@ -402,13 +798,13 @@ def gen_reward_vs_time_plots(metrics_file_tmpl, n_trials, n_parties, reward_keys
     :type x_axis_key: `str`
     :return: None
     """
-    # obtain the party data
-    dat = parse_party_data(metrics_file_tmpl, n_trials, n_parties)
-    offset_methods = {"off": offset_method_first, "del": offset_method_delta}
-    dat = offset_vals(dat, [k for k, v in dat.items() if ":ts" in k], offset_methods)
-    # pp.pprint(dat)
+    # obtain the party data, offset the timestamps and aggregate over the trials, one axis at a time
+    cube = load_metrics_cube(metrics_file_tmpl, n_trials, n_parties)
+    cube.offset([k for k in cube.metrics if ":ts" in k], OFFSET_METHODS)
+    trial_agg_methods = {k: TRIAL_AGGREGATES[k] for k in ("mean", "stderr", "len")}
+    metrics_dict = cube.aggregate(trial_agg_methods)
 
-    gen_reward_vs_time_plots2(dat, reward_keys, x_axis_val, x_axis_key)
+    plot_reward_keys(metrics_dict, cube.metadata(), reward_keys, x_axis_val)
 
 
 def gen_timing_plots(metrics_file_tmpl, n_trials, n_parties, offset_cycle_keys):
@@ -426,44 +822,22 @@ def gen_timing_plots(metrics_file_tmpl, n_trials, n_parties, offset_cycle_keys):
     :type offset_cycle_keys: `list[str]`
     :return: None
     """
-    # obtain the party data
-    dat = parse_party_data(metrics_file_tmpl, n_trials, n_parties)
-    dat = offset_vals_cycle(dat, offset_cycle_keys)
-
-    # get metadata from dictionary and remove it as it won't be treated the same way as the rest
-    metadata_dict = dat.pop("metadata")
-
-    # group metrics data by iter, so each inner list contains each trials' value for that iter
-    metrics_dict = group_by_iter(dat)
-    trial_agg_methods = {
-        "mean": statistics.mean,
-        "var": lambda x: statistics.variance(x) if len(x) > 1 else 0,
-        "len": len,
-    }
-    metrics_dict = aggregate_over_trials(metrics_dict, trial_agg_methods)
-
-    # filter keys to the only ones we want
-    offset_cycle_keys = ["{}_delta".format(k) for k in offset_cycle_keys]
-    metrics_dict = {k: metrics_dict[k] for k in metrics_dict.keys() & offset_cycle_keys}
-
-    # compute mean over rounds, and compute standard error using error propagation
-    for k, v in metrics_dict.items():
-        for i, p in enumerate(v):
-            n_iters = len(p["var"])
-            p["mean"] = np.nanmean(p["mean"])
-            p["var"] = np.nansum(p["var"]) / math.pow(n_iters, 2)
-            p["sde"] = 2.086 * math.sqrt(p["var"]) / math.sqrt(n_iters)
-            p["len"] = statistics.mode(p["len"])
+    # obtain the party data and the durations between the timestamps, for all parties and trials at once
+    cube = load_metrics_cube(metrics_file_tmpl, n_trials, n_parties)
+    offset_cycle_keys = cube.offset_cycle(offset_cycle_keys)
+
+    # aggregate over the trials, then compute the mean over rounds
+    # and the standard error using error propagation
+    deltas = cube.stack(offset_cycle_keys)
+    n_iters = cube.lengths.max(axis=1, initial=0)
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mean = np.nanmean(trial_mean(deltas, 2), axis=-1)
+        var = np.nansum(trial_var(deltas, 2), axis=-1) / np.power(n_iters, 2)
+        sde = 2.086 * np.sqrt(var) / np.sqrt(n_iters)
 
     # reorganize values for plotting
-    plot_dict = {k: {} for k in offset_cycle_keys}
-    for k, v in metrics_dict.items():
-        plot_dict[k]["mean"] = []
-        plot_dict[k]["sde"] = []
-        for party in v:
-            print(party)
-            plot_dict[k]["mean"] += [party["mean"]]
-            plot_dict[k]["sde"] += [party["sde"]]
+    plot_dict = {k: {"mean": list(mean[i]), "sde": list(sde[i])} for i, k in enumerate(offset_cycle_keys)}
 
     (fig1, axes) = plt.subplots(
         1, 4, gridspec_kw={"width_ratios": [0.8, 1.9, 3.95, 8]}, sharey=True, constrained_layout=True
@@ -10,6 +10,7 @@ import os
 import pprint as pp
 import random
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime, timezone
 from io import BytesIO, TextIOWrapper
@@ -20,7 +21,6 @@ import subprocess as sp
 import time
 from string import Template
 
-import paramiko
 import yaml
 from tqdm.auto import tqdm
 
@@ -28,6 +28,7 @@ fl_path = os.path.abspath(".")
 if fl_path not in sys.path:
     sys.path.append(fl_path)
 import experiment_manager.ibmfl_cli_automator.postprocess as ibmfl_postproc
+from experiment_manager.ibmfl_cli_automator.ssh_pool import SSHSessionPool
 
 # USAGE:
 # ./ibmfl_cli_automator/run_paramiko.py <runner_config_dir>
@@ -52,6 +53,7 @@ class Runner:
 
     __cmds_agg = "START\nTRAIN\nEVAL\nSTOP"
     __cmds_party = "START\nREGISTER"
+    __default_max_parallel_jobs = 8
 
     def __init__(self):
         """
@@ -65,6 +67,7 @@ class Runner:
         self.__exp_info = {}
         self.__config_party_dicts = []
         self.__exp_timestamp = None
+        self.__ssh_pool = SSHSessionPool()
 
     @staticmethod
     def generate_timestamp():
@@ -138,157 +141,72 @@ class Runner:
         return (status, outstr)
 
     @staticmethod
-    def __stat_on_server(client, path_remote):
+    def __stat_on_server(session, path_remote):
         """
-        Write file to server
+        Stat a file on the server
 
-        :param path_local: file on the local machine
-        :type path_local: `str`
-        :param client: remote client to copy the file to
-        :type client: `paramiko.client.SSHClient`
-        :param path_remote: place to copy the file to, on the remote machine
-        :type path_remote: `str`
-        :return: None
-        """
-        sftp = client.open_sftp()
-        try:
-            ret = sftp.stat(path_remote)
-        except IOError:
-            ret = 0
-        sftp.close()
-        return ret
-
-    @staticmethod
-    def copy_to_server_dir(src, dst, client):
-        """
-        Write file to server, in the specific case that its a directory.
-        :param src: local path to be copied from
-        :type src: `str`
-        :param dst: destination path on the server to copy to
-        :type dst: `str`
-        :param client: file transfer client
-        :type client: `paramiko.client.SSHClient`
-        :return: None
-        """
-        sftp = client.open_sftp()
-        for item in os.listdir(src):
-            if os.path.isfile(os.path.join(src, item)):
-                sftp.put(os.path.join(src, item), os.path.join(dst, item))
-            else:
-                # subdir within src
-                try:
-                    sftp.mkdir(os.path.join(dst, item))
-                except IOError:
-                    # print('Warn: IOError with mkdir at remote: Perhaps the directory already exists.')
-                    # ignore if it exists
-                    pass
-                Runner.copy_to_server_dir(os.path.join(src, item), os.path.join(dst, item), client)
-
-    @staticmethod
-    def __copy_to_server(path_local, client, path_remote):
-        """
-        Write file to server, invokes copy_to_server_dir if path_local is a dir.
-        :param path_local: file on the local machine
-        :type path_local: `str`
-        :param client: remote client to copy the file to
-        :type client: `paramiko.client.SSHClient`
-        :param path_remote: place to copy the file to, on the remote machine
+        :param session: pooled session of the remote machine
+        :type session: `PooledSession`
+        :param path_remote: file on the remote machine
         :type path_remote: `str`
-        :return: None
+        :return: the file attributes, or 0 if the file does not exist
         """
-        # copy from local to remote
-        if path_local == path_remote:
-            return
-        path_remote_dir = Path(path_remote).parent
-        (status, outstr) = Runner.__exec_command_sync(client, "mkdir -p {}".format(path_remote_dir))
-        sftp = client.open_sftp()
-        print("copying {} to {}".format(path_local, path_remote))
-        if os.path.isdir(path_local):
-            if not os.path.exists(path_remote):
-                try:
-                    sftp.mkdir(path_remote)
-                except IOError:
-                    # suppress failure if directory exists
-                    pass
-            Runner.copy_to_server_dir(path_local, path_remote, client)
-        else:
-            sftp.put(path_local, path_remote)
-        sftp.close()
+        return SSHSessionPool.stat(session, path_remote)
 
     @staticmethod
-    def __copy_from_server(path_remote, client, path_local):
+    def __copy_from_server(path_remote, session, path_local):
         """
         Write file from server to local machine
 
         :param path_remote: file on the remote machine
         :type path_remote: `str`
-        :param client: remote client to copy the file from
-        :type client: `paramiko.client.SSHClient`
+        :param session: pooled session of the remote machine
+        :type session: `PooledSession`
         :param path_local: place to copy the file to, on the local machine
         :type path_local: `str`
         :return: None
         """
         if path_remote == path_local:
             return
-        config_path_dir = Path(path_local).parent
-        config_path_dir.mkdir(parents=True, exist_ok=True)
-        # copy from local to remote
-        sftp = client.open_sftp()
-        sftp.get(path_remote, path_local)
-        sftp.close()
+        SSHSessionPool.download(session, path_remote, path_local)
 
     @staticmethod
-    def __start_ssh_connection(server_in, port_in, username_in):
+    def __write_config_local(config_dict, config_path_loc):
         """
-        Get paramiko handle for an SSH connection
-
-        :param server_in: IP address or domain name to connect to
-        :type server_in: string
-        :param port_in: port to use for the connection
-        :type port_in: string
-        :param username_in: username to use for the connection
-        :type username_in: string
-        :return: object for interacting with that server
-        :rtype: `paramiko.client.SSHClient`
-        """
-        client = paramiko.SSHClient()
-        client.load_system_host_keys()
-        client.set_missing_host_key_policy(paramiko.MissingHostKeyPolicy())
-        client.connect(server_in, port=port_in, username=username_in)
-        return client
-
-    @staticmethod
-    def __copy_config_to_server(config_dict, config_path_loc, client, config_path_rem):
-        """
-        Write config dict to local config path, then copy it to the remote
+        Write config dict to local config path
 
         :param config_dict: local config to send
         :type config_dict: `dict`
         :param config_path_loc: place to put the config on the local machine
         :type config_path_loc: `str`
-        :param client: remote client to copy the config to
-        :type client: `paramiko.client.SSHClient`
-        :param config_path_rem: place to copy the config to, on the remote machine
-        :type config_path_rem: `str`
         :return: None
         """
-        # write local
         config_path_loc_dir = Path(config_path_loc).parent
         config_path_loc_dir.mkdir(parents=True, exist_ok=True)
         with open(config_path_loc, "w") as config_file:
             yaml.dump(config_dict, config_file)
-        # copy from local to remote
-        if config_path_loc == config_path_rem:
-            return
-        config_path_rem_dir = Path(config_path_rem).parent
-        (status, outstr) = Runner.__exec_command_sync(client, "mkdir -p {}".format(config_path_rem_dir))
-        if status != 0:
-            print("Bad config path.")
-            exit(0)
-        sftp = client.open_sftp()
-        sftp.put(config_path_loc, config_path_rem)
 
-        sftp.close()
+    def __stage_on_server(self, session, machine_info, uploads, tag):
+        """
+        Copy the config and supplementary files of a job to its machine. Files are sent through the
+        machine's pooled session and only if their content is not already cached on the machine.
+
+        :param session: pooled session of the job's machine
+        :type session: `PooledSession`
+        :param machine_info: info for machine as per the `config_runner.yml` file
+        :type machine_info: `dict`
+        :param uploads: pairs of local and remote paths to copy
+        :type uploads: `list[tuple(str, str)]`
+        :param tag: tag for this IBMFL job (i.e. 'agg' or 'partyX' for now)
+        :type tag: `str`
+        :return: None
+        """
+        uploads = [(local, remote) for local, remote in uploads if local != remote]
+        try:
+            n_sent = self.__ssh_pool.upload(session, uploads, machine_info["staging_dir"])
+        except IOError as ex:
+            sys.exit(f"Error staging files for {tag}: {ex}")
+        print(f"Staged {len(uploads)} paths for {tag}, transferred {n_sent} new files")
 
     @staticmethod
     def __get_exec_string(machine_info, cmd, tag, ts, obtain_stdout):
@@ -349,9 +267,10 @@ class Runner:
         :param ts: timestamp string for the trial
         :type ts: `str`
         """
-        # start agg connection
+        # get the pooled agg connection
         agg_ip = config_agg_dict["connection"]["info"]["ip"]
-        agg_client = Runner.__start_ssh_connection(agg_ip, 22, trial_info["agg_machine"]["ssh_username"])
+        agg_session = self.__ssh_pool.session(agg_ip, 22, trial_info["agg_machine"]["ssh_username"])
+        agg_client = agg_session.client
         print(f"Agg connection made to {agg_ip}")
 
         local_staging_dir = "{}/{}/trial{}".format(trial_info["local_staging_dir"], self.__exp_timestamp, ti)
@@ -360,12 +279,11 @@ class Runner:
         # make remote staging dir
         status, outstr = Runner.__exec_command_sync(agg_client, "mkdir -p {}".format(machine_staging_dir))
 
-        # copy config to server
-        Runner.__copy_config_to_server(
-            config_agg_dict, f"{local_staging_dir}/config_agg.yml", agg_client, f"{machine_staging_dir}/config_agg.yml"
-        )
-        for supp_file in agg_files:
-            Runner.__copy_to_server(str(supp_file), agg_client, f"{machine_staging_dir}/{supp_file.name}")
+        # copy config and files to server
+        Runner.__write_config_local(config_agg_dict, f"{local_staging_dir}/config_agg.yml")
+        uploads = [(f"{local_staging_dir}/config_agg.yml", f"{machine_staging_dir}/config_agg.yml")]
+        uploads += [(str(supp_file), f"{machine_staging_dir}/{supp_file.name}") for supp_file in agg_files]
+        self.__stage_on_server(agg_session, trial_info["agg_machine"], uploads, "agg")
 
         # start job on server
         agg_exec_string = Runner.__get_exec_string(
@@ -384,7 +302,7 @@ class Runner:
                 for cmd in cmds:
                     agg_handles[0].write(cmd)
         agg_handles[0].channel.shutdown_write()
-        return (agg_client, agg_handles)
+        return (agg_session, agg_handles)
 
     def __start_party_job(self, config_party_dict, party_files, trial_info, ti, pi, ts):
         """
@@ -399,9 +317,10 @@ class Runner:
         :param ts: timestamp string for the trial
         :type ts: `str`
         """
-        # party i's connection
+        # party i's pooled connection, shared with other parties on the same machine
         party_ip = config_party_dict["connection"]["info"]["ip"]
-        party_client = Runner.__start_ssh_connection(party_ip, 22, trial_info["party_machines"][pi]["ssh_username"])
+        party_session = self.__ssh_pool.session(party_ip, 22, trial_info["party_machines"][pi]["ssh_username"])
+        party_client = party_session.client
         print("Party {} connection made to {}".format(pi, party_ip))
 
         # copy config to server
@@ -409,15 +328,10 @@ class Runner:
         machine_staging_dir = "{}/{}".format(trial_info["party_machines"][pi]["staging_dir"], ts)
         status, outstr = Runner.__exec_command_sync(party_client, "mkdir -p {}".format(machine_staging_dir))
 
-        Runner.__copy_config_to_server(
-            config_party_dict,
-            f"{local_staging_dir}/config_party{pi}.yml",
-            party_client,
-            f"{machine_staging_dir}/config_party{pi}.yml",
-        )
-
-        for supp_file in party_files:
-            Runner.__copy_to_server(str(supp_file), party_client, f"{machine_staging_dir}/{supp_file.name}")
+        Runner.__write_config_local(config_party_dict, f"{local_staging_dir}/config_party{pi}.yml")
+        uploads = [(f"{local_staging_dir}/config_party{pi}.yml", f"{machine_staging_dir}/config_party{pi}.yml")]
+        uploads += [(str(supp_file), f"{machine_staging_dir}/{supp_file.name}") for supp_file in party_files]
+        self.__stage_on_server(party_session, trial_info["party_machines"][pi], uploads, f"party{pi}")
 
         # start job on server
         party_exec_string = Runner.__get_exec_string(
@@ -436,7 +350,7 @@ class Runner:
                 for cmd in cmds:
                     party_handles[0].write(cmd)
         party_handles[0].channel.shutdown_write()
-        return (party_client, party_handles)
+        return (party_session, party_handles)
 
     @staticmethod
     def __get_party_from_log(log, config_party_dicts):
@@ -611,15 +525,15 @@ class Runner:
         return trial_info
 
     @staticmethod
-    def __copy_logs_to_local(machine_staging_dir, client, local_staging_dir, tag):
+    def __copy_logs_to_local(machine_staging_dir, session, local_staging_dir, tag):
         """
         Copy the stdout and stderr files that the aggregator and party jobs produce back to the
-        local automator machine. Uses the passed-in paramiko client.
+        local automator machine. Uses the passed-in pooled session.
 
         :param machine_staging_dir: staging dir on agg/party machine
         :type machine_staging_dir: `string`
-        :param client: the remote machine client to use to obtain the logs
-        :type client: paramiko.client.SSHClient
+        :param session: pooled session of the remote machine to use to obtain the logs
+        :type session: `PooledSession`
         :param local_staging_dir: staging dir on automator machine
         :type local_staging_dir: `string`
         :param tag: the agg/party string corresponding to the client process (i.e. 'agg', 'party0')
@@ -629,10 +543,10 @@ class Runner:
         if local_staging_dir == machine_staging_dir:
             return
         Runner.__copy_from_server(
-            f"{machine_staging_dir}/stdout_{tag}.txt", client, f"{local_staging_dir}/stdout_{tag}.txt"
+            f"{machine_staging_dir}/stdout_{tag}.txt", session, f"{local_staging_dir}/stdout_{tag}.txt"
         )
         Runner.__copy_from_server(
-            f"{machine_staging_dir}/stderr_{tag}.txt", client, f"{local_staging_dir}/stderr_{tag}.txt"
+            f"{machine_staging_dir}/stderr_{tag}.txt", session, f"{local_staging_dir}/stderr_{tag}.txt"
         )
 
     def get_metrics_filepath(self):
@@ -653,42 +567,53 @@ class Runner:
             self.__config_party_dicts[0]["metrics_recorder"]["output_type"],
         ).replace("party0", "party${id}")
 
-    def __copy_metrics_to_local(self, party_clients):
+    def __copy_party_metrics_to_local(self, pi, party_session):
         """
-        Copy the metrics files that the party jobs produce back to the local automator machine.
-        Uses the passed-in paramiko clients.
+        Copy the metrics file of one party job back to the local automator machine.
 
-        :param party_clients: the remote machine client to use to obtain the logs
-        :type party_clients: `list[paramiko.client.SSHClient]`
-        :return: None
+        :param pi: the party's numerical ID for the trial
+        :type pi: `int`
+        :param party_session: pooled session of the party's machine
+        :type party_session: `PooledSession`
+        :return: whether the party wrote a metrics file
+        :rtype: `bool`
         """
-        # copy stuff back
-        metrics_file_exists = [True for p in range(self.__exp_info["n_parties"])]
-        for pi, config_party_dict in enumerate(self.__config_party_dicts):
-            if "metrics_recorder" not in config_party_dict:
-                metrics_file_exists[pi] = False
-                continue
+        config_party_dict = self.__config_party_dicts[pi]
+        if "metrics_recorder" not in config_party_dict:
+            return False
 
-            metrics_output_filepath_remote = "{}.{}".format(
-                config_party_dict["metrics_recorder"]["output_file"],
-                config_party_dict["metrics_recorder"]["output_type"],
-            )
+        metrics_output_filepath_remote = "{}.{}".format(
+            config_party_dict["metrics_recorder"]["output_file"],
+            config_party_dict["metrics_recorder"]["output_type"],
+        )
 
-            metrics_output_filepath_local = Template(self.get_metrics_filepath()).substitute(
-                {"ts": self.__exp_timestamp, "trial": self.__trial_cur, "id": pi}
-            )
+        metrics_output_filepath_local = Template(self.get_metrics_filepath()).substitute(
+            {"ts": self.__exp_timestamp, "trial": self.__trial_cur, "id": pi}
+        )
 
-            # don't copy files if there was no metrics recording
-            metrics_file_exists[pi] = Runner.__stat_on_server(party_clients[pi], metrics_output_filepath_remote)
-            if not metrics_file_exists[pi]:
-                print("No metrics file.")
-                continue
+        # don't copy files if there was no metrics recording
+        if not Runner.__stat_on_server(party_session, metrics_output_filepath_remote):
+            print("No metrics file.")
+            return False
 
-            Runner.__copy_from_server(metrics_output_filepath_remote, party_clients[pi], metrics_output_filepath_local)
+        Runner.__copy_from_server(metrics_output_filepath_remote, party_session, metrics_output_filepath_local)
 
-            print(f"Wrote output data to {metrics_output_filepath_local}")
+        print(f"Wrote output data to {metrics_output_filepath_local}")
+        return True
 
-        return metrics_file_exists
+    def __copy_metrics_to_local(self, party_sessions, executor):
+        """
+        Copy the metrics files that the party jobs produce back to the local automator machine,
+        concurrently. Uses the passed-in pooled sessions.
+
+        :param party_sessions: pooled sessions of the party machines, by party ID
+        :type party_sessions: `list[PooledSession]`
+        :param executor: pool running the copies
+        :type executor: `concurrent.futures.ThreadPoolExecutor`
+        :return: whether each party wrote a metrics file
+        :rtype: `list[bool]`
+        """
+        return list(executor.map(self.__copy_party_metrics_to_local, range(len(party_sessions)), party_sessions))
 
     @staticmethod
     def stage_trial_files(
@@ -909,24 +834,29 @@ class Runner:
             proc_labels = ["agg"] + [f"party{pi}" for pi in range(trial_info["n_parties"])]
             proc_file_dict = {proc_label: [] for proc_label in proc_labels}
 
+        # stage and start jobs with bounded parallelism
+        executor = ThreadPoolExecutor(
+            max_workers=trial_info.get("max_parallel_jobs", Runner.__default_max_parallel_jobs)
+        )
+
         # start agg
-        agg_client, agg_handles = self.__start_agg_job(
+        agg_session, agg_handles = self.__start_agg_job(
             config_agg_dict, proc_file_dict["agg"], trial_info, self.__trial_cur, ts
         )
         agg_handles[1].channel.recv(1024).decode()
         print("Started agg...")
 
         # start parties
-        party_clients = []
-        party_handles_list = []
-        for pi, config_party_dict in enumerate(self.__config_party_dicts):
-            party_client, party_handles = self.__start_party_job(
-                config_party_dict, proc_file_dict[f"party{pi}"], trial_info, self.__trial_cur, pi, ts
+        def start_party(pi):
+            party_job = self.__start_party_job(
+                self.__config_party_dicts[pi], proc_file_dict[f"party{pi}"], trial_info, self.__trial_cur, pi, ts
             )
             print(f"Started party {pi}...")
-            # keep party variables
-            party_clients += [party_client]
-            party_handles_list += [party_handles]
+            return party_job
+
+        party_jobs = list(executor.map(start_party, range(len(self.__config_party_dicts))))
+        party_sessions = [party_session for party_session, _ in party_jobs]
+        party_handles_list = [party_handles for _, party_handles in party_jobs]
 
         print("All jobs started.")
 
@@ -967,15 +897,18 @@ class Runner:
         # copy back logs and metrics
         machine_staging_dir = f"{trial_info['party_machines'][pi]['staging_dir']}/{ts}"
         local_staging_dir = f"{trial_info['local_staging_dir']}/{self.__exp_timestamp}/trial{self.__trial_cur}"
-        Runner.__copy_logs_to_local(machine_staging_dir, agg_client, local_staging_dir, "agg")
-        for pi in range(trial_info["n_parties"]):
-            Runner.__copy_logs_to_local(machine_staging_dir, party_clients[pi], local_staging_dir, f"party{pi}")
-        self.__copy_metrics_to_local(party_clients)
+        log_sessions = [(agg_session, "agg")]
+        log_sessions += [(party_sessions[pi], f"party{pi}") for pi in range(trial_info["n_parties"])]
+        log_copies = [
+            executor.submit(Runner.__copy_logs_to_local, machine_staging_dir, session, local_staging_dir, tag)
+            for session, tag in log_sessions
+        ]
+        self.__copy_metrics_to_local(party_sessions, executor)
+        for log_copy in log_copies:
+            log_copy.result()
 
-        # close up
-        agg_client.close()
-        for party_client in party_clients:
-            party_client.close()
+        # the sessions stay open for the next trial
+        executor.shutdown()
 
         print("Trial completed.")
 
@@ -1040,15 +973,18 @@ class Runner:
         if exp_path_latest.is_symlink():
             exp_path_latest.unlink()
         exp_path_latest.symlink_to(exp_path)
-        # run trials
-        for ti in range(n_trials):
-            self.__trial_cur = ti + 1
-            trial_info = self.get_trial_info(exp_info, machines, ti)
-            ts_obj = datetime.now(timezone.utc)
-            ts_fname = ts_obj.strftime("%Y%m%dT%H%M%S")
-            ts_print = ts_obj.strftime("%Y-%m-%d %H:%M:%S")
-            print("Starting trial {}/{} at {}:".format(ti + 1, n_trials, ts_print))
-            self.run_trial(trial_info, config_agg, config_parties, ts_fname, ui_mode)
+        # run trials, sharing one SSH session per machine
+        try:
+            for ti in range(n_trials):
+                self.__trial_cur = ti + 1
+                trial_info = self.get_trial_info(exp_info, machines, ti)
+                ts_obj = datetime.now(timezone.utc)
+                ts_fname = ts_obj.strftime("%Y%m%dT%H%M%S")
+                ts_print = ts_obj.strftime("%Y-%m-%d %H:%M:%S")
+                print("Starting trial {}/{} at {}:".format(ti + 1, n_trials, ts_print))
+                self.run_trial(trial_info, config_agg, config_parties, ts_fname, ui_mode)
+        finally:
+            self.__ssh_pool.close()
 
     def get_experiment_output(self):
         """
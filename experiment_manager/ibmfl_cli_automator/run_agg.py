@@ -16,6 +16,7 @@ fl_path = os.path.abspath(".")
 if fl_path not in sys.path:
     sys.path.append(fl_path)
 
+from examples.extensions.util.lazy_imports import lazy_class_resolution
 from ibmfl.aggregator.aggregator import Aggregator
 from ibmfl.aggregator.states import States
 from ibmfl.util.config import get_config_from_file
@@ -33,14 +34,17 @@ if __name__ == "__main__":
 
     server_process = None
     config_file = sys.argv[1]
-    config_dict = get_config_from_file(config_file)
+    with lazy_class_resolution():
+        # only the sections the aggregator instantiates import their classes
+        config_dict = get_config_from_file(config_file)
     n_parties = config_dict["hyperparams"]["global"]["num_parties"]
     logging.info("Going to wait for {} parties to register.".format(n_parties))
 
     if not os.path.isfile(config_file):
         logging.error("config file '{}' does not exist".format(config_file))
 
-    agg = Aggregator(config_file=config_file)
+    with lazy_class_resolution():
+        agg = Aggregator(config_file=config_file)
     for line in sys.stdin:
         msg = line.strip().upper()
 
@@ -16,6 +16,7 @@ fl_path = os.path.abspath(".")
 if fl_path not in sys.path:
     sys.path.append(fl_path)
 
+from examples.extensions.util.lazy_imports import lazy_class_resolution
 from ibmfl.party.party import Party
 from ibmfl.party.status_type import StatusType
 
@@ -30,7 +31,9 @@ if __name__ == "__main__":
     if len(sys.argv) < 2 or len(sys.argv) > 2:
         logging.error("Please provide yaml configuration")
     config_file = sys.argv[1]
-    p = Party(config_file=config_file)
+    with lazy_class_resolution():
+        # only the sections the party instantiates import their classes
+        p = Party(config_file=config_file)
 
     # Loop over commands passed by runner
     for msg in sys.stdin:
@@ -0,0 +1,286 @@
+"""
+Pooled SSH sessions and content-addressed uploads for the automator.
+
+`SSHSessionPool` keeps one paramiko connection per machine for as long as
+the pool lives, typically a whole experiment, and hands out SFTP channels
+over it to concurrent callers. `upload` stores every file once per machine
+under `<staging_dir>/.upload_cache/<sha256>` and hard-links it into the
+trial directory, so data files that did not change since an earlier trial
+or that several parties on the same machine share are not transferred again.
+"""
+import hashlib
+import os
+import posixpath
+import shlex
+import threading
+from contextlib import contextmanager
+
+import paramiko
+
+CACHE_DIR_NAME = ".upload_cache"
+
+# commands are split to stay well below the argument length limit of the remote shell
+_FILES_PER_COMMAND = 200
+
+_digest_cache = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path):
+    """
+    SHA-256 of a local file, cached until its size or modification time
+    changes.
+
+    :param path: local file
+    :type path: `str`
+    :return: hex digest
+    :rtype: `str`
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        if key in _digest_cache:
+            return _digest_cache[key]
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    digest = sha.hexdigest()
+    with _digest_lock:
+        _digest_cache[key] = digest
+    return digest
+
+
+def expand_upload(path_local, path_remote):
+    """
+    Lists the files to copy for a file or a directory tree.
+
+    :param path_local: local file or directory
+    :type path_local: `str`
+    :param path_remote: target path on the remote machine
+    :type path_remote: `str`
+    :return: pairs of local and remote file paths
+    :rtype: `list[tuple(str, str)]`
+    """
+    if not os.path.isdir(path_local):
+        return [(path_local, path_remote)]
+    pairs = []
+    for root, _, files in os.walk(path_local):
+        rel = os.path.relpath(root, path_local)
+        remote_root = path_remote if rel == "." else posixpath.join(path_remote, *rel.split(os.sep))
+        pairs += [(os.path.join(root, name), posixpath.join(remote_root, name)) for name in sorted(files)]
+    return pairs
+
+
+class PooledSession:
+    """
+    One SSH connection to a machine with a free list of SFTP channels and,
+    per upload cache directory, the set of file hashes known to be in it.
+    Machine entries of the same host and user can stage to different
+    directories, so the hashes are kept by cache directory.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.Lock()
+        self.idle_sftp = []
+        self.cached_hashes = {}
+        self.hash_locks = {}
+
+    @contextmanager
+    def sftp(self):
+        """
+        Yields an SFTP client that no other thread uses at the same time.
+
+        :return: SFTP client
+        :rtype: `paramiko.sftp_client.SFTPClient`
+        """
+        with self.lock:
+            sftp = self.idle_sftp.pop() if self.idle_sftp else None
+        if sftp is None:
+            sftp = self.client.open_sftp()
+        try:
+            yield sftp
+        except Exception:
+            sftp.close()
+            raise
+        with self.lock:
+            self.idle_sftp.append(sftp)
+
+    def known_hashes(self, cache_dir):
+        """
+        :return: the hashes known to be in an upload cache directory
+        :rtype: `set`
+        """
+        with self.lock:
+            return self.cached_hashes.setdefault(cache_dir, set())
+
+    def hash_lock(self, cache_dir, digest):
+        with self.lock:
+            return self.hash_locks.setdefault((cache_dir, digest), threading.Lock())
+
+    def run(self, cmdstr):
+        """
+        Runs a short command and returns its exit status and output.
+
+        :param cmdstr: command
+        :type cmdstr: `str`
+        :return: exit status and stdout
+        :rtype: `tuple(int, str)`
+        """
+        stdin, stdout, stderr = self.client.exec_command(cmdstr)
+        stdin.channel.shutdown_write()
+        outstr = stdout.read().decode()
+        errstr = stderr.read().decode()
+        status = stdout.channel.recv_exit_status()
+        if status != 0:
+            raise IOError(f"Command '{cmdstr}' failed with exit code {status}: {errstr}")
+        return status, outstr
+
+    def is_active(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        for sftp in self.idle_sftp:
+            sftp.close()
+        self.idle_sftp = []
+        self.client.close()
+
+
+class SSHSessionPool:
+    """
+    SSH sessions shared by all jobs of an experiment, one per machine and
+    user. Sessions are opened on first use and reopened if the connection
+    dropped.
+    """
+
+    def __init__(self):
+        self.__sessions = {}
+        self.__locks = {}
+        self.__lock = threading.Lock()
+
+    def session(self, server_in, port_in, username_in):
+        """
+        Returns the pooled session for a machine.
+
+        :param server_in: IP address or domain name to connect to
+        :type server_in: `str`
+        :param port_in: port to use for the connection
+        :type port_in: `int`
+        :param username_in: username to use for the connection
+        :type username_in: `str`
+        :return: pooled session
+        :rtype: `PooledSession`
+        """
+        key = (server_in, port_in, username_in)
+        with self.__lock:
+            lock = self.__locks.setdefault(key, threading.Lock())
+        with lock:
+            session = self.__sessions.get(key)
+            if session is None or not session.is_active():
+                client = paramiko.SSHClient()
+                client.load_system_host_keys()
+                client.set_missing_host_key_policy(paramiko.MissingHostKeyPolicy())
+                client.connect(server_in, port=port_in, username=username_in)
+                session = PooledSession(client)
+                self.__sessions[key] = session
+            return session
+
+    def close(self):
+        """Closes all sessions."""
+        with self.__lock:
+            sessions = list(self.__sessions.values())
+            self.__sessions = {}
+        for session in sessions:
+            session.close()
+
+    @staticmethod
+    def upload(session, pairs, staging_dir):
+        """
+        Copies local files to the remote machine. Files whose content is
+        already in the upload cache of the machine are linked instead of
+        transferred.
+
+        :param session: pooled session of the remote machine
+        :type session: `PooledSession`
+        :param pairs: local file or directory and remote path pairs
+        :type pairs: `list[tuple(str, str)]`
+        :param staging_dir: staging dir of the machine, which holds the cache
+        :type staging_dir: `str`
+        :return: number of files transferred
+        :rtype: `int`
+        """
+        files = [pair for local, remote in pairs for pair in expand_upload(local, remote)]
+        if not files:
+            return 0
+        cache_dir = posixpath.join(staging_dir, CACHE_DIR_NAME)
+        digests = {local: file_digest(local) for local, _ in files}
+        sources = {}
+        for local, digest in digests.items():
+            sources.setdefault(digest, local)
+
+        cached_hashes = session.known_hashes(cache_dir)
+        unknown = sorted(set(sources) - cached_hashes)
+        for start in range(0, len(unknown), _FILES_PER_COMMAND):
+            chunk = unknown[start : start + _FILES_PER_COMMAND]
+            _, outstr = session.run(
+                "mkdir -p {dir} && cd {dir} && for h in {hashes}; do [ -f $h ] && echo $h; done; true".format(
+                    dir=shlex.quote(cache_dir), hashes=" ".join(chunk)
+                )
+            )
+            cached_hashes.update(outstr.split())
+
+        transferred = 0
+        with session.sftp() as sftp:
+            for digest in unknown:
+                with session.hash_lock(cache_dir, digest):
+                    if digest in cached_hashes:
+                        continue
+                    target = posixpath.join(cache_dir, digest)
+                    sftp.put(sources[digest], target + ".part")
+                    sftp.posix_rename(target + ".part", target)
+                    cached_hashes.add(digest)
+                    transferred += 1
+
+        for start in range(0, len(files), _FILES_PER_COMMAND):
+            chunk = files[start : start + _FILES_PER_COMMAND]
+            dirs = sorted({posixpath.dirname(remote) for _, remote in chunk})
+            links = [
+                "{{ ln -f {src} {dst} 2>/dev/null || cp {src} {dst}; }}".format(
+                    src=shlex.quote(posixpath.join(cache_dir, digests[local])), dst=shlex.quote(remote)
+                )
+                for local, remote in chunk
+            ]
+            session.run(" && ".join(["mkdir -p " + " ".join(shlex.quote(d) for d in dirs)] + links))
+        return transferred
+
+    @staticmethod
+    def download(session, path_remote, path_local):
+        """
+        Copies a remote file to the local machine.
+
+        :param session: pooled session of the remote machine
+        :type session: `PooledSession`
+        :param path_remote: file on the remote machine
+        :type path_remote: `str`
+        :param path_local: place to copy the file to, on the local machine
+        :type path_local: `str`
+        :return: None
+        """
+        os.makedirs(os.path.dirname(path_local) or ".", exist_ok=True)
+        with session.sftp() as sftp:
+            sftp.get(path_remote, path_local)
+
+    @staticmethod
+    def stat(session, path_remote):
+        """
+        Stats a remote file.
+
+        :return: the remote attributes, or 0 if the file does not exist
+        """
+        with session.sftp() as sftp:
+            try:
+                return sftp.stat(path_remote)
+            except IOError:
+                return 0